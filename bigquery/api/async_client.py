@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs many BigQuery queries at once from an asyncio event loop.
+
+AsyncBigQuery exposes jobs.insert, jobs.get, jobs.getQueryResults and
+tabledata.insertAll as coroutines. googleapiclient requests block, so each
+one is executed on a thread from a pool while the event loop carries on; a
+semaphore bounds how many requests are in flight at once. The service
+object must therefore be built on a thread-safe transport, like those
+services.get_service() returns. A query's rows come an async iterator over
+its result pages, so no more than a page of them is held at once.
+
+Requires Python 3.5.2 or later.
+
+Example invocation, running every query in queries.sql (one per line):
+    $ python async_client.py my-project queries.sql --max_concurrency 50
+"""
+
+import argparse
+import asyncio
+from concurrent import futures
+import functools
+import json
+import time
+
+import async_query
+import job_poller
+import services
+import streaming_buffer
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+class AsyncBigQuery(object):
+    """Wraps a bigquery google-api-client object with coroutines.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object, safe to use from several threads.
+        max_concurrency: the most requests in flight at once.
+        num_retries: number of times to retry in case of 500 error.
+    """
+
+    def __init__(self, bigquery, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 num_retries=5):
+        self.bigquery = bigquery
+        self.max_concurrency = max_concurrency
+        self.num_retries = num_retries
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_concurrency)
+        # Created for each loop the client runs on, as a semaphore belongs
+        # to the loop it was created on.
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    def close(self):
+        self._executor.shutdown()
+
+    async def execute(self, request):
+        """Executes a googleapiclient request without blocking the loop."""
+        loop = asyncio.get_event_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+
+        async with self._semaphore:
+            return await loop.run_in_executor(
+                self._executor, functools.partial(
+                    request.execute, num_retries=self.num_retries))
+
+    async def insert_job(self, project_id, body):
+        return await self.execute(self.bigquery.jobs().insert(
+            projectId=project_id, body=body))
+
+    async def get_job(self, job_reference):
+        return await self.execute(self.bigquery.jobs().get(
+            projectId=job_reference['projectId'],
+            jobId=job_reference['jobId']))
+
+    async def get_query_results(self, job_reference, **kwargs):
+        return await self.execute(self.bigquery.jobs().getQueryResults(
+            projectId=job_reference['projectId'],
+            jobId=job_reference['jobId'],
+            **kwargs))
+
+    async def insert_all(self, project_id, dataset_id, table_id, rows):
+        """Streams rows (dicts of column name to value) into a table."""
+        return await self.execute(self.bigquery.tabledata().insertAll(
+            projectId=project_id,
+            datasetId=dataset_id,
+            tableId=table_id,
+            body=streaming_buffer.insert_all_body(rows)))
+
+    async def wait_for_job(self, job, interval=job_poller.DEFAULT_INTERVAL,
+                           max_interval=job_poller.DEFAULT_MAX_INTERVAL):
+        """Polls a job with backoff until it is done.
+
+        Raises:
+            RuntimeError: if the job failed.
+        """
+        backoff = job_poller.Backoff(interval, max_interval)
+        while True:
+            job = await self.get_job(job['jobReference'])
+            state = job['status']['state']
+            if state == 'DONE':
+                if 'errorResult' in job['status']:
+                    raise RuntimeError(job['status']['errorResult'])
+                return job
+            await asyncio.sleep(backoff.next_delay(state))
+
+    def query(self, project_id, query, batch=False,
+              interval=job_poller.DEFAULT_INTERVAL,
+              max_interval=job_poller.DEFAULT_MAX_INTERVAL):
+        """Returns a QueryPages, which runs the query job once iterated."""
+        return QueryPages(
+            self, project_id, query, batch, interval, max_interval)
+
+    async def _handle_pages(self, project_id, query, handle_page, batch,
+                            interval, max_interval):
+        row_count = 0
+        async for rows in self.query(
+                project_id, query, batch, interval, max_interval):
+            handle_page(query, rows)
+            row_count += len(rows)
+        return row_count
+
+    async def query_all(self, project_id, queries, handle_page, batch=False,
+                        interval=job_poller.DEFAULT_INTERVAL,
+                        max_interval=job_poller.DEFAULT_MAX_INTERVAL):
+        """Runs queries concurrently, calling handle_page(query, rows) with
+        each page of rows as it arrives.
+
+        Returns:
+            A list with, for each query, its number of rows or the
+            exception it raised.
+        """
+        return await asyncio.gather(*[
+            self._handle_pages(
+                project_id, query, handle_page, batch, interval,
+                max_interval)
+            for query in queries], return_exceptions=True)
+
+
+class QueryPages(object):
+    """An async iterator over the pages of a query's rows.
+
+    The first iteration inserts the query job and waits for it to finish.
+
+    Raises:
+        RuntimeError: if the job failed.
+    """
+
+    def __init__(self, client, project_id, query, batch=False,
+                 interval=job_poller.DEFAULT_INTERVAL,
+                 max_interval=job_poller.DEFAULT_MAX_INTERVAL):
+        self.client = client
+        self.project_id = project_id
+        self.query = query
+        self.batch = batch
+        self.interval = interval
+        self.max_interval = max_interval
+        self.job = None
+        self._page_token = None
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._done:
+            raise StopAsyncIteration
+        if self.job is None:
+            job = await self.client.insert_job(
+                self.project_id,
+                async_query.query_job_body(
+                    self.project_id, self.query, self.batch))
+            self.job = await self.client.wait_for_job(
+                job, self.interval, self.max_interval)
+
+        page = await self.client.get_query_results(
+            self.job['jobReference'], pageToken=self._page_token)
+        self._page_token = page.get('pageToken')
+        self._done = not self._page_token
+        return page.get('rows', [])
+
+
+def run(coroutine):
+    """Runs a coroutine to completion on a new event loop.
+
+    The loop is made the current one while it runs: before Python 3.5.3,
+    asyncio.get_event_loop() returns the current loop rather than the
+    running one, and asyncio.sleep() and asyncio.Semaphore() use it.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def main(project_id, queries_file, max_concurrency, batch, num_retries,
+         interval):
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials, on a transport
+    # that can be used from several threads.
+    bigquery = services.get_service('bigquery', 'v2')
+
+    with open(queries_file, 'r') as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    def print_page(query, rows):
+        print(json.dumps({'query': query, 'rows': rows}))
+
+    client = AsyncBigQuery(bigquery, max_concurrency, num_retries)
+    start = time.time()
+    try:
+        results = run(client.query_all(
+            project_id, queries, print_page, batch, interval=interval))
+    finally:
+        client.close()
+    elapsed = time.time() - start
+
+    for query, result in zip(queries, results):
+        if isinstance(result, Exception):
+            print(json.dumps({'query': query, 'error': str(result)}))
+    print('Ran {} queries in {:.1f}s ({:.1f} queries/s).'.format(
+        len(queries), elapsed, len(queries) / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_id', help='Your Google Cloud project ID.')
+    parser.add_argument(
+        'queries_file', help='A file holding one query per line.')
+    parser.add_argument(
+        '-c', '--max_concurrency',
+        help='Most requests to have in flight at once.',
+        type=int,
+        default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument(
+        '-b', '--batch', help='Run queries in batch mode.',
+        action='store_true')
+    parser.add_argument(
+        '-r', '--num_retries',
+        help='Number of times to retry in case of 500 error.',
+        type=int,
+        default=5)
+    parser.add_argument(
+        '-p', '--poll_interval',
+        help='How often to poll the queries for completion (seconds).',
+        type=float,
+        default=job_poller.DEFAULT_INTERVAL)
+
+    args = parser.parse_args()
+
+    main(
+        args.project_id,
+        args.queries_file,
+        args.max_concurrency,
+        args.batch,
+        args.num_retries,
+        args.poll_interval)
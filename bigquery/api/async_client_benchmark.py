@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks running many small queries one after another against running
+them concurrently with async_client.AsyncBigQuery.
+
+Both make the same requests for each query: jobs.insert, jobs.get until the
+job is done, and jobs.getQueryResults. The benchmark runs against
+fake_bigquery.FakeBigQuery, where every request takes `latency` seconds.
+
+Requires Python 3.5 or later.
+
+Example invocation:
+    $ python async_client_benchmark.py --queries 500 --latency 0.05
+"""
+
+import argparse
+import time
+
+import async_client
+import async_query
+import fake_bigquery
+import job_poller
+
+
+def make_service(num_queries, latency):
+    bigquery = fake_bigquery.FakeBigQuery(latency=latency)
+    queries = []
+    for i in range(num_queries):
+        query = 'SELECT {} AS n'.format(i)
+        bigquery.set_query_result(
+            query, [{'name': 'n', 'type': 'INTEGER'}], [[i]])
+        queries.append(query)
+    return bigquery, queries
+
+
+def run_sequentially(bigquery, queries, interval):
+    for query in queries:
+        job = async_query.async_query(bigquery, 'benchmark', query)
+        backoff = job_poller.Backoff(interval)
+        while True:
+            job = job_poller.get_job(bigquery, job['jobReference'])
+            if job['status']['state'] == 'DONE':
+                break
+            time.sleep(backoff.next_delay(job['status']['state']))
+        bigquery.jobs().getQueryResults(**job['jobReference']).execute()
+
+
+def run_concurrently(bigquery, queries, interval, max_concurrency):
+    client = async_client.AsyncBigQuery(bigquery, max_concurrency)
+    try:
+        async_client.run(client.query_all(
+            'benchmark', queries, lambda query, rows: None,
+            interval=interval))
+    finally:
+        client.close()
+
+
+def main(num_queries, latency, concurrency_levels, interval=0.1):
+    bigquery, queries = make_service(num_queries, latency)
+    start = time.time()
+    run_sequentially(bigquery, queries, interval)
+    elapsed = time.time() - start
+    print('sequential: {} queries in {:.2f}s ({:.1f} queries/s)'.format(
+        num_queries, elapsed, num_queries / elapsed))
+
+    for max_concurrency in concurrency_levels:
+        bigquery, queries = make_service(num_queries, latency)
+        start = time.time()
+        run_concurrently(bigquery, queries, interval, max_concurrency)
+        elapsed = time.time() - start
+        print('asyncio, {} in flight: {} queries in {:.2f}s '
+              '({:.1f} queries/s)'.format(
+                  max_concurrency, num_queries, elapsed,
+                  num_queries / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--queries', help='Number of queries to run.', type=int,
+        default=200)
+    parser.add_argument(
+        '--latency', help='Seconds each request takes.', type=float,
+        default=0.05)
+    parser.add_argument(
+        '--concurrency', help='Concurrency levels to benchmark.', type=int,
+        nargs='+', default=[8, 32, 100])
+
+    args = parser.parse_args()
+
+    main(args.queries, args.latency, args.concurrency)
@@ -0,0 +1,133 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import threading
+import time
+
+import async_client
+from fake_bigquery import FakeBigQuery
+
+
+def make_service(num_queries, latency=0.0):
+    bigquery = FakeBigQuery(latency=latency, max_page_rows=2, running_polls=1)
+    for i in range(num_queries):
+        bigquery.set_query_result(
+            'SELECT {}'.format(i), [{'name': 'n', 'type': 'INTEGER'}],
+            [[i]] * 5)
+    return bigquery
+
+
+def test_query_all():
+    bigquery = make_service(20)
+    client = async_client.AsyncBigQuery(bigquery, max_concurrency=4)
+
+    queries = ['SELECT {}'.format(i) for i in range(20)]
+    pages = collections.defaultdict(list)
+    results = async_client.run(client.query_all(
+        'test', queries, lambda query, rows: pages[query].append(rows),
+        interval=0.001))
+    client.close()
+
+    assert results == [5] * 20
+    # Each query's rows came a page at a time.
+    assert [len(rows) for rows in pages['SELECT 3']] == [2, 2, 1]
+    assert pages['SELECT 3'][0][0] == {'f': [{'v': '3'}]}
+
+
+def test_query_pages():
+    bigquery = make_service(1)
+    client = async_client.AsyncBigQuery(bigquery)
+    pages = client.query('test', 'SELECT 0', interval=0.001)
+
+    async def first_page():
+        async for rows in pages:
+            return rows
+
+    rows = async_client.run(first_page())
+    client.close()
+
+    assert len(rows) == 2
+    assert pages.job['status']['state'] == 'DONE'
+
+
+def test_failed_query():
+    bigquery = make_service(1)
+    original = bigquery.create_job
+
+    def create_job(*args, **kwargs):
+        job = original(*args, **kwargs)
+        bigquery.fail_job(job['resource']['jobReference']['jobId'])
+        return job
+
+    bigquery.create_job = create_job
+    client = async_client.AsyncBigQuery(bigquery)
+
+    results = async_client.run(client.query_all(
+        'test', ['SELECT 0'], lambda query, rows: None, interval=0.001))
+    client.close()
+
+    assert isinstance(results[0], RuntimeError)
+
+
+def test_concurrency_limit():
+    bigquery = make_service(0, latency=0.01)
+    in_flight = [0, 0]
+    lock = threading.Lock()
+    record_request = bigquery.record_request
+
+    def counting_record_request():
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        record_request()
+
+    bigquery.record_request = counting_record_request
+    client = async_client.AsyncBigQuery(bigquery, max_concurrency=3)
+
+    async_client.run(client.query_all(
+        'test', ['SELECT x'] * 10, lambda query, rows: None,
+        interval=0.001))
+    client.close()
+
+    assert in_flight[1] == 3
+
+
+def test_insert_all():
+    bigquery = make_service(0)
+    client = async_client.AsyncBigQuery(bigquery)
+
+    reply = async_client.run(client.insert_all(
+        'test', 'dataset', 'table', [{'a': 1}, {'a': 2}]))
+    client.close()
+
+    assert 'insertErrors' not in reply
+    assert sorted(
+        row['a'] for row in bigquery.table_rows(
+            'test', 'dataset', 'table').values()) == [1, 2]
+
+
+def test_client_runs_on_several_loops():
+    bigquery = make_service(4)
+    client = async_client.AsyncBigQuery(bigquery, max_concurrency=1)
+    queries = ['SELECT {}'.format(i) for i in range(4)]
+
+    # The second run's requests wait on a semaphore of the second loop.
+    for _ in range(2):
+        results = async_client.run(client.query_all(
+            'test', queries, lambda query, rows: None, interval=0.001))
+        assert results == [5] * 4
+    client.close()
@@ -24,18 +24,21 @@ For more information, see the README.md under /bigquery.
 
 import argparse
 import json
-import time
+import sys
 import uuid
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+import job_poller
+import query_cache
+import query_profiler
+import query_results
+import services
 
 
 # [START async_query]
-def async_query(bigquery, project_id, query, batch=False, num_retries=5):
+def query_job_body(project_id, query, batch=False):
     # Generate a unique job_id so retries
     # don't accidentally duplicate query
-    job_data = {
+    return {
         'jobReference': {
             'projectId': project_id,
             'job_id': str(uuid.uuid4())
@@ -47,6 +50,10 @@ def async_query(bigquery, project_id, query, batch=False, num_retries=5):
             }
         }
     }
+
+
+def async_query(bigquery, project_id, query, batch=False, num_retries=5):
+    job_data = query_job_body(project_id, query, batch)
     return bigquery.jobs().insert(
         projectId=project_id,
         body=job_data).execute(num_retries=num_retries)
@@ -54,60 +61,84 @@ def async_query(bigquery, project_id, query, batch=False, num_retries=5):
 
 
 # [START poll_job]
-def poll_job(bigquery, job):
-    """Waits for a job to complete."""
-
-    print('Waiting for job to finish...')
-
-    request = bigquery.jobs().get(
-        projectId=job['jobReference']['projectId'],
-        jobId=job['jobReference']['jobId'])
-
-    while True:
-        result = request.execute(num_retries=2)
-
-        if result['status']['state'] == 'DONE':
-            if 'errorResult' in result['status']:
-                raise RuntimeError(result['status']['errorResult'])
-            print('Job complete.')
-            return
-
-        time.sleep(1)
+def poll_job(bigquery, job, interval=job_poller.DEFAULT_INTERVAL,
+             num_retries=5):
+    """Waits for a job to complete, polling less often while it stays in
+    the same state."""
+    return job_poller.poll_job(
+        bigquery, job, interval=interval, num_retries=num_retries)
 # [END poll_job]
 
 
 # [START run]
-def main(project_id, query_string, batch, num_retries, interval):
+def main(project_id, query_string, batch, num_retries, interval,
+         num_workers=query_results.DEFAULT_NUM_WORKERS, cache_path=None,
+         profile_path=None):
     # [START build_service]
-    # Grab the application's default credentials from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
-    # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials. Its discovery
+    # document is cached on disk, and its thread-safe transport allows
+    # result pages to be fetched concurrently.
+    bigquery = services.get_service('bigquery', 'v2')
     # [END build_service]
 
-    # Submit the job and wait for it to complete.
-    query_job = async_query(
-        bigquery,
-        project_id,
-        query_string,
-        batch,
-        num_retries)
-
-    poll_job(bigquery, query_job)
-
-    # Page through the result set and print all results.
-    page_token = None
-    while True:
-        page = bigquery.jobs().getQueryResults(
-            pageToken=page_token,
-            **query_job['jobReference']).execute(num_retries=2)
-
-        print(json.dumps(page['rows']))
-
-        page_token = page.get('pageToken')
-        if not page_token:
-            break
+    # Serve the query from the local cache if it holds a result that is
+    # still valid.
+    cache = query_cache.QueryCache(cache_path) if cache_path else None
+    rows = cache.get(
+        bigquery, project_id, query_string, num_retries) if cache else None
+
+    # Optionally estimate the cost of the query before running it, and
+    # record its cost and latency afterwards.
+    profiler = query_profiler.Profiler(profile_path) if profile_path else None
+
+    try:
+        if rows is None:
+            estimated_bytes = None
+            if profiler:
+                estimated_bytes = profiler.preflight(
+                    bigquery, project_id, query_string, num_retries)
+                sys.stderr.write('Query will process {} bytes.\n'.format(
+                    estimated_bytes))
+
+            # Submit the job and wait for it to complete.
+            query_job = async_query(
+                bigquery,
+                project_id,
+                query_string,
+                batch,
+                num_retries)
+
+            try:
+                poll_job(
+                    bigquery, query_job, interval=interval,
+                    num_retries=num_retries)
+            finally:
+                if profiler:
+                    profiler.record_job(
+                        bigquery, query_string, query_job['jobReference'],
+                        estimated_bytes, num_retries)
+
+            # Page through the result set, fetching several pages at a time,
+            # and print each row as a line of JSON as soon as it arrives.
+            rows = query_results.iter_rows(
+                bigquery,
+                query_job['jobReference'],
+                num_workers=num_workers,
+                num_retries=num_retries)
+
+            if cache:
+                rows = cache.cache_rows(
+                    bigquery, query_string, query_job['jobReference'], rows,
+                    num_retries)
+
+        query_results.write_ndjson(rows)
+    finally:
+        if cache:
+            sys.stderr.write(json.dumps(cache.stats()) + '\n')
+            cache.close()
+        if profiler:
+            profiler.close()
 # [END run]
 
 
@@ -130,6 +161,18 @@ if __name__ == '__main__':
         help='How often to poll the query for completion (seconds).',
         type=int,
         default=1)
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of result pages to fetch concurrently.',
+        type=int,
+        default=query_results.DEFAULT_NUM_WORKERS)
+    parser.add_argument(
+        '-c', '--cache',
+        help='Path to a local cache of query results to read and update.')
+    parser.add_argument(
+        '--profile',
+        help='Path to a file to record the cost and latency of the query '
+             'in. See query_profiler.py.')
 
     args = parser.parse_args()
 
@@ -138,5 +181,8 @@ if __name__ == '__main__':
         args.query,
         args.batch,
         args.num_retries,
-        args.poll_interval)
+        args.poll_interval,
+        args.num_workers,
+        args.cache,
+        args.profile)
 # [END main]
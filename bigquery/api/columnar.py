@@ -0,0 +1,191 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Decodes query result rows into typed columns.
+
+The API returns every value as a string inside a {'f': [{'v': ...}]} row.
+Holding results in that form costs many times the memory of the data
+itself. Columns decodes rows one page at a time into a column per field:
+INTEGER, FLOAT, TIMESTAMP and BOOLEAN fields become compact array.array
+columns, and all other fields, including repeated and nested ones, are kept
+as lists of their values.
+
+NULLs in typed columns are stored as zero, and recorded in a per-column
+mask. If NumPy is installed, to_numpy() returns copies of the columns as
+NumPy arrays, masking the NULLs, so that later pages can still be added.
+"""
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _int_typecode():
+    # 'q' (64 bit) isn't available in Python 2, where 'l' is 64 bit on most
+    # platforms.
+    try:
+        array.array('q')
+        return 'q'
+    except ValueError:
+        return 'l'
+
+
+# The array.array type code and decoding function of each typed column.
+# TIMESTAMPs are returned as floating point seconds since the epoch.
+TYPED_COLUMNS = {
+    'INTEGER': (_int_typecode(), int),
+    'FLOAT': ('d', float),
+    'TIMESTAMP': ('d', float),
+    'BOOLEAN': ('b', lambda value: value == 'true'),
+}
+
+
+class Column(object):
+    """The values of one field.
+
+    Attributes:
+        name: the field name.
+        type: the field type from the schema.
+        values: an array.array for typed columns, otherwise a list.
+        nulls: for typed columns, a bytearray that is 1 where the value is
+            NULL. None for other columns, where NULLs are kept as None.
+    """
+
+    def __init__(self, field):
+        self.name = field['name']
+        self.type = field['type']
+        self._decode = None
+        self.nulls = None
+
+        typed = TYPED_COLUMNS.get(self.type)
+        if typed and field.get('mode') != 'REPEATED':
+            self.values = array.array(typed[0])
+            self.nulls = bytearray()
+            self._decode = typed[1]
+        else:
+            self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def extend(self, raw_values):
+        if self._decode is None:
+            self.values.extend(raw_values)
+            return
+
+        decode = self._decode
+        decoded = []
+        nulls = []
+        for value in raw_values:
+            if value is None:
+                decoded.append(0)
+                nulls.append(1)
+            else:
+                decoded.append(decode(value))
+                nulls.append(0)
+        self.values.extend(decoded)
+        self.nulls.extend(nulls)
+
+    def to_list(self):
+        """Returns the values as a list, with None for NULLs."""
+        if self.nulls is None:
+            return list(self.values)
+        if self.type == 'BOOLEAN':
+            values = [bool(value) for value in self.values]
+        else:
+            values = self.values.tolist()
+        return [
+            None if null else value
+            for value, null in zip(values, self.nulls)]
+
+    def to_numpy(self):
+        """Returns the values as a NumPy array, masked if there are NULLs.
+
+        The array is a copy: one that shared the buffer of self.values
+        would stop it from growing with later pages.
+        """
+        if numpy is None:
+            raise RuntimeError('NumPy is not installed.')
+        if self.nulls is None:
+            return numpy.array(self.values, dtype=object)
+
+        values = numpy.array(self.values, dtype=self.values.typecode)
+        if self.type == 'BOOLEAN':
+            values = values.view(numpy.bool_)
+        if any(self.nulls):
+            mask = numpy.array(self.nulls, dtype=numpy.bool_)
+            return numpy.ma.masked_array(values, mask=mask)
+        return values
+
+
+class Columns(object):
+    """Query results decoded into one Column per field of the schema.
+
+    Rows are added a page at a time with extend(), so that a large result
+    never needs to be held as decoded JSON all at once.
+    """
+
+    def __init__(self, schema):
+        self.columns = [Column(field) for field in schema['fields']]
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __getitem__(self, name):
+        for column in self.columns:
+            if column.name == name:
+                return column
+        raise KeyError(name)
+
+    @property
+    def names(self):
+        return [column.name for column in self.columns]
+
+    def extend(self, rows):
+        """Appends rows in the API's {'f': [{'v': ...}]} format."""
+        if not isinstance(rows, list):
+            rows = list(rows)
+        for index, column in enumerate(self.columns):
+            column.extend([row['f'][index]['v'] for row in rows])
+
+    def extend_pages(self, rows, page_size=10000):
+        """Appends rows from an iterator, such as query_results.iter_rows,
+        decoding page_size rows at a time."""
+        page = []
+        for row in rows:
+            page.append(row)
+            if len(page) >= page_size:
+                self.extend(page)
+                page = []
+        if page:
+            self.extend(page)
+
+    def to_dict(self):
+        """Returns a dict mapping each field name to a list of values."""
+        return dict(
+            (column.name, column.to_list()) for column in self.columns)
+
+    def to_numpy(self):
+        """Returns a dict mapping each field name to a NumPy array."""
+        return dict(
+            (column.name, column.to_numpy()) for column in self.columns)
+
+
+def decode(schema, rows):
+    """Decodes a list of rows into Columns."""
+    columns = Columns(schema)
+    columns.extend(rows)
+    return columns
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares the memory used by query results kept as the API's row dicts
+with the memory used by the same results decoded into columnar.Columns, and
+measures how fast pages are decoded.
+
+Pages are parsed from JSON, as they would be coming off the wire. Memory is
+measured with tracemalloc, so it is only reported on Python 3.4 and later.
+
+Example invocation:
+    $ python columnar_benchmark.py --rows 500000
+"""
+
+import argparse
+import json
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import columnar
+import fake_bigquery
+
+SCHEMA = {'fields': [
+    {'name': 'id', 'type': 'INTEGER'},
+    {'name': 'score', 'type': 'FLOAT'},
+    {'name': 'created', 'type': 'TIMESTAMP'},
+    {'name': 'active', 'type': 'BOOLEAN'},
+    {'name': 'name', 'type': 'STRING'},
+]}
+
+
+def make_pages(num_rows, page_size):
+    """Returns the results as serialized getQueryResults pages."""
+    pages = []
+    for start in range(0, num_rows, page_size):
+        rows = [
+            fake_bigquery.make_row([
+                i, i * 0.5, '{}.0E9'.format(1 + i % 9), i % 2 == 0,
+                'name{}'.format(i % 1000)])
+            for i in range(start, min(start + page_size, num_rows))]
+        pages.append(json.dumps({'schema': SCHEMA, 'rows': rows}))
+    return pages
+
+
+def keep_rows(pages):
+    rows = []
+    for page in pages:
+        rows.extend(json.loads(page)['rows'])
+    return rows
+
+
+def keep_columns(pages):
+    columns = columnar.Columns(SCHEMA)
+    for page in pages:
+        columns.extend(json.loads(page)['rows'])
+    return columns
+
+
+def measure(read, pages):
+    """Returns (seconds taken, bytes held by the result) of reading pages."""
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    result = read(pages)
+    elapsed = time.time() - start
+    size = None
+    if tracemalloc:
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    del result
+    return elapsed, size
+
+
+def main(num_rows, page_size):
+    pages = make_pages(num_rows, page_size)
+
+    for label, read in (('rows', keep_rows), ('columns', keep_columns)):
+        elapsed, size = measure(read, pages)
+        memory = 'n/a' if size is None else '{:.1f}MB'.format(size / 1e6)
+        print('{}: {} rows in {:.2f}s ({:.0f} rows/s), {} held'.format(
+            label, num_rows, elapsed, num_rows / elapsed, memory))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--rows', help='Number of rows in the result.', type=int,
+        default=200000)
+    parser.add_argument(
+        '--page_size', help='Rows per page.', type=int, default=10000)
+
+    args = parser.parse_args()
+
+    main(args.rows, args.page_size)
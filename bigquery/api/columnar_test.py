@@ -0,0 +1,90 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+
+import columnar
+from fake_bigquery import make_row
+import pytest
+
+SCHEMA = {'fields': [
+    {'name': 'id', 'type': 'INTEGER'},
+    {'name': 'score', 'type': 'FLOAT'},
+    {'name': 'created', 'type': 'TIMESTAMP'},
+    {'name': 'active', 'type': 'BOOLEAN'},
+    {'name': 'name', 'type': 'STRING'},
+    {'name': 'tags', 'type': 'INTEGER', 'mode': 'REPEATED'},
+]}
+
+ROWS = [
+    make_row([1, 0.5, '1.4E9', True, 'a', None]),
+    make_row([None, None, None, None, None, None]),
+    make_row([3, 2.5, '1.5E9', False, 'c', None]),
+]
+
+
+def test_decode():
+    columns = columnar.decode(SCHEMA, ROWS)
+
+    assert len(columns) == 3
+    assert columns.names == [
+        'id', 'score', 'created', 'active', 'name', 'tags']
+    assert isinstance(columns['id'].values, array.array)
+    assert isinstance(columns['name'].values, list)
+    assert columns.to_dict() == {
+        'id': [1, None, 3],
+        'score': [0.5, None, 2.5],
+        'created': [1.4e9, None, 1.5e9],
+        'active': [True, None, False],
+        'name': ['a', None, 'c'],
+        'tags': [None, None, None],
+    }
+
+
+def test_extend_pages():
+    columns = columnar.Columns(SCHEMA)
+
+    columns.extend_pages(iter(ROWS * 5), page_size=4)
+
+    assert len(columns) == 15
+    assert columns['id'].to_list() == [1, None, 3] * 5
+
+
+def test_unknown_column():
+    columns = columnar.Columns(SCHEMA)
+
+    with pytest.raises(KeyError):
+        columns['missing']
+
+
+def test_to_numpy():
+    numpy = pytest.importorskip('numpy')
+
+    arrays = columnar.decode(SCHEMA, ROWS).to_numpy()
+
+    assert arrays['id'].dtype.kind == 'i'
+    assert arrays['id'].mask.tolist() == [False, True, False]
+    assert arrays['active'].dtype == numpy.bool_
+    assert arrays['name'].tolist() == ['a', None, 'c']
+
+
+def test_extend_after_to_numpy():
+    pytest.importorskip('numpy')
+    columns = columnar.decode(SCHEMA, ROWS)
+    arrays = columns.to_numpy()
+
+    columns.extend(ROWS)
+
+    assert len(columns) == 6
+    assert all(len(column) == 6 for column in columns.columns)
+    assert arrays['id'].tolist() == [1, None, 3]
@@ -0,0 +1,22 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+collect_ignore = []
+
+# async_client uses async/await, which older versions of Python can't parse,
+# and returns async iterators from __aiter__, which needs 3.5.2. nox runs its
+# tests in the async_tests session.
+if sys.version_info < (3, 5, 2):
+    collect_ignore.append('async_client_test.py')
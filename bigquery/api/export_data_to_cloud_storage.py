@@ -16,6 +16,14 @@
 """Command-line application to export a table from BigQuery to Google Cloud
 Storage.
 
+Several tables can be exported at once by passing a comma-separated list of
+table IDs. Each table is then written to sharded files under the given
+Cloud Storage path, for example gs://mybucket/exports/mytable/mytable-*.csv.
+A table whose path already holds files, such as from an earlier export, is
+skipped unless --overwrite is passed, in which case those files are deleted
+first. All the export jobs are submitted before waiting on them together,
+and the files written for each table are checked once every export is done.
+
 This sample is used on this page:
 
     https://cloud.google.com/bigquery/exporting-data-from-bigquery
@@ -24,11 +32,30 @@ For more information, see the README.md under /bigquery.
 """
 
 import argparse
+import collections
+from concurrent import futures
 import time
 import uuid
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+from googleapiclient.errors import HttpError
+import job_poller
+import services
+import sharded_load
+
+DEFAULT_NUM_WORKERS = 4
+
+FILE_EXTENSIONS = {
+    'CSV': 'csv',
+    'NEWLINE_DELIMITED_JSON': 'json',
+    'AVRO': 'avro',
+}
+
+# The outcome of exporting one table with export_tables(). `seconds` is the
+# time from submitting the job until it was done, and `shards` and `bytes`
+# describe the files found in Cloud Storage afterwards.
+ExportResult = collections.namedtuple(
+    'ExportResult',
+    ['table_id', 'uri', 'seconds', 'shards', 'bytes', 'error'])
 
 
 # [START export_table]
@@ -80,40 +107,172 @@ def export_table(bigquery, cloud_storage_path,
 # [END export_table]
 
 
-# [START poll_job]
-def poll_job(bigquery, job):
-    """Waits for a job to complete."""
+def sharded_uri(cloud_storage_prefix, table_id, export_format="CSV",
+                compression="NONE"):
+    """Returns a wildcard URI under which a table is exported in shards.
+
+    BigQuery writes a table of more than 1GB to several files only if the
+    destination contains a '*', and several files are also written in
+    parallel, so even smaller tables export faster this way.
+    """
+    extension = FILE_EXTENSIONS[export_format]
+    if compression == "GZIP":
+        extension += '.gz'
+    return '{}/{}/{}-*.{}'.format(
+        cloud_storage_prefix.rstrip('/'), table_id, table_id, extension)
+
+
+def export_tables(bigquery, storage, cloud_storage_prefix,
+                  project_id, dataset_id, table_ids,
+                  export_format="CSV", compression="NONE",
+                  num_workers=DEFAULT_NUM_WORKERS, interval=1,
+                  num_retries=5, overwrite=False):
+    """Exports several tables to sharded files in Cloud Storage.
+
+    Every export job is submitted first, and then all the jobs are waited
+    on together, so all of the exports run in BigQuery at the same time.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object, safe to use from several threads.
+        storage: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        cloud_storage_prefix: the Cloud Storage path under which each table
+            is exported, e.g. gs://mybucket/exports/
+        num_workers: the number of requests sent concurrently, to submit,
+            poll and check the exports. It doesn't limit how many exports
+            run at once.
+        overwrite: whether to delete the files already at a table's URI
+            before exporting it. Otherwise a table with files at its URI
+            isn't exported, and its result has an error saying so.
+
+    Returns:
+        An ExportResult for each table, in the order of table_ids. A job
+        that couldn't be submitted or failed, or files that don't match the
+        job's statistics, are reported in `error` rather than raised.
+    """
+    def submit(table_id):
+        uri = sharded_uri(
+            cloud_storage_prefix, table_id, export_format, compression)
+        start = time.time()
+        try:
+            existing = sharded_load.expand_uris(storage, [uri], num_retries)
+            if existing and not overwrite:
+                return table_id, uri, start, None, (
+                    '{} files already exist at {}.'.format(
+                        len(existing), uri))
+            clear_shards(storage, existing, num_retries)
+            job = export_table(
+                bigquery, uri, project_id, dataset_id, table_id,
+                export_format=export_format, num_retries=num_retries,
+                compression=compression)
+        except HttpError as error:
+            return table_id, uri, start, None, str(error)
+        return table_id, uri, start, job, None
+
+    def check(submitted):
+        table_id, uri, start, job, error = submitted
+        if job is None:
+            return ExportResult(table_id, uri, 0.0, 0, 0, error)
+
+        result = results[job['jobReference']['jobId']]
+        # The results time the jobs from the start of the wait.
+        seconds = wait_start - start + result.seconds
+        if result.error:
+            return ExportResult(
+                table_id, uri, seconds, 0, 0, result.error.get('message'))
+
+        try:
+            shards, size, error = verify_shards(
+                storage, uri, result.job, num_retries)
+        except HttpError as error:
+            return ExportResult(
+                table_id, uri, seconds, 0, 0,
+                'Listing the files failed: {}'.format(error))
+        return ExportResult(table_id, uri, seconds, shards, size, error)
 
-    print('Waiting for job to finish...')
+    with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        exports = list(executor.map(submit, table_ids))
 
-    request = bigquery.jobs().get(
-        projectId=job['jobReference']['projectId'],
-        jobId=job['jobReference']['jobId'])
+        wait_start = time.time()
+        results = job_poller.wait_all(
+            bigquery, [job for _, _, _, job, _ in exports if job],
+            interval=interval, num_workers=num_workers,
+            num_retries=num_retries)
 
-    while True:
-        result = request.execute(num_retries=2)
+        return list(executor.map(check, exports))
 
-        if result['status']['state'] == 'DONE':
-            if 'errorResult' in result['status']:
-                raise RuntimeError(result['status']['errorResult'])
-            print('Job complete.')
-            return
 
-        time.sleep(1)
+def clear_shards(storage, objects, num_retries=5):
+    """Deletes the files of an earlier export, as returned by
+    sharded_load.expand_uris, which verify_shards would count otherwise."""
+    for object_uri, _ in objects:
+        bucket, name = sharded_load.split_uri(object_uri)
+        storage.objects().delete(bucket=bucket, object=name).execute(
+            num_retries=num_retries)
+
+
+def verify_shards(storage, uri, job, num_retries=5):
+    """Lists the files an export job wrote to a wildcard URI.
+
+    Returns:
+        A tuple of the number of files, their total size in bytes and an
+        error message, or None if the files match the job's statistics.
+    """
+    objects = sharded_load.expand_uris(storage, [uri], num_retries)
+    shards = len(objects)
+    size = sum(object_size for _, object_size in objects)
+
+    counts = job.get('statistics', {}).get('extract', {}).get(
+        'destinationUriFileCounts')
+    error = None
+    if not objects:
+        error = 'No files were written to {}'.format(uri)
+    elif counts and int(counts[0]) != shards:
+        error = 'Expected {} files, found {}.'.format(counts[0], shards)
+    return shards, size, error
+
+
+def print_report(results):
+    """Prints the time taken and files written for each table, slowest
+    first."""
+    for result in sorted(results, key=lambda r: r.seconds, reverse=True):
+        print('{}\t{:.1f}s\t{} files\t{:.1f}MB\t{}'.format(
+            result.table_id, result.seconds, result.shards,
+            result.bytes / 1e6, result.error or 'DONE'))
+
+
+# [START poll_job]
+def poll_job(bigquery, job, interval=job_poller.DEFAULT_INTERVAL,
+             num_retries=5):
+    """Waits for a job to complete, polling less often while it stays in
+    the same state."""
+    return job_poller.poll_job(
+        bigquery, job, interval=interval, num_retries=num_retries)
 # [END poll_job]
 
 
 # [START run]
 def main(cloud_storage_path, project_id, dataset_id, table_id,
-         num_retries, interval, export_format="CSV", compression="NONE"):
+         num_retries, interval, export_format="CSV", compression="NONE",
+         num_workers=DEFAULT_NUM_WORKERS, overwrite=False):
     # [START build_service]
-    # Grab the application's default credentials from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
-    # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials.
+    bigquery = services.get_service('bigquery', 'v2')
     # [END build_service]
 
+    table_ids = table_id.split(',')
+    if len(table_ids) > 1:
+        storage = services.get_service('storage', 'v1')
+        results = export_tables(
+            bigquery, storage, cloud_storage_path, project_id, dataset_id,
+            table_ids, export_format=export_format, compression=compression,
+            num_workers=num_workers, interval=interval,
+            num_retries=num_retries, overwrite=overwrite)
+        print_report(results)
+        return
+
     job = export_table(
         bigquery,
         cloud_storage_path,
@@ -123,7 +282,8 @@ def main(cloud_storage_path, project_id, dataset_id, table_id,
         num_retries=num_retries,
         export_format=export_format,
         compression=compression)
-    poll_job(bigquery, job)
+    poll_job(
+        bigquery, job, interval=interval, num_retries=num_retries)
 # [END run]
 
 
@@ -134,11 +294,15 @@ if __name__ == '__main__':
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('project_id', help='Your Google Cloud project ID.')
     parser.add_argument('dataset_id', help='BigQuery dataset to export.')
-    parser.add_argument('table_id', help='BigQuery table to export.')
+    parser.add_argument(
+        'table_id',
+        help=('BigQuery table to export, or a comma-separated list of '
+              'tables to export concurrently.'))
     parser.add_argument(
         'gcs_path',
         help=('Google Cloud Storage path to store the exported data. For '
-              'example, gs://mybucket/mydata.csv'))
+              'example, gs://mybucket/mydata.csv, or gs://mybucket/exports/ '
+              'when exporting several tables.'))
     parser.add_argument(
         '-p', '--poll_interval',
         help='How often to poll the query for completion (seconds).',
@@ -154,6 +318,17 @@ if __name__ == '__main__':
         help='compress resultset with gzip',
         action='store_true',
         default=False)
+    parser.add_argument(
+        '-w', '--num_workers',
+        help=('Number of requests to send concurrently when exporting '
+              'several tables. All of the exports run at once.'),
+        type=int,
+        default=DEFAULT_NUM_WORKERS)
+    parser.add_argument(
+        '--overwrite',
+        help=('Delete the files already in a table\'s export path when '
+              'exporting several tables.'),
+        action='store_true')
 
     args = parser.parse_args()
 
@@ -164,5 +339,7 @@ if __name__ == '__main__':
         args.table_id,
         args.num_retries,
         args.poll_interval,
-        compression="GZIP" if args.gzip else "NONE")
+        compression="GZIP" if args.gzip else "NONE",
+        num_workers=args.num_workers,
+        overwrite=args.overwrite)
 # [END main]
@@ -11,8 +11,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import export_data_to_cloud_storage
 from export_data_to_cloud_storage import main
+import fake_bigquery
+import fake_storage
 from gcp.testing.flaky import flaky
+from googleapiclient import errors
+import httplib2
 
 DATASET_ID = 'test_dataset'
 TABLE_ID = 'test_table'
@@ -58,3 +63,93 @@ def test_export_table_avro(cloud_config):
         num_retries=5,
         interval=1,
         export_format="AVRO")
+
+
+def test_sharded_uri():
+    assert export_data_to_cloud_storage.sharded_uri(
+        'gs://bucket/exports/', 'words', 'NEWLINE_DELIMITED_JSON', 'GZIP'
+    ) == 'gs://bucket/exports/words/words-*.json.gz'
+
+
+def test_export_tables():
+    storage = fake_storage.FakeStorage(page_size=2)
+    bigquery = fake_bigquery.FakeBigQuery(storage=storage, running_polls=1)
+    bigquery.export_shard_rows = 2
+    for table_id, num_rows in (('small', 1), ('large', 7)):
+        bigquery.insert_rows('test', DATASET_ID, table_id, [
+            {'insertId': str(i), 'json': {'n': i}} for i in range(num_rows)])
+
+    results = export_data_to_cloud_storage.export_tables(
+        bigquery, storage, 'gs://bucket/exports', 'test', DATASET_ID,
+        ['small', 'large'], export_format='NEWLINE_DELIMITED_JSON',
+        num_workers=2, interval=0.001)
+
+    assert [r.table_id for r in results] == ['small', 'large']
+    assert [r.shards for r in results] == [1, 4]
+    assert [r.error for r in results] == [None, None]
+    assert results[1].uri == 'gs://bucket/exports/large/large-*.json'
+    assert results[1].bytes == sum(
+        len(storage.get_content('bucket', 'exports/large/large-{:012d}.json'
+                                .format(i))) for i in range(4))
+
+
+def test_export_tables_keeps_existing_files():
+    storage = fake_storage.FakeStorage()
+    bigquery = fake_bigquery.FakeBigQuery(storage=storage)
+    bigquery.insert_rows('test', DATASET_ID, 'words', [
+        {'insertId': '0', 'json': {'n': 0}}])
+    storage.add_object(
+        'bucket', 'exports/words/words-000000000000.csv', b'old\n')
+
+    results = export_data_to_cloud_storage.export_tables(
+        bigquery, storage, 'gs://bucket/exports', 'test', DATASET_ID,
+        ['words'], interval=0.001)
+
+    assert results[0].error == (
+        '1 files already exist at gs://bucket/exports/words/words-*.csv.')
+    assert storage.get_content(
+        'bucket', 'exports/words/words-000000000000.csv') == b'old\n'
+
+
+def test_export_tables_replaces_stale_shards_and_goes_on_after_errors():
+    storage = fake_storage.FakeStorage()
+    bigquery = fake_bigquery.FakeBigQuery(storage=storage, running_polls=1)
+    bigquery.export_shard_rows = 2
+    bigquery.insert_rows('test', DATASET_ID, 'words', [
+        {'insertId': str(i), 'json': {'n': i}} for i in range(3)])
+    # An earlier export of a larger table left more shards.
+    for i in range(5):
+        storage.add_object(
+            'bucket', 'exports/words/words-{:012d}.csv'.format(i), b'old\n')
+    original = bigquery.create_job
+
+    def create_job(project_id, configuration, *args, **kwargs):
+        table = configuration['extract']['sourceTable']['tableId']
+        if table == 'missing':
+            raise errors.HttpError(httplib2.Response({'status': 404}), b'')
+        return original(project_id, configuration, *args, **kwargs)
+
+    bigquery.create_job = create_job
+
+    results = export_data_to_cloud_storage.export_tables(
+        bigquery, storage, 'gs://bucket/exports', 'test', DATASET_ID,
+        ['missing', 'words'], interval=0.001, overwrite=True)
+
+    assert results[0].table_id == 'missing'
+    assert results[0].error
+    assert results[1].error is None
+    assert results[1].shards == 2
+    assert storage.get_content(
+        'bucket', 'exports/words/words-000000000000.csv') != b'old\n'
+
+
+def test_verify_shards_mismatch():
+    storage = fake_storage.FakeStorage()
+    storage.add_object('bucket', 'words/words-000000000000.csv', b'a\n')
+    job = {'statistics': {'extract': {'destinationUriFileCounts': ['2']}}}
+
+    shards, size, error = export_data_to_cloud_storage.verify_shards(
+        storage, 'gs://bucket/words/words-*.csv', job)
+
+    assert (shards, size) == (1, 2)
+    assert error == 'Expected 2 files, found 1.'
@@ -0,0 +1,836 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the BigQuery API service object.
+
+FakeBigQuery mimics the parts of the googleapiclient service object used by
+these samples, so that they can be tested and benchmarked without a project
+or network access. Every request sleeps for `latency` seconds before it is
+answered, which approximates the round trip to the real API.
+
+FakeBigQueryServer serves the jobs methods of a FakeBigQuery over HTTP on a
+local port instead, so that requests also go through the client library,
+httplib2 and a socket.
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from googleapiclient.model import JsonModel
+import httplib2
+import services
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+UPLOAD_URI = (
+    'https://www.googleapis.com/resumable/upload/bigquery/v2/projects/{}/jobs'
+    '?uploadType=resumable')
+
+
+def make_row(values):
+    """Encodes a list of python values the way the API returns a row."""
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append({'v': None})
+        elif isinstance(value, bool):
+            cells.append({'v': 'true' if value else 'false'})
+        else:
+            cells.append({'v': str(value)})
+    return {'f': cells}
+
+
+class FakeRequest(object):
+    """A request that is only answered when it is executed."""
+
+    def __init__(self, service, handler, **kwargs):
+        self.headers = {}
+        self._service = service
+        self._handler = handler
+        self._kwargs = kwargs
+
+    def execute(self, num_retries=0, http=None):
+        self._service.record_request()
+        if self._service.latency:
+            time.sleep(self._service.latency)
+        return self._handler(**self._kwargs)
+
+
+class FakeBatch(object):
+    """A batch of requests answered in a single round trip."""
+
+    def __init__(self, service, callback=None):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self._requests))
+        self._requests.append((request_id, request, callback))
+
+    def execute(self, http=None):
+        self._service.record_request()
+        if self._service.latency:
+            time.sleep(self._service.latency)
+        for request_id, request, callback in self._requests:
+            response, exception = None, None
+            try:
+                response = request._handler(**request._kwargs)
+            except HttpError as error:
+                exception = error
+            for done in (callback, self._callback):
+                if done is not None:
+                    done(request_id, response, exception)
+
+
+class FakeBigQuery(object):
+    """Serves query jobs out of results registered with set_query_result.
+
+    Args:
+        latency: seconds each request takes.
+        max_page_rows: the most rows returned in one page, standing in for
+            the API's response size limit.
+        running_polls: how many times a job reports itself as still running
+            before it is done.
+        storage: a fake_storage.FakeStorage holding the Cloud Storage
+            objects read by load jobs.
+        bandwidth: bytes per second at which media uploads are received, or
+            None for no limit.
+    """
+
+    def __init__(self, latency=0.0, max_page_rows=100000, running_polls=0,
+                 storage=None, bandwidth=None):
+        self.latency = latency
+        self.max_page_rows = max_page_rows
+        self.running_polls = running_polls
+        self.storage = storage
+        self.upload_http = FakeUploadHttp(self, bandwidth)
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._results = {}
+        self._jobs = {}
+        self._tables = {}
+        self._insert_failures = {}
+        self._job_errors = {}
+        self._job_warnings = {}
+        self._table_modified = {}
+        self._projects = []
+        # Dataset resources by (project, dataset), and their table IDs.
+        self._datasets = {}
+        self._dataset_tables = {}
+        self.list_page_size = 50
+        # The most rows written to each file by an export to a wildcard URI.
+        self.export_shard_rows = 1000
+        # The data uploaded to each load job, by job ID.
+        self.uploads = {}
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def set_query_result(self, query, fields, rows, referenced_tables=()):
+        """Registers the schema fields and rows (lists of values) returned
+        by a query, and the (project, dataset, table) tuples it reads."""
+        self._results[query] = (
+            {'fields': fields}, [make_row(row) for row in rows],
+            [{'projectId': p, 'datasetId': d, 'tableId': t}
+             for p, d, t in referenced_tables])
+
+    def touch_table(self, project_id, dataset_id, table_id):
+        """Marks a table, and the dataset holding it, as modified."""
+        key = (project_id, dataset_id, table_id)
+        with self._lock:
+            self._table_modified[key] = str(
+                int(self.table_modified(*key)) + 1)
+            dataset = self._datasets.get((project_id, dataset_id))
+            if dataset:
+                dataset['lastModifiedTime'] = str(
+                    int(dataset['lastModifiedTime']) + 1)
+
+    def add_table(self, project_id, dataset_id, table_id):
+        """Creates a table, and its dataset and project if needed."""
+        with self._lock:
+            if project_id not in self._projects:
+                self._projects.append(project_id)
+            key = (project_id, dataset_id)
+            if key not in self._datasets:
+                self._datasets[key] = {
+                    'kind': 'bigquery#dataset',
+                    'datasetReference': {
+                        'projectId': project_id,
+                        'datasetId': dataset_id,
+                    },
+                    'lastModifiedTime': '1',
+                }
+                self._dataset_tables[key] = []
+            self._dataset_tables[key].append(table_id)
+        self.touch_table(project_id, dataset_id, table_id)
+
+    def page(self, items, page_token):
+        """Returns one page of a list and the token of the next."""
+        start = int(page_token or 0)
+        end = start + self.list_page_size
+        return items[start:end], str(end) if end < len(items) else None
+
+    def table_modified(self, project_id, dataset_id, table_id):
+        return self._table_modified.get(
+            (project_id, dataset_id, table_id), '1')
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def projects(self):
+        return _Projects(self)
+
+    def datasets(self):
+        return _Datasets(self)
+
+    def jobs(self):
+        return _Jobs(self)
+
+    def tables(self):
+        return _Tables(self)
+
+    def tabledata(self):
+        return _TableData(self)
+
+    def table_rows(self, project_id, dataset_id, table_id):
+        """Returns the rows streamed into a table, keyed by insertId."""
+        return self._tables.setdefault((project_id, dataset_id, table_id), {})
+
+    def fail_insert(self, insert_id, reason='backendError', times=1):
+        """Makes the next `times` attempts to insert a row fail."""
+        self._insert_failures[insert_id] = [reason, times]
+
+    def insert_rows(self, project_id, dataset_id, table_id, rows):
+        """Inserts rows, honoring the failures set up with fail_insert.
+
+        As with the real API, when any row fails, none of the other rows in
+        the request are inserted and they are reported as 'stopped'.
+        """
+        with self._lock:
+            errors = []
+            for index, row in enumerate(rows):
+                failure = self._insert_failures.get(row.get('insertId'))
+                if failure and failure[1] > 0:
+                    failure[1] -= 1
+                    errors.append({'index': index, 'errors': [
+                        {'reason': failure[0], 'message': 'Injected.'}]})
+
+            if errors:
+                failed = set(error['index'] for error in errors)
+                errors.extend(
+                    {'index': index, 'errors': [{'reason': 'stopped'}]}
+                    for index in range(len(rows)) if index not in failed)
+                return errors
+
+            table = self.table_rows(project_id, dataset_id, table_id)
+            for row in rows:
+                table[row.get('insertId')] = row['json']
+            return []
+
+    def create_job(self, project_id, configuration, job_id=None, media=None):
+        job_id = job_id or str(uuid.uuid4())
+        query = configuration.get('query', {}).get('query')
+        schema, rows, referenced = self._results.get(
+            query, ({'fields': []}, [], []))
+        with self._lock:
+            self._jobs[job_id] = {
+                'resource': {
+                    'jobReference': {
+                        'projectId': project_id,
+                        'jobId': job_id,
+                    },
+                    'configuration': configuration,
+                    'status': {'state': 'RUNNING'},
+                    'statistics': {'creationTime': _now_ms()},
+                },
+                'schema': schema,
+                'rows': rows,
+                'referenced_tables': referenced,
+                'running_polls': self.running_polls,
+                'media': media,
+            }
+        return self._jobs[job_id]
+
+    def query_statistics(self, rows):
+        """Makes up the statistics of a query that returned rows."""
+        processed = len(json.dumps(rows))
+        # Queries are billed by the MB, with a minimum of 10MB.
+        billed = max(10, (processed + 2 ** 20 - 1) // 2 ** 20) * 2 ** 20
+        return {
+            'totalBytesProcessed': str(processed),
+            'totalBytesBilled': str(billed),
+            'totalSlotMs': str(len(rows) + 1),
+            'cacheHit': False,
+        }
+
+    def dry_run(self, project_id, configuration):
+        """Returns the job resource of a dry run, without creating a job."""
+        query = configuration.get('query', {}).get('query')
+        _, rows, _ = self._results.get(query, (None, [], None))
+        processed = self.query_statistics(rows)['totalBytesProcessed']
+        return {
+            'jobReference': {'projectId': project_id},
+            'configuration': configuration,
+            'status': {'state': 'DONE'},
+            'statistics': {
+                'totalBytesProcessed': processed,
+                'query': {'totalBytesProcessed': processed},
+            },
+        }
+
+    def fail_job(self, job_id, message='Injected failure.'):
+        """Makes the job fail once it is done."""
+        self._job_errors[job_id] = {'reason': 'invalid', 'message': message}
+
+    def warn_job(self, job_id, message='Injected error.'):
+        """Makes the job succeed with an error once it is done, as a load
+        job does when it skips bad rows."""
+        self._job_warnings[job_id] = {'reason': 'invalid', 'message': message}
+
+    def get_job(self, job_id):
+        return self._jobs[job_id]
+
+    def poll_job(self, job_id):
+        """Advances the job one poll towards completion."""
+        job = self._jobs[job_id]
+        with self._lock:
+            if job['running_polls'] > 0:
+                job['running_polls'] -= 1
+            elif job['resource']['status']['state'] != 'DONE':
+                job['resource']['status']['state'] = 'DONE'
+                self._finish_job(job)
+                if job_id in self._job_errors:
+                    job['resource']['status']['errorResult'] = (
+                        self._job_errors[job_id])
+                    job['resource']['status']['errors'] = [
+                        self._job_errors[job_id]]
+                elif job_id in self._job_warnings:
+                    job['resource']['status']['errors'] = [
+                        self._job_warnings[job_id]]
+        return job
+
+    def _finish_job(self, record):
+        job = record['resource']
+        statistics = job['statistics']
+        statistics['startTime'] = statistics['creationTime']
+        statistics['endTime'] = _now_ms()
+
+        if 'query' in job['configuration']:
+            statistics['query'] = self.query_statistics(record['rows'])
+            statistics['query']['referencedTables'] = (
+                record['referenced_tables'])
+            statistics['totalBytesProcessed'] = (
+                statistics['query']['totalBytesProcessed'])
+
+        extract = job['configuration'].get('extract')
+        if extract and self.storage:
+            statistics['extract'] = {'destinationUriFileCounts': [
+                str(self._export(extract['sourceTable'], uri))
+                for uri in extract['destinationUris']]}
+
+        load = job['configuration'].get('load')
+        if load and record.get('media') is not None:
+            self.uploads[job['jobReference']['jobId']] = record['media']
+            statistics['load'] = {
+                'inputFiles': '1',
+                'inputFileBytes': str(len(record['media'])),
+            }
+        elif load and self.storage:
+            contents = [
+                self.storage.get_content(*_split_uri(uri))
+                for uri in load['sourceUris']]
+            statistics['load'] = {
+                'inputFiles': str(len(contents)),
+                'inputFileBytes': str(sum(len(c) for c in contents)),
+                'outputRows': str(sum(c.count(b'\n') for c in contents)),
+            }
+
+    def _export(self, table, uri):
+        """Writes the rows streamed into a table to Cloud Storage as
+        newline delimited JSON, returning the number of files written."""
+        rows = list(self.table_rows(
+            table['projectId'], table['datasetId'], table['tableId']).values())
+        lines = [json.dumps(row).encode('utf-8') + b'\n' for row in rows]
+        bucket, name = _split_uri(uri)
+
+        if '*' not in name:
+            self.storage.add_object(bucket, name, b''.join(lines))
+            return 1
+
+        shard_rows = self.export_shard_rows
+        num_shards = max(1, (len(lines) + shard_rows - 1) // shard_rows)
+        for shard in range(num_shards):
+            self.storage.add_object(
+                bucket, name.replace('*', '{:012d}'.format(shard), 1),
+                b''.join(lines[shard * shard_rows:(shard + 1) * shard_rows]))
+        return num_shards
+
+
+def _now_ms():
+    return str(int(time.time() * 1000))
+
+
+def _split_uri(uri):
+    """Splits gs://bucket/name into (bucket, name)."""
+    return uri[len('gs://'):].split('/', 1)
+
+
+class _Jobs(object):
+    def __init__(self, service):
+        self._service = service
+
+    def insert(self, projectId, body, media_body=None):
+        if media_body is not None and media_body.resumable():
+            # Resumable uploads go through the real client code, talking to
+            # FakeUploadHttp.
+            return HttpRequest(
+                self._service.upload_http, JsonModel().response,
+                UPLOAD_URI.format(projectId), method='POST',
+                body=json.dumps(body),
+                headers={'content-type': 'application/json'},
+                resumable=media_body)
+
+        media = None
+        if media_body is not None:
+            media = media_body.getbytes(0, media_body.size())
+        return FakeRequest(self._service, self._insert,
+                           projectId=projectId, body=body, media=media)
+
+    def _insert(self, projectId, body, media=None):
+        if body['configuration'].get('dryRun'):
+            return self._service.dry_run(projectId, body['configuration'])
+        reference = body.get('jobReference', {})
+        job = self._service.create_job(
+            projectId, body['configuration'],
+            reference.get('jobId') or reference.get('job_id'), media)
+        return job['resource']
+
+    def get(self, projectId, jobId):
+        return FakeRequest(self._service, self._get, jobId=jobId)
+
+    def _get(self, jobId):
+        return self._service.poll_job(jobId)['resource']
+
+    def query(self, projectId, body):
+        return FakeRequest(self._service, self._query,
+                           projectId=projectId, body=body)
+
+    def _query(self, projectId, body):
+        job = self._service.create_job(
+            projectId, {'query': {'query': body['query']}})
+        job_id = job['resource']['jobReference']['jobId']
+        return self._get_query_results(
+            jobId=job_id, maxResults=body.get('maxResults'))
+
+    def getQueryResults(self, projectId, jobId, pageToken=None,
+                        startIndex=None, maxResults=None, timeoutMs=None):
+        return FakeRequest(self._service, self._get_query_results,
+                           jobId=jobId, pageToken=pageToken,
+                           startIndex=startIndex, maxResults=maxResults)
+
+    def _get_query_results(self, jobId, pageToken=None, startIndex=None,
+                           maxResults=None):
+        job = self._service.poll_job(jobId)
+        reply = {
+            'kind': 'bigquery#getQueryResultsResponse',
+            'jobReference': job['resource']['jobReference'],
+            'jobComplete': job['resource']['status']['state'] == 'DONE',
+        }
+        if not reply['jobComplete']:
+            return reply
+
+        rows = job['rows']
+        start = int(pageToken or startIndex or 0)
+        count = self._service.max_page_rows
+        if maxResults is not None:
+            count = min(count, int(maxResults))
+        end = min(start + count, len(rows))
+
+        reply['schema'] = job['schema']
+        reply['totalRows'] = str(len(rows))
+        if start < end:
+            reply['rows'] = rows[start:end]
+        if end < len(rows):
+            reply['pageToken'] = str(end)
+        return reply
+
+
+def _list_reply(kind, key, items, page_token):
+    reply = {'kind': kind}
+    if items:
+        reply[key] = items
+    if page_token:
+        reply['nextPageToken'] = page_token
+    return reply
+
+
+class _Projects(object):
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, pageToken=None, maxResults=None):
+        return FakeRequest(self._service, self._list, pageToken=pageToken)
+
+    def _list(self, pageToken):
+        projects, token = self._service.page(
+            sorted(self._service._projects), pageToken)
+        return _list_reply('bigquery#projectList', 'projects', [
+            {'id': project, 'projectReference': {'projectId': project}}
+            for project in projects], token)
+
+
+class _Datasets(object):
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, projectId, pageToken=None, maxResults=None, all=None):
+        return FakeRequest(self._service, self._list, projectId=projectId,
+                           pageToken=pageToken)
+
+    def _list(self, projectId, pageToken):
+        datasets, token = self._service.page(sorted(
+            dataset_id for project_id, dataset_id in self._service._datasets
+            if project_id == projectId), pageToken)
+        return _list_reply('bigquery#datasetList', 'datasets', [
+            {'datasetReference': {
+                'projectId': projectId, 'datasetId': dataset_id}}
+            for dataset_id in datasets], token)
+
+    def get(self, projectId, datasetId, fields=None):
+        return FakeRequest(self._service, self._get, projectId=projectId,
+                           datasetId=datasetId)
+
+    def _get(self, projectId, datasetId):
+        return dict(self._service._datasets[(projectId, datasetId)])
+
+
+class _Tables(object):
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, projectId, datasetId, pageToken=None, maxResults=None):
+        return FakeRequest(self._service, self._list, projectId=projectId,
+                           datasetId=datasetId, pageToken=pageToken)
+
+    def _list(self, projectId, datasetId, pageToken):
+        tables, token = self._service.page(sorted(
+            self._service._dataset_tables[(projectId, datasetId)]),
+            pageToken)
+        return _list_reply('bigquery#tableList', 'tables', [
+            {'kind': 'bigquery#table',
+             'type': 'TABLE',
+             'tableReference': {
+                 'projectId': projectId,
+                 'datasetId': datasetId,
+                 'tableId': table_id}}
+            for table_id in tables], token)
+
+    def get(self, projectId, datasetId, tableId, fields=None):
+        return FakeRequest(self._service, self._get, projectId=projectId,
+                           datasetId=datasetId, tableId=tableId)
+
+    def _get(self, projectId, datasetId, tableId):
+        return {
+            'kind': 'bigquery#table',
+            'tableReference': {
+                'projectId': projectId,
+                'datasetId': datasetId,
+                'tableId': tableId,
+            },
+            'lastModifiedTime': self._service.table_modified(
+                projectId, datasetId, tableId),
+        }
+
+
+class _TableData(object):
+    def __init__(self, service):
+        self._service = service
+
+    def insertAll(self, projectId, datasetId, tableId, body):
+        return FakeRequest(self._service, self._insert_all,
+                           projectId=projectId, datasetId=datasetId,
+                           tableId=tableId, body=body)
+
+    def _insert_all(self, projectId, datasetId, tableId, body):
+        errors = self._service.insert_rows(
+            projectId, datasetId, tableId, body['rows'])
+        reply = {'kind': 'bigquery#tableDataInsertAllResponse'}
+        if errors:
+            reply['insertErrors'] = sorted(errors, key=lambda e: e['index'])
+        return reply
+
+
+class FakeUploadHttp(object):
+    """Answers resumable media uploads in place of httplib2.Http.
+
+    Set fail_after to a byte count to make the connection drop once the
+    upload has received that many bytes, as if the client had crashed.
+    """
+
+    def __init__(self, service, bandwidth=None):
+        self.service = service
+        self.bandwidth = bandwidth
+        self.fail_after = None
+        self.chunk_requests = 0
+        self._sessions = {}
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        self.service.record_request()
+        if self.service.latency:
+            time.sleep(self.service.latency)
+
+        if method == 'POST':
+            return self._start_session(uri, body)
+        return self._put_chunk(uri, body, headers or {})
+
+    def _start_session(self, uri, body):
+        session_uri = '{}&upload_id={}'.format(uri, uuid.uuid4().hex)
+        project_id = re.search(r'/projects/([^/]+)/', uri).group(1)
+        self._sessions[session_uri] = {
+            'project_id': project_id,
+            'body': json.loads(body),
+            'data': bytearray(),
+        }
+        return httplib2.Response(
+            {'status': 200, 'location': session_uri}), b''
+
+    def _put_chunk(self, uri, body, headers):
+        session = self._sessions.get(uri)
+        if session is None:
+            # The session has expired.
+            return httplib2.Response({'status': 404}), b'Not Found'
+        data = session['data']
+        if 'job' in session:
+            return self._done(session)
+
+        if hasattr(body, 'read'):
+            body = body.read()
+        body = body or b''
+
+        content_range = headers.get('Content-Range', '')
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if match:
+            self.chunk_requests += 1
+            if int(match.group(1)) != len(data):
+                return self._incomplete(data)
+
+            if self.fail_after is not None:
+                room = self.fail_after - len(data)
+                if room < len(body):
+                    data.extend(body[:max(room, 0)])
+                    self.fail_after = None
+                    raise httplib2.HttpLib2Error('Injected connection drop.')
+
+            if self.bandwidth:
+                time.sleep(len(body) / float(self.bandwidth))
+            data.extend(body)
+
+        total = content_range.rsplit('/', 1)[-1]
+        if total == '*' or len(data) < int(total):
+            return self._incomplete(data)
+
+        body = session['body']
+        reference = body.get('jobReference', {})
+        session['job'] = self.service.create_job(
+            session['project_id'], body['configuration'],
+            reference.get('jobId'), bytes(data))
+        return self._done(session)
+
+    def _done(self, session):
+        return (httplib2.Response({'status': 200}),
+                json.dumps(session['job']['resource']).encode('utf-8'))
+
+    def _incomplete(self, data):
+        headers = {'status': 308}
+        if data:
+            headers['range'] = 'bytes=0-{}'.format(len(data) - 1)
+        return httplib2.Response(headers), b''
+
+
+def _parameter(location, required=False):
+    return {'type': 'string', 'location': location, 'required': required}
+
+
+def _method(name, http_method, path, parameters, request=None,
+            response='Job'):
+    path_parameters = re.findall(r'{(\w+)}', path)
+    method = {
+        'id': 'bigquery.' + name,
+        'path': path,
+        'httpMethod': http_method,
+        'parameters': dict(
+            [(p, _parameter('path', True)) for p in path_parameters] +
+            [(p, _parameter('query')) for p in parameters]),
+        'parameterOrder': path_parameters,
+        'response': {'$ref': response},
+    }
+    if request:
+        method['request'] = {'$ref': request}
+    return method
+
+
+def discovery_document(root_url):
+    """Describes the jobs methods of the bigquery v2 API that
+    FakeBigQueryServer serves."""
+    return {
+        'kind': 'discovery#restDescription',
+        'name': 'bigquery',
+        'version': 'v2',
+        'rootUrl': root_url,
+        'servicePath': 'bigquery/v2/',
+        'parameters': {
+            'alt': _parameter('query'),
+            'fields': _parameter('query'),
+        },
+        'schemas': {
+            'Job': {'id': 'Job', 'type': 'object'},
+            'GetQueryResultsResponse': {
+                'id': 'GetQueryResultsResponse', 'type': 'object'},
+        },
+        'resources': {
+            'jobs': {'methods': {
+                'insert': _method(
+                    'jobs.insert', 'POST', 'projects/{projectId}/jobs', [],
+                    request='Job'),
+                'get': _method(
+                    'jobs.get', 'GET', 'projects/{projectId}/jobs/{jobId}',
+                    []),
+                'getQueryResults': _method(
+                    'jobs.getQueryResults', 'GET',
+                    'projects/{projectId}/queries/{jobId}',
+                    ['pageToken', 'startIndex', 'maxResults', 'timeoutMs'],
+                    response='GetQueryResultsResponse'),
+            }},
+        },
+    }
+
+
+# A job, or the results of a query job.
+_JOB_PATH = re.compile(
+    r'^/bigquery/v2/projects/([^/]+)/(jobs|queries)(?:/([^/]+))?$')
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers each HTTP request with the server's FakeBigQuery."""
+
+    protocol_version = 'HTTP/1.1'
+    # The headers and body are written separately; without this, each
+    # response on a keep-alive connection waits for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def _serve(self):
+        body = self.rfile.read(int(self.headers.get('content-length') or 0))
+        parsed = urlparse(self.path)
+        query = dict(
+            (key, values[0]) for key, values in parse_qs(parsed.query).items())
+        match = _JOB_PATH.match(parsed.path)
+        status = 404
+        content = {'error': {'code': 404, 'message': 'Not found.'}}
+        if match:
+            try:
+                content = self._request(
+                    match.group(1), match.group(2), match.group(3), body,
+                    query).execute()
+                status = 200
+            except KeyError:
+                pass
+            except HttpError as error:
+                status, content = error.resp.status, json.loads(
+                    error.content.decode('utf-8'))
+
+        content = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _request(self, project_id, collection, job_id, body, query):
+        jobs = self.server.fake.jobs()
+        if collection == 'jobs' and job_id is None:
+            return jobs.insert(
+                projectId=project_id, body=json.loads(body.decode('utf-8')))
+        if collection == 'jobs':
+            return jobs.get(projectId=project_id, jobId=job_id)
+        return jobs.getQueryResults(
+            projectId=project_id, jobId=job_id,
+            pageToken=query.get('pageToken'),
+            startIndex=query.get('startIndex'),
+            maxResults=query.get('maxResults'))
+
+    do_GET = do_POST = _serve
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeBigQueryServer(object):
+    """Serves a FakeBigQuery over HTTP on a local port, from background
+    threads.
+
+    Only jobs.insert, jobs.get and jobs.getQueryResults are served. Use it
+    as a context manager:
+
+        with FakeBigQueryServer(FakeBigQuery(latency=0.01)) as server:
+            bigquery = server.build_service()
+
+    Args:
+        fake: the FakeBigQuery to serve, or None for a new one.
+    """
+
+    def __init__(self, fake=None):
+        self.fake = fake or FakeBigQuery()
+        self._server = _ThreadingServer(('127.0.0.1', 0), _Handler)
+        self._server.fake = self.fake
+        self.url = 'http://127.0.0.1:{}/'.format(
+            self._server.server_address[1])
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def build_service(self):
+        """Builds a bigquery service object that sends its requests to the
+        server, safe to use from several threads."""
+        return discovery.build_from_document(
+            json.dumps(discovery_document(self.url)),
+            http=services.ThreadLocalHttp())
@@ -0,0 +1,109 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the Cloud Storage API service object.
+
+FakeStorage covers the object metadata and delete calls that the BigQuery
+samples make when loading from and exporting to Cloud Storage. Objects live
+in memory and are added with add_object().
+"""
+
+import threading
+
+from fake_bigquery import FakeRequest
+
+
+class FakeStorage(object):
+    """Serves object metadata out of memory.
+
+    Args:
+        latency: seconds each request takes.
+        page_size: the most objects returned in one page of objects().list.
+    """
+
+    def __init__(self, latency=0.0, page_size=1000):
+        self.latency = latency
+        self.page_size = page_size
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def add_object(self, bucket, name, content):
+        with self._lock:
+            self._buckets.setdefault(bucket, {})[name] = content
+
+    def get_content(self, bucket, name):
+        return self._buckets[bucket][name]
+
+    def delete_object(self, bucket, name):
+        with self._lock:
+            del self._buckets[bucket][name]
+        return ''
+
+    def object_resource(self, bucket, name):
+        return {
+            'kind': 'storage#object',
+            'bucket': bucket,
+            'name': name,
+            'size': str(len(self._buckets[bucket][name])),
+        }
+
+    def objects(self):
+        return _Objects(self)
+
+
+class _Objects(object):
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, bucket, object, fields=None):
+        return FakeRequest(self._service, self._service.object_resource,
+                           bucket=bucket, name=object)
+
+    def delete(self, bucket, object):
+        return FakeRequest(self._service, self._service.delete_object,
+                           bucket=bucket, name=object)
+
+    def list(self, bucket, prefix=None, pageToken=None, fields=None,
+             maxResults=None):
+        request = FakeRequest(self._service, self._list, bucket=bucket,
+                              prefix=prefix or '', pageToken=pageToken)
+        request.list_args = {'bucket': bucket, 'prefix': prefix}
+        return request
+
+    def list_next(self, previous_request, previous_response):
+        page_token = previous_response.get('nextPageToken')
+        if not page_token:
+            return None
+        return self.list(pageToken=page_token, **previous_request.list_args)
+
+    def _list(self, bucket, prefix, pageToken):
+        names = sorted(
+            name for name in self._service._buckets.get(bucket, {})
+            if name.startswith(prefix))
+        start = int(pageToken or 0)
+        end = start + self._service.page_size
+
+        reply = {
+            'kind': 'storage#objects',
+            'items': [
+                self._service.object_resource(bucket, name)
+                for name in names[start:end]],
+        }
+        if end < len(names):
+            reply['nextPageToken'] = str(end)
+        return reply
@@ -30,9 +30,10 @@ import argparse
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from oauth2client.client import GoogleCredentials
+import query_cache
 
 
-def main(project_id):
+def main(project_id, cache_path=None):
     # [START build_service]
     # Grab the application's default credentials from the environment.
     credentials = GoogleCredentials.get_application_default()
@@ -40,6 +41,12 @@ def main(project_id):
     bigquery_service = build('bigquery', 'v2', credentials=credentials)
     # [END build_service]
 
+    # Optionally keep results in a local cache, so that running the sample
+    # again doesn't run the query again until the table changes.
+    if cache_path:
+        bigquery_service = query_cache.CachedQueries(
+            bigquery_service, query_cache.QueryCache(cache_path))
+
     try:
         # [START run_query]
         query_request = bigquery_service.jobs()
@@ -71,8 +78,11 @@ if __name__ == '__main__':
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('project_id', help='Your Google Cloud Project ID.')
+    parser.add_argument(
+        '-c', '--cache',
+        help='Path to a local cache of query results to read and update.')
 
     args = parser.parse_args()
 
-    main(args.project_id)
+    main(args.project_id, args.cache)
 # [END all]
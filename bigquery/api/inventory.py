@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command-line application that lists every project, dataset and table
+visible to the caller, as newline delimited JSON.
+
+Projects, datasets and tables are listed concurrently, following every page
+of each list. A list that fails, for example with a 403 for a project the
+caller can't read, is written as an error record and the crawl goes on.
+Given the output of an earlier run as a snapshot, only the
+datasets whose lastModifiedTime changed since have their tables listed
+again; the tables of the other datasets are copied from the snapshot.
+
+Example invocation:
+    $ python inventory.py > inventory.json
+    $ python inventory.py --snapshot inventory.json > inventory-new.json
+
+For more information, see the README.md under /bigquery.
+"""
+
+import argparse
+from concurrent import futures
+import json
+import sys
+import threading
+
+from googleapiclient.errors import HttpError
+import services
+
+DEFAULT_NUM_WORKERS = 8
+
+
+def list_all(method, key, num_retries=5, **kwargs):
+    """Yields the items of every page of a list method, such as
+    bigquery.datasets().list."""
+    page_token = None
+    while True:
+        reply = method(pageToken=page_token, **kwargs).execute(
+            num_retries=num_retries)
+        for item in reply.get(key, []):
+            yield item
+        page_token = reply.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def load_snapshot(lines):
+    """Indexes the records of an earlier run by dataset.
+
+    Returns:
+        A dict mapping (projectId, datasetId) to a tuple of the dataset's
+        lastModifiedTime and its table records.
+    """
+    datasets = {}
+    tables = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        key = (record.get('projectId'), record.get('datasetId'))
+        if record['kind'] == 'dataset':
+            datasets[key] = record['lastModifiedTime']
+        elif record['kind'] == 'table':
+            tables.setdefault(key, []).append(record)
+    return dict(
+        (key, (modified, tables.get(key, [])))
+        for key, modified in datasets.items())
+
+
+class Crawler(object):
+    """Lists projects, datasets and tables from a pool of threads.
+
+    Each task lists one thing and returns the records it found along with
+    the follow-up tasks to run, so listing a project's datasets leads to
+    listing each dataset's tables.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object, safe to use from several threads.
+        snapshot: the result of load_snapshot(), or None.
+        num_workers: the most list requests in flight at once.
+    """
+
+    def __init__(self, bigquery, snapshot=None,
+                 num_workers=DEFAULT_NUM_WORKERS, num_retries=5):
+        self.bigquery = bigquery
+        self.snapshot = snapshot or {}
+        self.num_workers = num_workers
+        self.num_retries = num_retries
+        self.datasets_listed = 0
+        self.datasets_reused = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def crawl(self, project_ids=None):
+        """Yields a record for every project, dataset and table, in the
+        order they are found.
+
+        Args:
+            project_ids: the projects to list. Defaults to every project
+                returned by projects().list.
+        """
+        executor = futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        pending = set()
+
+        def submit(task, *args):
+            pending.add(executor.submit(self._run, task, *args))
+
+        if project_ids is None:
+            submit(self._list_projects)
+        else:
+            for project_id in project_ids:
+                submit(self._list_project, project_id)
+
+        try:
+            while pending:
+                done, _ = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    records, follow_ups = future.result()
+                    for record in records:
+                        yield record
+                    for follow_up in follow_ups:
+                        submit(*follow_up)
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+    def _run(self, task, *args):
+        """Runs a task, turning an HttpError into an error record for the
+        project or dataset it was listing."""
+        try:
+            return task(*args)
+        except HttpError as error:
+            with self._lock:
+                self.errors += 1
+            record = {
+                'kind': 'error',
+                'status': error.resp.status,
+                'message': str(error),
+            }
+            record.update(zip(('projectId', 'datasetId'), args))
+            return [record], []
+
+    def _list_projects(self):
+        projects = list_all(
+            self.bigquery.projects().list, 'projects', self.num_retries)
+        return [], [
+            (self._list_project, project['projectReference']['projectId'])
+            for project in projects]
+
+    def _list_project(self, project_id):
+        datasets = list_all(
+            self.bigquery.datasets().list, 'datasets', self.num_retries,
+            projectId=project_id)
+        record = {'kind': 'project', 'projectId': project_id}
+        return [record], [
+            (self._list_dataset, project_id,
+             dataset['datasetReference']['datasetId'])
+            for dataset in datasets]
+
+    def _list_dataset(self, project_id, dataset_id):
+        dataset = self.bigquery.datasets().get(
+            projectId=project_id, datasetId=dataset_id,
+            fields='lastModifiedTime').execute(num_retries=self.num_retries)
+        modified = dataset.get('lastModifiedTime')
+        records = [{
+            'kind': 'dataset',
+            'projectId': project_id,
+            'datasetId': dataset_id,
+            'lastModifiedTime': modified,
+        }]
+
+        cached = self.snapshot.get((project_id, dataset_id))
+        if cached and cached[0] == modified:
+            with self._lock:
+                self.datasets_reused += 1
+            return records + cached[1], []
+
+        with self._lock:
+            self.datasets_listed += 1
+        tables = list_all(
+            self.bigquery.tables().list, 'tables', self.num_retries,
+            projectId=project_id, datasetId=dataset_id)
+        records.extend({
+            'kind': 'table',
+            'projectId': project_id,
+            'datasetId': dataset_id,
+            'tableId': table['tableReference']['tableId'],
+            'type': table.get('type'),
+        } for table in tables)
+        return records, []
+
+
+def main(project_ids, snapshot_path, output_path, num_workers, num_retries):
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials.
+    bigquery = services.get_service('bigquery', 'v2')
+
+    snapshot = None
+    if snapshot_path:
+        # The snapshot is read in full first, so that it may also be the
+        # output file.
+        with open(snapshot_path, 'r') as f:
+            snapshot = load_snapshot(f)
+
+    crawler = Crawler(bigquery, snapshot, num_workers, num_retries)
+    out = open(output_path, 'w') if output_path else sys.stdout
+    try:
+        for record in crawler.crawl(project_ids or None):
+            out.write(json.dumps(record) + '\n')
+    finally:
+        if output_path:
+            out.close()
+
+    sys.stderr.write(
+        'Listed tables of {} datasets, reused {}, {} errors.\n'.format(
+            crawler.datasets_listed, crawler.datasets_reused,
+            crawler.errors))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--project', dest='project_ids', action='append', default=[],
+        help='A project to list. May be repeated. Defaults to every '
+             'project visible to the caller.')
+    parser.add_argument(
+        '--snapshot',
+        help='The output of an earlier run, used to skip datasets that '
+             'have not changed.')
+    parser.add_argument(
+        '-o', '--output', help='Where to write the inventory. Defaults to '
+                               'standard output.')
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of list requests to make concurrently.',
+        type=int,
+        default=DEFAULT_NUM_WORKERS)
+    parser.add_argument(
+        '-r', '--num_retries',
+        help='Number of times to retry in case of 500 error.',
+        type=int,
+        default=5)
+
+    args = parser.parse_args()
+
+    main(
+        args.project_ids,
+        args.snapshot,
+        args.output,
+        args.num_workers,
+        args.num_retries)
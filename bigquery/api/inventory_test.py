@@ -0,0 +1,92 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import fake_bigquery
+from fake_bigquery import FakeBigQuery
+from googleapiclient.errors import HttpError
+import httplib2
+import inventory
+
+
+def make_service():
+    bigquery = FakeBigQuery()
+    bigquery.list_page_size = 2
+    for project_id in ('alpha', 'beta', 'gamma'):
+        for dataset_id in ('d1', 'd2', 'd3'):
+            for table_id in ('t1', 't2', 't3'):
+                bigquery.add_table(project_id, dataset_id, table_id)
+    return bigquery
+
+
+def crawl(bigquery, snapshot=None, project_ids=None):
+    crawler = inventory.Crawler(bigquery, snapshot, num_workers=4)
+    return crawler, list(crawler.crawl(project_ids))
+
+
+def kinds(records):
+    counts = {}
+    for record in records:
+        counts[record['kind']] = counts.get(record['kind'], 0) + 1
+    return counts
+
+
+def test_crawl_everything():
+    crawler, records = crawl(make_service())
+
+    assert kinds(records) == {'project': 3, 'dataset': 9, 'table': 27}
+    assert crawler.datasets_listed == 9
+
+
+def test_crawl_projects():
+    _, records = crawl(make_service(), project_ids=['beta'])
+
+    assert kinds(records) == {'project': 1, 'dataset': 3, 'table': 9}
+    assert set(record['projectId'] for record in records) == set(['beta'])
+
+
+def test_incremental_refresh():
+    bigquery = make_service()
+    _, records = crawl(bigquery)
+    snapshot = inventory.load_snapshot(
+        json.dumps(record) for record in records)
+
+    bigquery.add_table('beta', 'd2', 't4')
+    crawler, refreshed = crawl(bigquery, snapshot)
+
+    assert crawler.datasets_listed == 1
+    assert crawler.datasets_reused == 8
+    assert kinds(refreshed) == {'project': 3, 'dataset': 9, 'table': 28}
+    assert {'kind': 'table', 'projectId': 'beta', 'datasetId': 'd2',
+            'tableId': 't4', 'type': 'TABLE'} in refreshed
+
+
+def test_crawl_goes_on_after_errors(monkeypatch):
+    list_datasets = fake_bigquery._Datasets._list
+
+    def forbidden(self, projectId, pageToken):
+        if projectId == 'beta':
+            raise HttpError(
+                httplib2.Response({'status': 403}), b'Access Denied')
+        return list_datasets(self, projectId, pageToken)
+
+    monkeypatch.setattr(fake_bigquery._Datasets, '_list', forbidden)
+    crawler, records = crawl(make_service())
+
+    assert kinds(records) == {
+        'project': 2, 'dataset': 6, 'table': 18, 'error': 1}
+    [error] = [record for record in records if record['kind'] == 'error']
+    assert error['projectId'] == 'beta'
+    assert error['status'] == 403
+    assert crawler.errors == 1
@@ -0,0 +1,243 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Waits for BigQuery jobs to complete.
+
+Jobs are polled with jittered exponential backoff: the delay between polls
+starts at the poll interval and doubles, up to a maximum, for as long as the
+job stays in the same state. When the job changes state, for example from
+PENDING to RUNNING, the delay drops back to the poll interval.
+
+poll_job() waits for a single job. wait_all() waits for many jobs at once,
+polling the ones that are due from a pool of worker threads, and reports how
+long each job took. Given a batch size, it polls the jobs that are due
+together in batch requests, rather than with one round trip per job. A poll
+that fails is retried at the job's next poll; only a job whose poll fails
+`num_retries` + 1 times in a row, a first try and `num_retries` retries, is
+given up on.
+"""
+
+import collections
+from concurrent import futures
+import heapq
+import random
+import time
+
+import batch
+from googleapiclient.errors import HttpError
+
+DEFAULT_INTERVAL = 1
+DEFAULT_MAX_INTERVAL = 30
+DEFAULT_NUM_WORKERS = 8
+
+# The outcome of a job waited for by wait_all(). `error` is the job's
+# errorResult, or None if it succeeded, and `seconds` is the time it took
+# from the start of the wait until the job was seen to be done.
+JobResult = collections.namedtuple('JobResult', ['job', 'seconds', 'error'])
+
+
+class Backoff(object):
+    """Computes the delay before the next poll of a job."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.delay = interval
+        self.state = None
+
+    def next_delay(self, state):
+        """Returns the seconds to wait, given the job's current state."""
+        if state != self.state:
+            self.state = state
+            self.delay = self.interval
+        else:
+            self.delay = min(self.delay * 2, self.max_interval)
+
+        # Jitter the delay so that many jobs started together don't keep
+        # polling in lock step.
+        return self.delay * random.uniform(0.5, 1.5)
+
+
+def get_job(bigquery, job_reference, num_retries=5):
+    return bigquery.jobs().get(
+        projectId=job_reference['projectId'],
+        jobId=job_reference['jobId']).execute(num_retries=num_retries)
+
+
+def get_jobs(bigquery, job_references, batch_size=batch.DEFAULT_BATCH_SIZE,
+             num_retries=5):
+    """Fetches several jobs with batch requests.
+
+    Returns:
+        A list of the job resources, in the order of the references.
+    """
+    with batch.Batcher(
+            bigquery.new_batch_http_request, batch_size,
+            num_retries) as batcher:
+        results = [
+            batcher.add(bigquery.jobs().get(
+                projectId=reference['projectId'],
+                jobId=reference['jobId']))
+            for reference in job_references]
+    return [result.result() for result in results]
+
+
+def _poll_jobs(bigquery, job_references, batch_size, num_retries):
+    """Returns the job resource, or the HttpError that polling it failed
+    with, for each reference."""
+    if not batch_size:
+        polled = []
+        for reference in job_references:
+            try:
+                polled.append(get_job(bigquery, reference, num_retries))
+            except HttpError as error:
+                polled.append(error)
+        return polled
+
+    with batch.Batcher(
+            bigquery.new_batch_http_request, batch_size,
+            num_retries) as batcher:
+        results = [
+            batcher.add(bigquery.jobs().get(
+                projectId=reference['projectId'],
+                jobId=reference['jobId']))
+            for reference in job_references]
+    return [result.exception() or result.result() for result in results]
+
+
+# [START poll_job]
+def poll_job(bigquery, job, interval=DEFAULT_INTERVAL,
+             max_interval=DEFAULT_MAX_INTERVAL, num_retries=5):
+    """Waits for a job to complete and returns its final resource.
+
+    Raises:
+        RuntimeError: if the job failed.
+    """
+    print('Waiting for job to finish...')
+
+    backoff = Backoff(interval, max_interval)
+
+    while True:
+        result = get_job(bigquery, job['jobReference'], num_retries)
+        state = result['status']['state']
+
+        if state == 'DONE':
+            if 'errorResult' in result['status']:
+                raise RuntimeError(result['status']['errorResult'])
+            print('Job complete.')
+            return result
+
+        time.sleep(backoff.next_delay(state))
+# [END poll_job]
+
+
+def wait_all(bigquery, jobs, interval=DEFAULT_INTERVAL,
+             max_interval=DEFAULT_MAX_INTERVAL,
+             num_workers=DEFAULT_NUM_WORKERS, num_retries=5, batch_size=None):
+    """Waits for all of the given jobs to complete.
+
+    Failed jobs don't stop the wait; check the `error` of each result. Nor
+    do failed polls: a job that can't be polled num_retries + 1 times in a
+    row is given an error saying so, and the last resource seen of it.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object, safe to use from several threads.
+        jobs: job resources, such as the replies to jobs().insert().
+        interval: the initial number of seconds between polls of a job.
+        max_interval: the most seconds between polls of a job.
+        num_workers: the number of jobs polled concurrently.
+        num_retries: number of times to retry in case of 500 error.
+        batch_size: if set, the jobs due to be polled are fetched this many
+            at a time with batch requests, each worker sending one batch.
+
+    Returns:
+        A dict mapping each job ID to a JobResult.
+    """
+    start = time.time()
+    references = dict(
+        (job['jobReference']['jobId'], job['jobReference']) for job in jobs)
+    backoffs = dict(
+        (job_id, Backoff(interval, max_interval)) for job_id in references)
+    # The latest resource of each job, and its polls that failed in a row.
+    latest = dict((job['jobReference']['jobId'], job) for job in jobs)
+    poll_errors = collections.Counter()
+
+    # A heap of (time of the next poll, job ID).
+    schedule = [(start, job_id) for job_id in references]
+    heapq.heapify(schedule)
+    results = {}
+
+    def poll(job_ids):
+        return _poll_jobs(
+            bigquery, [references[job_id] for job_id in job_ids],
+            batch_size, num_retries)
+
+    executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        while schedule:
+            now = time.time()
+            if schedule[0][0] > now:
+                time.sleep(schedule[0][0] - now)
+                continue
+
+            due = []
+            while schedule and schedule[0][0] <= now:
+                due.append(heapq.heappop(schedule)[1])
+
+            size = batch_size or 1
+            groups = [due[i:i + size] for i in range(0, len(due), size)]
+            polled = [
+                job for jobs in executor.map(poll, groups) for job in jobs]
+
+            for job_id, job in zip(due, polled):
+                if isinstance(job, HttpError):
+                    poll_errors[job_id] += 1
+                    if poll_errors[job_id] > num_retries:
+                        results[job_id] = JobResult(
+                            latest[job_id], time.time() - start,
+                            {'message': 'Polling the job failed: {}'.format(
+                                job)})
+                        continue
+                    # Go on as if the job were still in its last state; a
+                    # job passed in as DONE is done all the same.
+                    job = latest[job_id]
+                    state = job.get('status', {}).get('state')
+                else:
+                    poll_errors[job_id] = 0
+                    latest[job_id] = job
+                    state = job['status']['state']
+
+                if state == 'DONE':
+                    results[job_id] = JobResult(
+                        job, time.time() - start,
+                        job['status'].get('errorResult'))
+                else:
+                    heapq.heappush(schedule, (
+                        time.time() + backoffs[job_id].next_delay(state),
+                        job_id))
+    finally:
+        executor.shutdown()
+
+    return results
+
+
+def print_report(results):
+    """Prints the outcome and wall time of each job, slowest first."""
+    ordered = sorted(
+        results.items(), key=lambda item: item[1].seconds, reverse=True)
+    for job_id, result in ordered:
+        print('{}\t{:.1f}s\t{}'.format(
+            job_id, result.seconds,
+            result.error.get('message') if result.error else 'DONE'))
@@ -0,0 +1,150 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fake_bigquery
+from googleapiclient.errors import HttpError
+import httplib2
+import job_poller
+import pytest
+
+
+def insert_job(bigquery, job_id):
+    return bigquery.jobs().insert(
+        projectId='test',
+        body={
+            'jobReference': {'projectId': 'test', 'jobId': job_id},
+            'configuration': {'query': {'query': 'SELECT 1'}},
+        }).execute()
+
+
+def test_backoff_grows_and_resets_on_state_change(monkeypatch):
+    monkeypatch.setattr(job_poller.random, 'uniform', lambda a, b: 1)
+    backoff = job_poller.Backoff(interval=1, max_interval=5)
+
+    delays = [backoff.next_delay(state) for state in (
+        'PENDING', 'PENDING', 'PENDING', 'PENDING', 'PENDING', 'RUNNING')]
+
+    assert delays == [1, 2, 4, 5, 5, 1]
+
+
+def test_poll_job(capsys):
+    bigquery = fake_bigquery.FakeBigQuery(running_polls=3)
+    job = insert_job(bigquery, 'job1')
+
+    result = job_poller.poll_job(bigquery, job, interval=0.001)
+
+    assert result['status']['state'] == 'DONE'
+    assert bigquery.request_count == 5
+    out, _ = capsys.readouterr()
+    assert 'Waiting for job to finish...' in out
+    assert 'Job complete.' in out
+
+
+def test_poll_job_failure():
+    bigquery = fake_bigquery.FakeBigQuery()
+    job = insert_job(bigquery, 'job1')
+    bigquery.fail_job('job1')
+
+    with pytest.raises(RuntimeError):
+        job_poller.poll_job(bigquery, job, interval=0.001)
+
+
+def test_wait_all(capsys):
+    bigquery = fake_bigquery.FakeBigQuery(running_polls=2)
+    jobs = [insert_job(bigquery, 'job{}'.format(i)) for i in range(20)]
+    bigquery.fail_job('job7', 'Bad data.')
+
+    results = job_poller.wait_all(
+        bigquery, jobs, interval=0.001, num_workers=4)
+
+    assert sorted(results) == sorted('job{}'.format(i) for i in range(20))
+    assert all(
+        result.job['status']['state'] == 'DONE'
+        for result in results.values())
+    assert results['job7'].error['message'] == 'Bad data.'
+    assert results['job3'].error is None
+    assert all(result.seconds >= 0 for result in results.values())
+
+    job_poller.print_report(results)
+    out, _ = capsys.readouterr()
+    assert 'job7' in out and 'Bad data.' in out
+
+
+def test_wait_all_batched():
+    bigquery = fake_bigquery.FakeBigQuery(running_polls=2)
+    jobs = [insert_job(bigquery, 'job{}'.format(i)) for i in range(20)]
+    bigquery.fail_job('job7', 'Bad data.')
+    inserts = bigquery.request_count
+
+    results = job_poller.wait_all(
+        bigquery, jobs, interval=0.001, num_workers=2, batch_size=10)
+
+    assert len(results) == 20
+    assert results['job7'].error['message'] == 'Bad data.'
+    # Each round of polls takes two batch requests rather than twenty.
+    assert bigquery.request_count - inserts < 20 * 3
+
+
+@pytest.mark.parametrize('batch_size', [None, 5])
+def test_wait_all_survives_failed_polls(monkeypatch, batch_size):
+    bigquery = fake_bigquery.FakeBigQuery(running_polls=1)
+    jobs = [insert_job(bigquery, 'job{}'.format(i)) for i in range(5)]
+    # job1 fails to be polled twice, and job2 every time.
+    failures = {'job1': 2, 'job2': 100}
+    poll_job = bigquery.poll_job
+
+    def flaky_poll_job(job_id):
+        if failures.get(job_id):
+            failures[job_id] -= 1
+            raise HttpError(httplib2.Response({'status': 404}), b'')
+        return poll_job(job_id)
+
+    monkeypatch.setattr(bigquery, 'poll_job', flaky_poll_job)
+
+    results = job_poller.wait_all(
+        bigquery, jobs, interval=0.001, num_retries=3, batch_size=batch_size)
+
+    assert len(results) == 5
+    assert results['job1'].error is None
+    assert results['job1'].job['status']['state'] == 'DONE'
+    assert 'Polling the job failed' in results['job2'].error['message']
+    assert results['job2'].job['jobReference']['jobId'] == 'job2'
+    assert failures['job2'] == 100 - 4
+
+
+def test_wait_all_done_job_that_cant_be_polled(monkeypatch):
+    bigquery = fake_bigquery.FakeBigQuery()
+    job = insert_job(bigquery, 'job0')
+    job['status'] = {'state': 'DONE'}
+
+    def failing_poll_job(job_id):
+        raise HttpError(httplib2.Response({'status': 503}), b'')
+
+    monkeypatch.setattr(bigquery, 'poll_job', failing_poll_job)
+
+    results = job_poller.wait_all(bigquery, [job], interval=0.001)
+
+    assert results['job0'].job is job
+    assert results['job0'].error is None
+
+
+def test_get_jobs():
+    bigquery = fake_bigquery.FakeBigQuery()
+    jobs = [insert_job(bigquery, 'job{}'.format(i)) for i in range(5)]
+
+    results = job_poller.get_jobs(
+        bigquery, [job['jobReference'] for job in jobs], batch_size=2)
+
+    assert [job['jobReference']['jobId'] for job in results] == [
+        'job{}'.format(i) for i in range(5)]
+    assert bigquery.request_count == 5 + 3
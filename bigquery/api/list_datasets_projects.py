@@ -15,6 +15,9 @@
 
 """Command-line application to list all projects and datasets in BigQuery.
 
+This sample prints only the first page of each list. To list every project,
+dataset and table, see inventory.py.
+
 This sample is used on this page:
 
     https://cloud.google.com/bigquery/docs/managing_jobs_datasets_projects
@@ -25,8 +28,7 @@ For more information, see the README.md under /bigquery.
 import argparse
 from pprint import pprint
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+import services
 from six.moves.urllib.error import HTTPError
 
 
@@ -61,9 +63,9 @@ def list_projects(bigquery):
 
 
 def main(project_id):
-    credentials = GoogleCredentials.get_application_default()
-    # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials.
+    bigquery = services.get_service('bigquery', 'v2')
 
     list_datasets(bigquery, project_id)
     list_projects(bigquery)
@@ -24,15 +24,31 @@ For more information, see the README.md under /bigquery.
 
 import argparse
 import json
-import time
 
-from googleapiclient import discovery
 from googleapiclient.http import MediaFileUpload
-from oauth2client.client import GoogleCredentials
+import job_poller
+import resumable_upload
+import services
+
+
+def create_service():
+    """Creates a bigquery service object, using the application's default
+    auth."""
+    return services.get_service('bigquery', 'v2')
+
+
+def print_progress(uploaded, total):
+    if total:
+        print('Uploaded {}%.'.format(int(uploaded * 100 / total)))
+    else:
+        print('Uploaded {} bytes.'.format(uploaded))
 
 
 # [START make_post]
-def load_data(schema_path, data_path, project_id, dataset_id, table_id):
+def load_data(schema_path, data_path, project_id, dataset_id, table_id,
+              poll_interval=job_poller.DEFAULT_INTERVAL, bigquery=None,
+              resumable=False, chunksize=resumable_upload.DEFAULT_CHUNK_SIZE,
+              compress=False):
     """Loads the given data file into BigQuery.
 
     Args:
@@ -43,73 +59,89 @@ def load_data(schema_path, data_path, project_id, dataset_id, table_id):
             assumed to be the project id this request is to be made under.
         dataset_id: The dataset id of the destination table.
         table_id: The table id to load data into.
+        poll_interval: How often to poll the job for completion (seconds).
+        bigquery: A bigquery service object to reuse. One is created if it
+            isn't given.
+        resumable: Whether to upload the file in resumable chunks, which
+            continues an earlier interrupted upload of the same file.
+        chunksize: The bytes sent per request of a resumable upload, a
+            multiple of 256KB.
+        compress: Whether to gzip the file while uploading it. Implies a
+            resumable upload.
     """
-    # Create a bigquery service object, using the application's default auth
-    credentials = GoogleCredentials.get_application_default()
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    if bigquery is None:
+        bigquery = create_service()
 
     # Infer the data format from the name of the data file.
     source_format = 'CSV'
     if data_path[-5:].lower() == '.json':
         source_format = 'NEWLINE_DELIMITED_JSON'
 
-    # Post to the jobs resource using the client's media upload interface. See:
-    # http://developers.google.com/api-client-library/python/guide/media_upload
-    insert_request = bigquery.jobs().insert(
-        projectId=project_id,
-        # Provide a configuration object. See:
-        # https://cloud.google.com/bigquery/docs/reference/v2/jobs#resource
-        body={
-            'configuration': {
-                'load': {
-                    'schema': {
-                        'fields': json.load(open(schema_path, 'r'))
-                    },
-                    'destinationTable': {
-                        'projectId': project_id,
-                        'datasetId': dataset_id,
-                        'tableId': table_id
-                    },
-                    'sourceFormat': source_format,
-                }
+    with open(schema_path, 'r') as schema_file:
+        schema = json.load(schema_file)
+
+    # Provide a configuration object. See:
+    # https://cloud.google.com/bigquery/docs/reference/v2/jobs#resource
+    body = {
+        'configuration': {
+            'load': {
+                'schema': {
+                    'fields': schema
+                },
+                'destinationTable': {
+                    'projectId': project_id,
+                    'datasetId': dataset_id,
+                    'tableId': table_id
+                },
+                'sourceFormat': source_format,
             }
-        },
-        media_body=MediaFileUpload(
-            data_path,
-            mimetype='application/octet-stream'))
-    job = insert_request.execute()
-
-    print('Waiting for job to finish...')
-
-    status_request = bigquery.jobs().get(
-        projectId=job['jobReference']['projectId'],
-        jobId=job['jobReference']['jobId'])
-
-    # Poll the job until it finishes.
-    while True:
-        result = status_request.execute(num_retries=2)
-
-        if result['status']['state'] == 'DONE':
-            if result['status'].get('errors'):
-                raise RuntimeError('\n'.join(
-                    e['message'] for e in result['status']['errors']))
-            print('Job complete.')
-            return
-
-        time.sleep(1)
+        }
+    }
+
+    if resumable or compress:
+        job = resumable_upload.insert_job(
+            bigquery, project_id, body, data_path,
+            chunksize=chunksize,
+            compress=compress,
+            progress_callback=print_progress)
+    else:
+        # Post to the jobs resource using the client's media upload
+        # interface. See:
+        # http://developers.google.com/api-client-library/python/guide/media_upload
+        insert_request = bigquery.jobs().insert(
+            projectId=project_id,
+            body=body,
+            media_body=MediaFileUpload(
+                data_path,
+                mimetype='application/octet-stream'))
+        job = insert_request.execute()
+
+    result = job_poller.poll_job(bigquery, job, interval=poll_interval)
+    # A job that succeeded can still report errors, such as bad rows that
+    # were skipped.
+    if result['status'].get('errors'):
+        raise RuntimeError('\n'.join(
+            e['message'] for e in result['status']['errors']))
+    return result
 # [END make_post]
 
 
 # [START main]
-def main(project_id, dataset_id, table_name, schema_path, data_path):
+def main(project_id, dataset_id, table_name, schema_path, data_path,
+         resumable=False, chunksize=resumable_upload.DEFAULT_CHUNK_SIZE,
+         compress=False):
     load_data(
         schema_path,
         data_path,
         project_id,
         dataset_id,
-        table_name)
+        table_name,
+        resumable=resumable,
+        chunksize=chunksize,
+        compress=compress)
 # [END main]
 
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description=__doc__,
@@ -124,6 +156,21 @@ if __name__ == '__main__':
     parser.add_argument(
         'data_file',
         help='Path to the data file.')
+    parser.add_argument(
+        '--resumable',
+        help='Upload the file in resumable chunks. Rerunning an interrupted '
+             'upload continues where it stopped.',
+        action='store_true')
+    parser.add_argument(
+        '--chunksize',
+        help='Bytes sent per request of a resumable upload, a multiple of '
+             '256KB.',
+        type=int,
+        default=resumable_upload.DEFAULT_CHUNK_SIZE)
+    parser.add_argument(
+        '-z', '--gzip',
+        help='Compress the file with gzip while uploading it.',
+        action='store_true')
 
     args = parser.parse_args()
 
@@ -132,4 +179,7 @@ if __name__ == '__main__':
         args.dataset_id,
         args.table_name,
         args.schema_file,
-        args.data_file)
+        args.data_file,
+        args.resumable,
+        args.chunksize,
+        args.gzip)
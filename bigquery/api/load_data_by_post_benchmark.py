@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks resumable uploads of a local file at various chunk sizes.
+
+The uploads go through the client library's resumable upload code to
+fake_bigquery.FakeUploadHttp, which stands in for the upload server. Every
+request to it takes `latency` seconds, and the data is received at
+`bandwidth` bytes per second, so small chunks pay for more round trips.
+
+Example invocation:
+    $ python load_data_by_post_benchmark.py --size_mb 64 --gzip
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import fake_bigquery
+import resumable_upload
+
+BODY = {'configuration': {'load': {'sourceFormat': 'CSV'}}}
+
+
+def write_data_file(path, size_mb):
+    """Writes CSV-like rows, which compress about as well as real data."""
+    row = 0
+    with open(path, 'wb') as f:
+        while f.tell() < size_mb * 1024 * 1024:
+            f.write('{},name-{},{}\n'.format(
+                row, row % 7919, row * 31 % 1000003).encode('utf-8'))
+            row += 1
+
+
+def main(size_mb, chunk_sizes, latency, bandwidth, compress=False):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        data_path = os.path.join(temp_dir, 'data.csv')
+        write_data_file(data_path, size_mb)
+        size = os.path.getsize(data_path)
+
+        for chunk_size in chunk_sizes:
+            bigquery = fake_bigquery.FakeBigQuery(
+                latency=latency, bandwidth=bandwidth)
+            start = time.time()
+            resumable_upload.insert_job(
+                bigquery, 'benchmark', BODY, data_path,
+                chunksize=chunk_size, compress=compress)
+            elapsed = time.time() - start
+
+            print('{}KB chunks: {} requests, {:.2f}s, {:.1f} MB/s'.format(
+                chunk_size // 1024, bigquery.upload_http.chunk_requests,
+                elapsed, size / elapsed / 1e6))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--size_mb', help='Size of the file to upload.', type=int,
+        default=32)
+    parser.add_argument(
+        '--chunk_sizes', help='Chunk sizes to benchmark, in KB.', type=int,
+        nargs='+', default=[256, 1024, 4096, 16384])
+    parser.add_argument(
+        '--latency', help='Seconds each request takes.', type=float,
+        default=0.05)
+    parser.add_argument(
+        '--bandwidth', help='Upload bandwidth in MB/s.', type=float,
+        default=100)
+    parser.add_argument(
+        '-z', '--gzip', help='Compress the file while uploading it.',
+        action='store_true')
+
+    args = parser.parse_args()
+
+    main(
+        args.size_mb,
+        [size * 1024 for size in args.chunk_sizes],
+        args.latency,
+        args.bandwidth * 1e6,
+        args.gzip)
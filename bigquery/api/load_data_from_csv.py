@@ -25,11 +25,10 @@ For more information, see the README.md under /bigquery.
 
 import argparse
 import json
-import time
 import uuid
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+import job_poller
+import services
 
 
 # [START load_table]
@@ -44,12 +43,17 @@ def load_table(bigquery, project_id, dataset_id, table_name, source_schema,
         source_schema: a valid bigquery schema,
         see https://cloud.google.com/bigquery/docs/reference/v2/tables
         source_path: the fully qualified Google Cloud Storage location of
-        the data to load into your table
+        the data to load into your table, or a list of such locations
 
     Returns: a bigquery load job, see
     https://cloud.google.com/bigquery/docs/reference/v2/jobs#configuration.load
     """
 
+    if isinstance(source_path, list):
+        source_uris = source_path
+    else:
+        source_uris = [source_path]
+
     # Generate a unique job_id so retries
     # don't accidentally duplicate query
     job_data = {
@@ -59,7 +63,7 @@ def load_table(bigquery, project_id, dataset_id, table_name, source_schema,
         },
         'configuration': {
             'load': {
-                'sourceUris': [source_path],
+                'sourceUris': source_uris,
                 'schema': {
                     'fields': source_schema
                 },
@@ -79,25 +83,12 @@ def load_table(bigquery, project_id, dataset_id, table_name, source_schema,
 
 
 # [START poll_job]
-def poll_job(bigquery, job):
-    """Waits for a job to complete."""
-
-    print('Waiting for job to finish...')
-
-    request = bigquery.jobs().get(
-        projectId=job['jobReference']['projectId'],
-        jobId=job['jobReference']['jobId'])
-
-    while True:
-        result = request.execute(num_retries=2)
-
-        if result['status']['state'] == 'DONE':
-            if 'errorResult' in result['status']:
-                raise RuntimeError(result['status']['errorResult'])
-            print('Job complete.')
-            return
-
-        time.sleep(1)
+def poll_job(bigquery, job, interval=job_poller.DEFAULT_INTERVAL,
+             num_retries=5):
+    """Waits for a job to complete, polling less often while it stays in
+    the same state."""
+    return job_poller.poll_job(
+        bigquery, job, interval=interval, num_retries=num_retries)
 # [END poll_job]
 
 
@@ -105,11 +96,9 @@ def poll_job(bigquery, job):
 def main(project_id, dataset_id, table_name, schema_file, data_path,
          poll_interval, num_retries):
     # [START build_service]
-    # Grab the application's default credentials from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
-    # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials.
+    bigquery = services.get_service('bigquery', 'v2')
     # [END build_service]
 
     with open(schema_file, 'r') as f:
@@ -124,7 +113,8 @@ def main(project_id, dataset_id, table_name, schema_file, data_path,
         data_path,
         num_retries)
 
-    poll_job(bigquery, job)
+    poll_job(
+        bigquery, job, interval=poll_interval, num_retries=num_retries)
 # [END run]
 
 
@@ -0,0 +1,378 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local, on-disk cache of query results.
+
+Results are keyed by the project, SQL dialect and query text with comments
+and redundant whitespace removed, so trivially different spellings of a
+query share an entry. Along with the rows, each entry records the
+lastModifiedTime of every table the query read. A cached result is only
+used while it is younger than the cache's TTL and none of those tables have
+changed since. Results that can't be checked that way, of queries that read
+no tables or call non-deterministic functions such as NOW() or RAND(), are
+not cached.
+
+Entries are kept in a SQLite database. Rows are written as they stream
+past, in chunks of CHUNK_ROWS rows, and read back a chunk at a time, so
+caching a result doesn't hold it in memory. Each chunk is stored column by
+column as zlib compressed JSON, which is much smaller than the row-oriented
+API format. The least recently used entries are evicted once the cache holds
+more than max_entries results or max_bytes of data, and a result bigger
+than max_bytes is not cached at all.
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import time
+import uuid
+import zlib
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CHUNK_ROWS = 10000
+
+# String literals and quoted identifiers, or runs of whitespace and comments.
+_TOKEN_RE = re.compile(r'''
+    (?P<literal>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`|\[[^\]]*\])
+  | (?P<space>(?:\s+|--[^\n]*|\#[^\n]*|/\*.*?\*/)+)
+''', re.VERBOSE | re.DOTALL)
+
+# Functions whose results change from one run of a query to the next.
+_NONDETERMINISTIC_RE = re.compile(
+    r'\b(?:CURRENT_(?:DATE|DATETIME|TIME|TIMESTAMP|USER)|NOW|RAND|'
+    r'GENERATE_UUID|SESSION_USER)\b', re.IGNORECASE)
+
+
+def normalize_query(query):
+    """Removes comments, redundant whitespace and trailing semicolons from a
+    query, leaving string literals and quoted names untouched."""
+    def replace(match):
+        if match.group('literal'):
+            return match.group('literal')
+        return ' '
+
+    return _TOKEN_RE.sub(replace, query).strip().rstrip('; ')
+
+
+def is_deterministic(query):
+    """Returns whether a query calls none of the functions, outside string
+    literals and quoted names, whose results change between runs."""
+    def replace(match):
+        return ' '
+
+    return not _NONDETERMINISTIC_RE.search(_TOKEN_RE.sub(replace, query))
+
+
+def to_columns(rows):
+    """Converts API rows ({'f': [{'v': ...}]}) into a list of columns."""
+    if not rows:
+        return []
+    return [
+        [row['f'][i]['v'] for row in rows]
+        for i in range(len(rows[0]['f']))]
+
+
+def from_columns(columns):
+    """Converts a list of columns back into API rows."""
+    return [
+        {'f': [{'v': value} for value in values]}
+        for values in zip(*columns)]
+
+
+def get_table_modified_times(bigquery, tables, num_retries=5):
+    """Returns [projectId, datasetId, tableId, lastModifiedTime] for each
+    table reference."""
+    modified = []
+    for table in tables:
+        resource = bigquery.tables().get(
+            projectId=table['projectId'],
+            datasetId=table['datasetId'],
+            tableId=table['tableId'],
+            fields='lastModifiedTime').execute(num_retries=num_retries)
+        modified.append([
+            table['projectId'], table['datasetId'], table['tableId'],
+            resource.get('lastModifiedTime')])
+    return modified
+
+
+class QueryCache(object):
+    """Stores query results in a SQLite database at `path`.
+
+    Args:
+        path: the database file. Use ':memory:' for a cache that isn't
+            kept across runs.
+        ttl: seconds a result stays valid.
+        max_entries: the most results kept.
+        max_bytes: the most bytes of compressed results kept.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            '  key TEXT PRIMARY KEY,'
+            '  entry_id TEXT,'
+            '  query TEXT,'
+            '  tables TEXT,'
+            '  created REAL,'
+            '  last_used REAL,'
+            '  size INTEGER)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS chunks ('
+            '  entry_id TEXT,'
+            '  seq INTEGER,'
+            '  payload BLOB,'
+            '  PRIMARY KEY (entry_id, seq))')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    @staticmethod
+    def key(project_id, query, use_legacy_sql=True):
+        return hashlib.sha256(json.dumps(
+            [project_id, bool(use_legacy_sql), normalize_query(query)]
+        ).encode('utf-8')).hexdigest()
+
+    def get(self, bigquery, project_id, query, num_retries=5,
+            use_legacy_sql=True):
+        """Returns an iterator over the cached rows of a query run in a
+        project, or None if there is no valid result in the cache."""
+        key = self.key(project_id, query, use_legacy_sql)
+        entry = self._db.execute(
+            'SELECT entry_id, tables, created FROM entries WHERE key = ?',
+            (key,)).fetchone()
+
+        if entry is None or not self._is_fresh(
+                bigquery, json.loads(entry[1]), entry[2], num_retries):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._db.execute(
+            'UPDATE entries SET last_used = ? WHERE key = ?',
+            (time.time(), key))
+        self._db.commit()
+        return self._read_rows(entry[0])
+
+    def _read_rows(self, entry_id):
+        chunks = self._db.execute(
+            'SELECT payload FROM chunks WHERE entry_id = ? ORDER BY seq',
+            (entry_id,))
+        for payload, in chunks:
+            for row in from_columns(json.loads(
+                    zlib.decompress(bytes(payload)).decode('utf-8'))):
+                yield row
+
+    def _is_fresh(self, bigquery, tables, created, num_retries):
+        if time.time() - created > self.ttl:
+            return False
+
+        references = [
+            {'projectId': t[0], 'datasetId': t[1], 'tableId': t[2]}
+            for t in tables]
+        try:
+            current = get_table_modified_times(
+                bigquery, references, num_retries)
+        except Exception:
+            # A table that can't be read any more, e.g. because it was
+            # deleted, invalidates the result.
+            return False
+        return current == tables
+
+    def _referenced_tables(self, bigquery, query, job_reference,
+                           num_retries):
+        """Returns the tables a query job read, with their modified times, or
+        None if the job's result can't be cached."""
+        if not is_deterministic(query):
+            return None
+        job = bigquery.jobs().get(
+            projectId=job_reference['projectId'],
+            jobId=job_reference['jobId']).execute(num_retries=num_retries)
+        referenced = job.get('statistics', {}).get('query', {}).get(
+            'referencedTables', [])
+        if not referenced:
+            # Without tables to check, there is no telling when the result
+            # changes.
+            return None
+        return get_table_modified_times(bigquery, referenced, num_retries)
+
+    def put(self, bigquery, query, job_reference, rows, num_retries=5,
+            use_legacy_sql=True):
+        """Caches the rows produced by a query job."""
+        for _ in self.cache_rows(
+                bigquery, query, job_reference, rows, num_retries,
+                use_legacy_sql):
+            pass
+
+    def cache_rows(self, bigquery, query, job_reference, rows,
+                   num_retries=5, use_legacy_sql=True):
+        """Yields rows as they arrive, writing them to the cache a chunk at a
+        time. The result is cached once every row has been read."""
+        tables = self._referenced_tables(
+            bigquery, query, job_reference, num_retries)
+        if tables is None:
+            for row in rows:
+                yield row
+            return
+
+        # Chunks are written under a new ID, and only replace the entry's
+        # current ones once they are complete.
+        entry_id = uuid.uuid4().hex
+        size = 0
+        chunk = []
+        complete = False
+        try:
+            for row in rows:
+                yield row
+                chunk.append(row)
+                if len(chunk) >= CHUNK_ROWS:
+                    size = self._write_chunk(entry_id, chunk, size)
+                    chunk = []
+            size = self._write_chunk(entry_id, chunk, size)
+            complete = size is not None
+        finally:
+            if not complete:
+                # The rows weren't all read, or were too many to keep.
+                self._db.execute(
+                    'DELETE FROM chunks WHERE entry_id = ?', (entry_id,))
+                self._db.commit()
+        if not complete:
+            return
+
+        key = self.key(job_reference['projectId'], query, use_legacy_sql)
+        self._delete(key)
+        now = time.time()
+        self._db.execute(
+            'INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (key, entry_id, normalize_query(query), json.dumps(tables),
+             now, now, size))
+        self._evict()
+        self._db.commit()
+
+    def _write_chunk(self, entry_id, rows, size):
+        """Writes a chunk of rows, returning the entry's size so far, or None
+        once it is more than the cache can hold."""
+        if size is None:
+            return None
+        payload = zlib.compress(json.dumps(to_columns(rows)).encode('utf-8'))
+        size += len(payload)
+        if size > self.max_bytes:
+            return None
+        seq, = self._db.execute(
+            'SELECT COUNT(*) FROM chunks WHERE entry_id = ?',
+            (entry_id,)).fetchone()
+        self._db.execute(
+            'INSERT INTO chunks VALUES (?, ?, ?)',
+            (entry_id, seq, sqlite3.Binary(payload)))
+        self._db.commit()
+        return size
+
+    def _delete(self, key):
+        self._db.execute(
+            'DELETE FROM chunks WHERE entry_id IN ('
+            '  SELECT entry_id FROM entries WHERE key = ?)', (key,))
+        self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def _evict(self):
+        while True:
+            count, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+            ).fetchone()
+            if count <= self.max_entries and size <= self.max_bytes:
+                return
+            self._delete(self._db.execute(
+                'SELECT key FROM entries ORDER BY last_used LIMIT 1'
+            ).fetchone()[0])
+            self.evictions += 1
+
+    def stats(self):
+        count, size = self._db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'entries': count,
+            'bytes': size,
+        }
+
+
+class CachedQueries(object):
+    """Wraps a bigquery service object so that the results of
+    jobs().query() requests come from a QueryCache when it holds them.
+
+    Only responses that hold every row of their result are cached. Every
+    other method is passed through to the wrapped service.
+    """
+
+    def __init__(self, bigquery, cache):
+        self._bigquery = bigquery
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._bigquery, name)
+
+    def jobs(self):
+        return _CachedJobs(self._bigquery, self._cache)
+
+
+class _CachedJobs(object):
+    def __init__(self, bigquery, cache):
+        self._bigquery = bigquery
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._bigquery.jobs(), name)
+
+    def query(self, projectId, body):
+        return _CachedQuery(self._bigquery, self._cache, projectId, body)
+
+
+class _CachedQuery(object):
+    def __init__(self, bigquery, cache, project_id, body):
+        self._bigquery = bigquery
+        self._cache = cache
+        self._project_id = project_id
+        self._body = body
+
+    def execute(self, num_retries=0):
+        query = self._body['query']
+        use_legacy_sql = self._body.get('useLegacySql', True)
+        rows = self._cache.get(
+            self._bigquery, self._project_id, query, num_retries,
+            use_legacy_sql)
+        if rows is not None:
+            return {'jobComplete': True, 'cacheHit': True, 'rows': list(rows)}
+
+        response = self._bigquery.jobs().query(
+            projectId=self._project_id, body=self._body).execute(
+                num_retries=num_retries)
+        if response.get('jobComplete') and 'pageToken' not in response:
+            self._cache.put(
+                self._bigquery, query, response['jobReference'],
+                response.get('rows', []), num_retries, use_legacy_sql)
+        return response
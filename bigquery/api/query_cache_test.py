@@ -0,0 +1,209 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from fake_bigquery import FakeBigQuery
+import pytest
+import query_cache
+
+QUERY = 'SELECT word FROM [my-project:my_dataset.words]'
+TABLE = ('my-project', 'my_dataset', 'words')
+
+
+def run_query(bigquery, query):
+    return bigquery.jobs().query(
+        projectId='my-project', body={'query': query}).execute()
+
+
+def make_service():
+    bigquery = FakeBigQuery()
+    bigquery.set_query_result(
+        QUERY, [{'name': 'word', 'type': 'STRING'}],
+        [['a'], ['b'], [None]], referenced_tables=[TABLE])
+    return bigquery
+
+
+def test_normalize_query():
+    assert query_cache.normalize_query(
+        'SELECT  a, -- first column\n\tb\nFROM t;  ') == 'SELECT a, b FROM t'
+    assert query_cache.normalize_query(
+        "SELECT 'a  -- b' /* comment */ FROM t") == "SELECT 'a  -- b' FROM t"
+
+
+def test_columns_round_trip():
+    rows = [{'f': [{'v': '1'}, {'v': None}]}, {'f': [{'v': '2'}, {'v': 'x'}]}]
+
+    columns = query_cache.to_columns(rows)
+
+    assert columns == [['1', '2'], [None, 'x']]
+    assert query_cache.from_columns(columns) == rows
+
+
+def test_get_put(tmpdir):
+    bigquery = make_service()
+    path = str(tmpdir.join('cache.db'))
+    cache = query_cache.QueryCache(path)
+
+    assert cache.get(bigquery, 'my-project', QUERY) is None
+    response = run_query(bigquery, QUERY)
+    cache.put(bigquery, QUERY, response['jobReference'], response['rows'])
+    cache.close()
+
+    # The result is kept across instances, and is found for the same query
+    # spelled differently.
+    cache = query_cache.QueryCache(path)
+    rows = cache.get(
+        bigquery, 'my-project', '  ' + QUERY.replace(' ', '\n') + ';')
+
+    assert list(rows) == response['rows']
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 0
+    assert stats['entries'] == 1
+
+
+def test_invalidated_by_table_change():
+    bigquery = make_service()
+    cache = query_cache.QueryCache(':memory:')
+    response = run_query(bigquery, QUERY)
+    cache.put(bigquery, QUERY, response['jobReference'], response['rows'])
+
+    bigquery.touch_table(*TABLE)
+
+    assert cache.get(bigquery, 'my-project', QUERY) is None
+
+
+def test_expires():
+    bigquery = make_service()
+    cache = query_cache.QueryCache(':memory:', ttl=-1)
+    response = run_query(bigquery, QUERY)
+    cache.put(bigquery, QUERY, response['jobReference'], response['rows'])
+
+    assert cache.get(bigquery, 'my-project', QUERY) is None
+
+
+def test_evicts_least_recently_used():
+    bigquery = make_service()
+    cache = query_cache.QueryCache(':memory:', max_entries=2)
+    response = run_query(bigquery, QUERY)
+
+    for query in ('SELECT 1', 'SELECT 2'):
+        cache.put(bigquery, query, response['jobReference'], [])
+    cache.get(bigquery, 'my-project', 'SELECT 1')
+    cache.put(bigquery, 'SELECT 3', response['jobReference'], [])
+
+    assert list(cache.get(bigquery, 'my-project', 'SELECT 1')) == []
+    assert cache.get(bigquery, 'my-project', 'SELECT 2') is None
+    assert cache.evictions == 1
+
+
+def test_cache_rows():
+    bigquery = make_service()
+    cache = query_cache.QueryCache(':memory:')
+    response = run_query(bigquery, QUERY)
+
+    rows = list(cache.cache_rows(
+        bigquery, QUERY, response['jobReference'], iter(response['rows'])))
+
+    assert rows == response['rows']
+    assert list(cache.get(bigquery, 'my-project', QUERY)) == rows
+
+
+def test_is_deterministic():
+    assert query_cache.is_deterministic(QUERY)
+    assert query_cache.is_deterministic("SELECT 'NOW()' FROM t")
+    assert not query_cache.is_deterministic('SELECT NOW() FROM t')
+    assert not query_cache.is_deterministic('SELECT rand() AS r FROM t')
+    assert not query_cache.is_deterministic(
+        'SELECT * FROM t WHERE d < CURRENT_DATE')
+
+
+def test_keyed_by_project_and_dialect():
+    bigquery = make_service()
+    cache = query_cache.QueryCache(':memory:')
+    response = run_query(bigquery, QUERY)
+    cache.put(bigquery, QUERY, response['jobReference'], response['rows'])
+
+    assert cache.get(bigquery, 'other-project', QUERY) is None
+    assert cache.get(
+        bigquery, 'my-project', QUERY, use_legacy_sql=False) is None
+    assert cache.get(bigquery, 'my-project', QUERY) is not None
+
+
+@pytest.mark.parametrize('query,tables', [
+    ('SELECT NOW(), word FROM [my-project:my_dataset.words]', [TABLE]),
+    ('SELECT 1', []),
+])
+def test_skips_results_that_cant_be_checked(query, tables):
+    bigquery = make_service()
+    bigquery.set_query_result(
+        query, [{'name': 'f0_', 'type': 'INTEGER'}], [['1']],
+        referenced_tables=tables)
+    cache = query_cache.QueryCache(':memory:')
+    response = run_query(bigquery, query)
+
+    cache.put(bigquery, query, response['jobReference'], response['rows'])
+
+    assert cache.get(bigquery, 'my-project', query) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_cache_rows_in_chunks(monkeypatch):
+    monkeypatch.setattr(query_cache, 'CHUNK_ROWS', 2)
+    bigquery = make_service()
+    cache = query_cache.QueryCache(':memory:')
+    response = run_query(bigquery, QUERY)
+    rows = iter(response['rows'])
+
+    cached = cache.cache_rows(bigquery, QUERY, response['jobReference'], rows)
+    next(cached)
+    next(cached)
+    next(cached)
+    # The first chunk was written before the last row was read.
+    assert cache._db.execute('SELECT COUNT(*) FROM chunks').fetchone() == (1,)
+    assert list(cached) == []
+
+    assert list(cache.get(bigquery, 'my-project', QUERY)) == response['rows']
+
+
+def test_cache_rows_skips_unfinished_and_oversized_results():
+    bigquery = make_service()
+    response = run_query(bigquery, QUERY)
+    cache = query_cache.QueryCache(':memory:')
+
+    cached = cache.cache_rows(
+        bigquery, QUERY, response['jobReference'], iter(response['rows']))
+    next(cached)
+    cached.close()
+    assert cache.get(bigquery, 'my-project', QUERY) is None
+
+    cache = query_cache.QueryCache(':memory:', max_bytes=10)
+    cache.put(bigquery, QUERY, response['jobReference'], response['rows'])
+    assert cache.get(bigquery, 'my-project', QUERY) is None
+    assert cache._db.execute('SELECT COUNT(*) FROM chunks').fetchone() == (0,)
+
+
+def test_cached_queries():
+    bigquery = make_service()
+    cached = query_cache.CachedQueries(
+        bigquery, query_cache.QueryCache(':memory:'))
+
+    first = cached.jobs().query(
+        projectId='my-project', body={'query': QUERY}).execute()
+    second = cached.jobs().query(
+        projectId='my-project', body={'query': QUERY}).execute()
+
+    assert second['cacheHit']
+    assert second['rows'] == first['rows']
+    assert cached.jobs().get(
+        projectId='my-project',
+        jobId=first['jobReference']['jobId']).execute()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Records the cost and latency of query jobs, and reports on them.
+
+Profiler estimates the bytes a query will process with a dry run before it
+is submitted, and once the job is done records from its statistics:
+
+* queue time, from the job's creation until it started running,
+* execution time, from its start until its end,
+* slot milliseconds, bytes processed and bytes billed,
+* whether the result came from the query cache, and
+* the error, if the job failed.
+
+The records are kept in a SQLite file. Queries are grouped by fingerprint:
+the query with comments, whitespace and literal values removed, so that the
+same query run with different parameters is counted together.
+
+Run as a script, it prints the median and 95th percentile of each metric per
+fingerprint.
+
+Example invocation:
+    $ python async_query.py --profile metrics.db my-project 'SELECT ...'
+    $ python query_profiler.py metrics.db
+"""
+
+import argparse
+import hashlib
+import math
+import re
+import sqlite3
+import time
+
+import job_poller
+import query_cache
+
+# Quoted strings, and numbers that aren't part of a name.
+_LITERAL_RE = re.compile(r'''
+    '(?:[^'\\]|\\.)*'
+  | "(?:[^"\\]|\\.)*"
+  | \b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b
+''', re.VERBOSE)
+
+# The metrics summarized for each fingerprint.
+METRICS = [
+    'queue_ms', 'execution_ms', 'slot_ms', 'bytes_processed', 'bytes_billed']
+
+
+def fingerprint(query):
+    """Returns a short hash identifying the shape of a query."""
+    shape = _LITERAL_RE.sub('?', query_cache.normalize_query(query))
+    return hashlib.sha1(shape.encode('utf-8')).hexdigest()[:12]
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of a list of numbers."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(fraction * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def dry_run(bigquery, project_id, query, num_retries=5):
+    """Returns the number of bytes a query would process."""
+    job = bigquery.jobs().insert(
+        projectId=project_id,
+        body={
+            'configuration': {
+                'query': {'query': query},
+                'dryRun': True,
+            }
+        }).execute(num_retries=num_retries)
+    return int(job['statistics']['totalBytesProcessed'])
+
+
+def job_metrics(job):
+    """Extracts the recorded metrics from a finished job resource."""
+    statistics = job.get('statistics', {})
+    query = statistics.get('query', {})
+
+    def number(source, key):
+        value = source.get(key)
+        return int(value) if value is not None else None
+
+    created = number(statistics, 'creationTime')
+    started = number(statistics, 'startTime')
+    ended = number(statistics, 'endTime')
+    error = job.get('status', {}).get('errorResult')
+
+    return {
+        'queue_ms': started - created if started and created else None,
+        'execution_ms': ended - started if ended and started else None,
+        'slot_ms': number(query, 'totalSlotMs'),
+        'bytes_processed': number(query, 'totalBytesProcessed'),
+        'bytes_billed': number(query, 'totalBytesBilled'),
+        'cache_hit': query.get('cacheHit'),
+        'error': error.get('message') if error else None,
+    }
+
+
+class Profiler(object):
+    """Records query job metrics to a SQLite file at `path`."""
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            '  job_id TEXT PRIMARY KEY,'
+            '  fingerprint TEXT,'
+            '  query TEXT,'
+            '  recorded REAL,'
+            '  estimated_bytes INTEGER,'
+            '  queue_ms INTEGER,'
+            '  execution_ms INTEGER,'
+            '  slot_ms INTEGER,'
+            '  bytes_processed INTEGER,'
+            '  bytes_billed INTEGER,'
+            '  cache_hit INTEGER,'
+            '  error TEXT)')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def preflight(self, bigquery, project_id, query, num_retries=5):
+        """Dry runs a query, returning the bytes it would process.
+
+        Errors in the query, such as syntax errors, are raised here before
+        any job is created.
+        """
+        return dry_run(bigquery, project_id, query, num_retries)
+
+    def record(self, query, job, estimated_bytes=None):
+        """Records the metrics of a finished job resource."""
+        metrics = job_metrics(job)
+        cache_hit = metrics['cache_hit']
+        self._db.execute(
+            'INSERT OR REPLACE INTO jobs VALUES '
+            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job['jobReference']['jobId'], fingerprint(query),
+             query_cache.normalize_query(query), time.time(),
+             estimated_bytes, metrics['queue_ms'], metrics['execution_ms'],
+             metrics['slot_ms'], metrics['bytes_processed'],
+             metrics['bytes_billed'],
+             None if cache_hit is None else int(cache_hit),
+             metrics['error']))
+        self._db.commit()
+        return metrics
+
+    def record_job(self, bigquery, query, job_reference, estimated_bytes=None,
+                   num_retries=5):
+        """Fetches a finished job and records its metrics."""
+        job = job_poller.get_job(bigquery, job_reference, num_retries)
+        return self.record(query, job, estimated_bytes)
+
+    def report(self):
+        """Summarizes the recorded jobs by fingerprint.
+
+        Returns:
+            A list of dicts, one per fingerprint, slowest first by 95th
+            percentile execution time.
+        """
+        groups = {}
+        for row in self._db.execute(
+                'SELECT fingerprint, query, queue_ms, execution_ms, slot_ms,'
+                '  bytes_processed, bytes_billed, cache_hit, error '
+                'FROM jobs ORDER BY recorded'):
+            group = groups.setdefault(row[0], {
+                'fingerprint': row[0],
+                'query': row[1],
+                'jobs': 0,
+                'errors': 0,
+                'cache_hits': 0,
+                'values': dict((name, []) for name in METRICS),
+            })
+            group['jobs'] += 1
+            group['errors'] += 1 if row[8] else 0
+            group['cache_hits'] += row[7] or 0
+            for name, value in zip(METRICS, row[2:7]):
+                if value is not None:
+                    group['values'][name].append(value)
+
+        summaries = []
+        for group in groups.values():
+            values = group.pop('values')
+            for name in METRICS:
+                group[name + '_p50'] = percentile(values[name], 0.5)
+                group[name + '_p95'] = percentile(values[name], 0.95)
+            summaries.append(group)
+
+        return sorted(
+            summaries, key=lambda s: s['execution_ms_p95'] or 0, reverse=True)
+
+
+def print_report(summaries):
+    print('fingerprint\tjobs\terrors\tcache hits\texec p50/p95 ms\t'
+          'queue p50/p95 ms\tslot p50/p95 ms\tbilled p50/p95 MB\tquery')
+    for s in summaries:
+        billed = [
+            '{:.1f}'.format(v / 2.0 ** 20) if v is not None else '-'
+            for v in (s['bytes_billed_p50'], s['bytes_billed_p95'])]
+        print('\t'.join(str(field) for field in [
+            s['fingerprint'], s['jobs'], s['errors'], s['cache_hits'],
+            '{}/{}'.format(s['execution_ms_p50'], s['execution_ms_p95']),
+            '{}/{}'.format(s['queue_ms_p50'], s['queue_ms_p95']),
+            '{}/{}'.format(s['slot_ms_p50'], s['slot_ms_p95']),
+            '/'.join(billed),
+            s['query'][:80]]))
+
+
+def main(path):
+    profiler = Profiler(path)
+    try:
+        print_report(profiler.report())
+    finally:
+        profiler.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'path', help='The metrics file written with --profile.')
+
+    args = parser.parse_args()
+
+    main(args.path)
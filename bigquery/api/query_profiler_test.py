@@ -0,0 +1,130 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import async_query
+from fake_bigquery import FakeBigQuery
+import pytest
+import query_profiler
+import query_results
+import sync_query
+
+QUERY = 'SELECT word FROM [my-project:my_dataset.words] WHERE n > {}'
+
+
+def run_job(bigquery, query, fail=False):
+    job = bigquery.jobs().insert(
+        projectId='my-project',
+        body={'configuration': {'query': {'query': query}}}).execute()
+    if fail:
+        bigquery.fail_job(job['jobReference']['jobId'], 'Out of memory.')
+    return job
+
+
+def test_fingerprint():
+    assert query_profiler.fingerprint(QUERY.format(1)) == (
+        query_profiler.fingerprint(QUERY.format(20) + '\n;'))
+    assert query_profiler.fingerprint(QUERY.format(1)) != (
+        query_profiler.fingerprint(QUERY.format(1) + ' LIMIT 5'))
+
+
+def test_percentile():
+    values = list(range(1, 21))
+
+    assert query_profiler.percentile(values, 0.5) == 10
+    assert query_profiler.percentile(values, 0.95) == 19
+    assert query_profiler.percentile([], 0.5) is None
+
+
+def test_dry_run():
+    bigquery = FakeBigQuery()
+    bigquery.set_query_result(
+        QUERY.format(1), [{'name': 'word', 'type': 'STRING'}], [['a']] * 10)
+
+    estimated = query_profiler.dry_run(bigquery, 'my-project', QUERY.format(1))
+
+    assert estimated > 0
+    assert bigquery.request_count == 1
+
+
+def test_record_and_report():
+    bigquery = FakeBigQuery()
+    bigquery.set_query_result(
+        QUERY.format(1), [{'name': 'word', 'type': 'STRING'}], [['a']] * 10)
+    profiler = query_profiler.Profiler(':memory:')
+
+    for n in (1, 2, 3):
+        job = run_job(bigquery, QUERY.format(n), fail=n == 3)
+        metrics = profiler.record_job(
+            bigquery, QUERY.format(n), job['jobReference'], 100)
+    job = run_job(bigquery, 'SELECT 1')
+    profiler.record_job(bigquery, 'SELECT 1', job['jobReference'])
+
+    assert metrics['error'] == 'Out of memory.'
+    assert metrics['execution_ms'] >= 0
+    report = profiler.report()
+    assert len(report) == 2
+    summary = [s for s in report if s['jobs'] == 3][0]
+    assert summary['errors'] == 1
+    assert summary['cache_hits'] == 0
+    assert summary['bytes_billed_p95'] == 10 * 2 ** 20
+    assert summary['slot_ms_p50'] is not None
+
+
+def use_fake(monkeypatch, module, bigquery):
+    monkeypatch.setattr(
+        module.services, 'get_service', lambda *args, **kwargs: bigquery)
+
+
+def test_async_query_profile(monkeypatch, tmpdir, capsys):
+    bigquery = FakeBigQuery()
+    bigquery.set_query_result(
+        QUERY.format(1), [{'name': 'word', 'type': 'STRING'}], [['a']])
+    use_fake(monkeypatch, async_query, bigquery)
+    path = str(tmpdir.join('metrics.db'))
+
+    async_query.main(
+        'my-project', QUERY.format(1), False, 5, 0.001, profile_path=path)
+
+    out, err = capsys.readouterr()
+    assert 'Query will process' in err
+    profiler = query_profiler.Profiler(path)
+    assert [s['jobs'] for s in profiler.report()] == [1]
+
+    query_profiler.main(path)
+    out, _ = capsys.readouterr()
+    assert query_profiler.fingerprint(QUERY.format(1)) in out
+
+
+def test_sync_query_profiles_failed_reads(monkeypatch, tmpdir):
+    bigquery = FakeBigQuery()
+    bigquery.set_query_result(
+        QUERY.format(1), [{'name': 'word', 'type': 'STRING'}], [['a']])
+    use_fake(monkeypatch, sync_query, bigquery)
+    closed = []
+    monkeypatch.setattr(
+        query_profiler.Profiler, 'close',
+        lambda self: closed.append(self._db.close()))
+
+    def fail(rows):
+        raise IOError('Broken pipe.')
+
+    monkeypatch.setattr(query_results, 'write_ndjson', fail)
+    path = str(tmpdir.join('metrics.db'))
+
+    with pytest.raises(IOError):
+        sync_query.main(
+            'my-project', QUERY.format(1), 1000, 5, profile_path=path)
+
+    assert closed
+    profiler = query_profiler.Profiler(path)
+    assert [s['jobs'] for s in profiler.report()] == [1]
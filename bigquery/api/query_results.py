@@ -0,0 +1,143 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Reads the results of a BigQuery query job.
+
+Rather than following pageToken one page at a time, rows are read in
+fixed-size ranges addressed by startIndex. Once the total number of rows is
+known, several ranges are fetched concurrently and yielded back in order,
+with only a bounded number of pages held in memory at any time.
+
+The service object passed in must be safe to use from several threads, for
+example one returned by services.get_service().
+"""
+
+import collections
+from concurrent import futures
+import json
+import sys
+
+DEFAULT_PAGE_SIZE = 10000
+DEFAULT_NUM_WORKERS = 4
+
+# How long a single getQueryResults call waits for a running job to finish.
+WAIT_TIMEOUT_MS = 10000
+
+
+def _get_query_results(bigquery, job_reference, num_retries, **kwargs):
+    return bigquery.jobs().getQueryResults(
+        projectId=job_reference['projectId'],
+        jobId=job_reference['jobId'],
+        **kwargs).execute(num_retries=num_retries)
+
+
+def get_first_page(bigquery, job_reference, page_size=DEFAULT_PAGE_SIZE,
+                   num_retries=5):
+    """Waits for a query job to complete and returns its first page."""
+    while True:
+        page = _get_query_results(
+            bigquery, job_reference, num_retries,
+            maxResults=page_size,
+            timeoutMs=WAIT_TIMEOUT_MS)
+
+        if page.get('jobComplete'):
+            return page
+
+
+def fetch_range(bigquery, job_reference, start_index, count, num_retries=5):
+    """Returns up to `count` rows of the result, beginning at `start_index`.
+
+    The API may return fewer rows than requested, for instance to keep the
+    response under its size limit, so keep asking until the range is filled.
+    """
+    rows = []
+    while len(rows) < count:
+        page = _get_query_results(
+            bigquery, job_reference, num_retries,
+            startIndex=start_index + len(rows),
+            maxResults=count - len(rows))
+
+        page_rows = page.get('rows', [])
+        if not page_rows:
+            break
+        rows.extend(page_rows)
+
+    return rows
+
+
+def iter_rows(bigquery, job_reference, first_page=None,
+              page_size=DEFAULT_PAGE_SIZE, num_workers=DEFAULT_NUM_WORKERS,
+              num_retries=5):
+    """Yields every row of a query job's result, in order.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object.
+        job_reference: the jobReference of the query job.
+        first_page: an already fetched response for the first page, such as
+            the reply to jobs().query(). If it is missing or the job was not
+            complete yet, the first page is fetched again.
+        page_size: the number of rows requested by each call.
+        num_workers: the number of pages fetched concurrently.
+        num_retries: number of times to retry in case of 500 error.
+    """
+    if not first_page or not first_page.get('jobComplete'):
+        first_page = get_first_page(
+            bigquery, job_reference, page_size, num_retries)
+
+    total_rows = int(first_page.get('totalRows', 0))
+    rows = first_page.get('rows', [])
+    for row in rows:
+        yield row
+
+    if len(rows) >= total_rows:
+        return
+
+    ranges = [
+        (start_index, min(page_size, total_rows - start_index))
+        for start_index in range(len(rows), total_rows, page_size)]
+
+    # Allow two pages per worker to be in flight (or waiting to be consumed),
+    # which keeps the workers busy while bounding memory use.
+    max_pending = 2 * num_workers
+    executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+    pending = collections.deque()
+
+    try:
+        for start_index, count in ranges:
+            pending.append(executor.submit(
+                fetch_range, bigquery, job_reference, start_index, count,
+                num_retries))
+
+            if len(pending) >= max_pending:
+                for row in pending.popleft().result():
+                    yield row
+
+        while pending:
+            for row in pending.popleft().result():
+                yield row
+    finally:
+        # If the caller stopped early, don't fetch any more pages.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def write_ndjson(rows, out=sys.stdout):
+    """Writes rows as newline-delimited JSON and returns how many."""
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row))
+        out.write('\n')
+        count += 1
+    return count
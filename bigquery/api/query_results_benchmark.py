@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks reading query results page by page against reading them with
+query_results.iter_rows.
+
+The benchmark runs against a fake_bigquery.FakeBigQueryServer on a local
+port, so no project is needed, while requests still go through the client
+library, httplib2 and services.ThreadLocalHttp's per-thread connections. Each
+request to the fake takes `latency` seconds, which is what the concurrent
+reader hides.
+
+Example invocation:
+    $ python query_results_benchmark.py --rows 200000 --latency 0.05
+"""
+
+import argparse
+import time
+
+import fake_bigquery
+import query_results
+
+QUERY = 'SELECT word, word_count FROM [publicdata:samples.shakespeare]'
+
+
+def make_server(num_rows, latency, page_size):
+    fake = fake_bigquery.FakeBigQuery(
+        latency=latency, max_page_rows=page_size)
+    fake.set_query_result(
+        QUERY,
+        [{'name': 'word', 'type': 'STRING'},
+         {'name': 'word_count', 'type': 'INTEGER'}],
+        (('word{}'.format(i), i) for i in range(num_rows)))
+    return fake_bigquery.FakeBigQueryServer(fake)
+
+
+def start_query(bigquery):
+    job = bigquery.jobs().insert(
+        projectId='benchmark',
+        body={'configuration': {'query': {'query': QUERY}}}).execute()
+    return job['jobReference']
+
+
+def read_sequentially(bigquery, job_reference, page_size):
+    """Reads the result by following pageToken, as the samples used to."""
+    page_token = None
+    while True:
+        page = bigquery.jobs().getQueryResults(
+            pageToken=page_token,
+            maxResults=page_size,
+            **job_reference).execute()
+
+        for row in page.get('rows', []):
+            yield row
+
+        page_token = page.get('pageToken')
+        if not page_token:
+            break
+
+
+def measure(rows):
+    """Consumes rows and returns (row count, seconds taken)."""
+    start = time.time()
+    count = 0
+    for _ in rows:
+        count += 1
+    return count, time.time() - start
+
+
+def main(num_rows, latency, page_size, worker_counts):
+    with make_server(num_rows, latency, page_size) as server:
+        bigquery = server.build_service()
+
+        count, elapsed = measure(read_sequentially(
+            bigquery, start_query(bigquery), page_size))
+        print('sequential: {} rows in {:.2f}s ({:.0f} rows/s)'.format(
+            count, elapsed, count / elapsed))
+
+        for num_workers in worker_counts:
+            count, elapsed = measure(query_results.iter_rows(
+                bigquery, start_query(bigquery), page_size=page_size,
+                num_workers=num_workers))
+            print('{} workers: {} rows in {:.2f}s ({:.0f} rows/s)'.format(
+                num_workers, count, elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--rows', help='Number of rows in the result.', type=int,
+        default=100000)
+    parser.add_argument(
+        '--latency', help='Seconds each request takes.', type=float,
+        default=0.05)
+    parser.add_argument(
+        '--page_size', help='Rows per page.', type=int, default=1000)
+    parser.add_argument(
+        '--workers', help='Worker counts to benchmark.', type=int,
+        nargs='+', default=[1, 4, 8, 16])
+
+    args = parser.parse_args()
+
+    main(args.rows, args.latency, args.page_size, args.workers)
@@ -0,0 +1,119 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import fake_bigquery
+from googleapiclient import errors
+import pytest
+import query_results
+import query_results_benchmark
+import six
+
+QUERY = 'SELECT n FROM numbers'
+
+
+def run_query(bigquery, num_rows):
+    bigquery.set_query_result(
+        QUERY, [{'name': 'n', 'type': 'INTEGER'}],
+        [[i] for i in range(num_rows)])
+    return bigquery.jobs().query(
+        projectId='test', body={'query': QUERY}).execute()
+
+
+def test_iter_rows_in_order():
+    bigquery = fake_bigquery.FakeBigQuery(max_page_rows=7)
+    job = run_query(bigquery, 100)
+
+    rows = list(query_results.iter_rows(
+        bigquery, job['jobReference'], page_size=10, num_workers=3))
+
+    assert [int(row['f'][0]['v']) for row in rows] == list(range(100))
+
+
+def test_iter_rows_reuses_first_page():
+    bigquery = fake_bigquery.FakeBigQuery(max_page_rows=10)
+    job = run_query(bigquery, 10)
+
+    rows = list(query_results.iter_rows(
+        bigquery, job['jobReference'], first_page=job))
+
+    assert len(rows) == 10
+    # Only the jobs().query() call was made.
+    assert bigquery.request_count == 1
+
+
+def test_iter_rows_waits_for_job():
+    bigquery = fake_bigquery.FakeBigQuery(running_polls=2)
+    bigquery.set_query_result(QUERY, [], [[1], [2]])
+    job = bigquery.jobs().insert(
+        projectId='test',
+        body={'configuration': {'query': {'query': QUERY}}}).execute()
+
+    rows = list(query_results.iter_rows(bigquery, job['jobReference']))
+
+    assert len(rows) == 2
+
+
+def test_iter_rows_over_http():
+    fake = fake_bigquery.FakeBigQuery(max_page_rows=7, running_polls=1)
+    fake.set_query_result(
+        QUERY, [{'name': 'n', 'type': 'INTEGER'}],
+        [[i] for i in range(100)])
+
+    with fake_bigquery.FakeBigQueryServer(fake) as server:
+        bigquery = server.build_service()
+        job = bigquery.jobs().insert(
+            projectId='test',
+            body={'configuration': {'query': {'query': QUERY}}}).execute()
+        rows = list(query_results.iter_rows(
+            bigquery, job['jobReference'], page_size=10, num_workers=3))
+
+        with pytest.raises(errors.HttpError) as excinfo:
+            bigquery.jobs().get(projectId='test', jobId='missing').execute()
+
+    assert [int(row['f'][0]['v']) for row in rows] == list(range(100))
+    assert excinfo.value.resp.status == 404
+
+
+def test_iter_rows_stops_early():
+    bigquery = fake_bigquery.FakeBigQuery(max_page_rows=10)
+    job = run_query(bigquery, 10000)
+
+    rows = query_results.iter_rows(
+        bigquery, job['jobReference'], page_size=10, num_workers=2)
+    first = next(rows)
+    rows.close()
+
+    assert first['f'][0]['v'] == '0'
+    assert bigquery.request_count < 20
+
+
+def test_write_ndjson():
+    rows = [
+        fake_bigquery.make_row([1, 'a']),
+        fake_bigquery.make_row([2, None])]
+    out = six.StringIO()
+
+    assert query_results.write_ndjson(rows, out) == 2
+    lines = out.getvalue().splitlines()
+    assert [json.loads(line) for line in lines] == rows
+
+
+def test_benchmark(capsys):
+    query_results_benchmark.main(
+        num_rows=1000, latency=0, page_size=100, worker_counts=[1, 4])
+
+    out, _ = capsys.readouterr()
+    assert 'sequential: 1000 rows' in out
+    assert '4 workers: 1000 rows' in out
@@ -0,0 +1,265 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Uploads a local file into a BigQuery load job in resumable chunks.
+
+After every chunk the resumable session URI is saved to a small state file
+next to the data file. If the upload is interrupted, running it again picks
+the session back up, asks the server how many bytes it has committed and
+continues from there.
+
+The file can optionally be gzip compressed on the fly. GzipMediaUpload reads
+and compresses the file a block at a time, keeping no more than about a
+chunk and a block of compressed data in memory, even when resuming far into
+the file.
+"""
+
+import json
+import os
+import zlib
+
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaUpload
+
+# Chunk sizes must be a multiple of 256KB.
+CHUNK_SIZE_UNIT = 256 * 1024
+DEFAULT_CHUNK_SIZE = 32 * CHUNK_SIZE_UNIT
+
+# How much of the source file is read and compressed at a time.
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+class GzipMediaUpload(MediaUpload):
+    """A resumable media upload of a file, gzip compressed as it is sent.
+
+    The compressed size isn't known until the whole file has been
+    compressed, so size() returns None until then. To make sure the final
+    chunk is sent with the total size, the compressed data is kept one chunk
+    ahead of what has been uploaded.
+
+    The compressed output is deterministic, so after a restart the file is
+    compressed again from the start and the bytes the server already has are
+    skipped rather than sent.
+    """
+
+    def __init__(self, filename, mimetype='application/octet-stream',
+                 chunksize=DEFAULT_CHUNK_SIZE, compresslevel=6):
+        super(GzipMediaUpload, self).__init__()
+        self._filename = filename
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._compresslevel = compresslevel
+        self._rewind()
+
+    def _rewind(self):
+        if getattr(self, '_fd', None):
+            self._fd.close()
+        self._fd = open(self._filename, 'rb')
+        # A 16 + MAX_WBITS window writes a gzip header and trailer. The
+        # header's timestamp is left at zero, keeping the output repeatable.
+        self._compressor = zlib.compressobj(
+            self._compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._buffer = bytearray()
+        self._buffer_start = 0
+        self._next_begin = 0
+        self._total = None
+
+    def _fill(self, end, begin=0):
+        """Compresses more of the file until `end` bytes have been produced
+        or the file is exhausted, dropping the output before `begin` as it
+        is produced."""
+        while self._total is None and (
+                self._buffer_start + len(self._buffer) < end):
+            block = self._fd.read(READ_BLOCK_SIZE)
+            if block:
+                self._buffer.extend(self._compressor.compress(block))
+            else:
+                self._buffer.extend(self._compressor.flush())
+                self._total = self._buffer_start + len(self._buffer)
+                self._fd.close()
+            self._drop(begin)
+
+    def _drop(self, begin):
+        """Drops the buffered output before `begin`."""
+        count = min(begin - self._buffer_start, len(self._buffer))
+        if count > 0:
+            del self._buffer[:count]
+            self._buffer_start += count
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        self._fill(self._next_begin + self._chunksize + 1)
+        return self._total
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        if begin < self._buffer_start:
+            self._rewind()
+
+        # Everything before `begin` has been committed by the server.
+        self._drop(begin)
+        self._fill(begin + length + 1, begin)
+        data = bytes(self._buffer[:length])
+        self._next_begin = begin + len(data)
+        return data
+
+    def to_json(self):
+        """Serializes the file and settings of the upload, but not its
+        progress: the compressed output is repeatable, so the upload made by
+        from_json() produces the same bytes from any offset."""
+        return self._to_json(strip=[
+            '_fd', '_compressor', '_buffer', '_buffer_start', '_next_begin',
+            '_total'])
+
+    @staticmethod
+    def from_json(s):
+        d = json.loads(s)
+        return GzipMediaUpload(
+            d['_filename'], mimetype=d['_mimetype'],
+            chunksize=d['_chunksize'], compresslevel=d['_compresslevel'])
+
+
+def state_path_for(data_path):
+    return data_path + '.upload-state.json'
+
+
+def _source_fingerprint(data_path, compress):
+    stat = os.stat(data_path)
+    return {
+        'source': os.path.abspath(data_path),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'compress': compress,
+    }
+
+
+def load_state(state_path, fingerprint):
+    """Returns the saved state of an upload of the same file, if any."""
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+    if any(state.get(key) != value for key, value in fingerprint.items()):
+        return None
+    return state
+
+
+def save_state(state_path, state):
+    # Write to a temporary file first so that a crash never leaves a
+    # truncated state file behind.
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        json.dump(state, f)
+    if os.name == 'nt' and os.path.exists(state_path):
+        # os.rename can't replace an existing file on Windows.
+        os.remove(state_path)
+    os.rename(temp_path, state_path)
+
+
+def resume_upload(request, resumable_uri):
+    """Points a resumable upload request at an earlier upload session.
+
+    Asks the server how many bytes of the session it has, and sets the
+    request's resumable_progress so that next_chunk() carries on from
+    there. If the session has expired, the request is left to start a new
+    one.
+
+    Returns:
+        The response, if the server already has the whole upload, or None.
+    """
+    size = request.resumable.size()
+    resp, content = request.http.request(
+        resumable_uri, 'PUT', headers={
+            'Content-Range': 'bytes */{}'.format(
+                '*' if size is None else size),
+            'Content-Length': '0',
+        })
+    if resp.status in (404, 410):
+        return None
+    if resp.status in (200, 201):
+        return request.postproc(resp, content)
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=resumable_uri)
+
+    request.resumable_uri = resumable_uri
+    # The server leaves out the range if it has no bytes yet.
+    if 'range' in resp:
+        request.resumable_progress = int(resp['range'].split('-')[1]) + 1
+    return None
+
+
+def insert_job(bigquery, project_id, body, data_path,
+               chunksize=DEFAULT_CHUNK_SIZE, compress=False,
+               state_path=None, num_retries=5, progress_callback=None):
+    """Inserts a load job, uploading its data in resumable chunks.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object.
+        body: the job resource to insert.
+        data_path: the local file to upload.
+        chunksize: bytes sent per request, a multiple of 256KB.
+        compress: whether to gzip the file as it is uploaded.
+        state_path: where the progress of the upload is saved. Defaults to
+            a file next to data_path.
+        progress_callback: called with (bytes uploaded, total bytes or None)
+            after each chunk.
+
+    Returns:
+        The inserted job resource.
+    """
+    if chunksize % CHUNK_SIZE_UNIT:
+        raise ValueError('chunksize must be a multiple of 256KB.')
+
+    state_path = state_path or state_path_for(data_path)
+    fingerprint = _source_fingerprint(data_path, compress)
+
+    if compress:
+        media_body = GzipMediaUpload(data_path, chunksize=chunksize)
+    else:
+        media_body = MediaFileUpload(
+            data_path, mimetype='application/octet-stream',
+            chunksize=chunksize, resumable=True)
+
+    request = bigquery.jobs().insert(
+        projectId=project_id, body=body, media_body=media_body)
+
+    response = None
+    state = load_state(state_path, fingerprint)
+    if state:
+        response = resume_upload(request, state['resumable_uri'])
+
+    while response is None:
+        status, response = request.next_chunk(num_retries=num_retries)
+        if status:
+            fingerprint['resumable_uri'] = request.resumable_uri
+            fingerprint['progress'] = status.resumable_progress
+            save_state(state_path, fingerprint)
+            if progress_callback:
+                progress_callback(
+                    status.resumable_progress, status.total_size)
+
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    return response
@@ -0,0 +1,237 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import re
+import zlib
+
+import fake_bigquery
+from googleapiclient import http
+import httplib2
+import load_data_by_post
+import load_data_by_post_benchmark
+import pytest
+import resumable_upload
+
+CHUNK_SIZE = resumable_upload.CHUNK_SIZE_UNIT
+BODY = {'configuration': {'load': {'sourceFormat': 'CSV'}}}
+
+
+@pytest.fixture
+def data_file(tmpdir):
+    path = tmpdir.join('data.csv')
+    path.write_binary(os.urandom(3 * CHUNK_SIZE + 1000))
+    return str(path)
+
+
+def upload(bigquery, data_file, **kwargs):
+    job = resumable_upload.insert_job(
+        bigquery, 'test', BODY, data_file, chunksize=CHUNK_SIZE, **kwargs)
+    job_id = job['jobReference']['jobId']
+    bigquery.poll_job(job_id)
+    return bigquery.uploads[job_id]
+
+
+def test_resumable_upload(data_file):
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    uploaded = upload(bigquery, data_file)
+
+    with open(data_file, 'rb') as f:
+        assert uploaded == f.read()
+    assert bigquery.upload_http.chunk_requests == 4
+    assert not os.path.exists(resumable_upload.state_path_for(data_file))
+
+
+def test_compressed_upload(data_file):
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    uploaded = upload(bigquery, data_file, compress=True)
+
+    with open(data_file, 'rb') as f:
+        assert zlib.decompress(uploaded, 16 + zlib.MAX_WBITS) == f.read()
+
+
+def test_resumes_after_interruption(data_file):
+    bigquery = fake_bigquery.FakeBigQuery()
+    bigquery.upload_http.fail_after = 2 * CHUNK_SIZE + 100
+
+    with pytest.raises(httplib2.HttpLib2Error):
+        upload(bigquery, data_file)
+    assert os.path.exists(resumable_upload.state_path_for(data_file))
+    assert bigquery.upload_http.chunk_requests == 3
+
+    uploaded = upload(bigquery, data_file)
+
+    with open(data_file, 'rb') as f:
+        assert uploaded == f.read()
+    # Only the chunks the server didn't have were sent again.
+    assert bigquery.upload_http.chunk_requests == 5
+
+
+def test_resume_upload(data_file):
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    def make_request():
+        return bigquery.jobs().insert(
+            projectId='test', body=BODY, media_body=http.MediaFileUpload(
+                data_file, chunksize=CHUNK_SIZE, resumable=True))
+
+    # A session that has no bytes yet.
+    response, _ = bigquery.upload_http.request(
+        fake_bigquery.UPLOAD_URI.format('test'), 'POST',
+        body=json.dumps(BODY))
+    session_uri = response['location']
+    request = make_request()
+
+    assert resumable_upload.resume_upload(request, session_uri) is None
+    assert request.resumable_uri == session_uri
+    assert request.resumable_progress == 0
+
+    request.next_chunk()
+    request = make_request()
+    assert resumable_upload.resume_upload(request, session_uri) is None
+    assert request.resumable_progress == CHUNK_SIZE
+
+    job = None
+    while job is None:
+        _, job = request.next_chunk()
+    # The session of a finished upload answers with the job.
+    assert resumable_upload.resume_upload(make_request(), session_uri) == job
+
+
+def test_restarts_expired_session(data_file):
+    bigquery = fake_bigquery.FakeBigQuery()
+    bigquery.upload_http.fail_after = CHUNK_SIZE + 100
+    with pytest.raises(httplib2.HttpLib2Error):
+        upload(bigquery, data_file)
+    bigquery.upload_http._sessions.clear()
+
+    uploaded = upload(bigquery, data_file)
+
+    with open(data_file, 'rb') as f:
+        assert uploaded == f.read()
+    assert bigquery.upload_http.chunk_requests == 2 + 4
+
+
+def test_compressed_upload_resumes_after_interruption(data_file):
+    bigquery = fake_bigquery.FakeBigQuery()
+    bigquery.upload_http.fail_after = CHUNK_SIZE + 100
+
+    with pytest.raises(httplib2.HttpLib2Error):
+        upload(bigquery, data_file, compress=True)
+    uploaded = upload(bigquery, data_file, compress=True)
+
+    with open(data_file, 'rb') as f:
+        assert zlib.decompress(uploaded, 16 + zlib.MAX_WBITS) == f.read()
+
+
+def test_gzip_media_resumes_in_bounded_memory(tmpdir):
+    path = tmpdir.join('data')
+    data = os.urandom(8 * resumable_upload.READ_BLOCK_SIZE)
+    path.write_binary(data)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+
+    class RecordingUpload(resumable_upload.GzipMediaUpload):
+        peak = 0
+
+        def _drop(self, begin):
+            self.peak = max(self.peak, len(self._buffer))
+            super(RecordingUpload, self)._drop(begin)
+
+    media = RecordingUpload(str(path), chunksize=CHUNK_SIZE)
+    begin = 6 * resumable_upload.READ_BLOCK_SIZE
+
+    assert media.getbytes(begin, CHUNK_SIZE) == (
+        compressed[begin:begin + CHUNK_SIZE])
+    # The compressed output before the resumed offset wasn't all kept.
+    assert media.peak <= CHUNK_SIZE + 2 * resumable_upload.READ_BLOCK_SIZE
+
+
+def test_gzip_media_knows_size_before_last_chunk(tmpdir):
+    path = tmpdir.join('data')
+    path.write_binary(os.urandom(5000))
+    media = resumable_upload.GzipMediaUpload(str(path), chunksize=1 << 20)
+    total = len(media.getbytes(0, 1 << 20))
+
+    # The client reads size() before fetching each chunk, and must know the
+    # total by the time it sends the last one, even when that chunk is full.
+    for chunksize in (total, total // 2, total // 3, 1000):
+        media = resumable_upload.GzipMediaUpload(
+            str(path), chunksize=chunksize)
+        progress = 0
+        while progress < total:
+            size = media.size()
+            progress += len(media.getbytes(progress, chunksize))
+        assert size == total
+
+
+def test_gzip_media_to_json(tmpdir):
+    path = tmpdir.join('data')
+    path.write_binary(os.urandom(5000))
+    media = resumable_upload.GzipMediaUpload(
+        str(path), mimetype='text/csv', chunksize=1000, compresslevel=9)
+    first = media.getbytes(0, 1000)
+    expected = media.getbytes(1000, 1000)
+
+    restored = http.MediaUpload.new_from_json(media.to_json())
+
+    assert isinstance(restored, resumable_upload.GzipMediaUpload)
+    assert restored.mimetype() == 'text/csv'
+    assert restored.chunksize() == 1000
+    assert restored.getbytes(1000, 1000) == expected
+    assert restored.getbytes(0, 1000) == first
+
+
+def test_load_data_resumable(resource, capsys):
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    load_data_by_post.load_data(
+        resource('schema.json'), resource('data.csv'), 'test',
+        'test_dataset', 'test_table', bigquery=bigquery, resumable=True)
+
+    out, _ = capsys.readouterr()
+    assert re.search(
+        r'Waiting for job to finish.*Job complete.', out, re.DOTALL)
+    assert len(bigquery.uploads) == 1
+
+
+def test_load_data_raises_job_errors(resource, monkeypatch):
+    bigquery = fake_bigquery.FakeBigQuery()
+    create_job = bigquery.create_job
+
+    def warned_create_job(*args, **kwargs):
+        job = create_job(*args, **kwargs)
+        bigquery.warn_job(
+            job['resource']['jobReference']['jobId'], 'Bad row skipped.')
+        return job
+
+    monkeypatch.setattr(bigquery, 'create_job', warned_create_job)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        load_data_by_post.load_data(
+            resource('schema.json'), resource('data.csv'), 'test',
+            'dataset', 'table', poll_interval=0.001, bigquery=bigquery)
+    assert 'Bad row skipped.' in str(excinfo.value)
+
+
+def test_benchmark(capsys):
+    load_data_by_post_benchmark.main(
+        size_mb=1, chunk_sizes=[CHUNK_SIZE, 4 * CHUNK_SIZE], latency=0,
+        bandwidth=None)
+
+    out, _ = capsys.readouterr()
+    assert re.search(r'256KB chunks: .* MB/s', out)
+    assert re.search(r'1024KB chunks: .* MB/s', out)
@@ -0,0 +1,99 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import httplib2
+import pytest
+import services
+
+DISCOVERY_DOC = json.dumps({
+    'kind': 'discovery#restDescription',
+    'name': 'bigquery',
+    'version': 'v2',
+    'rootUrl': 'https://www.googleapis.com/',
+    'servicePath': 'bigquery/v2/',
+    'resources': {},
+})
+
+
+class DiscoveryHttp(object):
+    """Serves a discovery document and counts the requests for it."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, uri, *args, **kwargs):
+        self.requests += 1
+        return httplib2.Response({'status': 200}), DISCOVERY_DOC.encode()
+
+
+class FakeCredentials(object):
+    def __init__(self, http):
+        self.http = http
+        self.authorized = []
+
+    def authorize(self, http):
+        self.authorized.append(http)
+        return self.http
+
+
+@pytest.fixture
+def clean_services(request):
+    services.clear()
+    request.addfinalizer(services.clear)
+
+
+def test_disk_cache(tmpdir):
+    cache = services.DiskCache(str(tmpdir.join('cache')))
+
+    assert cache.get('https://example.com/doc') is None
+    cache.set('https://example.com/doc', DISCOVERY_DOC)
+    assert cache.get('https://example.com/doc') == DISCOVERY_DOC
+
+    cache.max_age = -1
+    assert cache.get('https://example.com/doc') is None
+
+
+def test_get_service_memoized(tmpdir, clean_services):
+    http = DiscoveryHttp()
+    credentials = FakeCredentials(http)
+    cache = services.DiskCache(str(tmpdir))
+
+    service = services.get_service('bigquery', 'v2', credentials, cache)
+
+    assert services.get_service('bigquery', 'v2', credentials, cache) is (
+        service)
+    assert http.requests == 1
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    # A new process reads the discovery document from disk.
+    services.clear()
+    assert services.get_service('bigquery', 'v2', credentials, cache) is not (
+        service)
+    assert http.requests == 1
+
+
+def test_services_share_a_thread_safe_transport(tmpdir, clean_services):
+    http = DiscoveryHttp()
+    credentials = FakeCredentials(http)
+    cache = services.DiskCache(str(tmpdir))
+
+    services.get_service('bigquery', 'v2', credentials, cache)
+    services.get_service('storage', 'v1', credentials, cache)
+
+    assert len(credentials.authorized) == 1
+    assert isinstance(
+        credentials.authorized[0], services.ThreadLocalHttp)
+    assert http.requests == 2
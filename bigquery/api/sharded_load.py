@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Loads many Cloud Storage files into a BigQuery table with several jobs.
+
+The source URIs, which may contain wildcards, are expanded into the matching
+objects. The objects are then packed into load jobs that each stay within a
+limit on the number of URIs and bytes, the jobs are submitted concurrently,
+and all of them are waited on together.
+
+Example invocation:
+    $ python sharded_load.py my-project my_dataset my_table schema.json \
+        'gs://mybucket/exports/part-*.csv'
+
+For more information, see the README.md under /bigquery.
+"""
+
+import argparse
+from concurrent import futures
+import json
+import re
+import time
+
+import job_poller
+import load_data_from_csv
+import services
+
+# BigQuery allows up to 10,000 source URIs per load job. The byte limit is
+# kept well below the 15TB allowed per job so that work is spread out over
+# several jobs.
+DEFAULT_MAX_URIS_PER_JOB = 10000
+DEFAULT_MAX_BYTES_PER_JOB = 1024 ** 4
+DEFAULT_NUM_WORKERS = 8
+
+
+def split_uri(uri):
+    """Splits gs://bucket/name into (bucket, name)."""
+    if not uri.startswith('gs://'):
+        raise ValueError('Not a Cloud Storage URI: {}'.format(uri))
+    bucket, _, name = uri[len('gs://'):].partition('/')
+    return bucket, name
+
+
+def expand_uris(storage, uris, num_retries=5):
+    """Returns (uri, size in bytes) for every object the URIs refer to.
+
+    URIs containing a '*' are matched against the objects whose names start
+    with the part of the name before the first '*'. As in the source URIs
+    of a load job, '*' is the only wildcard: it matches any characters, and
+    every other character matches only itself.
+    """
+    objects = []
+    for uri in uris:
+        bucket, name = split_uri(uri)
+
+        if '*' not in name:
+            resource = storage.objects().get(
+                bucket=bucket, object=name,
+                fields='size').execute(num_retries=num_retries)
+            objects.append((uri, int(resource['size'])))
+            continue
+
+        prefix = name.split('*', 1)[0]
+        pattern = re.compile(
+            re.escape(name).replace(r'\*', '.*') + r'\Z', re.DOTALL)
+        req = storage.objects().list(
+            bucket=bucket, prefix=prefix,
+            fields='nextPageToken,items(name,size)')
+        while req:
+            resp = req.execute(num_retries=num_retries)
+            for item in resp.get('items', []):
+                if pattern.match(item['name']):
+                    objects.append((
+                        'gs://{}/{}'.format(bucket, item['name']),
+                        int(item['size'])))
+            req = storage.objects().list_next(req, resp)
+
+    return objects
+
+
+def pack_shards(objects, max_uris=DEFAULT_MAX_URIS_PER_JOB,
+                max_bytes=DEFAULT_MAX_BYTES_PER_JOB):
+    """Groups (uri, size) pairs into lists of URIs, one per load job.
+
+    Each list has at most max_uris URIs totalling at most max_bytes, except
+    that an object larger than max_bytes gets a job of its own.
+    """
+    shards = []
+    shard = []
+    shard_bytes = 0
+
+    for uri, size in objects:
+        if shard and (len(shard) >= max_uris or
+                      shard_bytes + size > max_bytes):
+            shards.append(shard)
+            shard = []
+            shard_bytes = 0
+        shard.append(uri)
+        shard_bytes += size
+
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def summarize(results, seconds):
+    """Totals the load statistics of finished jobs."""
+    summary = {
+        'jobs': len(results),
+        'failed_jobs': 0,
+        'files': 0,
+        'rows': 0,
+        'bytes': 0,
+        'seconds': seconds,
+    }
+    for result in results.values():
+        if result.error:
+            summary['failed_jobs'] += 1
+            continue
+        load = result.job.get('statistics', {}).get('load', {})
+        summary['files'] += int(load.get('inputFiles', 0))
+        summary['rows'] += int(load.get('outputRows', 0))
+        summary['bytes'] += int(load.get('inputFileBytes', 0))
+
+    if seconds:
+        summary['rows_per_second'] = summary['rows'] / seconds
+        summary['megabytes_per_second'] = summary['bytes'] / seconds / 1e6
+    return summary
+
+
+def load_sharded(bigquery, storage, project_id, dataset_id, table_name,
+                 source_schema, source_uris,
+                 max_uris_per_job=DEFAULT_MAX_URIS_PER_JOB,
+                 max_bytes_per_job=DEFAULT_MAX_BYTES_PER_JOB,
+                 num_workers=DEFAULT_NUM_WORKERS, poll_interval=1,
+                 num_retries=5):
+    """Loads the objects matching source_uris into a table.
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object, safe to use from several threads.
+        storage: an initialized and authorized storage
+            google-api-client object.
+        source_schema: a valid bigquery schema,
+            see https://cloud.google.com/bigquery/docs/reference/v2/tables
+        source_uris: Cloud Storage URIs of the data, which may contain
+            wildcards, e.g. gs://mybucket/exports/part-*.csv
+        num_workers: the number of jobs submitted and polled concurrently.
+
+    Returns:
+        A tuple of the summary produced by summarize() and the
+        job_poller.JobResult of every job.
+    """
+    start = time.time()
+    objects = expand_uris(storage, source_uris, num_retries)
+    shards = pack_shards(objects, max_uris_per_job, max_bytes_per_job)
+
+    def submit(shard):
+        return load_data_from_csv.load_table(
+            bigquery, project_id, dataset_id, table_name, source_schema,
+            shard, num_retries)
+
+    with futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        jobs = list(executor.map(submit, shards))
+
+    results = job_poller.wait_all(
+        bigquery, jobs, interval=poll_interval, num_workers=num_workers,
+        num_retries=num_retries)
+
+    return summarize(results, time.time() - start), results
+
+
+def main(project_id, dataset_id, table_name, schema_file, source_uris,
+         max_uris_per_job, max_bytes_per_job, num_workers, poll_interval,
+         num_retries):
+    # Construct the service objects for interacting with the BigQuery and
+    # Cloud Storage APIs, authorized with the application's default
+    # credentials. They share one thread-safe transport.
+    bigquery = services.get_service('bigquery', 'v2')
+    storage = services.get_service('storage', 'v1')
+
+    with open(schema_file, 'r') as f:
+        schema = json.load(f)
+
+    summary, results = load_sharded(
+        bigquery, storage, project_id, dataset_id, table_name, schema,
+        source_uris,
+        max_uris_per_job=max_uris_per_job,
+        max_bytes_per_job=max_bytes_per_job,
+        num_workers=num_workers,
+        poll_interval=poll_interval,
+        num_retries=num_retries)
+
+    job_poller.print_report(results)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_id', help='Your Google Cloud project ID.')
+    parser.add_argument('dataset_id', help='A BigQuery dataset ID.')
+    parser.add_argument(
+        'table_name', help='Name of the table to load data into.')
+    parser.add_argument(
+        'schema_file',
+        help='Path to a schema file describing the table schema.')
+    parser.add_argument(
+        'source_uris', nargs='+',
+        help='Google Cloud Storage paths to the CSV data, which may contain '
+             'wildcards, for example: gs://mybucket/in-*.csv')
+    parser.add_argument(
+        '--max_uris_per_job',
+        help='Most source files loaded by one job.',
+        type=int,
+        default=DEFAULT_MAX_URIS_PER_JOB)
+    parser.add_argument(
+        '--max_bytes_per_job',
+        help='Most bytes loaded by one job.',
+        type=int,
+        default=DEFAULT_MAX_BYTES_PER_JOB)
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of jobs to submit and poll concurrently.',
+        type=int,
+        default=DEFAULT_NUM_WORKERS)
+    parser.add_argument(
+        '-p', '--poll_interval',
+        help='How often to poll the jobs for completion (seconds).',
+        type=int,
+        default=1)
+    parser.add_argument(
+        '-r', '--num_retries',
+        help='Number of times to retry in case of 500 error.',
+        type=int,
+        default=5)
+
+    args = parser.parse_args()
+
+    main(
+        args.project_id,
+        args.dataset_id,
+        args.table_name,
+        args.schema_file,
+        args.source_uris,
+        args.max_uris_per_job,
+        args.max_bytes_per_job,
+        args.num_workers,
+        args.poll_interval,
+        args.num_retries)
@@ -0,0 +1,89 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import fake_bigquery
+import fake_storage
+import sharded_load
+
+BUCKET = 'test-bucket'
+
+
+def make_services(resource, num_shards):
+    with open(resource('data.csv'), 'rb') as data_file:
+        data = data_file.read()
+
+    storage = fake_storage.FakeStorage(page_size=3)
+    for i in range(num_shards):
+        storage.add_object(BUCKET, 'exports/part-{:03d}.csv'.format(i), data)
+    storage.add_object(BUCKET, 'exports/README', b'not data\n')
+    bigquery = fake_bigquery.FakeBigQuery(storage=storage, running_polls=1)
+    return bigquery, storage, data
+
+
+def test_expand_uris(resource):
+    _, storage, data = make_services(resource, 5)
+
+    objects = sharded_load.expand_uris(storage, [
+        'gs://{}/exports/part-*.csv'.format(BUCKET),
+        'gs://{}/exports/README'.format(BUCKET)])
+
+    assert len(objects) == 6
+    assert objects[0] == (
+        'gs://{}/exports/part-000.csv'.format(BUCKET), len(data))
+    assert objects[-1] == ('gs://{}/exports/README'.format(BUCKET), 9)
+
+
+def test_expand_uris_matches_only_star_as_wildcard():
+    storage = fake_storage.FakeStorage()
+    for name in ['logs/[a]?-1.csv', 'logs/a-1.csv', 'logs/[a]x-1.csv']:
+        storage.add_object(BUCKET, name, b'1\n')
+
+    objects = sharded_load.expand_uris(
+        storage, ['gs://{}/logs/[a]?-*.csv'.format(BUCKET)])
+
+    assert objects == [('gs://{}/logs/[a]?-1.csv'.format(BUCKET), 2)]
+
+
+def test_pack_shards():
+    objects = [('gs://b/{}'.format(i), size)
+               for i, size in enumerate([5, 5, 5, 20, 1, 1, 1, 1])]
+
+    shards = sharded_load.pack_shards(objects, max_uris=3, max_bytes=10)
+
+    assert shards == [
+        ['gs://b/0', 'gs://b/1'],
+        ['gs://b/2'],
+        ['gs://b/3'],
+        ['gs://b/4', 'gs://b/5', 'gs://b/6'],
+        ['gs://b/7']]
+
+
+def test_load_sharded(resource):
+    bigquery, storage, data = make_services(resource, 25)
+    with open(resource('schema.json'), 'r') as schema_file:
+        schema = json.load(schema_file)
+
+    summary, results = sharded_load.load_sharded(
+        bigquery, storage, 'test', 'test_dataset', 'test_table', schema,
+        ['gs://{}/exports/part-*.csv'.format(BUCKET)],
+        max_uris_per_job=4, num_workers=4, poll_interval=0.001)
+
+    assert summary['jobs'] == 7
+    assert summary['failed_jobs'] == 0
+    assert summary['files'] == 25
+    assert summary['bytes'] == 25 * len(data)
+    assert summary['rows'] == 25 * data.count(b'\n')
+    assert summary['rows_per_second'] > 0
+    assert len(results) == 7
@@ -25,24 +25,18 @@ For more information, see the README.md under /bigquery.
 import argparse
 import ast
 import json
-import uuid
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+import services
 from six.moves import input
+import streaming_buffer
 
 
 # [START stream_row_to_bigquery]
 def stream_row_to_bigquery(bigquery, project_id, dataset_id, table_name, row,
                            num_retries=5):
-    insert_all_data = {
-        'rows': [{
-            'json': row,
-            # Generate a unique id for each row so retries don't accidentally
-            # duplicate insert
-            'insertId': str(uuid.uuid4()),
-        }]
-    }
+    # Each row gets a unique insertId so retries don't accidentally
+    # duplicate the insert.
+    insert_all_data = streaming_buffer.insert_all_body([row])
     return bigquery.tabledata().insertAll(
         projectId=project_id,
         datasetId=dataset_id,
@@ -52,19 +46,28 @@ def stream_row_to_bigquery(bigquery, project_id, dataset_id, table_name, row,
 
 
 # [START run]
-def main(project_id, dataset_id, table_name, num_retries):
+def main(project_id, dataset_id, table_name, num_retries,
+         num_workers=streaming_buffer.DEFAULT_NUM_WORKERS):
     # [START build_service]
-    # Grab the application's default credentials from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
-    # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials. Its discovery
+    # document is cached on disk, and its thread-safe transport allows
+    # batches to be sent concurrently.
+    bigquery = services.get_service('bigquery', 'v2')
     # [END build_service]
 
-    for row in get_rows():
-        response = stream_row_to_bigquery(
-            bigquery, project_id, dataset_id, table_name, row, num_retries)
-        print(json.dumps(response))
+    # Rather than sending a request per row, collect the rows into batches
+    # and send several batches at a time.
+    with streaming_buffer.StreamingBuffer(
+            bigquery, project_id, dataset_id, table_name,
+            num_workers=num_workers,
+            num_retries=num_retries) as buffer:
+        buffer.insert_all(get_rows())
+
+    print(json.dumps(buffer.stats()))
+    for row, errors in buffer.failed_rows:
+        print('Failed to insert {}: {}'.format(
+            json.dumps(row), json.dumps(errors)))
 
 
 def get_rows():
@@ -95,6 +98,11 @@ if __name__ == '__main__':
         help='Number of times to retry in case of 500 error.',
         type=int,
         default=5)
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of batches to send concurrently.',
+        type=int,
+        default=streaming_buffer.DEFAULT_NUM_WORKERS)
 
     args = parser.parse_args()
 
@@ -102,5 +110,6 @@ if __name__ == '__main__':
         args.project_id,
         args.dataset_id,
         args.table_name,
-        args.num_retries)
+        args.num_retries,
+        args.num_workers)
 # [END main]
@@ -0,0 +1,308 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batches rows streamed into BigQuery.
+
+Sending one tabledata().insertAll request per row spends most of the time
+on request overhead. StreamingBuffer collects rows into batches, bounded by
+row count, size and age, and sends them concurrently from a pool of worker
+threads. Rows that insertAll reports as failed are retried on their own,
+keeping their insertId so that BigQuery can de-duplicate them.
+
+The service object passed in must be safe to use from several threads, for
+example one returned by services.get_service().
+"""
+
+from concurrent import futures
+import json
+import threading
+import time
+import uuid
+
+# Streaming insert quotas recommend around 500 rows per request, and limit
+# each request to 10MB.
+DEFAULT_MAX_ROWS = 500
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_LATENCY = 1.0
+DEFAULT_NUM_WORKERS = 4
+
+# Seconds to wait before the first retry of failed rows. Later retries back
+# off exponentially.
+ROW_RETRY_DELAY = 0.1
+
+# Rows failing with these reasons did not hit a problem of their own, and may
+# succeed when retried.
+RETRYABLE_REASONS = frozenset(
+    ['backendError', 'internalError', 'timeout', 'stopped'])
+
+
+class BatchError(Exception):
+    """Raised when requests to insert batches of rows failed.
+
+    Attributes:
+        rows: the rows of every batch that failed that were not inserted,
+            each a dict of its 'json' data and the 'insertId' it was sent
+            with. Sending them again with the same insertIds lets BigQuery
+            de-duplicate any that a failed request did insert.
+        error: the error of the first batch that failed.
+    """
+
+    def __init__(self, rows, error):
+        super(BatchError, self).__init__(
+            '{} rows not inserted: {}'.format(len(rows), error))
+        self.rows = rows
+        self.error = error
+
+
+def insert_all_body(rows):
+    """Returns the body of an insertAll request that streams rows (dicts of
+    column name to value) into a table."""
+    return {
+        'rows': [{
+            'json': row,
+            # Generate a unique id for each row so retries don't accidentally
+            # duplicate insert
+            'insertId': str(uuid.uuid4()),
+        } for row in rows]
+    }
+
+
+class StreamingBuffer(object):
+    """Collects rows and streams them into a table in batches.
+
+    Use it as a context manager, or call close() when done, so that the last
+    batch is sent:
+
+        with StreamingBuffer(bigquery, project, dataset, table) as buffer:
+            buffer.insert_all(rows)
+
+    Args:
+        bigquery: an initialized and authorized bigquery
+            google-api-client object.
+        max_rows: the most rows sent in one request.
+        max_bytes: the most bytes of JSON encoded rows sent in one request.
+        max_latency: the most seconds a row waits before its batch is sent.
+        num_workers: the number of requests sent concurrently.
+        num_retries: number of times to retry a request in case of 500 error.
+        max_row_retries: number of times to retry the rows that insertAll
+            reported as failed.
+    """
+
+    def __init__(self, bigquery, project_id, dataset_id, table_id,
+                 max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES,
+                 max_latency=DEFAULT_MAX_LATENCY,
+                 num_workers=DEFAULT_NUM_WORKERS, num_retries=5,
+                 max_row_retries=3):
+        self.bigquery = bigquery
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.table_id = table_id
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.num_retries = num_retries
+        self.max_row_retries = max_row_retries
+
+        # Rows that could not be inserted, along with their errors.
+        self.failed_rows = []
+
+        self.rows_inserted = 0
+        self.batches_sent = 0
+        self._batch_seconds = 0.0
+        self._max_batch_seconds = 0.0
+        self._start_time = time.time()
+
+        self._lock = threading.Condition()
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_started = None
+        self._pending = set()
+        # Errors that stopped batches from being sent, with their rows.
+        self._errors = []
+        self._closed = False
+
+        self._executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+        # Don't let more batches queue up than the workers can send at once.
+        self._slots = threading.Semaphore(2 * num_workers)
+
+        self._flusher = threading.Thread(target=self._flush_when_stale)
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def insert(self, row, insert_id=None):
+        """Adds a row (a dict of column name to value) to the buffer."""
+        entry, = insert_all_body([row])['rows']
+        if insert_id:
+            entry['insertId'] = insert_id
+        size = len(json.dumps(entry))
+
+        with self._lock:
+            if self._closed:
+                raise ValueError('Cannot insert into a closed buffer.')
+
+            if self._batch and self._batch_bytes + size > self.max_bytes:
+                self._send_batch()
+
+            if not self._batch:
+                self._batch_started = time.time()
+                self._lock.notify()
+            self._batch.append(entry)
+            self._batch_bytes += size
+
+            if len(self._batch) >= self.max_rows:
+                self._send_batch()
+
+    def insert_all(self, rows):
+        """Adds every row of an iterable, such as streaming.get_rows()."""
+        for row in rows:
+            self.insert(row)
+
+    def flush(self):
+        """Sends any buffered rows and waits for every batch to finish.
+
+        Raises:
+            BatchError: if a request failed, even after retries, leaving
+                its rows uninserted. The error's rows can be inserted again
+                with their insertIds, for example with
+                insert(row['json'], row['insertId']).
+        """
+        with self._lock:
+            if self._batch:
+                self._send_batch()
+            pending = list(self._pending)
+
+        futures.wait(pending)
+
+        # Re-raise the first error that stopped a batch from being sent.
+        with self._lock:
+            errors = self._errors
+            self._errors = []
+        if errors:
+            raise BatchError(
+                [row for _, rows in errors for row in rows], errors[0][0])
+
+    def close(self):
+        """Flushes the buffer and stops its worker threads."""
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._closed = True
+                self._lock.notify()
+            self._flusher.join()
+            self._executor.shutdown()
+
+    def stats(self):
+        """Returns counters describing the throughput of the buffer."""
+        with self._lock:
+            elapsed = time.time() - self._start_time
+            return {
+                'rows_inserted': self.rows_inserted,
+                'rows_failed': len(self.failed_rows),
+                'batches_sent': self.batches_sent,
+                'rows_per_second': (
+                    self.rows_inserted / elapsed if elapsed else 0.0),
+                'mean_batch_seconds': (
+                    self._batch_seconds / self.batches_sent
+                    if self.batches_sent else 0.0),
+                'max_batch_seconds': self._max_batch_seconds,
+            }
+
+    def _send_batch(self):
+        """Hands the current batch to the workers. Holds self._lock."""
+        batch = self._batch
+        self._batch = []
+        self._batch_bytes = 0
+        self._batch_started = None
+
+        # Wait for a free slot without holding the lock, so that finishing
+        # batches can update the counters.
+        self._lock.release()
+        try:
+            self._slots.acquire()
+        finally:
+            self._lock.acquire()
+
+        future = self._executor.submit(self._insert_batch, batch)
+        self._pending.add(future)
+        future.add_done_callback(self._batch_done)
+
+    def _batch_done(self, future):
+        self._slots.release()
+        with self._lock:
+            self._pending.discard(future)
+
+    def _flush_when_stale(self):
+        """Sends the current batch once its oldest row is max_latency old."""
+        with self._lock:
+            while not self._closed:
+                if self._batch_started is None:
+                    self._lock.wait()
+                    continue
+
+                age = time.time() - self._batch_started
+                if age >= self.max_latency:
+                    self._send_batch()
+                else:
+                    self._lock.wait(self.max_latency - age)
+
+    def _insert_batch(self, rows):
+        start = time.time()
+        attempt = 0
+
+        while rows:
+            try:
+                response = self.bigquery.tabledata().insertAll(
+                    projectId=self.project_id,
+                    datasetId=self.dataset_id,
+                    tableId=self.table_id,
+                    body={'rows': rows}).execute(num_retries=self.num_retries)
+            except Exception as error:
+                # Only the rows of this attempt are left to insert; earlier
+                # attempts inserted the rest or recorded them as failed.
+                with self._lock:
+                    self._errors.append((error, rows))
+                return
+
+            retry_rows = []
+            failed_rows = []
+            for error in response.get('insertErrors', []):
+                row = rows[error['index']]
+                reasons = set(e.get('reason') for e in error['errors'])
+                if (reasons <= RETRYABLE_REASONS and
+                        attempt < self.max_row_retries):
+                    retry_rows.append(row)
+                else:
+                    failed_rows.append((row['json'], error['errors']))
+
+            with self._lock:
+                self.rows_inserted += (
+                    len(rows) - len(retry_rows) - len(failed_rows))
+                self.failed_rows.extend(failed_rows)
+
+            rows = retry_rows
+            attempt += 1
+            if rows:
+                time.sleep(ROW_RETRY_DELAY * 2 ** (attempt - 1))
+
+        elapsed = time.time() - start
+        with self._lock:
+            self.batches_sent += 1
+            self._batch_seconds += elapsed
+            self._max_batch_seconds = max(self._max_batch_seconds, elapsed)
@@ -0,0 +1,150 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+
+import fake_bigquery
+from googleapiclient import errors
+import httplib2
+import pytest
+import streaming_buffer
+
+PROJECT_ID = 'test'
+DATASET_ID = 'test_dataset'
+TABLE_ID = 'test_table'
+
+
+def make_buffer(bigquery, **kwargs):
+    return streaming_buffer.StreamingBuffer(
+        bigquery, PROJECT_ID, DATASET_ID, TABLE_ID, **kwargs)
+
+
+def test_batches_by_row_count(resource):
+    with open(resource('streamrows.json'), 'r') as rows_file:
+        rows = json.load(rows_file)
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    with make_buffer(bigquery, max_rows=2) as buffer:
+        buffer.insert_all(rows)
+
+    table = bigquery.table_rows(PROJECT_ID, DATASET_ID, TABLE_ID)
+    assert sorted(table.values(), key=lambda r: r['Age']) == \
+        sorted(rows, key=lambda r: r['Age'])
+    assert bigquery.request_count == 3
+    stats = buffer.stats()
+    assert stats['rows_inserted'] == 5
+    assert stats['batches_sent'] == 3
+
+
+def test_batches_by_size():
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    with make_buffer(bigquery, max_bytes=200) as buffer:
+        for i in range(10):
+            buffer.insert({'payload': 'x' * 50})
+
+    assert len(bigquery.table_rows(PROJECT_ID, DATASET_ID, TABLE_ID)) == 10
+    assert bigquery.request_count > 1
+
+
+def test_flushes_after_max_latency():
+    bigquery = fake_bigquery.FakeBigQuery()
+    buffer = make_buffer(bigquery, max_latency=0.05)
+
+    buffer.insert({'n': 1})
+    deadline = time.time() + 5
+    while bigquery.request_count == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    buffer.close()
+
+    assert bigquery.request_count == 1
+    assert buffer.stats()['rows_inserted'] == 1
+
+
+def test_retries_only_failed_rows(monkeypatch):
+    monkeypatch.setattr(streaming_buffer, 'ROW_RETRY_DELAY', 0)
+    bigquery = fake_bigquery.FakeBigQuery()
+    bigquery.fail_insert('bad', reason='invalid')
+    bigquery.fail_insert('flaky', reason='backendError', times=2)
+
+    with make_buffer(bigquery) as buffer:
+        buffer.insert({'n': 1}, insert_id='ok')
+        buffer.insert({'n': 2}, insert_id='bad')
+        buffer.insert({'n': 3}, insert_id='flaky')
+
+    table = bigquery.table_rows(PROJECT_ID, DATASET_ID, TABLE_ID)
+    assert sorted(table) == ['flaky', 'ok']
+    assert buffer.rows_inserted == 2
+    assert len(buffer.failed_rows) == 1
+    row, errors = buffer.failed_rows[0]
+    assert row == {'n': 2}
+    assert errors[0]['reason'] == 'invalid'
+
+
+def test_close_raises_failed_batches(monkeypatch):
+    bigquery = fake_bigquery.FakeBigQuery()
+
+    def insert_rows(*args):
+        raise errors.HttpError(httplib2.Response({'status': 503}), b'')
+
+    monkeypatch.setattr(bigquery, 'insert_rows', insert_rows)
+    buffer = make_buffer(bigquery, max_rows=2)
+    buffer.insert_all({'n': n} for n in range(3))
+
+    with pytest.raises(streaming_buffer.BatchError) as excinfo:
+        buffer.close()
+
+    assert sorted(row['json']['n'] for row in excinfo.value.rows) == [0, 1, 2]
+    assert all(row['insertId'] for row in excinfo.value.rows)
+    assert isinstance(excinfo.value.error, errors.HttpError)
+    assert buffer.rows_inserted == 0
+    # The buffer was closed all the same.
+    with pytest.raises(ValueError):
+        buffer.insert({'n': 3})
+
+
+def test_insert_after_close_fails():
+    buffer = make_buffer(fake_bigquery.FakeBigQuery())
+    buffer.close()
+
+    with pytest.raises(ValueError):
+        buffer.insert({'n': 1})
+
+
+def test_batch_error_keeps_insert_ids_of_rows_left(monkeypatch):
+    monkeypatch.setattr(streaming_buffer, 'ROW_RETRY_DELAY', 0)
+    bigquery = fake_bigquery.FakeBigQuery()
+    calls = []
+
+    def insert_rows(project_id, dataset_id, table_id, rows):
+        calls.append(rows)
+        if len(calls) > 1:
+            raise errors.HttpError(httplib2.Response({'status': 503}), b'')
+        # The first request inserts every row but the flaky one.
+        table = bigquery.table_rows(project_id, dataset_id, table_id)
+        for row in rows:
+            if row['insertId'] != 'flaky':
+                table[row['insertId']] = row['json']
+        return [{'index': 1, 'errors': [{'reason': 'backendError'}]}]
+
+    monkeypatch.setattr(bigquery, 'insert_rows', insert_rows)
+    buffer = make_buffer(bigquery)
+    buffer.insert({'n': 0}, insert_id='ok')
+    buffer.insert({'n': 1}, insert_id='flaky')
+
+    with pytest.raises(streaming_buffer.BatchError) as excinfo:
+        buffer.close()
+
+    assert excinfo.value.rows == [{'json': {'n': 1}, 'insertId': 'flaky'}]
+    assert buffer.rows_inserted == 1
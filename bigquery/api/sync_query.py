@@ -24,9 +24,12 @@ For more information, see the README.md under /bigquery.
 
 import argparse
 import json
+import sys
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+import query_cache
+import query_profiler
+import query_results
+import services
 
 
 # [START sync_query]
@@ -42,40 +45,74 @@ def sync_query(bigquery, project_id, query, timeout=10000, num_retries=5):
 
 
 # [START run]
-def main(project_id, query, timeout, num_retries):
+def main(project_id, query, timeout, num_retries,
+         num_workers=query_results.DEFAULT_NUM_WORKERS, cache_path=None,
+         profile_path=None):
     # [START build_service]
-    # Grab the application's default credentials from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
-    # Construct the service object for interacting with the BigQuery API.
-    bigquery = discovery.build('bigquery', 'v2', credentials=credentials)
+    # Construct the service object for interacting with the BigQuery API,
+    # authorized with the application's default credentials. Its discovery
+    # document is cached on disk, and its thread-safe transport allows
+    # result pages to be fetched concurrently.
+    bigquery = services.get_service('bigquery', 'v2')
     # [END build_service]
 
-    query_job = sync_query(
-        bigquery,
-        project_id,
-        query,
-        timeout,
-        num_retries)
-
-    # [START paging]
-    # Page through the result set and print all results.
-    results = []
-    page_token = None
-
-    while True:
-        page = bigquery.jobs().getQueryResults(
-            pageToken=page_token,
-            **query_job['jobReference']).execute(num_retries=2)
-
-        results.extend(page.get('rows', []))
-
-        page_token = page.get('pageToken')
-        if not page_token:
-            break
-
-    print(json.dumps(results))
-    # [END paging]
+    # Serve the query from the local cache if it holds a result that is
+    # still valid.
+    cache = query_cache.QueryCache(cache_path) if cache_path else None
+    rows = cache.get(
+        bigquery, project_id, query, num_retries) if cache else None
+
+    # Optionally estimate the cost of the query before running it, and
+    # record its cost and latency afterwards.
+    profiler = query_profiler.Profiler(profile_path) if profile_path else None
+    query_job = None
+
+    try:
+        if rows is None:
+            estimated_bytes = None
+            if profiler:
+                estimated_bytes = profiler.preflight(
+                    bigquery, project_id, query, num_retries)
+                sys.stderr.write('Query will process {} bytes.\n'.format(
+                    estimated_bytes))
+
+            query_job = sync_query(
+                bigquery,
+                project_id,
+                query,
+                timeout,
+                num_retries)
+
+            # [START paging]
+            # Page through the result set, fetching several pages at a time,
+            # and print each row as a line of JSON as soon as it arrives.
+            rows = query_results.iter_rows(
+                bigquery,
+                query_job['jobReference'],
+                first_page=query_job,
+                num_workers=num_workers,
+                num_retries=num_retries)
+            # [END paging]
+
+            if cache:
+                rows = cache.cache_rows(
+                    bigquery, query, query_job['jobReference'], rows,
+                    num_retries)
+
+        try:
+            query_results.write_ndjson(rows)
+        finally:
+            # The job is recorded even if reading its results failed.
+            if profiler and query_job:
+                profiler.record_job(
+                    bigquery, query, query_job['jobReference'],
+                    estimated_bytes, num_retries)
+    finally:
+        if cache:
+            sys.stderr.write(json.dumps(cache.stats()) + '\n')
+            cache.close()
+        if profiler:
+            profiler.close()
 # [END run]
 
 
@@ -96,6 +133,18 @@ if __name__ == '__main__':
         help='Number of times to retry in case of 500 error.',
         type=int,
         default=5)
+    parser.add_argument(
+        '-w', '--num_workers',
+        help='Number of result pages to fetch concurrently.',
+        type=int,
+        default=query_results.DEFAULT_NUM_WORKERS)
+    parser.add_argument(
+        '-c', '--cache',
+        help='Path to a local cache of query results to read and update.')
+    parser.add_argument(
+        '--profile',
+        help='Path to a file to record the cost and latency of the query '
+             'in. See query_profiler.py.')
 
     args = parser.parse_args()
 
@@ -103,6 +152,9 @@ if __name__ == '__main__':
         args.project_id,
         args.query,
         args.timeout,
-        args.num_retries)
+        args.num_retries,
+        args.num_workers,
+        args.cache,
+        args.profile)
 
 # [END main]
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command-line sample that writes many Cloud Datastore entities at once.
+
+put_multi() and delete_multi() send all their entities in one commit, and a
+commit holds at most MAX_MUTATIONS mutations. A BulkWriter takes any number
+of entities or keys, from an iterator, and:
+
+* commits them in batches of up to MAX_MUTATIONS;
+* runs up to `num_workers` commits at once;
+* sends every entity of an entity group, the entities with the same root
+  ancestor, through the same worker, one commit after another, because
+  concurrent commits to one entity group fail with contention errors;
+* allocates IDs for entities whose keys have none before committing them,
+  so that a retried commit overwrites what an earlier attempt may have
+  written rather than inserting the entities again;
+* retries commits that fail with contention or server errors, waiting
+  longer after each attempt; and
+* reports the entities written per second.
+
+This sample writes generated tasks, spread over a number of task lists.
+
+Example invocation:
+    $ python bulk_writer.py --project-id my-project --count 100000 \\
+        --task-lists 100
+"""
+
+import argparse
+import collections
+from concurrent import futures
+import datetime
+import itertools
+import random
+import sys
+import threading
+import time
+
+from gcloud import datastore
+from gcloud import exceptions
+from gcloud.credentials import get_credentials
+from gcloud.datastore.connection import Connection
+import services
+
+# The most mutations in one commit.
+MAX_MUTATIONS = 500
+DEFAULT_NUM_WORKERS = 16
+DEFAULT_NUM_RETRIES = 8
+# Contention, throttling and server errors are worth retrying.
+RETRYABLE_ERRORS = (
+    exceptions.Conflict, exceptions.TooManyRequests, exceptions.ServerError)
+
+
+def create_client(project_id):
+    """Returns a client that can be used from several threads at once."""
+    credentials = get_credentials()
+    if credentials.create_scoped_required():
+        credentials = credentials.create_scoped(Connection.SCOPE)
+    return datastore.Client(
+        project_id, http=services.authorized_http(credentials))
+
+
+def entity_group(key):
+    """Returns the namespace and root ancestor of a key, which identify its
+    entity group, or None for a root key without an ID yet."""
+    root = key.flat_path[:2]
+    if len(root) < 2:
+        return None
+    return key.namespace, root
+
+
+class WriteStats(object):
+    """Counts the entities written, safely across threads."""
+
+    def __init__(self):
+        self.entities_written = 0
+        self.commits = 0
+        self.retries = 0
+        self.failures = []
+        self.start = time.time()
+        self.end = None
+        self._lock = threading.Lock()
+
+    def record(self, count):
+        with self._lock:
+            self.entities_written += count
+            self.commits += 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self, items, error):
+        with self._lock:
+            self.failures.append((items, error))
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def entities_per_second(self):
+        return self.entities_written / self.elapsed if self.elapsed else 0.0
+
+    def report(self):
+        return (
+            '{} entities written in {} commits, {} commits failed, '
+            '{} retries, {:.1f} entities/s, {} elapsed'.format(
+                self.entities_written, self.commits, len(self.failures),
+                self.retries, self.entities_per_second,
+                datetime.timedelta(seconds=int(self.elapsed))))
+
+
+class BulkWriter(object):
+    """Writes or deletes entities in concurrent commits.
+
+    Args:
+        client: a datastore.Client that is safe to use from several
+            threads, such as one from create_client().
+        num_workers: the most commits run at once.
+        batch_size: the most mutations in one commit.
+        num_retries: number of times to retry a commit that failed with
+            contention or a server error.
+        interval: the initial number of seconds to wait before retrying.
+    """
+
+    def __init__(self, client, num_workers=DEFAULT_NUM_WORKERS,
+                 batch_size=MAX_MUTATIONS, num_retries=DEFAULT_NUM_RETRIES,
+                 interval=1):
+        self.client = client
+        self.num_workers = num_workers
+        self.batch_size = min(batch_size, MAX_MUTATIONS)
+        self.num_retries = num_retries
+        self.interval = interval
+
+    def put(self, entities, progress=None, progress_interval=10):
+        """Upserts the entities, completing their keys if they have no IDs.
+
+        Args:
+            entities: an iterable of datastore.Entity.
+            progress: a file to write a report to every `progress_interval`
+                seconds, if any.
+
+        Returns:
+            A WriteStats; commits that failed are in its failures, with
+            their entities, not raised.
+        """
+        return self._run(
+            'put', entities, lambda entity: entity.key, progress,
+            progress_interval)
+
+    def delete(self, keys, progress=None, progress_interval=10):
+        """Deletes the entities with the keys, like put() does."""
+        return self._run(
+            'delete', keys, lambda key: key, progress, progress_interval)
+
+    def _run(self, operation, items, key_of, progress, progress_interval):
+        stats = WriteStats()
+        # Each worker has a lane, which commits one batch at a time.
+        lanes = [[] for _ in range(self.num_workers)]
+        pending = [None] * self.num_workers
+        round_robin = itertools.cycle(range(self.num_workers))
+        last_report = time.time()
+
+        executor = futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        try:
+            for item in items:
+                group = entity_group(key_of(item))
+                lane = next(round_robin) if group is None else (
+                    hash(group) % self.num_workers)
+                lanes[lane].append(item)
+                if len(lanes[lane]) >= self.batch_size:
+                    pending[lane] = self._submit(
+                        executor, pending[lane], operation, lanes[lane],
+                        stats)
+                    lanes[lane] = []
+                if progress and time.time() - last_report >= (
+                        progress_interval):
+                    last_report = time.time()
+                    progress.write(stats.report() + '\n')
+
+            for lane, batch in enumerate(lanes):
+                if batch:
+                    self._submit(
+                        executor, pending[lane], operation, batch, stats)
+        finally:
+            executor.shutdown()
+            stats.end = time.time()
+        return stats
+
+    def _submit(self, executor, previous, operation, items, stats):
+        """Commits a batch once the lane's previous commit is done, which
+        keeps an entity group's commits apart and bounds those queued."""
+        if previous is not None:
+            previous.result()
+        return executor.submit(self._commit, operation, items, stats)
+
+    def _complete_keys(self, entities):
+        """Gives the entities with partial keys IDs allocated for them."""
+        # Partial keys never compare equal, so group them by their paths.
+        partial = collections.OrderedDict()
+        for entity in entities:
+            key = entity.key
+            if key.is_partial:
+                partial.setdefault(
+                    (key.namespace, key.flat_path), []).append(entity)
+        for group in partial.values():
+            allocated = self.client.allocate_ids(group[0].key, len(group))
+            for entity, key in zip(group, allocated):
+                entity.key = key
+
+    def _commit(self, operation, items, stats):
+        for attempt in range(self.num_retries + 1):
+            try:
+                if operation == 'put':
+                    # A commit that failed may have been applied all the
+                    # same, and a partial key would be inserted again.
+                    self._complete_keys(items)
+                batch = self.client.batch()
+                for item in items:
+                    getattr(batch, operation)(item)
+                batch.commit()
+            except RETRYABLE_ERRORS as error:
+                if attempt == self.num_retries:
+                    stats.record_failure(items, error)
+                    return
+                stats.record_retry()
+                time.sleep(
+                    self.interval * 2 ** attempt * random.uniform(0.5, 1.5))
+            except Exception as error:
+                stats.record_failure(items, error)
+                return
+            else:
+                stats.record(len(items))
+                return
+
+
+def generate_tasks(client, count, task_lists):
+    """Yields `count` tasks, spread over `task_lists` task lists, or with
+    no parent if task_lists is 0."""
+    created = datetime.datetime.utcnow()
+    for index in range(count):
+        if task_lists:
+            key = client.key(
+                'TaskList', 'list-{}'.format(index % task_lists), 'Task')
+        else:
+            key = client.key('Task')
+        task = datastore.Entity(key, exclude_from_indexes=['description'])
+        task.update({
+            'created': created,
+            'description': 'Generated task {}'.format(index),
+            'done': False,
+            'priority': index % 10,
+        })
+        yield task
+
+
+def main(project_id, count, task_lists, num_workers=DEFAULT_NUM_WORKERS):
+    client = create_client(project_id)
+    writer = BulkWriter(client, num_workers)
+    stats = writer.put(
+        generate_tasks(client, count, task_lists), progress=sys.stderr)
+
+    for entities, error in stats.failures:
+        print('Failed to write {} entities: {}'.format(len(entities), error))
+    print(stats.report())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--project-id', help='Your cloud project ID.')
+    parser.add_argument(
+        '--count', type=int, default=10000,
+        help='The number of tasks to write.')
+    parser.add_argument(
+        '--task-lists', type=int, default=100,
+        help='The number of task lists to spread the tasks over, each an '
+             'entity group. With 0, each task is its own entity group.')
+    parser.add_argument(
+        '-w', '--num-workers', type=int, default=DEFAULT_NUM_WORKERS,
+        help='The most commits to run at once.')
+
+    args = parser.parse_args()
+
+    main(args.project_id, args.count, args.task_lists, args.num_workers)
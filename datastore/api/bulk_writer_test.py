@@ -0,0 +1,149 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import bulk_writer
+import fake_datastore
+from gcloud import datastore
+from gcloud import exceptions
+import pytest
+
+
+def make_client(fake):
+    return datastore.Client('project', http=fake)
+
+
+def test_put_keeps_entity_groups_apart():
+    fake = fake_datastore.FakeDatastore(latency=0.005)
+    client = make_client(fake)
+    writer = bulk_writer.BulkWriter(client, num_workers=8, batch_size=50)
+
+    stats = writer.put(bulk_writer.generate_tasks(client, 2000, 10))
+
+    assert stats.entities_written == 2000
+    assert stats.commits == 40
+    assert not stats.failures
+    # Each task list is committed to by one worker at a time.
+    assert fake.conflicts == 0
+    assert len(fake.entities()) == 2000
+    assert stats.report().startswith(
+        '2000 entities written in 40 commits, 0 commits failed, 0 retries')
+
+
+def test_concurrent_commits_to_one_entity_group_conflict():
+    fake = fake_datastore.FakeDatastore(latency=0.05)
+    client = make_client(fake)
+    errors = []
+
+    def put(index):
+        task = datastore.Entity(client.key('TaskList', 'default', 'Task'))
+        task['index'] = index
+        try:
+            client.put(task)
+        except exceptions.Conflict as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=put, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors
+    assert fake.conflicts == len(errors)
+
+
+def test_put_retries_contention():
+    fake = fake_datastore.FakeDatastore()
+    fake.inject(409, 'commit', times=3)
+    client = make_client(fake)
+    writer = bulk_writer.BulkWriter(client, num_workers=2, interval=0.001)
+
+    stats = writer.put(bulk_writer.generate_tasks(client, 100, 0))
+
+    assert stats.entities_written == 100
+    assert stats.retries == 3
+    assert not stats.failures
+    # The tasks' keys were completed.
+    assert all(key[0][1] for key in fake.entities())
+
+
+def test_put_retries_are_idempotent(monkeypatch):
+    fake = fake_datastore.FakeDatastore()
+    client = make_client(fake)
+    writer = bulk_writer.BulkWriter(client, num_workers=2, interval=0.001)
+    apply_mutations = fake._apply
+    lost = [True]
+
+    def apply_and_lose_response(mutations):
+        response = apply_mutations(mutations)
+        if lost.pop() if lost else False:
+            raise fake_datastore.DatastoreError(503, 'Response lost.')
+        return response
+
+    monkeypatch.setattr(fake, '_apply', apply_and_lose_response)
+
+    stats = writer.put(bulk_writer.generate_tasks(client, 100, 0))
+
+    assert stats.retries == 1
+    assert stats.entities_written == 100
+    # The retried commit wrote the same keys again, not new entities.
+    assert len(fake.entities()) == 100
+
+
+def test_put_records_failures():
+    fake = fake_datastore.FakeDatastore()
+    client = make_client(fake)
+    writer = bulk_writer.BulkWriter(
+        client, num_workers=1, batch_size=10, num_retries=2, interval=0.001)
+    fake.inject(503, 'commit', times=3)
+
+    stats = writer.put(bulk_writer.generate_tasks(client, 30, 1))
+
+    [(entities, error)] = stats.failures
+    assert len(entities) == 10
+    assert isinstance(error, exceptions.ServiceUnavailable)
+    assert stats.entities_written == 20
+
+
+def test_delete():
+    fake = fake_datastore.FakeDatastore()
+    client = make_client(fake)
+    tasks = list(bulk_writer.generate_tasks(client, 1200, 3))
+    writer = bulk_writer.BulkWriter(client, num_workers=4)
+    writer.put(tasks)
+    assert len(fake.entities()) == 1200
+
+    stats = writer.delete(task.key for task in tasks)
+
+    assert stats.entities_written == 1200
+    assert not fake.entities()
+
+
+def test_batch_size_is_capped():
+    writer = bulk_writer.BulkWriter(None, batch_size=1000)
+    assert writer.batch_size == bulk_writer.MAX_MUTATIONS
+
+
+@pytest.mark.parametrize('task_lists', [0, 5])
+def test_main(monkeypatch, capsys, task_lists):
+    fake = fake_datastore.FakeDatastore()
+    monkeypatch.setattr(
+        bulk_writer, 'create_client', lambda project_id: make_client(fake))
+
+    bulk_writer.main('project', 700, task_lists, num_workers=4)
+
+    out, _ = capsys.readouterr()
+    assert out.startswith('700 entities written in ')
+    assert len(fake.entities()) == 700
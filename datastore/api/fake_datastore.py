@@ -0,0 +1,365 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the Cloud Datastore API.
+
+FakeDatastore answers the protocol buffer requests of a datastore.Client in
+place of httplib2.Http, keeping entities in memory, so that the samples can
+be tested without a project or network access:
+
+    client = datastore.Client('project', http=FakeDatastore())
+
+Every request takes `latency` seconds. Like the real service, a commit
+fails with a contention error, 409 ABORTED, if another commit to the same
+entity group is in progress. FakeDatastore.inject() makes chosen requests
+fail with an error status.
+
+Queries support kinds, ancestors, filters and sort orders, including on
+__key__ and on __scatter__, the property that the service sets on a random
+sample of entities. Keys-only queries return only keys, and results come in
+batches with cursors. Cursors are positions in the results, so they only
+hold while the entities don't change.
+"""
+
+import hashlib
+import operator
+import threading
+import time
+
+from gcloud.datastore import helpers
+from gcloud.datastore._generated import datastore_pb2
+from gcloud.datastore._generated import query_pb2
+from gcloud.datastore.key import Key
+from google.rpc import code_pb2
+from google.rpc import status_pb2
+import httplib2
+import six
+
+_CODES = {
+    409: code_pb2.ABORTED,
+    429: code_pb2.RESOURCE_EXHAUSTED,
+    500: code_pb2.INTERNAL,
+    503: code_pb2.UNAVAILABLE,
+}
+
+
+_COMPARISONS = {
+    query_pb2.PropertyFilter.EQUAL: operator.eq,
+    query_pb2.PropertyFilter.LESS_THAN: operator.lt,
+    query_pb2.PropertyFilter.LESS_THAN_OR_EQUAL: operator.le,
+    query_pb2.PropertyFilter.GREATER_THAN: operator.gt,
+    query_pb2.PropertyFilter.GREATER_THAN_OR_EQUAL: operator.ge,
+}
+
+# Stands for a property that an entity doesn't have.
+_MISSING = object()
+
+
+class DatastoreError(Exception):
+    def __init__(self, status, message):
+        super(DatastoreError, self).__init__(message)
+        self.status = status
+
+
+def path_of(key_pb):
+    """Returns a key's path as a tuple of (kind, id or name) pairs."""
+    return tuple(
+        (element.kind, element.name or element.id)
+        for element in key_pb.path)
+
+
+def key_order(path):
+    """Returns what sorts key paths in the order of the service: by kind,
+    then IDs before names."""
+    return tuple(
+        (kind, isinstance(id_or_name, six.string_types), id_or_name)
+        for kind, id_or_name in path)
+
+
+def _property_filters(filter_pb):
+    """Returns the property filters of a filter, which are all ANDed."""
+    if filter_pb.HasField('composite_filter'):
+        return [
+            property_filter
+            for child in filter_pb.composite_filter.filters
+            for property_filter in _property_filters(child)]
+    if filter_pb.HasField('property_filter'):
+        return [filter_pb.property_filter]
+    return []
+
+
+def _comparable(value):
+    if isinstance(value, Key):
+        return key_order(path_of(value.to_protobuf()))
+    return value
+
+
+class FakeDatastore(object):
+    """Serves the Datastore API out of memory.
+
+    Args:
+        latency: seconds each request takes.
+        scatter_every: about one in this many entities has a __scatter__
+            property, as on the real service.
+        batch_size: the most entities a query returns at once.
+    """
+
+    def __init__(self, latency=0.0, scatter_every=512, batch_size=300):
+        self.latency = latency
+        self.scatter_every = scatter_every
+        self.batch_size = batch_size
+        self.request_count = 0
+        self.commit_count = 0
+        self.conflicts = 0
+        self._lock = threading.Lock()
+        self._entities = {}
+        self._busy_groups = set()
+        self._next_id = 1
+        self._faults = []
+
+    def inject(self, status, method=None, after=0, times=1):
+        """Makes requests fail with an error status.
+
+        Args:
+            status: the status, such as 409 or 503.
+            method: the RPC, such as 'commit', or None for any.
+            after: the number of matching requests to serve first.
+            times: the number of matching requests to fail after those.
+        """
+        with self._lock:
+            self._faults.append([status, method, after, times])
+
+    def entities(self, namespace=''):
+        """Returns the stored entity protobufs, keyed by path."""
+        with self._lock:
+            return dict(
+                (path, entity) for (entity_namespace, path), entity
+                in self._entities.items() if entity_namespace == namespace)
+
+    def request(self, uri, method='POST', body=None, headers=None,
+                redirections=5, connection_type=None):
+        rpc = uri.rsplit(':', 1)[1]
+        try:
+            self._take_fault(rpc)
+            handler = getattr(self, '_' + rpc, None)
+            if handler is None:
+                raise DatastoreError(501, 'Not implemented: ' + rpc)
+            content = handler(body).SerializeToString()
+            status = 200
+        except DatastoreError as error:
+            status = error.status
+            content = status_pb2.Status(
+                code=_CODES.get(status, code_pb2.UNKNOWN),
+                message=str(error)).SerializeToString()
+        if self.latency:
+            time.sleep(self.latency)
+        return httplib2.Response({
+            'status': str(status),
+            'content-type': 'application/x-protobuf',
+        }), content
+
+    def _take_fault(self, rpc):
+        with self._lock:
+            self.request_count += 1
+            for fault in self._faults:
+                status, method, after, times = fault
+                if method not in (None, rpc):
+                    continue
+                if after:
+                    fault[2] -= 1
+                elif times:
+                    fault[3] -= 1
+                    raise DatastoreError(status, 'Injected error.')
+
+    def _allocate_id(self, key_pb):
+        """Completes an incomplete key. Call with the lock held."""
+        key_pb.path[-1].id = self._next_id
+        self._next_id += 1
+
+    def _commit(self, body):
+        request = datastore_pb2.CommitRequest.FromString(body)
+        mutations = []
+        groups = set()
+        for mutation in request.mutations:
+            operation = mutation.WhichOneof('operation')
+            key_pb = (
+                mutation.delete if operation == 'delete'
+                else getattr(mutation, operation).key)
+            mutations.append((operation, mutation, key_pb))
+            root = key_pb.path[0]
+            if root.id or root.name:
+                groups.add((key_pb.partition_id.namespace_id,
+                            path_of(key_pb)[0]))
+
+        with self._lock:
+            self.commit_count += 1
+            if groups & self._busy_groups:
+                self.conflicts += 1
+                raise DatastoreError(
+                    409, 'too much contention on these datastore entities. '
+                    'please try again.')
+            self._busy_groups.update(groups)
+        try:
+            # The commit holds its entity groups while it takes place.
+            if self.latency:
+                time.sleep(self.latency)
+            with self._lock:
+                return self._apply(mutations)
+        finally:
+            with self._lock:
+                self._busy_groups.difference_update(groups)
+
+    def _apply(self, mutations):
+        """Applies a commit's mutations. Call with the lock held."""
+        response = datastore_pb2.CommitResponse()
+        for operation, mutation, key_pb in mutations:
+            result = response.mutation_results.add()
+            if operation == 'delete':
+                self._entities.pop(
+                    (key_pb.partition_id.namespace_id, path_of(key_pb)), None)
+                continue
+
+            entity = getattr(mutation, operation)
+            if not (entity.key.path[-1].id or entity.key.path[-1].name):
+                self._allocate_id(entity.key)
+                result.key.CopyFrom(entity.key)
+            stored = type(entity)()
+            stored.CopyFrom(entity)
+            self._entities[(entity.key.partition_id.namespace_id,
+                            path_of(entity.key))] = stored
+        return response
+
+    def _lookup(self, body):
+        request = datastore_pb2.LookupRequest.FromString(body)
+        response = datastore_pb2.LookupResponse()
+        with self._lock:
+            for key_pb in request.keys:
+                entity = self._entities.get(
+                    (key_pb.partition_id.namespace_id, path_of(key_pb)))
+                if entity is None:
+                    response.missing.add().entity.key.CopyFrom(key_pb)
+                else:
+                    response.found.add().entity.CopyFrom(entity)
+        return response
+
+    def _allocateIds(self, body):
+        request = datastore_pb2.AllocateIdsRequest.FromString(body)
+        response = datastore_pb2.AllocateIdsResponse()
+        with self._lock:
+            for key_pb in request.keys:
+                key = response.keys.add()
+                key.CopyFrom(key_pb)
+                self._allocate_id(key)
+        return response
+
+    def _value(self, path, entity, name):
+        """Returns an entity's property, in a form that sorts like it does
+        on the service."""
+        if name == '__key__':
+            return key_order(path)
+        if name == '__scatter__':
+            digest = int(
+                hashlib.md5(repr(path).encode('utf-8')).hexdigest(), 16)
+            return digest if digest % self.scatter_every == 0 else _MISSING
+        return _comparable(entity.get(name, _MISSING))
+
+    def _matches(self, path, entity, property_filter):
+        value = self._value(path, entity, property_filter.property.name)
+        if value is _MISSING:
+            return False
+        target = _comparable(
+            helpers._get_value_from_value_pb(property_filter.value))
+        if property_filter.op == query_pb2.PropertyFilter.HAS_ANCESTOR:
+            return value[:len(target)] == target
+        try:
+            return _COMPARISONS[property_filter.op](value, target)
+        except TypeError:
+            # Values of different types don't match.
+            return False
+
+    def _query_results(self, namespace, query):
+        """Returns the (path, entity protobuf) of every result, in order."""
+        kind = query.kind[0].name if query.kind else None
+        filters = _property_filters(query.filter)
+        with self._lock:
+            candidates = sorted(
+                (key_order(path), path, entity_pb)
+                for (entity_namespace, path), entity_pb
+                in self._entities.items()
+                if entity_namespace == namespace and
+                kind in (None, path[-1][0]))
+
+        results = []
+        for _, path, entity_pb in candidates:
+            entity = helpers.entity_from_protobuf(entity_pb)
+            if not all(self._matches(path, entity, property_filter)
+                       for property_filter in filters):
+                continue
+            # Entities without a property that the results are sorted by
+            # are left out.
+            values = [
+                self._value(path, entity, order.property.name)
+                for order in query.order]
+            if not any(value is _MISSING for value in values):
+                results.append((values, path, entity_pb))
+
+        for index in reversed(range(len(query.order))):
+            results.sort(
+                key=lambda result: result[0][index],
+                reverse=query.order[index].direction == (
+                    query_pb2.PropertyOrder.DESCENDING))
+        return [(path, entity_pb) for _, path, entity_pb in results]
+
+    def _runQuery(self, body):
+        request = datastore_pb2.RunQueryRequest.FromString(body)
+        query = request.query
+        results = self._query_results(
+            request.partition_id.namespace_id, query)
+
+        start = int(query.start_cursor or 0) + query.offset
+        end = int(query.end_cursor) if query.end_cursor else len(results)
+        limit = query.limit.value if query.HasField('limit') else None
+        stop = min(end, start + self.batch_size)
+        if limit is not None:
+            stop = min(stop, start + limit)
+
+        response = datastore_pb2.RunQueryResponse()
+        batch = response.batch
+        keys_only = [
+            projection.property.name for projection in query.projection] == [
+                '__key__']
+        batch.entity_result_type = (
+            query_pb2.EntityResult.KEY_ONLY if keys_only
+            else query_pb2.EntityResult.FULL)
+        for index, (_, entity_pb) in enumerate(
+                results[start:stop], start + 1):
+            result = batch.entity_results.add()
+            if keys_only:
+                result.entity.key.CopyFrom(entity_pb.key)
+            else:
+                result.entity.CopyFrom(entity_pb)
+            result.cursor = str(index).encode('ascii')
+        batch.skipped_results = min(query.offset, len(results))
+        batch.end_cursor = str(max(stop, start)).encode('ascii')
+        batch.more_results = _more_results(stop, start, limit, end, results)
+        return response
+
+
+def _more_results(stop, start, limit, end, results):
+    if limit is not None and stop == start + limit and stop < len(results):
+        return query_pb2.QueryResultBatch.MORE_RESULTS_AFTER_LIMIT
+    if stop < end:
+        return query_pb2.QueryResultBatch.NOT_FINISHED
+    if end < len(results):
+        return query_pb2.QueryResultBatch.MORE_RESULTS_AFTER_CURSOR
+    return query_pb2.QueryResultBatch.NO_MORE_RESULTS
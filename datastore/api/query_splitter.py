@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command-line sample that reads every result of a query in parallel.
+
+A query's results come a page at a time, each page fetched from the cursor
+at which the one before ended, so reading a whole kind takes as long as all
+the round trips one after another. A QueryScanner:
+
+* splits the query into shards, ranges of keys, at split points picked from
+  a sample of the query's keys: those of the entities with a __scatter__
+  property, which the service sets on a random sample of entities, or the
+  first MAX_SAMPLED_KEYS keys, for results too small for that sample, on
+  the emulator, or where there is no index to sort the results by
+  __scatter__;
+* reads each shard page by page, from its own cursor, in a pool of threads;
+* yields the entities of all the shards as one stream, in no set order; and
+* saves each shard's cursor to a checkpoint file once its page has been
+  yielded, so that a scan that stopped part way resumes each shard from
+  there rather than from the start.
+
+The shards filter on __key__, so only queries without inequality filters,
+sort orders or distinct_on properties can be split.
+
+Example invocation:
+    $ python query_splitter.py --project-id my-project Task --shards 32
+"""
+
+import argparse
+from concurrent import futures
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+import bulk_writer
+from gcloud import exceptions
+from six.moves import queue
+
+DEFAULT_NUM_SHARDS = 16
+DEFAULT_PAGE_SIZE = 500
+# The number of __scatter__ keys sampled for each split point.
+DEFAULT_OVERSAMPLING = 32
+# The most keys read to pick split points from when there is no __scatter__
+# sample. Results with more keys have the rest in their last shard.
+MAX_SAMPLED_KEYS = 10000
+DEFAULT_CHECKPOINT = 'query-scan.checkpoint'
+
+
+def key_order(key):
+    """Returns what sorts keys in the order of the service: by kind, then
+    IDs before names, for each element of their paths."""
+    return tuple(
+        (element['kind'], 'name' in element,
+         element.get('name', element.get('id')))
+        for element in key.path)
+
+
+def check_splittable(query):
+    """Raises ValueError unless the query can be split into key ranges."""
+    if query.order:
+        raise ValueError('Can\'t split a query with sort orders.')
+    if query.distinct_on:
+        # Each shard would return the first entity of every group in it.
+        raise ValueError('Can\'t split a query with distinct-on properties.')
+    for name, operator, _ in query.filters:
+        if operator != '=':
+            raise ValueError(
+                'Can\'t split a query with an inequality filter on '
+                '{}.'.format(name))
+
+
+def _pick(keys, num_shards):
+    """Returns up to num_shards - 1 evenly spaced keys, in order."""
+    keys = sorted(keys, key=key_order)
+    points = []
+    for index in range(1, num_shards):
+        key = keys[len(keys) * index // num_shards] if keys else None
+        if key is not None and (
+                not points or key_order(points[-1]) != key_order(key)):
+            points.append(key)
+    return points
+
+
+def scatter_split_points(client, query, num_shards,
+                         oversampling=DEFAULT_OVERSAMPLING):
+    """Returns split points from a sample of the query's keys with a
+    __scatter__ property, or fewer than num_shards - 1 if the results are
+    few."""
+    sample = client.query(
+        kind=query.kind, namespace=query.namespace, ancestor=query.ancestor,
+        filters=query.filters)
+    sample.keys_only()
+    sample.order = ['__scatter__']
+    keys = [
+        entity.key for entity in sample.fetch(
+            limit=(num_shards - 1) * oversampling)]
+    if len(keys) < num_shards - 1:
+        return keys
+    return _pick(keys, num_shards)
+
+
+def sampled_split_points(client, query, num_shards,
+                         max_keys=MAX_SAMPLED_KEYS):
+    """Returns split points from the first max_keys keys of the query's
+    results, read with a keys-only query."""
+    keys_query = client.query(
+        kind=query.kind, namespace=query.namespace, ancestor=query.ancestor,
+        filters=query.filters)
+    keys_query.keys_only()
+    entities = itertools.islice(keys_query.fetch(limit=max_keys), max_keys)
+    return _pick([entity.key for entity in entities], num_shards)
+
+
+def split_points(client, query, num_shards,
+                 oversampling=DEFAULT_OVERSAMPLING):
+    """Returns up to num_shards - 1 keys that split the query's results
+    into key ranges of about the same size."""
+    if num_shards < 2:
+        return []
+    try:
+        points = scatter_split_points(
+            client, query, num_shards, oversampling)
+    except exceptions.BadRequest:
+        # Sorting a filtered query by __scatter__ takes a composite index.
+        points = []
+    if len(points) < num_shards - 1:
+        # Too few entities have a __scatter__ property to go by.
+        points = sampled_split_points(client, query, num_shards)
+    return points
+
+
+def shard_query(client, query, start=None, end=None):
+    """Returns the query limited to the keys from start up to end."""
+    shard = client.query(
+        kind=query.kind, namespace=query.namespace, ancestor=query.ancestor,
+        filters=query.filters, projection=query.projection)
+    if start is not None:
+        shard.add_filter('__key__', '>=', start)
+    if end is not None:
+        shard.add_filter('__key__', '<', end)
+    return shard
+
+
+def fetch_pages(query, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """Yields each page of the query's results, starting from cursor, with
+    the cursor that the next page starts from."""
+    while True:
+        entities, more, cursor = query.fetch(
+            limit=page_size, start_cursor=cursor).next_page()
+        # A page can end at the limit with more results after it.
+        done = cursor is None or (not more and len(entities) < page_size)
+        yield entities, cursor, done
+        if done:
+            return
+
+
+class QueryScanner(object):
+    """Reads every result of a query in shards, several at once.
+
+    Args:
+        client: a datastore.Client that is safe to use from several
+            threads, such as one from bulk_writer.create_client().
+        query: the query, without inequality filters, sort orders or
+            distinct-on properties.
+        num_shards: the most shards to split the query into.
+        num_workers: the number of shards read at once. Defaults to
+            num_shards.
+        page_size: the most entities a shard fetches at once.
+        checkpoint_path: a file to save the progress of each shard in, if
+            any.
+        oversampling: the number of __scatter__ keys sampled for each split
+            point.
+
+    Raises:
+        ValueError: if the query can't be split.
+    """
+
+    def __init__(self, client, query, num_shards=DEFAULT_NUM_SHARDS,
+                 num_workers=None, page_size=DEFAULT_PAGE_SIZE,
+                 checkpoint_path=None, oversampling=DEFAULT_OVERSAMPLING):
+        check_splittable(query)
+        self.client = client
+        self.query = query
+        self.num_shards = num_shards
+        self.num_workers = num_workers or num_shards
+        self.page_size = page_size
+        self.checkpoint_path = checkpoint_path
+        self.oversampling = oversampling
+
+        self.shards = []
+        self.entities_scanned = 0
+        self.pages_fetched = 0
+        self.start = None
+
+    def _description(self):
+        """Describes the query, to tell whether a checkpoint is of it."""
+        return {
+            'project': self.query.project,
+            'namespace': self.query.namespace,
+            'kind': self.query.kind,
+            'ancestor': self.query.ancestor and list(
+                self.query.ancestor.flat_path),
+            'filters': [
+                [name, operator, repr(value)]
+                for name, operator, value in self.query.filters],
+            'projection': list(self.query.projection),
+        }
+
+    def _key(self, flat_path):
+        if flat_path is None:
+            return None
+        return self.client.key(*flat_path, namespace=self.query.namespace)
+
+    def _load_checkpoint(self):
+        """Returns the shards saved by an earlier scan of the same query,
+        or None."""
+        if not self.checkpoint_path:
+            return None
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if checkpoint['query'] != self._description():
+            return None
+        return [
+            dict(shard, start=self._key(shard['start']),
+                 end=self._key(shard['end']),
+                 # The cursors are saved as text, and start_cursor decodes
+                 # them as bytes on Python 2.
+                 cursor=shard['cursor'] and shard['cursor'].encode('ascii'))
+            for shard in checkpoint['shards']]
+
+    def _save_checkpoint(self):
+        checkpoint = {
+            'query': self._description(),
+            'shards': [
+                dict(shard,
+                     start=shard['start'] and list(shard['start'].flat_path),
+                     end=shard['end'] and list(shard['end'].flat_path),
+                     cursor=shard['cursor'] and shard['cursor'].decode(
+                         'ascii'))
+                for shard in self.shards],
+        }
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        if os.name == 'nt' and os.path.exists(self.checkpoint_path):
+            # os.rename can't replace an existing file on Windows.
+            os.remove(self.checkpoint_path)
+        os.rename(temp_path, self.checkpoint_path)
+
+    def _split(self):
+        points = split_points(
+            self.client, self.query, self.num_shards, self.oversampling)
+        bounds = [None] + points + [None]
+        return [
+            {'start': start, 'end': end, 'cursor': None, 'done': False}
+            for start, end in zip(bounds, bounds[1:])]
+
+    def _read_shard(self, index, results, stop):
+        """Fetches the pages of a shard into the results queue, until the
+        shard is done or the scan stops."""
+        shard = self.shards[index]
+        query = shard_query(
+            self.client, self.query, shard['start'], shard['end'])
+        try:
+            for entities, cursor, done in fetch_pages(
+                    query, shard['cursor'], self.page_size):
+                if not self._put(results, stop, (index, entities, cursor,
+                                                 done, None)):
+                    return
+        except Exception as error:
+            self._put(results, stop, (index, None, None, True, error))
+
+    def _put(self, results, stop, item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _advance(self, index, entities, cursor, done):
+        """Records a page of a shard as yielded."""
+        shard = self.shards[index]
+        shard['cursor'] = cursor
+        shard['done'] = done
+        self.entities_scanned += len(entities)
+        self.pages_fetched += 1
+        if self.checkpoint_path:
+            self._save_checkpoint()
+
+    def scan(self):
+        """Yields every result of the query, from all the shards as they
+        come. The checkpoint, if any, is removed once every shard is done.
+        """
+        self.start = time.time()
+        self.shards = self._load_checkpoint() or self._split()
+        pending = [
+            index for index, shard in enumerate(self.shards)
+            if not shard['done']]
+        results = queue.Queue(maxsize=self.num_workers * 2)
+        stop = threading.Event()
+
+        executor = futures.ThreadPoolExecutor(
+            max_workers=max(1, min(self.num_workers, len(pending))))
+        try:
+            for index in pending:
+                executor.submit(self._read_shard, index, results, stop)
+            remaining = len(pending)
+            while remaining:
+                index, entities, cursor, done, error = results.get()
+                if error is not None:
+                    raise error
+                for entity in entities:
+                    yield entity
+                self._advance(index, entities, cursor, done)
+                remaining -= done
+        finally:
+            stop.set()
+            executor.shutdown()
+
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def report(self):
+        elapsed = time.time() - self.start if self.start else 0
+        return (
+            '{} entities in {} pages, {} of {} shards done, '
+            '{:.1f} entities/s'.format(
+                self.entities_scanned, self.pages_fetched,
+                sum(shard['done'] for shard in self.shards),
+                len(self.shards),
+                self.entities_scanned / elapsed if elapsed else 0.0))
+
+
+def main(project_id, kind, num_shards=DEFAULT_NUM_SHARDS,
+         checkpoint_path=DEFAULT_CHECKPOINT, progress_interval=10):
+    """Counts the entities of a kind."""
+    client = bulk_writer.create_client(project_id)
+    scanner = QueryScanner(
+        client, client.query(kind=kind), num_shards,
+        checkpoint_path=checkpoint_path)
+
+    last_report = time.time()
+    for _ in scanner.scan():
+        if time.time() - last_report >= progress_interval:
+            last_report = time.time()
+            sys.stderr.write(scanner.report() + '\n')
+    print(scanner.report())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--project-id', help='Your cloud project ID.')
+    parser.add_argument('kind', help='The kind of entity to scan.')
+    parser.add_argument(
+        '--shards', type=int, default=DEFAULT_NUM_SHARDS,
+        help='The most shards to split the scan into.')
+    parser.add_argument(
+        '--checkpoint', default=DEFAULT_CHECKPOINT,
+        help='Where to save progress, to resume from after a failure.')
+
+    args = parser.parse_args()
+
+    main(args.project_id, args.kind, args.shards, args.checkpoint)
@@ -0,0 +1,239 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+import bulk_writer
+import fake_datastore
+from gcloud import datastore
+from gcloud import exceptions
+import pytest
+import query_splitter
+
+
+def make_client(fake, count=1000, task_lists=10):
+    client = datastore.Client('project', http=fake)
+    bulk_writer.BulkWriter(client, num_workers=4).put(
+        bulk_writer.generate_tasks(client, count, task_lists))
+    return client
+
+
+def paths(entities):
+    return sorted(tuple(entity.key.flat_path) for entity in entities)
+
+
+def test_split_points_from_scatter_sample():
+    fake = fake_datastore.FakeDatastore(scatter_every=8)
+    client = make_client(fake)
+    query = client.query(kind='Task')
+
+    points = query_splitter.split_points(client, query, 8, oversampling=4)
+
+    assert len(points) == 7
+    orders = [query_splitter.key_order(point) for point in points]
+    assert orders == sorted(set(orders))
+
+
+def test_split_points_from_every_key_of_small_kinds():
+    # With the default sampling, none of these entities has __scatter__.
+    fake = fake_datastore.FakeDatastore()
+    client = make_client(fake, count=100)
+    query = client.query(kind='Task', filters=[('priority', '=', 3)])
+
+    points = query_splitter.split_points(client, query, 4)
+
+    assert len(points) == 3
+    assert all(point['priority'] == 3 for point in client.get_multi(points))
+
+
+@pytest.mark.parametrize('num_shards', [4, 16])
+def test_split_points_within_the_query(num_shards):
+    # Sample enough of the query's keys that the shards come out even.
+    fake = fake_datastore.FakeDatastore(scatter_every=2)
+    client = make_client(fake)
+    query = client.query(
+        kind='Task', ancestor=client.key('TaskList', 'list-1'))
+    bounds = [None] + query_splitter.split_points(
+        client, query, num_shards) + [None]
+
+    sizes = [
+        len(list(
+            query_splitter.shard_query(client, query, start, end).fetch()))
+        for start, end in zip(bounds, bounds[1:])]
+
+    assert sum(sizes) == 100
+    # The sample is of the query's results, not of the whole kind.
+    assert len(sizes) == num_shards
+    assert max(sizes) <= 2 * 100 // num_shards + 8
+
+
+def test_split_points_without_scatter_index():
+    fake = fake_datastore.FakeDatastore(scatter_every=8)
+    client = make_client(fake, count=100)
+    query = client.query(kind='Task', filters=[('priority', '=', 3)])
+    # The service has no index to sort the filtered query by __scatter__.
+    fake.inject(400, 'runQuery', times=1)
+
+    points = query_splitter.split_points(client, query, 4)
+
+    assert len(points) == 3
+    assert all(point['priority'] == 3 for point in client.get_multi(points))
+
+
+def test_sampled_split_points_read_at_most_max_keys():
+    fake = fake_datastore.FakeDatastore(batch_size=30)
+    client = make_client(fake, count=250)
+    query = client.query(kind='Task')
+
+    points = query_splitter.sampled_split_points(
+        client, query, 4, max_keys=100)
+
+    keys = [entity.key for entity in client.query(kind='Task').fetch()]
+    first = sorted(keys, key=query_splitter.key_order)[:100]
+    assert len(points) == 3
+    assert set(point.flat_path for point in points) <= set(
+        key.flat_path for key in first)
+
+
+@pytest.mark.parametrize('num_shards', [1, 4, 16])
+def test_shards_cover_every_entity_once(num_shards):
+    fake = fake_datastore.FakeDatastore(scatter_every=8)
+    client = make_client(fake)
+    query = client.query(kind='Task')
+    bounds = [None] + query_splitter.split_points(
+        client, query, num_shards, oversampling=4) + [None]
+
+    entities = []
+    for start, end in zip(bounds, bounds[1:]):
+        entities.extend(
+            query_splitter.shard_query(client, query, start, end).fetch())
+
+    assert paths(entities) == paths(query.fetch())
+    assert len(entities) == 1000
+
+
+def test_fetch_pages_follows_cursors():
+    fake = fake_datastore.FakeDatastore(batch_size=30)
+    client = make_client(fake, count=250)
+
+    pages = list(query_splitter.fetch_pages(
+        client.query(kind='Task'), page_size=100))
+
+    # The service returns batches smaller than the page size at times.
+    assert [len(entities) for entities, _, _ in pages] == [30] * 8 + [10]
+    assert [done for _, _, done in pages] == [False] * 8 + [True]
+
+
+def test_scan():
+    fake = fake_datastore.FakeDatastore(latency=0.001, scatter_every=8)
+    client = make_client(fake)
+    query = client.query(
+        kind='Task', ancestor=client.key('TaskList', 'list-1'))
+    scanner = query_splitter.QueryScanner(
+        client, query, num_shards=4, num_workers=2, page_size=10,
+        oversampling=4)
+
+    entities = list(scanner.scan())
+
+    assert paths(entities) == paths(query.fetch())
+    assert len(entities) == 100
+    assert scanner.entities_scanned == 100
+    assert scanner.report().startswith('100 entities in ')
+    assert all(shard['done'] for shard in scanner.shards)
+
+
+def test_scan_resumes_from_checkpoint(tmpdir):
+    fake = fake_datastore.FakeDatastore(scatter_every=8)
+    client = make_client(fake)
+    query = client.query(kind='Task')
+    checkpoint = str(tmpdir.join('scan.checkpoint'))
+
+    def make_scanner():
+        return query_splitter.QueryScanner(
+            client, query, num_shards=4, page_size=50,
+            checkpoint_path=checkpoint, oversampling=4)
+
+    scanner = make_scanner()
+    scan = scanner.scan()
+    first = [next(scan) for _ in range(420)]
+    scan.close()
+
+    with open(checkpoint) as f:
+        saved = json.load(f)
+    assert len(saved['shards']) == 4
+    assert sum(1 for shard in saved['shards'] if shard['cursor']) >= 1
+    assert all(
+        isinstance(shard['cursor'], bytes)
+        for shard in make_scanner()._load_checkpoint() if shard['cursor'])
+
+    resumed = make_scanner()
+    rest = list(resumed.scan())
+
+    # Only the pages yielded in full were saved as read.
+    assert resumed.entities_scanned == 1000 - scanner.entities_scanned
+    assert len(rest) == resumed.entities_scanned
+    assert scanner.entities_scanned <= len(first)
+    assert set(paths(first + rest)) == set(paths(query.fetch()))
+    assert not os.path.exists(checkpoint)
+
+
+def test_scan_ignores_checkpoint_of_another_query(tmpdir):
+    fake = fake_datastore.FakeDatastore()
+    client = make_client(fake, count=100)
+    checkpoint = tmpdir.join('scan.checkpoint')
+    checkpoint.write(json.dumps({'query': {'kind': 'TaskList'}, 'shards': []}))
+
+    scanner = query_splitter.QueryScanner(
+        client, client.query(kind='Task'), num_shards=4,
+        checkpoint_path=str(checkpoint))
+
+    assert len(list(scanner.scan())) == 100
+
+
+def test_scan_raises_shard_errors():
+    fake = fake_datastore.FakeDatastore()
+    client = make_client(fake, count=100)
+    fake.inject(500, 'runQuery', after=4)
+    scanner = query_splitter.QueryScanner(
+        client, client.query(kind='Task'), num_shards=2, page_size=10)
+
+    with pytest.raises(exceptions.InternalServerError):
+        list(scanner.scan())
+
+
+@pytest.mark.parametrize('query_args', [
+    {'order': ['priority']},
+    {'filters': [('priority', '>', 3)]},
+    {'distinct_on': ['type']},
+])
+def test_rejects_queries_that_cant_be_split(query_args):
+    client = datastore.Client('project', http=fake_datastore.FakeDatastore())
+    with pytest.raises(ValueError):
+        query_splitter.QueryScanner(
+            client, client.query(kind='Task', **query_args))
+
+
+def test_main(monkeypatch, capsys, tmpdir):
+    fake = fake_datastore.FakeDatastore(scatter_every=8)
+    client = make_client(fake, count=500)
+    monkeypatch.setattr(
+        bulk_writer, 'create_client', lambda project_id: client)
+
+    query_splitter.main(
+        'project', 'Task', num_shards=8,
+        checkpoint_path=str(tmpdir.join('scan.checkpoint')))
+
+    out, _ = capsys.readouterr()
+    assert out.startswith('500 entities in ')
+    assert '8 of 8 shards done' in out
@@ -0,0 +1,49 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A transport for service clients that can be used from several threads.
+
+bigquery/api, storage/api and storage/transfer_service have a services.py
+that also builds and caches googleapiclient service objects. The Datastore
+samples use the gcloud library rather than googleapiclient, so this one only
+has the transport. `nox -s shared_modules` checks that its ThreadLocalHttp
+matches theirs.
+"""
+
+import threading
+
+import httplib2
+
+
+class ThreadLocalHttp(object):
+    """Dispatches requests to a per-thread httplib2.Http instance.
+
+    httplib2.Http objects are not safe to share between threads. This gives
+    each thread its own, each keeping its connections alive between
+    requests.
+    """
+
+    def __init__(self, http_factory=httplib2.Http):
+        self._http_factory = http_factory
+        self._local = threading.local()
+
+    def request(self, *args, **kwargs):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = self._http_factory()
+        return http.request(*args, **kwargs)
+
+
+def authorized_http(credentials):
+    """Returns a thread-safe transport authorized with the credentials."""
+    return credentials.authorize(ThreadLocalHttp())
@@ -21,9 +21,12 @@ import nox
 REPO_TOOLS_REQ =\
     'git+https://github.com/GoogleCloudPlatform/python-repo-tools.git'
 
+# Benchmarks run once each, as tests; session_benchmarks times them.
 COMMON_PYTEST_ARGS = [
     '-x', '--no-success-flaky-report', '--cov', '--cov-config',
-    '.coveragerc', '--cov-append', '--cov-report=']
+    '.coveragerc', '--cov-append', '--cov-report=', '--benchmark-disable']
+
+BENCHMARKS = ['storage/api/operations_benchmark_test.py']
 
 SESSION_TESTS_BLACKLIST = set(('appengine', 'testing'))
 
@@ -97,6 +100,18 @@ def session_tests(session, interpreter, extra_pytest_args=None):
             success_codes=[0, 5])  # Treat no test collected as success.
 
 
+def session_async_tests(session):
+    """Runs the tests of samples that need Python 3.5.2 or later, which the
+    tests session skips."""
+    session.interpreter = 'python3.5'
+    session.install(REPO_TOOLS_REQ)
+    session.install('-r', 'requirements-python3.4-dev.txt')
+    session.install('-r', 'bigquery/api/requirements.txt')
+    session.run(
+        'py.test', 'bigquery/api/async_client_test.py',
+        *(COMMON_PYTEST_ARGS + session.posargs))
+
+
 def session_gae(session, extra_pytest_args=None):
     session.interpreter = 'python2.7'
     session.install(REPO_TOOLS_REQ)
@@ -121,6 +136,29 @@ def session_gae(session, extra_pytest_args=None):
             success_codes=[0, 5])  # Treat no test collected as success.
 
 
+def session_benchmarks(session):
+    """Times the benchmarks, saving the results under .benchmarks so that
+    later runs can be compared with them, such as with
+    `nox -s benchmarks -- --benchmark-compare`."""
+    session.interpreter = 'python3.4'
+    session.install('-r', 'requirements-python3.4-dev.txt')
+    for benchmark in BENCHMARKS:
+        for reqfile in list_files(os.path.dirname(benchmark),
+                                  'requirements*.txt'):
+            session.install('-r', reqfile)
+
+    session.run(
+        'py.test', *(BENCHMARKS + [
+            '--benchmark-only', '--benchmark-autosave',
+            '--benchmark-storage=.benchmarks'] + session.posargs))
+
+
+def session_shared_modules(session):
+    """Checks that the modules copied into several sample directories, such
+    as services.py, have been kept the same."""
+    session.run('python', 'scripts/check_shared_modules.py')
+
+
 def session_travis(session):
     """On travis, just run with python3.4 and don't run slow or flaky tests."""
     session_tests(
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks that the copies of modules shared by sample directories match.
+
+Each sample directory is installed and run on its own, so a helper used by
+the samples of several directories is copied into each of them. This exits
+with an error, listing the copies that differ, when one copy was changed
+without the others.
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(
+    os.path.dirname(__file__),
+    '..'))
+
+# Each module, and the directories that have an identical copy of it.
+SHARED_MODULES = {
+    'services.py': [
+        'bigquery/api', 'storage/api', 'storage/transfer_service'],
+    'batch.py': ['bigquery/api', 'storage/api'],
+}
+
+# Classes that a directory's smaller module has copies of, and where.
+SHARED_CLASSES = {
+    'ThreadLocalHttp': [
+        'bigquery/api/services.py', 'datastore/api/services.py'],
+}
+
+
+def read(path):
+    with open(os.path.join(REPO_ROOT, path)) as f:
+        return f.read()
+
+
+def class_source(path, name):
+    """Returns the source of a top-level class, up to the next top-level
+    statement."""
+    source = read(path)
+    start = source.index('\nclass {}('.format(name))
+    end = source.find('\n\n\n', start + 1)
+    return source[start:end if end != -1 else None]
+
+
+def differing_copies():
+    """Yields (path, original) for each copy that differs from the
+    original it should match."""
+    for module, directories in sorted(SHARED_MODULES.items()):
+        paths = [os.path.join(d, module) for d in directories]
+        for path in paths[1:]:
+            if read(path) != read(paths[0]):
+                yield path, paths[0]
+
+    for name, paths in sorted(SHARED_CLASSES.items()):
+        for path in paths[1:]:
+            if class_source(path, name) != class_source(paths[0], name):
+                yield '{}:{}'.format(path, name), paths[0]
+
+
+def main():
+    differing = list(differing_copies())
+    for path, original in differing:
+        print('{} differs from {}.'.format(path, original))
+    return 1 if differing else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sends many small API requests in one round trip.
+
+Each metadata call, such as Cloud Storage's objects().get or BigQuery's
+jobs().get, costs a full HTTP round trip even though the request and
+response are tiny. The API's batch endpoint accepts several calls in a
+single multipart/mixed request, and answers them all in a single
+multipart/mixed response.
+
+Batcher queues requests and sends them in batches of up to `max_size`,
+handing back a future for each request. A batch can succeed as a whole while
+some of the calls in it fail; the calls that failed with a status worth
+retrying (429 and 5xx) are sent again in a new batch, with backoff, and the
+others are not resent.
+
+bigquery/api and storage/api each have this same module, as each sample
+directory is installed and run on its own. `nox -s shared_modules` checks
+that the copies match.
+"""
+
+from concurrent import futures
+import random
+import time
+
+from googleapiclient.errors import HttpError
+
+# The most calls the API accepts in one batch request.
+DEFAULT_BATCH_SIZE = 100
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_retryable(error):
+    return isinstance(error, HttpError) and (
+        error.resp.status in RETRYABLE_STATUSES)
+
+
+class Batcher(object):
+    """Coalesces requests into batch requests.
+
+    Args:
+        new_batch: a callable returning an empty BatchHttpRequest, such as
+            the new_batch_http_request method of a service object.
+        max_size: the most requests to send in one batch.
+        num_retries: number of times to retry a request that failed with a
+            retryable status.
+        interval: the initial number of seconds to wait before retrying.
+        http: the transport to send batches with. Defaults to that of the
+            first request in each batch.
+    """
+
+    def __init__(self, new_batch, max_size=DEFAULT_BATCH_SIZE, num_retries=5,
+                 interval=1, http=None):
+        self.new_batch = new_batch
+        self.max_size = max_size
+        self.num_retries = num_retries
+        self.interval = interval
+        self.http = http
+        self.batches_sent = 0
+        self.requests_sent = 0
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, request, callback=None):
+        """Queues a request, sending a batch if the queue is full.
+
+        Args:
+            request: a googleapiclient HttpRequest, such as
+                service.objects().get(...) or bigquery.jobs().get(...).
+                Media uploads can't be batched.
+            callback: called with the request's future once it is done.
+
+        Returns:
+            A concurrent.futures.Future holding the request's response, or
+            the HttpError it failed with.
+        """
+        future = futures.Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_size:
+            self.flush()
+        return future
+
+    def flush(self):
+        """Sends every queued request and waits for their responses."""
+        pending, self._pending = self._pending, []
+        for attempt in range(self.num_retries + 1):
+            if attempt:
+                delay = self.interval * 2 ** (attempt - 1)
+                time.sleep(delay * random.uniform(0.5, 1.5))
+
+            last_attempt = attempt == self.num_retries
+            failed = []
+            for start in range(0, len(pending), self.max_size):
+                failed.extend(self._send(
+                    pending[start:start + self.max_size], last_attempt))
+            pending = failed
+            if not pending:
+                return
+
+    def _send(self, requests, last_attempt):
+        """Sends one batch, resolving the futures of the requests that are
+        done and returning the ones to retry."""
+        failed = []
+
+        def callback(request_id, response, exception):
+            request, future = requests[int(request_id)]
+            if exception is None:
+                future.set_result(response)
+            elif is_retryable(exception) and not last_attempt:
+                failed.append((request, future))
+            else:
+                future.set_exception(exception)
+
+        batch = self.new_batch()
+        for request_id, (request, _) in enumerate(requests):
+            batch.add(request, callback=callback, request_id=str(request_id))
+
+        self.batches_sent += 1
+        self.requests_sent += len(requests)
+        try:
+            batch.execute(http=self.http)
+        except HttpError as e:
+            # The batch request as a whole was rejected.
+            if is_retryable(e) and not last_attempt:
+                return requests
+            for _, future in requests:
+                future.set_exception(e)
+            return []
+
+        return failed
@@ -0,0 +1,201 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from email.parser import FeedParser
+import json
+import threading
+
+import batch
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+import httplib2
+import list_objects
+import pytest
+from six.moves import BaseHTTPServer
+from six.moves.urllib.parse import unquote
+
+OBJECTS_PATH = '/storage/v1/b/bucket/o/'
+
+
+class BatchHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers multipart/mixed batches of objects().get requests.
+
+    Objects named in server.missing are not found, and those named in
+    server.flaky fail with a 503 that many times before they succeed.
+    """
+
+    def do_POST(self):
+        length = int(self.headers['content-length'])
+        parser = FeedParser()
+        parser.feed('content-type: {}\r\n\r\n'.format(
+            self.headers['content-type']))
+        parser.feed(self.rfile.read(length).decode('utf-8'))
+        self.server.batches.append([])
+
+        boundary = 'batch_boundary'
+        body = ''
+        for part in parser.close().get_payload():
+            status, content = self.answer(part.get_payload().split(' ')[1])
+            body += (
+                '--{}\r\n'
+                'Content-Type: application/http\r\n'
+                'Content-ID: <response-{}>\r\n\r\n'
+                'HTTP/1.1 {} Reason\r\n'
+                'Content-Type: application/json\r\n\r\n'
+                '{}\r\n').format(
+                    boundary, part['Content-ID'][1:-1], status,
+                    json.dumps(content))
+        body = (body + '--{}--\r\n'.format(boundary)).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header(
+            'Content-Type', 'multipart/mixed; boundary={}'.format(boundary))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer(self, path):
+        name = unquote(path.split('?')[0][len(OBJECTS_PATH):])
+        self.server.batches[-1].append(name)
+        if name in self.server.missing:
+            return 404, {'error': {'code': 404, 'message': 'Not Found'}}
+        if self.server.flaky.get(name):
+            self.server.flaky[name] -= 1
+            return 503, {'error': {'code': 503, 'message': 'Backend Error'}}
+        return 200, {'name': name}
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(request):
+    server = BaseHTTPServer.HTTPServer(('localhost', 0), BatchHandler)
+    server.batches = []
+    server.missing = set()
+    server.flaky = {}
+    server.url = 'http://localhost:{}/'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def shutdown():
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+    request.addfinalizer(shutdown)
+    return server
+
+
+@pytest.fixture
+def service(server):
+    document = {
+        'kind': 'discovery#restDescription',
+        'name': 'storage',
+        'version': 'v1',
+        'rootUrl': server.url,
+        'servicePath': 'storage/v1/',
+        'batchPath': 'batch',
+        'schemas': {'Object': {'id': 'Object', 'type': 'object'}},
+        'resources': {
+            'objects': {
+                'methods': {
+                    'get': {
+                        'id': 'storage.objects.get',
+                        'path': 'b/{bucket}/o/{object}',
+                        'httpMethod': 'GET',
+                        'parameters': {
+                            'bucket': {
+                                'type': 'string', 'location': 'path',
+                                'required': True},
+                            'object': {
+                                'type': 'string', 'location': 'path',
+                                'required': True},
+                        },
+                        'parameterOrder': ['bucket', 'object'],
+                        'response': {'$ref': 'Object'},
+                    },
+                },
+            },
+        },
+    }
+    return discovery.build_from_document(
+        json.dumps(document), http=httplib2.Http())
+
+
+def get_request(service, name):
+    return service.objects().get(bucket='bucket', object=name)
+
+
+def test_batcher(server, service):
+    done = []
+    batcher = batch.Batcher(service.new_batch_http_request, max_size=3)
+
+    results = [
+        batcher.add(get_request(service, 'object{}'.format(i)), done.append)
+        for i in range(5)]
+
+    # The first three were sent as soon as the batch was full.
+    assert len(server.batches) == 1
+    assert len(done) == 3
+    batcher.flush()
+
+    assert [len(names) for names in server.batches] == [3, 2]
+    assert [r.result()['name'] for r in results] == [
+        'object{}'.format(i) for i in range(5)]
+    assert done == results
+    assert batcher.requests_sent == 5
+
+
+def test_batcher_retries_failed_requests(server, service):
+    server.flaky = {'object1': 2, 'object3': 1}
+    server.missing = {'object4'}
+
+    with batch.Batcher(
+            service.new_batch_http_request, num_retries=3,
+            interval=0.001) as batcher:
+        results = [
+            batcher.add(get_request(service, 'object{}'.format(i)))
+            for i in range(5)]
+
+    # Only the requests that failed with a 503 were sent again.
+    assert server.batches == [
+        ['object0', 'object1', 'object2', 'object3', 'object4'],
+        ['object1', 'object3'],
+        ['object1']]
+    assert results[1].result() == {'name': 'object1'}
+    error = results[4].exception()
+    assert isinstance(error, HttpError) and error.resp.status == 404
+
+
+def test_batcher_gives_up(server, service):
+    server.flaky = {'object0': 5}
+
+    with batch.Batcher(
+            service.new_batch_http_request, num_retries=2,
+            interval=0.001) as batcher:
+        result = batcher.add(get_request(service, 'object0'))
+
+    assert len(server.batches) == 3
+    assert result.exception().resp.status == 503
+
+
+def test_get_objects_metadata(monkeypatch, server, service):
+    monkeypatch.setattr(list_objects, 'create_service', lambda: service)
+    server.missing = {'b c'}
+
+    metadata = list_objects.get_objects_metadata(
+        'bucket', ['a', 'b c', 'd/e'], batch_size=2)
+
+    assert metadata == [{'name': 'a'}, None, {'name': 'd/e'}]
+    assert len(server.batches) == 2
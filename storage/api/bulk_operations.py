@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Deletes, copies or rewrites many objects at once.
+
+Each operation is one request on one object, so operating on hundreds of
+thousands of objects one after another takes as many round trips. Here the
+operations run on a pool of threads, with an adaptive limit on how many run
+at once:
+
+* The limit starts low and rises by one each time that many operations have
+  succeeded in a row.
+* When the service pushes back with a 429 or 503, the limit is halved and
+  the operation is retried after an exponential backoff, so the load backs
+  off as a whole rather than each thread hammering on.
+* Objects are taken from the input as the limit allows, so a listing of any
+  size is streamed through in constant memory.
+
+The objects to operate on are names, or the object metadata that
+list_objects.list_bucket yields, or the newline-delimited JSON that
+list_objects.py --ndjson writes.
+
+Example invocations:
+    $ python list_objects.py my-bucket --ndjson > objects.ndjson
+    $ python bulk_operations.py copy my-bucket --input objects.ndjson \\
+        --destination_bucket my-backup
+    $ python bulk_operations.py delete my-bucket --prefix tmp/
+"""
+
+import argparse
+from concurrent import futures
+import json
+import random
+import sys
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+import list_objects
+import services
+
+DEFAULT_NUM_WORKERS = 64
+DEFAULT_INITIAL_CONCURRENCY = 8
+DEFAULT_NUM_RETRIES = 8
+
+# Statuses with which the service says to slow down.
+THROTTLED_STATUSES = (429, 503)
+
+
+class AdaptiveLimiter(object):
+    """Limits how many operations run at once, adapting the limit to how
+    much the service accepts.
+
+    The limit grows by one after each `limit` successes in a row, and halves
+    when an operation is throttled. Throttles that arrive within `cooldown`
+    seconds of the last cut count once, since they come from requests sent
+    before it.
+    """
+
+    def __init__(self, initial, maximum, minimum=1, cooldown=1.0):
+        self.limit = max(minimum, min(initial, maximum))
+        self.maximum = maximum
+        self.minimum = minimum
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._successes = 0
+        self._last_cut = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Waits until another operation may start."""
+        with self._condition:
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def succeeded(self):
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._successes = 0
+                self.limit = min(self.limit + 1, self.maximum)
+                self._condition.notify_all()
+
+    def throttled(self):
+        with self._condition:
+            self._successes = 0
+            now = time.time()
+            if now - self._last_cut >= self.cooldown:
+                self._last_cut = now
+                self.limit = max(self.limit // 2, self.minimum)
+
+
+class BulkStats(object):
+    """Counts the outcomes of a bulk operation, safely across threads."""
+
+    def __init__(self):
+        self.succeeded = 0
+        self.throttled = 0
+        self.failures = []
+        self.start = time.time()
+        self.end = None
+        self._lock = threading.Lock()
+
+    def record(self, name, error=None):
+        with self._lock:
+            if error is None:
+                self.succeeded += 1
+            else:
+                self.failures.append((name, error))
+
+    def record_throttle(self):
+        with self._lock:
+            self.throttled += 1
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def operations_per_second(self):
+        done = self.succeeded + len(self.failures)
+        return done / self.elapsed if self.elapsed else 0.0
+
+    def report(self, limiter=None):
+        report = '{} succeeded, {} failed, {} throttled, {:.1f} ops/s'.format(
+            self.succeeded, len(self.failures), self.throttled,
+            self.operations_per_second)
+        if limiter is not None:
+            report += ', concurrency {}'.format(limiter.limit)
+        return report
+
+
+def object_name(item):
+    """Returns the name of an object given by name or by its metadata."""
+    return item['name'] if isinstance(item, dict) else item
+
+
+def read_items(lines):
+    """Yields the objects in a listing: one name a line, or one object's
+    metadata a line as newline-delimited JSON.
+
+    Objects recorded as deleted by an object_index sync are skipped.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith('{'):
+            yield line
+            continue
+        record = json.loads(line)
+        if record.get('change') != 'deleted':
+            yield record
+
+
+def _run_one(operation, name, limiter, stats, num_retries, interval):
+    try:
+        for attempt in range(num_retries + 1):
+            try:
+                operation(name)
+            except HttpError as error:
+                if (error.resp.status not in THROTTLED_STATUSES or
+                        attempt == num_retries):
+                    stats.record(name, error)
+                    return
+                limiter.throttled()
+                stats.record_throttle()
+                time.sleep(
+                    interval * 2 ** attempt * random.uniform(0.5, 1.5))
+            except Exception as error:
+                stats.record(name, error)
+                return
+            else:
+                limiter.succeeded()
+                stats.record(name)
+                return
+    finally:
+        limiter.release()
+
+
+def run(operation, items, num_workers=DEFAULT_NUM_WORKERS,
+        initial_concurrency=DEFAULT_INITIAL_CONCURRENCY,
+        num_retries=DEFAULT_NUM_RETRIES, interval=1, progress=None,
+        progress_interval=10):
+    """Runs an operation on each object, several at once.
+
+    Args:
+        operation: a callable taking an object name, safe to call from
+            several threads, which raises HttpError if it fails.
+        items: the objects, as names or metadata.
+        num_workers: the most operations run at once.
+        initial_concurrency: how many operations run at once to begin with.
+        num_retries: number of times to retry a throttled operation.
+        interval: the initial number of seconds to wait before retrying.
+        progress: a file to write a report to every `progress_interval`
+            seconds, if any.
+
+    Returns:
+        A BulkStats; operations that failed are in its failures, not
+        raised.
+    """
+    limiter = AdaptiveLimiter(initial_concurrency, num_workers)
+    stats = BulkStats()
+    last_report = time.time()
+
+    executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        for item in items:
+            limiter.acquire()
+            executor.submit(
+                _run_one, operation, object_name(item), limiter, stats,
+                num_retries, interval)
+            if progress and time.time() - last_report >= progress_interval:
+                last_report = time.time()
+                progress.write(stats.report(limiter) + '\n')
+    finally:
+        executor.shutdown()
+        stats.end = time.time()
+    return stats
+
+
+def bulk_delete(service, bucket, items, **kwargs):
+    """Deletes objects, counting those already gone as deleted.
+
+    Args:
+        service: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        bucket: the bucket holding the objects.
+        items: the objects, as names or metadata.
+        **kwargs: passed on to run().
+
+    Returns:
+        A BulkStats.
+    """
+    def delete(name):
+        try:
+            service.objects().delete(bucket=bucket, object=name).execute()
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+
+    return run(delete, items, **kwargs)
+
+
+def bulk_copy(service, bucket, items, destination_bucket,
+              destination_prefix='', **kwargs):
+    """Copies objects, each to destination_prefix + its name.
+
+    A copy between locations or storage classes can fail for large objects;
+    use bulk_rewrite for those.
+
+    Returns:
+        A BulkStats.
+    """
+    def copy(name):
+        service.objects().copy(
+            sourceBucket=bucket, sourceObject=name,
+            destinationBucket=destination_bucket,
+            destinationObject=destination_prefix + name, body={}).execute()
+
+    return run(copy, items, **kwargs)
+
+
+def bulk_rewrite(service, bucket, items, destination_bucket=None,
+                 destination_prefix='', body=None,
+                 max_bytes_per_call=None, **kwargs):
+    """Rewrites objects, each to destination_prefix + its name.
+
+    Unlike a copy, a rewrite of any size can cross locations and storage
+    classes, and with no destination it rewrites the objects in place, for
+    example to change their storage class.
+
+    Args:
+        body: the metadata of the rewritten objects, such as
+            {'storageClass': 'NEARLINE'}. Defaults to that of the sources.
+        max_bytes_per_call: the most bytes the service rewrites before
+            returning a token to continue with; a multiple of 1MiB.
+        **kwargs: passed on to run().
+
+    Returns:
+        A BulkStats.
+    """
+    def rewrite(name):
+        token = None
+        while True:
+            response = service.objects().rewrite(
+                sourceBucket=bucket, sourceObject=name,
+                destinationBucket=destination_bucket or bucket,
+                destinationObject=destination_prefix + name,
+                body=body or {}, rewriteToken=token,
+                maxBytesRewrittenPerCall=max_bytes_per_call).execute()
+            if response['done']:
+                return response['resource']
+            token = response['rewriteToken']
+
+    return run(rewrite, items, **kwargs)
+
+
+def _read_file(path):
+    """Yields the objects listed in a file, closing it once they are read."""
+    with open(path, 'r') as f:
+        for item in read_items(f):
+            yield item
+
+
+def _get_items(bucket, input_path, prefix):
+    if input_path == '-':
+        return read_items(sys.stdin)
+    if input_path:
+        return _read_file(input_path)
+    return list_objects.list_bucket(bucket, prefix=prefix)
+
+
+def main(operation, bucket, input_path=None, prefix=None,
+         destination_bucket=None, destination_prefix='', storage_class=None,
+         num_workers=DEFAULT_NUM_WORKERS):
+    service = services.get_service('storage', 'v1')
+    items = _get_items(bucket, input_path, prefix)
+    kwargs = {'num_workers': num_workers, 'progress': sys.stderr}
+
+    if operation == 'delete':
+        stats = bulk_delete(service, bucket, items, **kwargs)
+    elif operation == 'copy':
+        stats = bulk_copy(
+            service, bucket, items, destination_bucket, destination_prefix,
+            **kwargs)
+    else:
+        body = {'storageClass': storage_class} if storage_class else None
+        stats = bulk_rewrite(
+            service, bucket, items, destination_bucket, destination_prefix,
+            body, **kwargs)
+
+    for name, error in stats.failures:
+        print('Failed: {}: {}'.format(name, error))
+    print(stats.report())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('operation', choices=['delete', 'copy', 'rewrite'])
+    parser.add_argument('bucket', help='Your Cloud Storage bucket.')
+    parser.add_argument(
+        '--input',
+        help='A file of the objects to operate on, one name or JSON object '
+             'a line, or - for stdin. Defaults to listing the bucket.')
+    parser.add_argument(
+        '--prefix', help='Operate on the objects listed under this prefix.')
+    parser.add_argument(
+        '--destination_bucket',
+        help='Where to copy or rewrite to. Rewrites default to in place.')
+    parser.add_argument(
+        '--destination_prefix', default='',
+        help='Prepended to the names of the copies.')
+    parser.add_argument(
+        '--storage_class', help='The storage class to rewrite to.')
+    parser.add_argument(
+        '-w', '--num_workers', help='The most operations to run at once.',
+        type=int, default=DEFAULT_NUM_WORKERS)
+
+    args = parser.parse_args()
+
+    main(args.operation, args.bucket, args.input, args.prefix,
+         args.destination_bucket, args.destination_prefix,
+         args.storage_class, args.num_workers)
@@ -0,0 +1,164 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import threading
+
+import bulk_operations
+import fake_gcs
+import httplib2
+import list_objects
+
+NAMES = ['object-{:03d}'.format(index) for index in range(100)]
+
+
+def make_fake(names=NAMES):
+    fake = fake_gcs.FakeGcs()
+    for name in names:
+        fake.add_object('bucket', name, name.encode('utf-8'))
+    return fake
+
+
+def throttle_first(fake, monkeypatch, times):
+    """Makes the first `times` requests for each URI fail with a 429, however
+    the requests of different objects interleave."""
+    request = fake.request
+    requests = collections.Counter()
+    lock = threading.Lock()
+
+    def throttling_request(uri, *args, **kwargs):
+        with lock:
+            requests[uri] += 1
+            throttle = requests[uri] <= times
+        if throttle:
+            return httplib2.Response({'status': 429}), b'{}'
+        return request(uri, *args, **kwargs)
+
+    monkeypatch.setattr(fake, 'request', throttling_request)
+
+
+def test_adaptive_limiter():
+    limiter = bulk_operations.AdaptiveLimiter(4, 6, cooldown=0)
+
+    for _ in range(4 + 5):
+        limiter.succeeded()
+    assert limiter.limit == 6
+
+    limiter.throttled()
+    assert limiter.limit == 3
+    for _ in range(3):
+        limiter.throttled()
+    assert limiter.limit == 1
+
+
+def test_adaptive_limiter_cooldown():
+    limiter = bulk_operations.AdaptiveLimiter(8, 8, cooldown=60)
+
+    limiter.throttled()
+    limiter.throttled()
+
+    assert limiter.limit == 4
+
+
+def test_read_items():
+    lines = [
+        'plain-name\n',
+        '\n',
+        json.dumps({'name': 'listed', 'size': '3'}) + '\n',
+        json.dumps({'change': 'deleted', 'name': 'gone'}) + '\n',
+    ]
+
+    assert [
+        bulk_operations.object_name(item)
+        for item in bulk_operations.read_items(lines)] == [
+            'plain-name', 'listed']
+
+
+def test_get_items_from_file(tmpdir):
+    listing = tmpdir.join('objects.ndjson')
+    listing.write('a\n' + json.dumps({'name': 'b'}) + '\n')
+
+    items = bulk_operations._get_items('bucket', str(listing), None)
+
+    assert [bulk_operations.object_name(item) for item in items] == [
+        'a', 'b']
+
+
+def test_bulk_delete(monkeypatch):
+    fake = make_fake()
+    throttle_first(fake, monkeypatch, 2)
+    service = fake_gcs.build_service(fake)
+
+    stats = bulk_operations.bulk_delete(
+        service, 'bucket', NAMES + ['missing'], num_workers=16,
+        num_retries=2, interval=0)
+
+    assert fake.object_names('bucket') == []
+    assert stats.succeeded == len(NAMES) + 1
+    assert stats.failures == []
+    # Every object was throttled twice, then deleted on its last try.
+    assert stats.throttled == (len(NAMES) + 1) * 2
+    assert stats.operations_per_second > 0
+
+
+def test_bulk_delete_gives_up_after_retries(monkeypatch):
+    fake = make_fake()
+    throttle_first(fake, monkeypatch, 3)
+
+    stats = bulk_operations.bulk_delete(
+        fake_gcs.build_service(fake), 'bucket', NAMES[:3], num_retries=2,
+        interval=0)
+
+    assert sorted(name for name, _ in stats.failures) == NAMES[:3]
+    assert stats.throttled == 3 * 2
+
+
+def test_bulk_copy_from_listing(monkeypatch):
+    fake = make_fake()
+    monkeypatch.setattr(
+        list_objects, 'create_service', lambda: fake_gcs.build_service(fake))
+
+    stats = bulk_operations.bulk_copy(
+        fake_gcs.build_service(fake), 'bucket',
+        list_objects.list_bucket('bucket', prefix='object-0'),
+        'backup', 'copies/')
+
+    assert stats.succeeded == 100
+    assert fake.object_names('backup') == ['copies/' + name for name in NAMES]
+    assert fake.get_data('backup', 'copies/object-042') == b'object-042'
+
+
+def test_bulk_rewrite_in_place():
+    fake = make_fake()
+
+    stats = bulk_operations.bulk_rewrite(
+        fake_gcs.build_service(fake), 'bucket', NAMES[:10],
+        body={'storageClass': 'NEARLINE'}, max_bytes_per_call=4)
+
+    assert stats.succeeded == 10
+    assert fake.request_count == 10 * 3
+    assert fake.get_data('bucket', 'object-005') == b'object-005'
+
+
+def test_bulk_copy_records_failures():
+    fake = make_fake(['exists'])
+
+    stats = bulk_operations.bulk_copy(
+        fake_gcs.build_service(fake), 'bucket', ['exists', 'missing'],
+        'backup')
+
+    assert stats.succeeded == 1
+    [(name, error)] = stats.failures
+    assert name == 'missing'
+    assert error.resp.status == 404
@@ -0,0 +1,282 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Computes the checksums Cloud Storage keeps for objects.
+
+Every object has a CRC32C checksum, and objects that weren't composed also
+have an MD5 hash. Both are reported in the object's metadata as base64
+encoded big-endian bytes.
+
+Data is hashed as it streams past, so that a transfer can be verified
+without reading the file again or keeping a copy of the download:
+
+* Hasher computes the hashes incrementally and checks them against an
+  object's metadata.
+* HashingReader wraps a file being uploaded, for MediaIoBaseUpload.
+* HashingWriter wraps a file being downloaded into, for
+  MediaIoBaseDownload, or discards the data once it is hashed.
+* read_chunks() and hashed() are generators for other pipelines.
+
+CRC32C is computed with crcmod's C extension if it is installed, and
+otherwise in pure Python, which is much slower. crc32c_combine() computes
+the checksum of two pieces of data joined together from the checksums of
+the pieces, which is how the checksum of a composed object relates to those
+of its sources.
+"""
+
+import base64
+import hashlib
+import struct
+
+try:
+    import crcmod.predefined
+except ImportError:
+    crcmod = None
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# The CRC32C (Castagnoli) polynomial, bit reversed.
+_POLY = 0x82F63B78
+
+
+class ChecksumMismatch(Exception):
+    """Raised when data doesn't match the checksum of the object."""
+
+
+def _make_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ (_POLY if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+
+_TABLE = _make_table()
+
+
+def _crc32c_python(data, crc=0):
+    crc ^= 0xFFFFFFFF
+    table = _TABLE
+    for byte in bytearray(data):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+if crcmod is not None:
+    _crc32c = crcmod.predefined.mkPredefinedCrcFun('crc-32c')
+else:
+    _crc32c = _crc32c_python
+
+
+def crc32c(data, crc=0):
+    """Returns the CRC32C of data, continuing from the CRC32C `crc` of the
+    data before it."""
+    return _crc32c(data, crc)
+
+
+def _gf2_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, matrix[row]) for row in range(32)]
+
+
+def crc32c_combine(crc1, crc2, length2):
+    """Returns the CRC32C of A followed by B, given the CRC32C of A, that of
+    B and the length of B.
+
+    This is zlib's crc32_combine() with the CRC32C polynomial: crc1 is
+    advanced past length2 zero bytes, by repeatedly squaring the operator
+    that appends a single zero bit, and then combined with crc2.
+    """
+    if length2 == 0:
+        return crc1
+
+    # The operator for one zero bit, then for two and four.
+    odd = [_POLY] + [1 << row for row in range(31)]
+    even = _gf2_square(odd)
+    odd = _gf2_square(even)
+
+    while True:
+        even = _gf2_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+        odd = _gf2_square(even)
+        if length2 & 1:
+            crc1 = _gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
+
+
+def encode_crc32c(value):
+    """Encodes a CRC32C the way object metadata reports it."""
+    return base64.b64encode(struct.pack('>I', value)).decode('ascii')
+
+
+def decode_crc32c(encoded):
+    return struct.unpack('>I', base64.b64decode(encoded))[0]
+
+
+def encode_md5(digest):
+    """Encodes an MD5 digest the way object metadata reports it."""
+    return base64.b64encode(digest).decode('ascii')
+
+
+class Hasher(object):
+    """Computes an MD5 hash and a CRC32C of data incrementally.
+
+    Args:
+        md5: whether to compute the MD5 hash.
+        crc32c: whether to compute the CRC32C, which is slow without crcmod.
+    """
+
+    def __init__(self, md5=True, crc32c=False):
+        self._md5 = hashlib.md5() if md5 else None
+        self._crc32c = 0 if crc32c else None
+        self.size = 0
+
+    @classmethod
+    def for_object(cls, resource):
+        """Returns a Hasher computing the cheapest hash the object has:
+        its MD5 hash, or its CRC32C if it was composed."""
+        if 'md5Hash' in resource:
+            return cls(md5=True, crc32c=False)
+        return cls(md5=False, crc32c=True)
+
+    def update(self, data):
+        if self._md5 is not None:
+            self._md5.update(data)
+        if self._crc32c is not None:
+            self._crc32c = crc32c(data, self._crc32c)
+        self.size += len(data)
+
+    def hashes(self):
+        """Returns the computed hashes, keyed by their metadata field."""
+        hashes = {}
+        if self._md5 is not None:
+            hashes['md5Hash'] = encode_md5(self._md5.digest())
+        if self._crc32c is not None:
+            hashes['crc32c'] = encode_crc32c(self._crc32c)
+        return hashes
+
+    def verify(self, resource, description='data'):
+        """Checks the hashes against those in an object's metadata.
+
+        Returns:
+            The number of hashes compared.
+
+        Raises:
+            ChecksumMismatch: if a hash doesn't match.
+        """
+        checked = 0
+        for field, value in sorted(self.hashes().items()):
+            expected = resource.get(field)
+            if expected is None:
+                continue
+            if expected != value:
+                raise ChecksumMismatch(
+                    '{} of {} is {}, but {} has {}.'.format(
+                        field, description, value,
+                        resource.get('name', 'the object'), expected))
+            checked += 1
+        return checked
+
+
+def read_chunks(f, chunksize=DEFAULT_CHUNK_SIZE):
+    """Yields the contents of a file object in chunks."""
+    while True:
+        chunk = f.read(chunksize)
+        if not chunk:
+            return
+        yield chunk
+
+
+def hashed(chunks, hasher):
+    """Passes chunks of data through, hashing them on the way."""
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+
+def hash_file(filename, hasher=None, chunksize=DEFAULT_CHUNK_SIZE):
+    """Hashes a local file, returning the Hasher."""
+    hasher = hasher or Hasher()
+    with open(filename, 'rb') as f:
+        for _ in hashed(read_chunks(f, chunksize), hasher):
+            pass
+    return hasher
+
+
+class HashingReader(object):
+    """Wraps a file object, hashing its data the first time it is read.
+
+    The upload code may seek back and read data again, for example when the
+    server received less of a chunk than was sent, but the data must be
+    read in order.
+    """
+
+    def __init__(self, f, hasher):
+        self._f = f
+        self.hasher = hasher
+        self._hashed = f.tell()
+
+    def seek(self, offset, whence=0):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def read(self, size=-1):
+        position = self._f.tell()
+        if position > self._hashed:
+            raise ValueError('Data must be read in order to be hashed.')
+        data = self._f.read(size)
+        new = data[self._hashed - position:]
+        if new:
+            self.hasher.update(new)
+            self._hashed += len(new)
+        return data
+
+
+class HashingWriter(object):
+    """Wraps a file object, hashing the data written to it.
+
+    Without a file object the data is only hashed, which verifies a
+    download without keeping it.
+    """
+
+    def __init__(self, hasher, f=None):
+        self.hasher = hasher
+        self._f = f
+
+    def write(self, data):
+        self.hasher.update(data)
+        if self._f is not None:
+            self._f.write(data)
@@ -0,0 +1,94 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+
+import checksums
+import fake_gcs
+from googleapiclient import http
+import pytest
+
+DATA = os.urandom(10000)
+
+
+def test_crc32c():
+    # The check value from the CRC catalogue.
+    assert checksums.crc32c(b'123456789') == 0xE3069283
+    assert checksums.crc32c(DATA[5000:], checksums.crc32c(DATA[:5000])) == (
+        checksums.crc32c(DATA))
+    assert checksums.decode_crc32c(checksums.encode_crc32c(1234)) == 1234
+
+
+def test_hasher_verify():
+    fake = fake_gcs.FakeGcs()
+    resource = fake.add_object('bucket', 'object', DATA)
+    hasher = checksums.Hasher(md5=True, crc32c=True)
+    passed_through = checksums.Hasher()
+    for chunk in checksums.hashed([DATA[:10], DATA[10:]], passed_through):
+        hasher.update(chunk)
+
+    assert hasher.verify(resource) == 2
+    assert hasher.size == len(DATA)
+    assert passed_through.verify(resource) == 1
+    assert set(checksums.Hasher.for_object(resource).hashes()) == (
+        {'md5Hash'})
+    assert set(checksums.Hasher.for_object({'crc32c': ''}).hashes()) == (
+        {'crc32c'})
+
+    hasher.update(b'more')
+    with pytest.raises(checksums.ChecksumMismatch):
+        hasher.verify(resource)
+
+
+def test_hashing_reader_and_writer():
+    fake = fake_gcs.FakeGcs()
+    service = fake_gcs.build_service(fake)
+    upload_hasher = checksums.Hasher(crc32c=True)
+
+    resource = service.objects().insert(
+        bucket='bucket', name='object',
+        media_body=http.MediaIoBaseUpload(
+            checksums.HashingReader(io.BytesIO(DATA), upload_hasher),
+            'application/octet-stream', chunksize=256 * 1024,
+            resumable=True)).execute()
+
+    download_hasher = checksums.Hasher(crc32c=True)
+    downloader = http.MediaIoBaseDownload(
+        checksums.HashingWriter(download_hasher),
+        service.objects().get_media(bucket='bucket', object='object'),
+        chunksize=3000)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk()
+
+    assert upload_hasher.verify(resource) == 2
+    assert download_hasher.verify(resource) == 2
+
+
+def test_hashing_reader_rereads():
+    hasher = checksums.Hasher()
+    reader = checksums.HashingReader(io.BytesIO(DATA), hasher)
+
+    reader.read(100)
+    reader.seek(50)
+    reader.read()
+
+    expected = checksums.Hasher()
+    expected.update(DATA)
+    assert hasher.hashes() == expected.hashes()
+
+    skipping = checksums.HashingReader(io.BytesIO(DATA), checksums.Hasher())
+    skipping.seek(10)
+    with pytest.raises(ValueError):
+        skipping.read()
@@ -24,6 +24,13 @@ This sample is used on this page:
 
 For more information, see the README.md under /storage.
 
+A compose request takes at most 32 sources, so any more are composed as a
+balanced tree of intermediate objects, each level of the tree in parallel,
+and the intermediate objects are deleted afterwards. The source files are
+uploaded concurrently. The composed object's CRC32C is checked against
+those of its sources, and then against its data, which is streamed through
+a hash rather than held in memory.
+
 To run, create a least two sample files:
     $ echo "File 1" > file1.txt
     $ echo "File 2" > file2.txt
@@ -31,62 +38,111 @@ To run, create a least two sample files:
 Example invocation:
     $ python compose_objects.py my-bucket destination.txt file1.txt file2.txt
 
+To merge objects already in the bucket, such as the shards of a BigQuery
+export, in name order:
+    $ python compose_objects.py my-bucket export.json --prefix export/shard-
+
 """
 
 import argparse
+from concurrent import futures
 import json
+import uuid
 
-from googleapiclient import discovery
-from oauth2client.client import GoogleCredentials
+import checksums
+import composite_upload
+from googleapiclient import http
+import list_objects
+import services
 
+DEFAULT_NUM_WORKERS = 16
 
-def main(bucket, destination, sources):
-    # Get the application default credentials. When running locally, these are
-    # available after running `gcloud init`. When running on compute
-    # engine, these are available from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
-    # Construct the service object for the interacting with the Cloud Storage
-    # API.
-    service = discovery.build('storage', 'v1', credentials=credentials)
 
-    # Upload the source files.
-    for filename in sources:
+def upload_sources(service, bucket, filenames, executor):
+    """Uploads the source files concurrently, returning their resources."""
+    def upload(filename):
         req = service.objects().insert(
             media_body=filename,
             name=filename,
             bucket=bucket)
-        resp = req.execute()
+        resp = req.execute(num_retries=5)
         print('> Uploaded source file {}'.format(filename))
-        print(json.dumps(resp, indent=2))
-
-    # Construct a request to compose the source files into the destination.
-    compose_req_body = {
-        'sourceObjects': [{'name': filename} for filename in sources],
-        'destination': {
-            'contentType': 'text/plain',    # required
-        }
-    }
-
-    req = service.objects().compose(
-        destinationBucket=bucket,
-        destinationObject=destination,
-        body=compose_req_body)
-
-    resp = req.execute()
-
-    print('> Composed files into {}'.format(destination))
-    print(json.dumps(resp, indent=2))
-
-    # Download and print the composed object.
+        return resp
+
+    return list(executor.map(upload, filenames))
+
+
+def compose_tree(service, bucket, sources, destination, body, executor):
+    """Composes any number of source objects into the destination object,
+    deleting the intermediate objects afterwards."""
+    temp_prefix = '{}.compose-{}'.format(destination, uuid.uuid4().hex[:8])
+    temporary = []
+    try:
+        return composite_upload.compose_all(
+            service, bucket, list(sources), destination, body, temp_prefix,
+            executor, temporary)
+    finally:
+        composite_upload.delete_objects(service, bucket, temporary)
+
+
+def verify_composed(service, bucket, resource, sources):
+    """Checks the composed object against its sources and its data.
+
+    Raises:
+        checksums.ChecksumMismatch: if it doesn't match.
+    """
+    expected = checksums.encode_crc32c(
+        composite_upload.combined_crc32c(sources))
+    if resource['crc32c'] != expected:
+        raise checksums.ChecksumMismatch(
+            'Composed object {} has CRC32C {}, but its sources make {}.'
+            .format(resource['name'], resource['crc32c'], expected))
+
+    # Download the composed object in chunks, hashing and discarding each,
+    # rather than reading it all into memory.
+    hasher = checksums.Hasher(md5=False, crc32c=True)
     req = service.objects().get_media(
-        bucket=bucket,
-        object=destination)
-
-    res = req.execute()
+        bucket=bucket, object=resource['name'],
+        generation=resource['generation'])
+    downloader = http.MediaIoBaseDownload(
+        checksums.HashingWriter(hasher), req,
+        chunksize=checksums.DEFAULT_CHUNK_SIZE * 16)
+    done = False
+    while not done:
+        _, done = downloader.next_chunk(num_retries=5)
+    hasher.verify(resource, resource['name'])
+    return hasher.size
+
+
+def main(bucket, destination, sources, prefix=None,
+         num_workers=DEFAULT_NUM_WORKERS):
+    # Construct the service object for the interacting with the Cloud Storage
+    # API, using the application default credentials.
+    service = services.get_service('storage', 'v1')
+
+    executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        if prefix:
+            # Compose the objects under the prefix, which are listed in
+            # name order.
+            resources = list(list_objects.list_bucket(
+                bucket, prefix=prefix,
+                fields='nextPageToken,items(name,size,crc32c)'))
+        else:
+            # Upload the source files.
+            resources = upload_sources(service, bucket, sources, executor)
+
+        resp = compose_tree(
+            service, bucket, [source['name'] for source in resources],
+            destination, {'contentType': 'text/plain'}, executor)
+    finally:
+        executor.shutdown()
+
+    print('> Composed {} objects into {}'.format(len(resources), destination))
+    print(json.dumps(resp, indent=2))
 
-    print('> Composed file contents:')
-    print(res)
+    size = verify_composed(service, bucket, resp, resources)
+    print('> Verified the {} bytes of {}'.format(size, destination))
 
 
 if __name__ == '__main__':
@@ -95,9 +151,20 @@ if __name__ == '__main__':
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('bucket', help='Your Cloud Storage bucket.')
     parser.add_argument('destination', help='Destination file name.')
-    parser.add_argument('sources', nargs='+', help='Source files to compose.')
+    parser.add_argument('sources', nargs='*', help='Source files to compose.')
+    parser.add_argument(
+        '--prefix',
+        help='Compose the objects under this prefix instead of uploading '
+             'source files.')
+    parser.add_argument(
+        '-w', '--num_workers', type=int, default=DEFAULT_NUM_WORKERS,
+        help='Number of uploads or composes to run at once.')
 
     args = parser.parse_args()
 
-    main(args.bucket, args.destination, args.sources)
+    if not args.sources and not args.prefix:
+        parser.error('Give source files or a --prefix.')
+
+    main(args.bucket, args.destination, args.sources, args.prefix,
+         args.num_workers)
 # [END all]
@@ -11,7 +11,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import checksums
+import compose_objects
 from compose_objects import main
+import fake_gcs
+import list_objects
+import pytest
+import services
 
 
 def test_main(cloud_config, resource):
@@ -21,3 +27,55 @@ def test_main(cloud_config, resource):
         [resource('file1.txt'),
          resource('file2.txt')]
     )
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    service = fake_gcs.build_service(fake)
+    monkeypatch.setattr(services, 'get_service', lambda *args: service)
+    monkeypatch.setattr(list_objects, 'create_service', lambda: service)
+    return fake
+
+
+def test_main_uploads_and_composes_many_files(fake, tmpdir, capsys):
+    filenames = []
+    for index in range(40):
+        path = tmpdir.join('file{:02d}.txt'.format(index))
+        path.write('File {}\n'.format(index))
+        filenames.append(str(path))
+
+    main('bucket', 'dest.txt', filenames)
+
+    assert fake.get_data('bucket', 'dest.txt') == b''.join(
+        'File {}\n'.format(index).encode('utf-8') for index in range(40))
+    assert fake.object_names('bucket') == sorted(filenames + ['dest.txt'])
+    out, _ = capsys.readouterr()
+    assert '> Verified the 310 bytes of dest.txt' in out
+
+
+def test_main_composes_prefix(fake, capsys):
+    for index in range(1000):
+        fake.add_object(
+            'bucket', 'export/shard-{:04d}'.format(index),
+            '{}\n'.format(index).encode('utf-8'))
+
+    main('bucket', 'export.json', [], prefix='export/shard-')
+
+    assert fake.get_data('bucket', 'export.json') == b''.join(
+        '{}\n'.format(index).encode('utf-8') for index in range(1000))
+    assert fake.object_names('bucket')[-1] == 'export/shard-0999'
+    assert len(fake.object_names('bucket')) == 1001
+
+
+def test_verify_composed_detects_corruption(fake):
+    service = fake_gcs.build_service(fake)
+    sources = [
+        fake.add_object('bucket', name, name.encode('utf-8'))
+        for name in ('a', 'b')]
+    resource = compose_objects.compose_tree(
+        service, 'bucket', ['a', 'b'], 'ab', None, None)
+
+    with pytest.raises(checksums.ChecksumMismatch):
+        compose_objects.verify_composed(
+            service, 'bucket', resource, sources[::-1])
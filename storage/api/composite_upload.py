@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Uploads a large file as parts in parallel, then composes them.
+
+A single upload stream is limited by the throughput of one connection. A
+parallel composite upload splits the file into parts, uploads each part
+concurrently as a temporary object, and then composes the parts into the
+destination object server-side:
+
+* The file is memory-mapped, and each part is read from its own slice of
+  the map, so the parts are read concurrently without sharing a file
+  position.
+* Each part's CRC32C is sent with it, so the server rejects a corrupted
+  part, and the parts' CRC32Cs are combined into that of the whole file.
+* A compose request takes at most 32 sources, so more parts are composed
+  as a balanced tree of intermediate objects, each level in parallel.
+* The parts and intermediate objects are deleted afterwards with batch
+  requests, whether or not the upload succeeded.
+* The CRC32C of the composed object is checked against that of the file.
+
+Example invocation:
+    $ python composite_upload.py my-bucket big-file.bin --parts 32
+"""
+
+import argparse
+from concurrent import futures
+import json
+import mmap
+import os
+import uuid
+
+import batch
+import checksums
+from googleapiclient import http
+import services
+
+DEFAULT_NUM_PARTS = 16
+DEFAULT_NUM_WORKERS = 8
+# Parts smaller than this aren't worth an extra request.
+DEFAULT_MIN_PART_SIZE = 4 * 1024 * 1024
+# Parts larger than this are sent with resumable uploads, in chunks of this
+# size, rather than in a single request.
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_COMPOSE_SOURCES = 32
+
+
+class FileSlice(object):
+    """A read-only file object over a slice of a buffer, such as an mmap.
+
+    Reading a slice doesn't move the position of the underlying buffer, so
+    several slices of one buffer can be read from different threads.
+    """
+
+    def __init__(self, buffer, offset, size):
+        self._buffer = buffer
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._position = min(max(offset, 0), self._size)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        end = self._size if size < 0 else min(
+            self._position + size, self._size)
+        data = self._buffer[self._offset + self._position:self._offset + end]
+        self._position = end
+        return bytes(data)
+
+
+def split(size, num_parts, min_part_size=DEFAULT_MIN_PART_SIZE):
+    """Returns the (offset, length) of each part of a file of `size` bytes.
+
+    The file is split into at most num_parts parts of equal length, but
+    into fewer if that would make them shorter than min_part_size.
+    """
+    if not size:
+        return [(0, 0)]
+    num_parts = max(1, min(num_parts, size // max(min_part_size, 1)))
+    part_size = -(-size // num_parts)
+    return [
+        (offset, min(part_size, size - offset))
+        for offset in range(0, size, part_size)]
+
+
+def upload_part(service, bucket, body, data, chunksize=DEFAULT_CHUNK_SIZE):
+    """Uploads a part, sending its CRC32C for the server to check.
+
+    Returns:
+        The part's CRC32C, as an integer, and the object's resource.
+    """
+    hasher = checksums.Hasher(md5=False, crc32c=True)
+    for chunk in checksums.read_chunks(data, chunksize):
+        hasher.update(chunk)
+    crc32c = hasher.hashes()['crc32c']
+    data.seek(0)
+
+    media = http.MediaIoBaseUpload(
+        data, 'application/octet-stream', chunksize=chunksize,
+        resumable=hasher.size > chunksize)
+    resource = service.objects().insert(
+        bucket=bucket, body=dict(body, crc32c=crc32c),
+        media_body=media).execute()
+    return checksums.decode_crc32c(crc32c), resource
+
+
+def compose(service, bucket, sources, destination, body=None):
+    """Composes up to 32 source objects into the destination object."""
+    return service.objects().compose(
+        destinationBucket=bucket,
+        destinationObject=destination,
+        body={
+            'sourceObjects': [{'name': name} for name in sources],
+            'destination': body or {
+                'contentType': 'application/octet-stream'},
+        }).execute()
+
+
+def plan_compose(num_sources, max_sources=MAX_COMPOSE_SOURCES):
+    """Plans a balanced tree of composes of any number of sources.
+
+    Each level composes the objects of the level below in as few groups as
+    the limit on sources allows, with the objects spread evenly across the
+    groups, until a single compose is left.
+
+    Returns:
+        The levels of the tree, from the sources up. Each level is a list of
+        the (start, end) range of the objects below that each compose on it
+        takes; the last level has a single compose, into the destination.
+    """
+    levels = []
+    count = num_sources
+    while True:
+        num_groups = max(1, -(-count // max_sources))
+        size, extra = divmod(count, num_groups)
+        ranges = []
+        start = 0
+        for index in range(num_groups):
+            end = start + size + (1 if index < extra else 0)
+            ranges.append((start, end))
+            start = end
+        levels.append(ranges)
+        if num_groups == 1:
+            return levels
+        count = num_groups
+
+
+def compose_all(service, bucket, sources, destination, body, temp_prefix,
+                executor, temporary):
+    """Composes any number of source objects into the destination object.
+
+    The sources are composed as a tree planned by plan_compose, each level's
+    composes in parallel, into intermediate objects named after temp_prefix
+    whose names are appended to `temporary` before they are created.
+    """
+    levels = plan_compose(len(sources))
+    for level, ranges in enumerate(levels[:-1]):
+        groups = [sources[start:end] for start, end in ranges]
+        targets = [
+            '{}/compose-{}-{:04d}'.format(temp_prefix, level, index)
+            for index in range(len(groups))]
+        temporary.extend(targets)
+        list(executor.map(
+            lambda group, target: compose(service, bucket, group, target),
+            groups, targets))
+        sources = targets
+
+    return compose(service, bucket, sources, destination, body)
+
+
+def combined_crc32c(resources):
+    """Returns the CRC32C, as an integer, of the concatenation of objects
+    with the given resources."""
+    crc32c = 0
+    for resource in resources:
+        crc32c = checksums.crc32c_combine(
+            crc32c, checksums.decode_crc32c(resource['crc32c']),
+            int(resource['size']))
+    return crc32c
+
+
+def delete_objects(service, bucket, names):
+    """Deletes objects with batch requests, ignoring those that are gone.
+
+    Returns:
+        The names that couldn't be deleted.
+    """
+    with batch.Batcher(service.new_batch_http_request) as batcher:
+        results = [
+            (name, batcher.add(service.objects().delete(
+                bucket=bucket, object=name)))
+            for name in names]
+
+    return [
+        name for name, result in results
+        if result.exception() is not None and
+        result.exception().resp.status != 404]
+
+
+def upload_file(service, bucket, filename, body,
+                num_parts=DEFAULT_NUM_PARTS, num_workers=DEFAULT_NUM_WORKERS,
+                min_part_size=DEFAULT_MIN_PART_SIZE,
+                chunksize=DEFAULT_CHUNK_SIZE):
+    """Uploads a file with a parallel composite upload.
+
+    Args:
+        service: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        bucket: the bucket to upload to.
+        filename: the local file to upload.
+        body: the metadata of the destination object, including its name.
+        num_parts: the most parts to split the file into.
+        num_workers: the number of parts uploaded concurrently.
+        min_part_size: the fewest bytes in a part.
+        chunksize: the largest part sent in a single request.
+
+    Returns:
+        The resource of the composed object.
+
+    Raises:
+        checksums.ChecksumMismatch: if the composed object's CRC32C doesn't
+            match the file.
+    """
+    name = body['name']
+    temp_prefix = '{}.parts-{}'.format(name, uuid.uuid4().hex[:8])
+    body = dict(body)
+    body.setdefault('contentType', 'application/octet-stream')
+
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # mmap can't map an empty file.
+        buffer = mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    parts = split(size, num_parts, min_part_size)
+    if len(parts) == 1:
+        # Nothing to compose, so upload straight to the destination.
+        part_bodies = [body]
+        temporary = []
+    else:
+        part_bodies = [
+            {'name': '{}/part-{:05d}'.format(temp_prefix, index)}
+            for index in range(len(parts))]
+        temporary = [part_body['name'] for part_body in part_bodies]
+
+    executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        crcs, resources = zip(*executor.map(
+            lambda part, part_body: upload_part(
+                service, bucket, part_body, FileSlice(buffer, *part),
+                chunksize),
+            parts, part_bodies))
+        resource = resources[0] if len(parts) == 1 else compose_all(
+            service, bucket, list(temporary), name, body, temp_prefix,
+            executor, temporary)
+    finally:
+        executor.shutdown()
+        if size:
+            buffer.close()
+        delete_objects(service, bucket, temporary)
+
+    crc32c = crcs[0]
+    for crc, (_, length) in zip(crcs[1:], parts[1:]):
+        crc32c = checksums.crc32c_combine(crc32c, crc, length)
+    if resource['crc32c'] != checksums.encode_crc32c(crc32c):
+        raise checksums.ChecksumMismatch(
+            'Composed object {} has CRC32C {}, but {} has {}.'.format(
+                name, resource['crc32c'], filename,
+                checksums.encode_crc32c(crc32c)))
+
+    return resource
+
+
+def main(bucket, filename, name, num_parts, num_workers):
+    service = services.get_service('storage', 'v1')
+    resource = upload_file(
+        service, bucket, filename, {'name': name or filename}, num_parts,
+        num_workers)
+    print(json.dumps(resource, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('bucket', help='Your Cloud Storage bucket.')
+    parser.add_argument('filename', help='The file to upload.')
+    parser.add_argument(
+        '--name', help='The name of the object. Defaults to the filename.')
+    parser.add_argument(
+        '-p', '--parts', help='The most parts to split the file into.',
+        type=int, default=DEFAULT_NUM_PARTS)
+    parser.add_argument(
+        '-w', '--num_workers', help='Number of parts to upload at once.',
+        type=int, default=DEFAULT_NUM_WORKERS)
+
+    args = parser.parse_args()
+
+    main(args.bucket, args.filename, args.name, args.parts, args.num_workers)
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks parallel composite uploads of a local file by part count.
+
+The uploads go to fake_gcs.FakeGcs, which stands in for the API. Every
+request to it takes `latency` seconds and each request moves media at
+`bandwidth` bytes per second, the way a single connection is limited, so
+uploading more parts at once makes better use of the link. One part is an
+ordinary upload of the whole file.
+
+CRC32C checksums are computed in pure Python unless crcmod's C extension is
+installed, which bounds the throughput at a few MB/s.
+
+Example invocation:
+    $ python composite_upload_benchmark.py --size_mb 16 --parts 1 4 16 64
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import checksums
+import composite_upload
+import fake_gcs
+
+
+def main(size_mb, part_counts, num_workers, latency, bandwidth):
+    temp_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(temp_dir, 'data.bin')
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(size_mb * 1024 * 1024))
+        size = os.path.getsize(filename)
+
+        print('CRC32C from {}.'.format(
+            'crcmod' if checksums.crcmod else 'pure Python'))
+        for num_parts in part_counts:
+            fake = fake_gcs.FakeGcs(latency=latency, bandwidth=bandwidth)
+            service = fake_gcs.build_service(fake)
+            start = time.time()
+            composite_upload.upload_file(
+                service, 'benchmark', filename, {'name': 'data.bin'},
+                num_parts, num_workers, min_part_size=1)
+            elapsed = time.time() - start
+
+            print('{} parts: {} requests, {:.2f}s, {:.1f} MB/s'.format(
+                num_parts, fake.request_count, elapsed, size / elapsed / 1e6))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        '--size_mb', help='Size of the file to upload.', type=int,
+        default=16)
+    parser.add_argument(
+        '--parts', help='Part counts to benchmark.', type=int, nargs='+',
+        default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument(
+        '-w', '--num_workers', help='Number of parts to upload at once.',
+        type=int, default=32)
+    parser.add_argument(
+        '--latency', help='Seconds each request takes.', type=float,
+        default=0.05)
+    parser.add_argument(
+        '--bandwidth', help='Bandwidth of each request in MB/s.', type=float,
+        default=5)
+
+    args = parser.parse_args()
+
+    main(
+        args.size_mb,
+        args.parts,
+        args.num_workers,
+        args.latency,
+        args.bandwidth * 1e6)
@@ -0,0 +1,128 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import os
+
+import checksums
+import composite_upload
+import crud_object
+import fake_gcs
+import pytest
+
+
+def write_file(tmpdir, size):
+    path = tmpdir.join('data.bin')
+    path.write_binary(os.urandom(size))
+    return str(path)
+
+
+def test_split():
+    assert composite_upload.split(10, 3, 1) == [(0, 4), (4, 4), (8, 2)]
+    assert composite_upload.split(10, 3, 5) == [(0, 5), (5, 5)]
+    assert composite_upload.split(10, 3, 100) == [(0, 10)]
+    assert composite_upload.split(0, 3, 1) == [(0, 0)]
+
+
+def test_plan_compose():
+    assert composite_upload.plan_compose(5) == [[(0, 5)]]
+    assert composite_upload.plan_compose(70) == [
+        [(0, 24), (24, 47), (47, 70)], [(0, 3)]]
+    levels = composite_upload.plan_compose(32 * 32 + 1)
+    assert [len(level) for level in levels] == [33, 2, 1]
+    assert max(end - start for start, end in levels[0]) == 32
+    assert min(end - start for start, end in levels[0]) == 31
+
+
+def test_file_slice():
+    data = composite_upload.FileSlice(b'0123456789', 2, 5)
+
+    assert data.read(2) == b'23'
+    assert data.read() == b'456'
+    assert data.seek(0, os.SEEK_END) == 5
+    data.seek(1)
+    assert data.read(100) == b'3456'
+
+
+def test_crc32c_combine():
+    first, second = os.urandom(1000), os.urandom(333)
+
+    assert checksums.crc32c_combine(
+        checksums.crc32c(first), checksums.crc32c(second), len(second)) == (
+        checksums.crc32c(first + second))
+
+
+@pytest.mark.parametrize('size,num_parts', [(100000, 4), (70000, 70), (0, 4)])
+def test_upload_file(tmpdir, size, num_parts):
+    fake = fake_gcs.FakeGcs()
+    service = fake_gcs.build_service(fake)
+    filename = write_file(tmpdir, size)
+
+    resource = composite_upload.upload_file(
+        service, 'bucket', filename, {'name': 'big'}, num_parts,
+        min_part_size=1, chunksize=16 * 1024)
+
+    with open(filename, 'rb') as f:
+        assert fake.get_data('bucket', 'big') == f.read()
+    assert int(resource['size']) == size
+    # The parts and intermediate composites were cleaned up.
+    assert fake.object_names('bucket') == ['big']
+
+
+def test_upload_file_cleans_up_after_failure(tmpdir, monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    service = fake_gcs.build_service(fake)
+    filename = write_file(tmpdir, 1000)
+
+    def compose(*args, **kwargs):
+        raise RuntimeError('Compose failed.')
+
+    monkeypatch.setattr(composite_upload, 'compose', compose)
+
+    with pytest.raises(RuntimeError):
+        composite_upload.upload_file(
+            service, 'bucket', filename, {'name': 'big'}, 4, min_part_size=1)
+
+    assert fake.object_names('bucket') == []
+
+
+def test_upload_file_checksum_mismatch(tmpdir, monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    service = fake_gcs.build_service(fake)
+    filename = write_file(tmpdir, 1000)
+    compose = composite_upload.compose
+
+    def corrupting_compose(service, bucket, sources, destination, body=None):
+        fake.add_object('bucket', sources[0], b'corrupted')
+        return compose(service, bucket, sources, destination, body)
+
+    monkeypatch.setattr(composite_upload, 'compose', corrupting_compose)
+
+    with pytest.raises(checksums.ChecksumMismatch):
+        composite_upload.upload_file(
+            service, 'bucket', filename, {'name': 'big'}, 4, min_part_size=1)
+
+
+def test_crud_object_upload_in_parts(tmpdir, monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    service = fake_gcs.build_service(fake)
+    monkeypatch.setattr(crud_object, 'create_service', lambda: service)
+    monkeypatch.setattr(composite_upload, 'upload_file', functools.partial(
+        composite_upload.upload_file, min_part_size=1))
+    filename = write_file(tmpdir, 5000)
+
+    resource = crud_object.upload_object(
+        'bucket', filename, ['reader@example.com'], [], num_parts=5)
+
+    assert resource['componentCount'] == 5
+    assert resource['acl'][0]['role'] == 'READER'
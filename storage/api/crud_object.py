@@ -24,28 +24,35 @@ For more information, see the README.md under /storage.
 """
 
 import argparse
-import filecmp
 import json
 import tempfile
 
-from googleapiclient import discovery
+import checksums
+import composite_upload
 from googleapiclient import http
+import services
+import sliced_download
 
-from oauth2client.client import GoogleCredentials
 
-
-def main(bucket, filename, readers=[], owners=[]):
+def main(bucket, filename, readers=[], owners=[], num_parts=None,
+         num_slices=None):
     print('Uploading object..')
-    resp = upload_object(bucket, filename, readers, owners)
+    resp = upload_object(bucket, filename, readers, owners, num_parts)
     print(json.dumps(resp, indent=2))
 
     print('Fetching object..')
-    with tempfile.NamedTemporaryFile(mode='w+b') as tmpfile:
-        get_object(bucket, filename, out_file=tmpfile)
-        tmpfile.seek(0)
-
-        if not filecmp.cmp(filename, tmpfile.name):
-            raise Exception('Downloaded file != uploaded object')
+    if num_slices:
+        # Sliced downloads need a file to write into, and verify it.
+        with tempfile.NamedTemporaryFile(mode='w+b') as tmpfile:
+            get_object(bucket, filename, tmpfile, num_slices)
+    else:
+        # Hash the object as it is downloaded, rather than keeping a copy
+        # to compare with the file. The upload was checked against the
+        # file's hashes as it was sent, so matching the object's metadata
+        # means the download matches the file.
+        hasher = checksums.Hasher.for_object(resp)
+        get_object(bucket, filename, out_file=checksums.HashingWriter(hasher))
+        hasher.verify(resp, 'the downloaded data')
 
     print('Deleting object..')
     resp = delete_object(bucket, filename)
@@ -55,19 +62,18 @@ def main(bucket, filename, readers=[], owners=[]):
 
 
 def create_service():
-    # Get the application default credentials. When running locally, these are
-    # available after running `gcloud init`. When running on compute
-    # engine, these are available from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
     # Construct the service object for interacting with the Cloud Storage API -
-    # the 'storage' service, at version 'v1'.
+    # the 'storage' service, at version 'v1'. The service is built once per
+    # process using the application default credentials, from a discovery
+    # document cached on disk, and then shared by every call.
     # You can browse other available api services and versions here:
     #     http://g.co/dev/api-client-library/python/apis/
-    return discovery.build('storage', 'v1', credentials=credentials)
+    return services.get_service('storage', 'v1')
 
 
-def upload_object(bucket, filename, readers, owners):
+def upload_object(bucket, filename, readers, owners, num_parts=None):
+    """Uploads a file. Given num_parts, large files are split into up to
+    that many parts, which are uploaded in parallel and then composed."""
     service = create_service()
 
     # This is the request body as specified:
@@ -94,23 +100,41 @@ def upload_object(bucket, filename, readers, owners):
             'email': o
         })
 
+    if num_parts:
+        return composite_upload.upload_file(
+            service, bucket, filename, body, num_parts)
+
     # Now insert them into the specified bucket as a media insertion.
     # http://g.co/dev/resources/api-libraries/documentation/storage/v1/python/latest/storage_v1.objects.html#insert
+    hasher = checksums.Hasher()
     with open(filename, 'rb') as f:
         req = service.objects().insert(
             bucket=bucket, body=body,
             # You can also just set media_body=filename, but # for the sake of
             # demonstration, pass in the more generic file handle, which could
-            # very well be a StringIO or similar.
-            media_body=http.MediaIoBaseUpload(f, 'application/octet-stream'))
+            # very well be a StringIO or similar. Wrapping it hashes the data
+            # as it is sent.
+            media_body=http.MediaIoBaseUpload(
+                checksums.HashingReader(f, hasher),
+                'application/octet-stream'))
         resp = req.execute()
 
+    # Check that the object holds what was sent.
+    hasher.verify(resp, filename)
     return resp
 
 
-def get_object(bucket, filename, out_file):
+def get_object(bucket, filename, out_file, num_slices=None):
+    """Downloads an object into out_file. Given num_slices, the object is
+    split into up to that many slices, which are downloaded in parallel
+    into the file named out_file.name."""
     service = create_service()
 
+    if num_slices:
+        sliced_download.download_file(
+            service, bucket, filename, out_file.name, num_slices)
+        return out_file
+
     # Use get_media instead of get to get the actual contents of the object.
     # http://g.co/dev/resources/api-libraries/documentation/storage/v1/python/latest/storage_v1.objects.html#get_media
     req = service.objects().get_media(bucket=bucket, object=filename)
@@ -144,7 +168,14 @@ if __name__ == '__main__':
                         help='Your Cloud Storage bucket.')
     parser.add_argument('--owner', action='append', default=[],
                         help='Your Cloud Storage bucket.')
+    parser.add_argument('-p', '--parts', type=int,
+                        help='Upload the file in up to this many parts at '
+                             'once, and compose them.')
+    parser.add_argument('-s', '--slices', type=int,
+                        help='Download the object in up to this many '
+                             'slices at once.')
 
     args = parser.parse_args()
 
-    main(args.bucket, args.filename, args.reader, args.owner)
+    main(args.bucket, args.filename, args.reader, args.owner, args.parts,
+         args.slices)
@@ -13,7 +13,11 @@
 
 import re
 
+import checksums
+import crud_object
 from crud_object import main
+import fake_gcs
+import pytest
 
 
 def test_main(cloud_config, capsys):
@@ -22,3 +26,33 @@ def test_main(cloud_config, capsys):
 
     assert not re.search(r'Downloaded file [!]=', out)
     assert re.search(r'Uploading.*Fetching.*Deleting.*Done', out, re.DOTALL)
+
+
+def test_main_verifies_with_hashes(monkeypatch, capsys):
+    fake = fake_gcs.FakeGcs()
+    monkeypatch.setattr(
+        crud_object, 'create_service', lambda: fake_gcs.build_service(fake))
+
+    crud_object.main('bucket', __file__)
+
+    out, _ = capsys.readouterr()
+    assert re.search(r'Uploading.*Fetching.*Deleting.*Done', out, re.DOTALL)
+    assert fake.object_names('bucket') == []
+
+
+def test_main_detects_corruption(monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    monkeypatch.setattr(
+        crud_object, 'create_service', lambda: fake_gcs.build_service(fake))
+    get = fake._get
+
+    def corrupting_get(bucket, name, query, headers):
+        status, response_headers, content = get(bucket, name, query, headers)
+        if query.get('alt') == 'media':
+            content = content[:-1] + b'!'
+        return status, response_headers, content
+
+    monkeypatch.setattr(fake, '_get', corrupting_get)
+
+    with pytest.raises(checksums.ChecksumMismatch):
+        crud_object.main('bucket', __file__)
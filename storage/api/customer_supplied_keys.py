@@ -27,12 +27,12 @@ For more information, see the README.md under /storage.
 """
 
 import argparse
-import filecmp
-import tempfile
+import base64
+import hashlib
 
-from googleapiclient import discovery
+import checksums
 from googleapiclient import http
-from oauth2client.client import GoogleCredentials
+import services
 
 
 # You can (and should) generate your own encryption key. Here's a good way to
@@ -52,99 +52,242 @@ KEY_HASH = 'aanjNC2nwso8e2FqcWILC3/Tt1YumvIwEj34kr6PRpI='
 ANOTHER_ENCRYPTION_KEY = 'oevtavYZC+TfGtV86kJBKTeytXAm1s2r3xIqam+QPKM='
 ANOTHER_KEY_HASH = '/gd0N3k3MK0SEDxnUiaswl0FFv6+5PHpo+5KD5SBCeA='
 
+# Encrypted objects are moved in chunks of this many bytes.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
 
 def create_service():
     """Creates the service object for calling the Cloud Storage API."""
-    # Get the application default credentials. When running locally, these are
-    # available after running `gcloud init`. When running on compute
-    # engine, these are available from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
     # Construct the service object for interacting with the Cloud Storage API -
-    # the 'storage' service, at version 'v1'.
+    # the 'storage' service, at version 'v1'. The service is built once per
+    # process using the application default credentials, from a discovery
+    # document cached on disk, and then shared by every call.
     # You can browse other available api services and versions here:
     #     https://developers.google.com/api-client-library/python/apis/
-    return discovery.build('storage', 'v1', credentials=credentials)
+    return services.get_service('storage', 'v1')
+
+
+# The base64-encoded SHA256 hash of each key seen, so it's derived once.
+_key_hashes = {}
+
+
+def key_sha256(encryption_key):
+    """Returns the base64-encoded SHA256 hash of a base64-encoded key."""
+    key_hash = _key_hashes.get(encryption_key)
+    if key_hash is None:
+        key_hash = base64.b64encode(hashlib.sha256(
+            base64.b64decode(encryption_key)).digest()).decode('ascii')
+        _key_hashes[encryption_key] = key_hash
+    return key_hash
+
+
+def encryption_headers(encryption_key, key_hash, prefix='x-goog-'):
+    """Returns the headers that supply a customer-supplied key. Use the
+    prefix 'x-goog-copy-source-' for the key of a copy or rewrite's source.
+    """
+    return {
+        prefix + 'encryption-algorithm': 'AES256',
+        prefix + 'encryption-key': encryption_key,
+        prefix + 'encryption-key-sha256': key_hash,
+    }
+
+
+class _KeyedHttp(object):
+    """Wraps an http object, adding headers to every request sent with it.
+
+    Media downloads, and the chunks of resumable uploads, are sent with
+    headers of their own rather than those of the HttpRequest, so the key
+    headers have to be added at the transport.
+    """
+
+    def __init__(self, http, headers):
+        self._http = http
+        self._headers = headers
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                *args, **kwargs):
+        headers = dict(headers or {})
+        headers.update(self._headers)
+        return self._http.request(uri, method, body, headers, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._http, name)
+
+
+class CsekSession(object):
+    """Reads and writes objects encrypted with a customer-supplied key.
+
+    Args:
+        service: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        encryption_key: the base64-encoded AES-256 key.
+        key_hash: the key's base64-encoded SHA256 hash, which is checked if
+            given, and otherwise derived.
+        chunksize: the bytes moved by each request of an upload or download;
+            a multiple of 256KiB.
+
+    Raises:
+        ValueError: if key_hash isn't the hash of the key.
+    """
+
+    def __init__(self, service, encryption_key, key_hash=None,
+                 chunksize=DEFAULT_CHUNK_SIZE):
+        self.service = service
+        self.key_hash = key_sha256(encryption_key)
+        if key_hash is not None and key_hash != self.key_hash:
+            raise ValueError('The key hash doesn\'t match the key.')
+        self.chunksize = chunksize
+        self.headers = encryption_headers(encryption_key, self.key_hash)
+        self.source_headers = encryption_headers(
+            encryption_key, self.key_hash, 'x-goog-copy-source-')
+
+    def attach(self, request, headers=None):
+        """Makes a request, and any requests that follow on from it, send
+        the key headers.
+
+        Returns:
+            The request.
+        """
+        headers = headers or self.headers
+        request.headers.update(headers)
+        request.http = _KeyedHttp(request.http, headers)
+        return request
+
+    def get(self, bucket, obj):
+        """Returns the object's metadata, with its hashes."""
+        return self.attach(self.service.objects().get(
+            bucket=bucket, object=obj)).execute(num_retries=5)
+
+    def upload(self, bucket, name, in_file,
+               content_type='application/octet-stream'):
+        """Uploads from a file object in chunks, checking the hashes of the
+        data sent against those of the object.
+
+        Returns:
+            The object's resource.
+        """
+        hasher = checksums.Hasher()
+        request = self.attach(self.service.objects().insert(
+            bucket=bucket, name=name,
+            # Wrapping the file hashes the data as it is sent.
+            media_body=http.MediaIoBaseUpload(
+                checksums.HashingReader(in_file, hasher), content_type,
+                chunksize=self.chunksize, resumable=True)))
+
+        resp = None
+        while resp is None:
+            _, resp = request.next_chunk(num_retries=5)
+
+        # Check that the object holds what was sent.
+        hasher.verify(resp, name)
+        return resp
+
+    def download(self, bucket, obj, out_file):
+        """Downloads into a file object in chunks, checking the data against
+        the object's hashes.
+
+        Returns:
+            The object's resource.
+        """
+        resource = self.get(bucket, obj)
+        hasher = checksums.Hasher.for_object(resource)
+        request = self.attach(self.service.objects().get_media(
+            bucket=bucket, object=obj, generation=resource['generation']))
+        downloader = http.MediaIoBaseDownload(
+            checksums.HashingWriter(hasher, out_file), request,
+            chunksize=self.chunksize)
+
+        done = False
+        while not done:
+            _, done = downloader.next_chunk(num_retries=5)
+
+        hasher.verify(resource, obj)
+        return resource
 
 
 def upload_object(bucket, filename, encryption_key, key_hash):
     """Uploads an object, specifying a custom encryption key."""
     service = create_service()
 
+    # The session attaches the key to every request of the upload, which is
+    # sent in chunks; you can pass it any file object, which could very well
+    # be a StringIO or similar.
+    session = CsekSession(service, encryption_key, key_hash)
     with open(filename, 'rb') as f:
-        request = service.objects().insert(
-            bucket=bucket, name=filename,
-            # You can also just set media_body=filename, but for the sake of
-            # demonstration, pass in the more generic file handle, which could
-            # very well be a StringIO or similar.
-            media_body=http.MediaIoBaseUpload(f, 'application/octet-stream'))
-        request.headers['x-goog-encryption-algorithm'] = 'AES256'
-        request.headers['x-goog-encryption-key'] = encryption_key
-        request.headers['x-goog-encryption-key-sha256'] = key_hash
-
-        resp = request.execute()
-
-    return resp
+        return session.upload(bucket, filename, f)
 
 
 def download_object(bucket, obj, out_file, encryption_key, key_hash):
-        """Downloads an object protected by a custom encryption key."""
-        service = create_service()
+    """Downloads an object protected by a custom encryption key."""
+    service = create_service()
 
-        request = service.objects().get_media(bucket=bucket, object=obj)
-        request.headers['x-goog-encryption-algorithm'] = 'AES256'
-        request.headers['x-goog-encryption-key'] = encryption_key
-        request.headers['x-goog-encryption-key-sha256'] = key_hash
+    # The object is downloaded in chunks, so it never needs to fit in
+    # memory.
+    session = CsekSession(service, encryption_key, key_hash)
+    return session.download(bucket, obj, out_file)
 
-        # Unfortunately, http.MediaIoBaseDownload overwrites HTTP headers,
-        # and so it cannot be used here. Instead, we shall download as a
-        # single request.
-        out_file.write(request.execute())
 
+def rewrite_rounds(service, bucket, obj, headers, max_bytes_per_call=None,
+                   rewrite_token=None, num_retries=5):
+    """Rewrites an object in place, in as many calls as the service needs.
 
-def rotate_key(bucket, obj, current_encryption_key, current_key_hash,
-               new_encryption_key, new_key_hash):
-    """Changes the encryption key used to store an existing object."""
-    service = create_service()
+    Args:
+        headers: the encryption headers of the source and destination.
+        max_bytes_per_call: the most bytes to rewrite in one call; a
+            multiple of 1MiB. Defaults to the service's choice.
+        rewrite_token: the token of an unfinished rewrite to continue.
 
-    request = service.objects().rewrite(
+    Yields:
+        The response to each call, the last of which is done and holds the
+        rewritten object's resource.
+    """
+    # For very large objects, calls to rewrite may not complete on the first
+    # call and may need to be resumed. Each call must carry the same
+    # parameters and keys, plus the token returned by the one before.
+    while True:
+        request = service.objects().rewrite(
             sourceBucket=bucket, sourceObject=obj,
             destinationBucket=bucket, destinationObject=obj,
+            rewriteToken=rewrite_token,
+            maxBytesRewrittenPerCall=max_bytes_per_call,
             body={})
+        request.headers.update(headers)
 
-    # For very large objects, calls to rewrite may not complete on the first
-    # call and may need to be resumed.
-    while True:
-        request.headers.update({
-            'x-goog-copy-source-encryption-algorithm': 'AES256',
-            'x-goog-copy-source-encryption-key': current_encryption_key,
-            'x-goog-copy-source-encryption-key-sha256': current_key_hash,
-            'x-goog-encryption-algorithm': 'AES256',
-            'x-goog-encryption-key': new_encryption_key,
-            'x-goog-encryption-key-sha256': new_key_hash})
-
-        rewrite_response = request.execute()
+        rewrite_response = request.execute(num_retries=num_retries)
+        yield rewrite_response
 
         if rewrite_response['done']:
-            break
+            return
+        rewrite_token = rewrite_response['rewriteToken']
 
-        print('Continuing rewrite call...')
-        request = service.objects().rewrite(
-                source_bucket=bucket, source_object=obj,
-                destination_bucket=bucket, destination_object=obj,
-                rewriteToken=rewrite_response['rewriteToken'])
-        rewrite_response.execute()
+
+def rotate_key(bucket, obj, current_encryption_key, current_key_hash,
+               new_encryption_key, new_key_hash, max_bytes_per_call=None):
+    """Changes the encryption key used to store an existing object."""
+    service = create_service()
+
+    headers = dict(CsekSession(
+        service, current_encryption_key, current_key_hash).source_headers)
+    headers.update(
+        CsekSession(service, new_encryption_key, new_key_hash).headers)
+
+    for rewrite_response in rewrite_rounds(
+            service, bucket, obj, headers, max_bytes_per_call):
+        if not rewrite_response['done']:
+            print('Continuing rewrite call...')
+    return rewrite_response['resource']
 
 
 def main(bucket, filename):
     print('Uploading object gs://{}/{}'.format(bucket, filename))
-    upload_object(bucket, filename, ENCRYPTION_KEY, KEY_HASH)
+    resp = upload_object(bucket, filename, ENCRYPTION_KEY, KEY_HASH)
     print('Downloading it back')
-    with tempfile.NamedTemporaryFile(mode='w+b') as tmpfile:
-        download_object(bucket, filename, tmpfile, ENCRYPTION_KEY, KEY_HASH)
-        tmpfile.seek(0)
-        assert filecmp.cmp(filename, tmpfile.name), \
-            'Downloaded file has different content from the original file.'
+    # The upload was checked against the file's hashes as it was sent, so
+    # a download matching the object's hashes matches the file.
+    hasher = checksums.Hasher.for_object(resp)
+    download_object(bucket, filename, checksums.HashingWriter(hasher),
+                    ENCRYPTION_KEY, KEY_HASH)
+    hasher.verify(resp, 'the downloaded data')
     print('Rotating its key')
     rotate_key(bucket, filename, ENCRYPTION_KEY, KEY_HASH,
                ANOTHER_ENCRYPTION_KEY, ANOTHER_KEY_HASH)
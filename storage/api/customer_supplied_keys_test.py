@@ -11,9 +11,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import io
+import os
 import re
 
+import customer_supplied_keys
 from customer_supplied_keys import main
+import fake_gcs
+from googleapiclient import errors
+import pytest
 
 
 def test_main(cloud_config, capsys):
@@ -22,3 +29,88 @@ def test_main(cloud_config, capsys):
 
     assert not re.search(r'Downloaded file [!]=', out)
     assert re.search(r'Uploading.*Downloading.*Rotating.*Done', out, re.DOTALL)
+
+
+def test_rotate_key_in_rounds(monkeypatch, capsys):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object(
+        'bucket', 'object', b'x' * 1000,
+        key_sha256=customer_supplied_keys.KEY_HASH)
+    monkeypatch.setattr(
+        customer_supplied_keys, 'create_service',
+        lambda: fake_gcs.build_service(fake))
+
+    resource = customer_supplied_keys.rotate_key(
+        'bucket', 'object', customer_supplied_keys.ENCRYPTION_KEY,
+        customer_supplied_keys.KEY_HASH,
+        customer_supplied_keys.ANOTHER_ENCRYPTION_KEY,
+        customer_supplied_keys.ANOTHER_KEY_HASH, max_bytes_per_call=400)
+
+    assert resource['customerEncryption']['keySha256'] == (
+        customer_supplied_keys.ANOTHER_KEY_HASH)
+    out, _ = capsys.readouterr()
+    assert out.count('Continuing rewrite call...') == 2
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    monkeypatch.setattr(
+        customer_supplied_keys, 'create_service',
+        lambda: fake_gcs.build_service(fake))
+    return fake
+
+
+def test_session_streams_in_chunks(fake):
+    data = os.urandom(3 * 256 * 1024 + 1000)
+    session = customer_supplied_keys.CsekSession(
+        fake_gcs.build_service(fake), customer_supplied_keys.ENCRYPTION_KEY,
+        chunksize=256 * 1024)
+    resource = session.upload('bucket', 'object', io.BytesIO(data))
+    assert resource['customerEncryption']['keySha256'] == (
+        customer_supplied_keys.KEY_HASH)
+    requests_before = fake.request_count
+
+    out_file = io.BytesIO()
+    session.download('bucket', 'object', out_file)
+
+    assert out_file.getvalue() == data
+    # The metadata, then four chunks.
+    assert fake.request_count - requests_before == 5
+
+
+def test_key_sha256_is_cached(monkeypatch):
+    monkeypatch.setattr(customer_supplied_keys, '_key_hashes', {})
+    key_hash = customer_supplied_keys.key_sha256(
+        customer_supplied_keys.ENCRYPTION_KEY)
+    monkeypatch.setattr(hashlib, 'sha256', None)
+
+    assert customer_supplied_keys.key_sha256(
+        customer_supplied_keys.ENCRYPTION_KEY) == key_hash
+
+
+def test_session_needs_the_right_key(fake):
+    fake.add_object(
+        'bucket', 'object', b'data',
+        key_sha256=customer_supplied_keys.KEY_HASH)
+    session = customer_supplied_keys.CsekSession(
+        fake_gcs.build_service(fake),
+        customer_supplied_keys.ANOTHER_ENCRYPTION_KEY)
+
+    with pytest.raises(errors.HttpError):
+        session.download('bucket', 'object', io.BytesIO())
+    with pytest.raises(ValueError):
+        customer_supplied_keys.CsekSession(
+            None, customer_supplied_keys.ENCRYPTION_KEY,
+            customer_supplied_keys.ANOTHER_KEY_HASH)
+
+
+def test_main_offline(fake, capsys):
+    main('bucket', __file__)
+
+    out, _ = capsys.readouterr()
+    assert re.search(r'Uploading.*Downloading.*Rotating.*Done', out, re.DOTALL)
+    resource = fake_gcs.build_service(fake).objects().get(
+        bucket='bucket', object=__file__).execute()
+    assert resource['customerEncryption']['keySha256'] == (
+        customer_supplied_keys.ANOTHER_KEY_HASH)
@@ -0,0 +1,765 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the Cloud Storage JSON API.
+
+FakeGcs answers HTTP requests in place of httplib2.Http, keeping buckets and
+objects in memory. build_service() returns a real googleapiclient service
+object on top of it, built from a discovery document describing the part of
+the API that these samples use, so that requests go through the client
+library's media upload, download and batch code unchanged.
+
+Every request sleeps for `latency` seconds before it is answered, and media
+is sent and received at `bandwidth` bytes per second per request, which
+approximates the round trip to the real API. FakeGcs.inject() makes chosen
+requests slower, fail with an error status or drop their connection, to
+test how the samples cope.
+
+FakeGcsServer serves a FakeGcs over HTTP on a local port instead, so that
+requests also go through httplib2 and a socket.
+"""
+
+import base64
+from email.parser import Parser
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+
+import checksums
+from googleapiclient import discovery
+import httplib2
+import services
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import parse_qs, unquote, urlparse
+
+ROOT_URL = 'https://www.googleapis.com/'
+
+_UPLOAD_PATH = re.compile(r'^/upload/storage/v1/b/([^/]+)/o$')
+# A bucket, object, or an action on an object such as /compose.
+_PATH = re.compile(r'^/storage/v1/b/([^/]+)(?:/o(?:/([^/]+)(/\w+)?)?)?$')
+# A copy or rewrite of one object to another.
+_COPY_PATH = re.compile(
+    r'^/storage/v1/b/([^/]+)/o/([^/]+)/(copyTo|rewriteTo)'
+    r'/b/([^/]+)/o/([^/]+)$')
+
+# The headers that carry a customer-supplied encryption key.
+_KEY_HEADER = 'x-goog-encryption'
+_SOURCE_KEY_HEADER = 'x-goog-copy-source-encryption'
+
+# The most source objects a single compose request accepts.
+MAX_COMPOSE_SOURCES = 32
+
+
+def _parameter(location, required=False, type='string'):
+    return {'type': type, 'location': location, 'required': required}
+
+
+def _method(name, http_method, path, parameters, request=None,
+            response='Object', **extra):
+    path_parameters = re.findall(r'{(\w+)}', path)
+    method = dict(extra, **{
+        'id': 'storage.' + name,
+        'path': path,
+        'httpMethod': http_method,
+        'parameters': dict(
+            [(p, _parameter('path', True)) for p in path_parameters] +
+            [(p, _parameter('query')) for p in parameters]),
+        'parameterOrder': path_parameters,
+    })
+    if request:
+        method['request'] = {'$ref': request}
+    if response:
+        method['response'] = {'$ref': response}
+    return method
+
+
+def discovery_document(root_url=ROOT_URL):
+    """Describes the methods of the storage v1 API that FakeGcs serves."""
+    upload_path = '/upload/storage/v1/b/{bucket}/o'
+    copy_path = (
+        'b/{{sourceBucket}}/o/{{sourceObject}}/{}/'
+        'b/{{destinationBucket}}/o/{{destinationObject}}')
+    return {
+        'kind': 'discovery#restDescription',
+        'name': 'storage',
+        'version': 'v1',
+        'rootUrl': root_url,
+        'servicePath': 'storage/v1/',
+        'batchPath': 'batch/storage/v1',
+        'parameters': {
+            'alt': _parameter('query'),
+            'fields': _parameter('query'),
+        },
+        'schemas': {
+            'Bucket': {'id': 'Bucket', 'type': 'object'},
+            'Object': {'id': 'Object', 'type': 'object'},
+            'Objects': {
+                'id': 'Objects',
+                'type': 'object',
+                'properties': {'nextPageToken': {'type': 'string'}},
+            },
+            'ComposeRequest': {'id': 'ComposeRequest', 'type': 'object'},
+            'RewriteResponse': {'id': 'RewriteResponse', 'type': 'object'},
+        },
+        'resources': {
+            'buckets': {'methods': {
+                'get': _method(
+                    'buckets.get', 'GET', 'b/{bucket}', [],
+                    response='Bucket'),
+            }},
+            'objects': {'methods': {
+                'insert': _method(
+                    'objects.insert', 'POST', 'b/{bucket}/o',
+                    ['name', 'ifGenerationMatch'], request='Object',
+                    supportsMediaUpload=True,
+                    mediaUpload={
+                        'accept': ['*/*'],
+                        'protocols': {
+                            'simple': {
+                                'multipart': True, 'path': upload_path},
+                            'resumable': {
+                                'multipart': True, 'path': upload_path},
+                        },
+                    }),
+                'list': _method(
+                    'objects.list', 'GET', 'b/{bucket}/o',
+                    ['prefix', 'delimiter', 'pageToken', 'maxResults',
+                     'versions'], response='Objects'),
+                'get': _method(
+                    'objects.get', 'GET', 'b/{bucket}/o/{object}',
+                    ['generation'], supportsMediaDownload=True),
+                'delete': _method(
+                    'objects.delete', 'DELETE', 'b/{bucket}/o/{object}',
+                    ['generation'], response=None),
+                'compose': _method(
+                    'objects.compose', 'POST',
+                    'b/{destinationBucket}/o/{destinationObject}/compose',
+                    [], request='ComposeRequest'),
+                'copy': _method(
+                    'objects.copy', 'POST', copy_path.format('copyTo'),
+                    ['sourceGeneration'], request='Object'),
+                'rewrite': _method(
+                    'objects.rewrite', 'POST', copy_path.format('rewriteTo'),
+                    ['sourceGeneration', 'rewriteToken',
+                     'maxBytesRewrittenPerCall'],
+                    request='Object', response='RewriteResponse'),
+            }},
+        },
+    }
+
+
+def build_service(fake):
+    """Builds a storage service object that sends its requests to fake."""
+    return discovery.build_from_document(
+        json.dumps(discovery_document()), http=fake)
+
+
+class _Fault(object):
+    """A fault injected into the requests that match a method and path."""
+
+    def __init__(self, status, drop, delay, method, path, after, times):
+        self.status = status
+        self.drop = drop
+        self.delay = delay
+        self.method = method
+        self.path = re.compile(path) if path else None
+        self.after = after
+        self.times = times
+
+    def fires(self, method, path):
+        """Counts a request, returning whether the fault applies to it.
+        Call with the lock held."""
+        if self.method not in (None, method) or (
+                self.path and not self.path.search(path)):
+            return False
+        if self.after:
+            self.after -= 1
+            return False
+        if self.times is None:
+            return True
+        if self.times:
+            self.times -= 1
+            return True
+        return False
+
+
+class FakeGcs(object):
+    """Serves the storage JSON API out of memory.
+
+    Args:
+        latency: seconds each request takes.
+        bandwidth: bytes per second at which each request sends or receives
+            media, or None for no limit.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._faults = []
+        self._buckets = {}
+        self._sessions = {}
+        self._generation = 0
+
+    def add_object(self, bucket, name, data, key_sha256=None, **metadata):
+        """Stores an object, as if it had been uploaded, encrypted with the
+        customer-supplied key whose hash is key_sha256 if one is given."""
+        with self._lock:
+            return self._store(
+                bucket, name, data, metadata, key_sha256=key_sha256)
+
+    def get_data(self, bucket, name):
+        return self._buckets[bucket][name]['data']
+
+    def object_names(self, bucket):
+        return sorted(self._buckets.get(bucket, {}))
+
+    def inject(self, status=None, drop=False, delay=0.0, method=None,
+               path=None, after=0, times=1):
+        """Makes requests that match a method and path fail or slow down.
+
+        Args:
+            status: the error status to answer with instead of serving the
+                requests, such as 429 or 503.
+            drop: whether to raise httplib2.HttpLib2Error instead, as a
+                dropped connection does.
+            delay: extra seconds each request takes.
+            method: the HTTP method of the requests, or None for any.
+            path: a regular expression searched for in the path of the
+                requests, such as '/rewriteTo/', or None for any.
+            after: the number of matching requests to serve first.
+            times: the number of matching requests to affect after those,
+                or None for every one.
+        """
+        with self._lock:
+            self._faults.append(
+                _Fault(status, drop, delay, method, path, after, times))
+
+    def _take_faults(self, method, uri):
+        path = urlparse(uri).path
+        with self._lock:
+            self.request_count += 1
+            return [
+                fault for fault in self._faults if fault.fires(method, path)]
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                redirections=5, connection_type=None):
+        faults = self._take_faults(method, uri)
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str) and not isinstance(body, bytes):
+            body = body.encode('utf-8')
+
+        status = next(
+            (fault.status for fault in faults if fault.status), None)
+        if status:
+            status, response_headers, content = _error(
+                status, 'Injected error.')
+        else:
+            status, response_headers, content = self._dispatch(
+                method, uri, body or b'', dict(
+                    (key.lower(), value)
+                    for key, value in (headers or {}).items()))
+
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode('utf-8')
+
+        delay = self.latency + sum(fault.delay for fault in faults)
+        if self.bandwidth:
+            delay += max(len(body or b''), len(content)) / float(
+                self.bandwidth)
+        if delay:
+            time.sleep(delay)
+        if any(fault.drop for fault in faults):
+            raise httplib2.HttpLib2Error('Injected connection drop.')
+
+        response_headers['status'] = status
+        return httplib2.Response(response_headers), content
+
+    def _dispatch(self, method, uri, body, headers):
+        parsed = urlparse(uri)
+        path = parsed.path
+        query = dict(
+            (key, values[0]) for key, values in parse_qs(parsed.query).items())
+
+        if path.startswith('/batch'):
+            return self._batch(body, headers)
+
+        upload = _UPLOAD_PATH.match(path)
+        if upload:
+            # Resumable sessions live at the URL the upload was sent to.
+            root_url = '{}://{}/'.format(parsed.scheme, parsed.netloc)
+            return self._upload(
+                unquote(upload.group(1)), query, body, headers, root_url)
+
+        copy = _COPY_PATH.match(path)
+        if copy:
+            with self._lock:
+                return self._copy(
+                    *[unquote(group) for group in copy.groups()],
+                    query=query, body=json.loads(body or b'{}'),
+                    headers=headers)
+
+        match = _PATH.match(path)
+        if not match:
+            return _error(404, 'Not Found')
+        bucket, name, action = [
+            unquote(group) if group else group for group in match.groups()]
+
+        with self._lock:
+            if name is None and path.endswith('/o'):
+                return self._list(bucket, query)
+            if name is None:
+                return self._get_bucket(bucket)
+            if action == '/compose':
+                return self._compose(bucket, name, json.loads(body))
+            if method == 'DELETE':
+                return self._delete(bucket, name)
+            return self._get(bucket, name, query, headers)
+
+    def _store(self, bucket, name, data, metadata, components=None,
+               crc32c=None, key_sha256=None):
+        data = bytes(data)
+        if crc32c is None:
+            crc32c = checksums.crc32c(data)
+        self._generation += 1
+        record = {
+            'data': data,
+            'generation': self._generation,
+            'metadata': dict(
+                (key, value) for key, value in metadata.items()
+                if key not in ('name', 'bucket', 'crc32c', 'md5Hash')),
+            'crc32c': checksums.encode_crc32c(crc32c),
+            'components': components,
+            'keySha256': key_sha256,
+        }
+        if components is None:
+            record['md5Hash'] = checksums.encode_md5(
+                hashlib.md5(data).digest())
+        self._buckets.setdefault(bucket, {})[name] = record
+        return _resource(bucket, name, record)
+
+    def _get_bucket(self, bucket):
+        if bucket not in self._buckets:
+            return _error(404, 'Not Found')
+        return 200, {}, {'kind': 'storage#bucket', 'name': bucket}
+
+    def _get(self, bucket, name, query, headers):
+        record = self._buckets.get(bucket, {}).get(name)
+        if record is None or query.get('generation', str(
+                record['generation'])) != str(record['generation']):
+            return _error(404, 'Not Found')
+        if query.get('alt') != 'media':
+            return 200, {}, _resource(bucket, name, record)
+        error = _check_key(record, headers, _KEY_HEADER)
+        if error:
+            return error
+
+        data = record['data']
+        match = re.match(r'bytes=(\d+)-(\d*)$', headers.get('range', ''))
+        if not match:
+            return 200, {'content-type': 'application/octet-stream'}, data
+        start = int(match.group(1))
+        end = min(int(match.group(2) or len(data) - 1), len(data) - 1)
+        if start >= len(data):
+            return _error(416, 'Requested range not satisfiable.')
+        return 206, {
+            'content-type': 'application/octet-stream',
+            'content-range': 'bytes {}-{}/{}'.format(start, end, len(data)),
+        }, data[start:end + 1]
+
+    def _list(self, bucket, query):
+        prefix = query.get('prefix', '')
+        delimiter = query.get('delimiter')
+        objects = self._buckets.get(bucket, {})
+
+        # Objects and prefixes, in name order, as they are paged through.
+        entries = []
+        for name in sorted(objects):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter and delimiter in rest:
+                common = prefix + rest[:rest.index(delimiter) + 1]
+                if not entries or entries[-1] != (common, True):
+                    entries.append((common, True))
+            else:
+                entries.append((name, False))
+
+        start = int(query.get('pageToken') or 0)
+        end = start + int(query.get('maxResults') or 1000)
+        reply = {'kind': 'storage#objects'}
+        items = [
+            _resource(bucket, name, objects[name])
+            for name, is_prefix in entries[start:end] if not is_prefix]
+        prefixes = [
+            name for name, is_prefix in entries[start:end] if is_prefix]
+        if items:
+            reply['items'] = items
+        if prefixes:
+            reply['prefixes'] = prefixes
+        if end < len(entries):
+            reply['nextPageToken'] = str(end)
+        return 200, {}, reply
+
+    def _delete(self, bucket, name):
+        if self._buckets.get(bucket, {}).pop(name, None) is None:
+            return _error(404, 'Not Found')
+        return 204, {}, b''
+
+    def _compose(self, bucket, name, body):
+        sources = body.get('sourceObjects', [])
+        if not sources or len(sources) > MAX_COMPOSE_SOURCES:
+            return _error(400, 'Too many or too few source objects.')
+
+        objects = self._buckets.get(bucket, {})
+        data = []
+        components = 0
+        crc32c = 0
+        for source in sources:
+            record = objects.get(source['name'])
+            if record is None:
+                return _error(404, 'Not Found')
+            data.append(record['data'])
+            components += record['components'] or 1
+            # Like the real service, derive the checksum from those of the
+            # sources rather than reading the data again.
+            crc32c = checksums.crc32c_combine(
+                crc32c, checksums.decode_crc32c(record['crc32c']),
+                len(record['data']))
+
+        return 200, {}, self._store(
+            bucket, name, b''.join(data), body.get('destination', {}),
+            components, crc32c)
+
+    def _copy(self, bucket, name, action, destination_bucket,
+              destination_name, query, body, headers):
+        record = self._buckets.get(bucket, {}).get(name)
+        if record is None:
+            return _error(404, 'Not Found')
+        key_sha256, error = _customer_key(headers, _KEY_HEADER)
+        error = error or _check_key(record, headers, _SOURCE_KEY_HEADER)
+        if error:
+            return error
+        metadata = body or record['metadata']
+
+        if action == 'copyTo':
+            return 200, {}, self._store(
+                destination_bucket, destination_name, record['data'],
+                metadata, record['components'],
+                checksums.decode_crc32c(record['crc32c']), key_sha256)
+
+        # A rewrite copies at most maxBytesRewrittenPerCall bytes a call,
+        # and the token says how far it has got.
+        size = len(record['data'])
+        token = query.get('rewriteToken') or '0'
+        if not token.isdigit():
+            return _error(400, 'Invalid rewrite token.')
+        done = int(token) + int(
+            query.get('maxBytesRewrittenPerCall') or size)
+        reply = {
+            'kind': 'storage#rewriteResponse',
+            'objectSize': str(size),
+            'totalBytesRewritten': str(min(done, size)),
+            'done': done >= size,
+        }
+        if done < size:
+            reply['rewriteToken'] = str(done)
+        else:
+            reply['resource'] = self._store(
+                destination_bucket, destination_name, record['data'],
+                metadata, record['components'],
+                checksums.decode_crc32c(record['crc32c']), key_sha256)
+        return 200, {}, reply
+
+    def _upload(self, bucket, query, body, headers, root_url):
+        upload_type = query.get('uploadType')
+        if upload_type == 'resumable' and 'upload_id' in query:
+            return self._put_chunk(query['upload_id'], body, headers)
+
+        if upload_type == 'resumable':
+            upload_id = uuid.uuid4().hex
+            with self._lock:
+                self._sessions[upload_id] = {
+                    'bucket': bucket,
+                    'metadata': json.loads(body.decode('utf-8') or '{}'),
+                    'name': query.get('name'),
+                    'data': bytearray(),
+                    'headers': headers,
+                }
+            location = '{}upload/storage/v1/b/{}/o?{}&upload_id={}'.format(
+                root_url, bucket, 'uploadType=resumable', upload_id)
+            return 200, {'location': location}, b''
+
+        if upload_type == 'multipart':
+            metadata, data = _parse_related(body, headers['content-type'])
+        else:
+            metadata, data = {}, body
+        return self._finish_upload(
+            bucket, query.get('name') or metadata.get('name'), data,
+            metadata, headers)
+
+    def _put_chunk(self, upload_id, body, headers):
+        with self._lock:
+            session = self._sessions.get(upload_id)
+        if session is None:
+            return _error(404, 'No such upload session.')
+
+        # Each request of an encrypted upload must carry the key.
+        key_sha256, error = _customer_key(session['headers'], _KEY_HEADER)
+        error = error or _check_key(
+            {'keySha256': key_sha256}, headers, _KEY_HEADER)
+        if error:
+            return error
+
+        data = session['data']
+        content_range = headers.get('content-range', '')
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        if match and int(match.group(1)) == len(data):
+            data.extend(body)
+
+        total = content_range.rsplit('/', 1)[-1]
+        if total == '*' or not total.isdigit() or len(data) < int(total):
+            response_headers = {}
+            if data:
+                response_headers['range'] = 'bytes=0-{}'.format(len(data) - 1)
+            return 308, response_headers, b''
+
+        with self._lock:
+            self._sessions.pop(upload_id, None)
+        return self._finish_upload(
+            session['bucket'],
+            session['name'] or session['metadata'].get('name'), data,
+            session['metadata'], session['headers'])
+
+    def _finish_upload(self, bucket, name, data, metadata, headers):
+        if not name:
+            return _error(400, 'Required object name.')
+        key_sha256, error = _customer_key(headers, _KEY_HEADER)
+        if error:
+            return error
+
+        data = bytes(data)
+        crc32c = checksums.crc32c(data)
+        if metadata.get('crc32c', checksums.encode_crc32c(crc32c)) != (
+                checksums.encode_crc32c(crc32c)):
+            return _error(400, 'Provided CRC32C doesn\'t match data.')
+        md5 = metadata.get('md5Hash')
+        if md5 and md5 != checksums.encode_md5(hashlib.md5(data).digest()):
+            return _error(400, 'Provided MD5 hash doesn\'t match data.')
+
+        with self._lock:
+            return 200, {}, self._store(
+                bucket, name, data, metadata, crc32c=crc32c,
+                key_sha256=key_sha256)
+
+    def _batch(self, body, headers):
+        boundary = 'batch_' + uuid.uuid4().hex
+        parts = []
+        for part in _split_parts(body, headers['content-type']):
+            content_id = re.search(
+                br'Content-ID: <([^>]*)>', part).group(1).decode('utf-8')
+            payload = part.split(b'\r\n\r\n', 1)[-1].split(b'\n\n', 1)[-1]
+            request_line, rest = payload.decode('utf-8').split('\n', 1)
+            method, path = request_line.split(' ')[:2]
+            message = Parser().parsestr(rest)
+
+            status, _, content = self._dispatch(
+                method, ROOT_URL.rstrip('/') + path,
+                (message.get_payload() or '').encode('utf-8'),
+                dict((key.lower(), value) for key, value in message.items()))
+            if not isinstance(content, bytes):
+                content = json.dumps(content).encode('utf-8')
+            parts.append(
+                '--{}\r\n'
+                'Content-Type: application/http\r\n'
+                'Content-ID: <response-{}>\r\n\r\n'
+                'HTTP/1.1 {} {}\r\n'
+                'Content-Type: application/json\r\n\r\n'.format(
+                    boundary, content_id, status,
+                    'OK' if status < 300 else 'Error').encode('utf-8') +
+                content + b'\r\n')
+
+        content = b''.join(parts) + '--{}--\r\n'.format(boundary).encode(
+            'utf-8')
+        return 200, {
+            'content-type': 'multipart/mixed; boundary={}'.format(boundary),
+        }, content
+
+
+def _http():
+    http = httplib2.Http()
+    # An unfinished resumable upload answers 308, which isn't a redirect.
+    if hasattr(http, 'redirect_codes'):
+        http.redirect_codes = http.redirect_codes - set([308])
+    return http
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Hands each HTTP request to the server's FakeGcs."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _serve(self):
+        body = self.rfile.read(int(self.headers.get('content-length') or 0))
+        try:
+            response, content = self.server.fake.request(
+                self.server.url + self.path.lstrip('/'), self.command, body,
+                dict(self.headers.items()))
+        except httplib2.HttpLib2Error:
+            # Hang up without answering.
+            self.close_connection = True
+            return
+
+        self.send_response(response.status)
+        for key, value in response.items():
+            if key not in ('status', 'content-length'):
+                self.send_header(key, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class FakeGcsServer(object):
+    """Serves a FakeGcs over HTTP on a local port, from background threads.
+
+    Use it as a context manager:
+
+        with FakeGcsServer(FakeGcs(latency=0.01)) as server:
+            service = server.build_service()
+
+    Args:
+        fake: the FakeGcs to serve, or None for a new one.
+    """
+
+    def __init__(self, fake=None):
+        self.fake = fake or FakeGcs()
+        self._server = _ThreadingServer(('127.0.0.1', 0), _Handler)
+        self._server.fake = self.fake
+        self.url = 'http://127.0.0.1:{}/'.format(
+            self._server.server_address[1])
+        self._server.url = self.url
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def build_service(self):
+        """Builds a storage service object that sends its requests to the
+        server, safe to use from several threads."""
+        return discovery.build_from_document(
+            json.dumps(discovery_document(self.url)),
+            http=services.ThreadLocalHttp(_http))
+
+
+def _resource(bucket, name, record):
+    resource = dict(record['metadata'], **{
+        'kind': 'storage#object',
+        'id': '{}/{}/{}'.format(bucket, name, record['generation']),
+        'bucket': bucket,
+        'name': name,
+        'generation': str(record['generation']),
+        'metageneration': '1',
+        'size': str(len(record['data'])),
+        'crc32c': record['crc32c'],
+    })
+    resource.setdefault('contentType', 'application/octet-stream')
+    if record['components'] is None:
+        resource['md5Hash'] = record['md5Hash']
+    else:
+        resource['componentCount'] = record['components']
+    if record['keySha256']:
+        resource['customerEncryption'] = {
+            'encryptionAlgorithm': 'AES256',
+            'keySha256': record['keySha256'],
+        }
+    return resource
+
+
+def _customer_key(headers, prefix):
+    """Returns the hash of the customer-supplied key in the headers with
+    the prefix, if any, and an error if the key doesn't match its hash."""
+    key = headers.get(prefix + '-key')
+    if key is None:
+        return None, None
+    key_sha256 = headers.get(prefix + '-key-sha256')
+    digest = base64.b64encode(
+        hashlib.sha256(base64.b64decode(key)).digest()).decode('ascii')
+    if headers.get(prefix + '-algorithm') != 'AES256' or (
+            digest != key_sha256):
+        return None, _error(400, 'Invalid customer-supplied key.')
+    return key_sha256, None
+
+
+def _check_key(record, headers, prefix):
+    """Returns an error unless the headers with the prefix supply the key
+    the object is encrypted with."""
+    key_sha256, error = _customer_key(headers, prefix)
+    if error:
+        return error
+    if key_sha256 != record['keySha256']:
+        return _error(400, 'The customer-supplied key doesn\'t match.')
+    return None
+
+
+def _error(status, message):
+    return status, {}, {'error': {'code': status, 'message': message}}
+
+
+def _split_parts(body, content_type):
+    """Splits a multipart body into its parts, headers included."""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type).group(1)
+    delimiter = b'--' + boundary.encode('utf-8')
+    start = body.index(delimiter) + len(delimiter)
+    # Email generators break lines with \n, HTTP with \r\n.
+    linesep = b'\r\n' if body[start:start + 2] == b'\r\n' else b'\n'
+    parts = body[start:].split(linesep + delimiter)
+    # Each part starts with the line break after its delimiter, and the
+    # last one is the end of the closing delimiter.
+    return [part[len(linesep):] for part in parts[:-1]]
+
+
+def _parse_related(body, content_type):
+    """Splits a multipart/related upload into its metadata and media."""
+    metadata, media = [
+        re.split(br'\r?\n\r?\n', part, 1)[1]
+        for part in _split_parts(body, content_type)]
+    return json.loads(metadata.decode('utf-8')), media
@@ -0,0 +1,106 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import time
+
+import fake_gcs
+from googleapiclient import http
+from googleapiclient.errors import HttpError
+import httplib2
+import pytest
+
+DATA = os.urandom(3 * 256 * 1024 + 100)
+
+
+def test_inject_errors():
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'a', b'a')
+    fake.add_object('bucket', 'b', b'b')
+    service = fake_gcs.build_service(fake)
+    fake.inject(status=503, method='GET', path='/o/a$', times=2)
+
+    for _ in range(2):
+        with pytest.raises(HttpError) as excinfo:
+            service.objects().get(bucket='bucket', object='a').execute()
+        assert excinfo.value.resp.status == 503
+    # Other requests are served, and the fault wears off.
+    service.objects().get(bucket='bucket', object='b').execute()
+    service.objects().get(bucket='bucket', object='a').execute()
+    assert fake.request_count == 4
+
+
+def test_inject_drop_and_delay():
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'a', b'a')
+    service = fake_gcs.build_service(fake)
+    fake.inject(drop=True, after=1)
+    fake.inject(delay=0.2, method='DELETE', times=None)
+
+    service.objects().get(bucket='bucket', object='a').execute()
+    with pytest.raises(httplib2.HttpLib2Error):
+        service.objects().get(bucket='bucket', object='a').execute()
+
+    start = time.time()
+    service.objects().delete(bucket='bucket', object='a').execute()
+    assert time.time() - start >= 0.2
+
+
+def test_server():
+    with fake_gcs.FakeGcsServer() as server:
+        service = server.build_service()
+        for index in range(5):
+            server.fake.add_object(
+                'bucket', 'dir/{}'.format(index), b'x' * index)
+
+        # A resumable upload, in chunks.
+        resource = service.objects().insert(
+            bucket='bucket', name='data', media_body=http.MediaIoBaseUpload(
+                io.BytesIO(DATA), 'application/octet-stream',
+                chunksize=256 * 1024, resumable=True)).execute()
+        assert int(resource['size']) == len(DATA)
+
+        # A download, in ranges.
+        out = io.BytesIO()
+        downloader = http.MediaIoBaseDownload(
+            out, service.objects().get_media(bucket='bucket', object='data'),
+            chunksize=256 * 1024)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        assert out.getvalue() == DATA
+
+        # A listing, in pages.
+        req = service.objects().list(
+            bucket='bucket', prefix='dir/', maxResults=2)
+        names = []
+        while req:
+            resp = req.execute()
+            names.extend(item['name'] for item in resp['items'])
+            req = service.objects().list_next(req, resp)
+        assert names == ['dir/{}'.format(index) for index in range(5)]
+
+        service.objects().compose(
+            destinationBucket='bucket', destinationObject='composed',
+            body={'sourceObjects': [{'name': 'dir/1'}, {'name': 'dir/2'}]},
+        ).execute()
+        resp = service.objects().rewrite(
+            sourceBucket='bucket', sourceObject='composed',
+            destinationBucket='bucket', destinationObject='rewritten',
+            body={}).execute()
+        assert resp['done']
+        service.objects().delete(bucket='bucket', object='composed').execute()
+
+        assert server.fake.get_data('bucket', 'rewritten') == b'xxx'
+        assert 'composed' not in server.fake.object_names('bucket')
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rotates the customer-supplied encryption key of many objects.
+
+Rotating a key rewrites every byte of an object, which for a large object
+takes many rewrite calls, each continuing from the token returned by the
+one before. A KeyRotation:
+
+* rewrites several objects at once, each in calls of at most
+  `max_bytes_per_call` bytes;
+* appends each object's latest rewrite token to a journal file, so that a
+  rotation that stopped part way continues each object from its last token
+  rather than from the start, and skips the objects already rotated;
+* looks up the objects' metadata first, in batches, to skip those already
+  under the new key and to know how many bytes are left; and
+* reports the bytes rewritten per second and the estimated time left.
+
+The journal records key hashes but never the keys themselves.
+
+Example invocation:
+    $ python key_rotation.py my-bucket --prefix data/ \\
+        --current_key "$OLD_KEY" --new_key "$NEW_KEY"
+"""
+
+import argparse
+from concurrent import futures
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import batch
+import customer_supplied_keys
+from googleapiclient.errors import HttpError
+import list_objects
+import services
+
+DEFAULT_NUM_WORKERS = 8
+# The service requires a multiple of 1MiB.
+DEFAULT_MAX_BYTES_PER_CALL = 256 * 1024 * 1024
+DEFAULT_JOURNAL = 'key-rotation.journal'
+
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1000:
+            return '{:.1f} {}'.format(count, unit)
+        count /= 1000.0
+    return '{:.1f} TB'.format(count)
+
+
+class KeyRotation(object):
+    """Rotates the key of objects in a bucket from one customer-supplied key
+    to another.
+
+    Args:
+        service: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        bucket: the bucket holding the objects.
+        names: the names of the objects to rotate.
+        current_key: the base64-encoded key the objects are encrypted with.
+        new_key: the base64-encoded key to encrypt them with instead.
+        journal_path: the file to record progress in.
+        max_bytes_per_call: the most bytes rewritten by one call.
+        num_retries: number of times to retry in case of 500 error.
+    """
+
+    def __init__(self, service, bucket, names, current_key, new_key,
+                 journal_path=DEFAULT_JOURNAL,
+                 max_bytes_per_call=DEFAULT_MAX_BYTES_PER_CALL,
+                 num_retries=5):
+        self.service = service
+        self.bucket = bucket
+        self.names = list(names)
+        current = customer_supplied_keys.CsekSession(service, current_key)
+        new = customer_supplied_keys.CsekSession(service, new_key)
+        self.current_key_hash = current.key_hash
+        self.new_key_hash = new.key_hash
+        self.headers = dict(current.source_headers, **new.headers)
+        self.journal_path = journal_path
+        self.max_bytes_per_call = max_bytes_per_call
+        self.num_retries = num_retries
+
+        self.total_bytes = 0
+        self.bytes_rewritten = 0
+        self.objects_rotated = 0
+        self.failures = []
+        self.start = None
+        self._journal = None
+        self._sizes = {}
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _load_journal(self):
+        """Replays the journal of an earlier run of the same rotation."""
+        self._state = {}
+        try:
+            with open(self.journal_path, 'r') as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return
+        for index, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a crashed run may be cut short.
+                break
+            if index == 0 and entry != self._journal_header():
+                return
+            elif index:
+                self._state[entry['name']] = entry
+
+    def _open_journal(self):
+        """Starts a compacted journal holding the replayed state, then keeps
+        it open to append to."""
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(json.dumps(self._journal_header()) + '\n')
+            for entry in self._state.values():
+                f.write(json.dumps(entry) + '\n')
+        if os.name == 'nt' and os.path.exists(self.journal_path):
+            # os.rename can't replace an existing file on Windows.
+            os.remove(self.journal_path)
+        os.rename(temp_path, self.journal_path)
+        self._journal = open(self.journal_path, 'a')
+
+    def _journal_header(self):
+        return {
+            'bucket': self.bucket,
+            'current_key_sha256': self.current_key_hash,
+            'new_key_sha256': self.new_key_hash,
+        }
+
+    def _record(self, entry):
+        """Appends an object's progress to the journal. Call with the lock
+        held."""
+        self._state[entry['name']] = entry
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+
+    def _get_sizes(self, names):
+        """Returns the size of each object still under the current key.
+
+        Objects already under the new key are recorded as done.
+        """
+        with batch.Batcher(self.service.new_batch_http_request) as batcher:
+            results = [
+                (name, batcher.add(self.service.objects().get(
+                    bucket=self.bucket, object=name)))
+                for name in names]
+
+        sizes = {}
+        for name, result in results:
+            if result.exception() is not None:
+                self.failures.append((name, result.exception()))
+                continue
+            resource = result.result()
+            key_hash = resource.get('customerEncryption', {}).get('keySha256')
+            if key_hash == self.new_key_hash:
+                with self._lock:
+                    self._record({'name': name, 'done': True})
+            else:
+                sizes[name] = int(resource['size'])
+        return sizes
+
+    def _rotate(self, name):
+        entry = self._state.get(name, {'name': name, 'rewritten': 0})
+        token = entry.get('token')
+        try:
+            for response in customer_supplied_keys.rewrite_rounds(
+                    self.service, self.bucket, name, self.headers,
+                    self.max_bytes_per_call, token, self.num_retries):
+                entry = self._update(name, entry, response)
+        except HttpError as error:
+            if token is None or error.resp.status != 400:
+                raise
+            # The token has expired, so start the object over.
+            self._update(name, entry, {'totalBytesRewritten': 0})
+            self._rotate(name)
+
+    def _update(self, name, entry, response):
+        rewritten = int(response['totalBytesRewritten'])
+        with self._lock:
+            self.bytes_rewritten += rewritten - entry['rewritten']
+            entry = {
+                'name': name,
+                'rewritten': rewritten,
+                'token': response.get('rewriteToken'),
+                'done': response.get('done', False),
+            }
+            self._record(entry)
+            if entry['done']:
+                self.objects_rotated += 1
+        return entry
+
+    def report(self):
+        """Returns a line on the progress and speed of the rotation."""
+        with self._lock:
+            elapsed = time.time() - self.start
+            done = sum(
+                self._state.get(name, {}).get('rewritten', 0)
+                for name in self._sizes)
+            rate = self.bytes_rewritten / elapsed if elapsed else 0
+        remaining = self.total_bytes - done
+        eta = datetime.timedelta(
+            seconds=int(remaining / rate)) if rate else 'unknown'
+        return '{} objects rotated, {} of {} rewritten, {}/s, ETA {}'.format(
+            self.objects_rotated, _format_bytes(self.total_bytes - remaining),
+            _format_bytes(self.total_bytes), _format_bytes(rate), eta)
+
+    def run(self, num_workers=DEFAULT_NUM_WORKERS, progress=None,
+            progress_interval=10):
+        """Rotates the key of every object not already rotated.
+
+        Args:
+            num_workers: the number of objects rewritten at once.
+            progress: a file to write a report to every `progress_interval`
+                seconds, if any.
+
+        Returns:
+            The objects that couldn't be rotated, with their errors. The
+            journal is kept if there are any, so that another run can
+            finish the rotation, and removed otherwise.
+        """
+        self.start = time.time()
+        self._load_journal()
+        self._open_journal()
+        try:
+            pending = [
+                name for name in self.names
+                if not self._state.get(name, {}).get('done')]
+            self._sizes = self._get_sizes(pending)
+            self.total_bytes = sum(self._sizes.values())
+
+            executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+            try:
+                # Submit in the order of names: dict order is arbitrary
+                # before Python 3.6.
+                results = dict(
+                    (executor.submit(self._rotate, name), name)
+                    for name in pending if name in self._sizes)
+                self._wait(results, progress, progress_interval)
+            finally:
+                executor.shutdown()
+        finally:
+            self._journal.close()
+
+        if not self.failures:
+            os.remove(self.journal_path)
+        return self.failures
+
+    def _wait(self, results, progress, progress_interval):
+        pending = set(results)
+        while pending:
+            done, pending = futures.wait(
+                pending, timeout=progress_interval,
+                return_when=futures.FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    self.failures.append(
+                        (results[future], future.exception()))
+            if progress:
+                progress.write(self.report() + '\n')
+
+
+def main(bucket, prefix, current_key, new_key, journal_path, num_workers,
+         max_bytes_per_call):
+    service = services.get_service('storage', 'v1')
+    names = [
+        item['name'] for item in list_objects.list_bucket(
+            bucket, prefix=prefix, fields='nextPageToken,items(name)')]
+    rotation = KeyRotation(
+        service, bucket, names, current_key, new_key, journal_path,
+        max_bytes_per_call)
+    failures = rotation.run(num_workers, progress=sys.stderr)
+
+    for name, error in failures:
+        print('Failed: {}: {}'.format(name, error))
+    print(rotation.report())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('bucket', help='Your Cloud Storage bucket.')
+    parser.add_argument(
+        '--prefix', help='Rotate only the objects under this prefix.')
+    parser.add_argument(
+        '--current_key', required=True,
+        help='The base64-encoded key the objects are encrypted with.')
+    parser.add_argument(
+        '--new_key', required=True,
+        help='The base64-encoded key to encrypt the objects with.')
+    parser.add_argument(
+        '--journal', default=DEFAULT_JOURNAL,
+        help='Where to record progress, to resume from after a failure.')
+    parser.add_argument(
+        '-w', '--num_workers', help='Number of objects to rewrite at once.',
+        type=int, default=DEFAULT_NUM_WORKERS)
+    parser.add_argument(
+        '--max_mb_per_call', type=int,
+        default=DEFAULT_MAX_BYTES_PER_CALL // (1024 * 1024),
+        help='The most MiB to rewrite in one call.')
+
+    args = parser.parse_args()
+
+    main(args.bucket, args.prefix, args.current_key, args.new_key,
+         args.journal, args.num_workers, args.max_mb_per_call * 1024 * 1024)
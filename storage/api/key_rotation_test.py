@@ -0,0 +1,135 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+
+import customer_supplied_keys as keys
+import fake_gcs
+import httplib2
+import key_rotation
+
+NAMES = ['object-{}'.format(index) for index in range(5)]
+SIZE = 1000
+
+
+def make_fake():
+    fake = fake_gcs.FakeGcs()
+    for name in NAMES:
+        fake.add_object(
+            'bucket', name, os.urandom(SIZE), key_sha256=keys.KEY_HASH)
+    return fake
+
+
+def make_rotation(fake, tmpdir, **kwargs):
+    kwargs.setdefault('max_bytes_per_call', 300)
+    return key_rotation.KeyRotation(
+        fake_gcs.build_service(fake), 'bucket', NAMES, keys.ENCRYPTION_KEY,
+        keys.ANOTHER_ENCRYPTION_KEY, str(tmpdir.join('journal')), **kwargs)
+
+
+def key_hashes(fake):
+    service = fake_gcs.build_service(fake)
+    return set(
+        service.objects().get(bucket='bucket', object=name).execute()[
+            'customerEncryption']['keySha256'] for name in NAMES)
+
+
+def count_rewrites(fake, monkeypatch, fail_at=None):
+    """Counts rewrite requests, dropping the connection of the fail_at-th."""
+    request = fake.request
+    rewrites = []
+    lock = threading.Lock()
+
+    def counting_request(uri, *args, **kwargs):
+        if '/rewriteTo/' in uri:
+            with lock:
+                rewrites.append(uri)
+                if len(rewrites) == fail_at:
+                    raise httplib2.HttpLib2Error('Injected connection drop.')
+        return request(uri, *args, **kwargs)
+
+    monkeypatch.setattr(fake, 'request', counting_request)
+    return rewrites
+
+
+def test_rotation(tmpdir, monkeypatch):
+    fake = make_fake()
+    rewrites = count_rewrites(fake, monkeypatch)
+    rotation = make_rotation(fake, tmpdir)
+
+    assert rotation.run(num_workers=3) == []
+
+    assert key_hashes(fake) == {keys.ANOTHER_KEY_HASH}
+    # Each object in calls of at most 300 bytes.
+    assert len(rewrites) == len(NAMES) * 4
+    assert rotation.bytes_rewritten == len(NAMES) * SIZE
+    assert rotation.report().startswith(
+        '5 objects rotated, 5.0 KB of 5.0 KB rewritten')
+    assert not tmpdir.join('journal').exists()
+
+
+def test_rotation_resumes(tmpdir, monkeypatch):
+    fake = make_fake()
+    rewrites = count_rewrites(fake, monkeypatch, fail_at=7)
+
+    # The third call for the second object fails, and the others go on.
+    [(name, _)] = make_rotation(fake, tmpdir).run(num_workers=1)
+    assert name == NAMES[1]
+    assert tmpdir.join('journal').exists()
+
+    second = make_rotation(fake, tmpdir)
+    assert second.run(num_workers=1) == []
+
+    assert key_hashes(fake) == {keys.ANOTHER_KEY_HASH}
+    # Only the dropped call was repeated.
+    assert len(rewrites) == len(NAMES) * 4 + 1
+    assert second.objects_rotated == 1
+    assert 'ETA 0:00:00' in second.report()
+
+
+def test_rotation_skips_rotated_objects(tmpdir, monkeypatch):
+    fake = make_fake()
+    fake.add_object(
+        'bucket', NAMES[0], b'rotated', key_sha256=keys.ANOTHER_KEY_HASH)
+    rewrites = count_rewrites(fake, monkeypatch)
+
+    assert make_rotation(fake, tmpdir, max_bytes_per_call=None).run() == []
+
+    assert len(rewrites) == len(NAMES) - 1
+
+
+def test_rotation_restarts_expired_tokens(tmpdir):
+    fake = make_fake()
+    rotation = make_rotation(fake, tmpdir)
+    with open(rotation.journal_path, 'w') as f:
+        f.write(json.dumps(rotation._journal_header()) + '\n')
+        f.write(json.dumps({
+            'name': NAMES[0], 'rewritten': 600, 'token': 'expired',
+            'done': False}) + '\n')
+
+    assert rotation.run() == []
+
+    assert key_hashes(fake) == {keys.ANOTHER_KEY_HASH}
+
+
+def test_rotation_records_failures(tmpdir):
+    fake = make_fake()
+    fake.add_object('bucket', NAMES[0], b'other key', key_sha256='other')
+
+    [(name, error)] = make_rotation(fake, tmpdir).run()
+
+    assert name == NAMES[0]
+    assert error.resp.status == 400
+    assert tmpdir.join('journal').exists()
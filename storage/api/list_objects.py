@@ -24,25 +24,30 @@ For more information, see the README.md under /storage.
 """
 
 import argparse
+import collections
+from concurrent import futures
 import json
+import sys
 
-from googleapiclient import discovery
+import batch
+import object_index
+import services
 
-from oauth2client.client import GoogleCredentials
+DEFAULT_NUM_WORKERS = 8
+DEFAULT_FIELDS = (
+    'nextPageToken,prefixes,'
+    'items(name,generation,size,md5Hash,contentType,metadata(my-key))')
 
 
 def create_service():
     """Creates the service object for calling the Cloud Storage API."""
-    # Get the application default credentials. When running locally, these are
-    # available after running `gcloud init`. When running on compute
-    # engine, these are available from the environment.
-    credentials = GoogleCredentials.get_application_default()
-
     # Construct the service object for interacting with the Cloud Storage API -
-    # the 'storage' service, at version 'v1'.
+    # the 'storage' service, at version 'v1'. The service is built once per
+    # process using the application default credentials, from a discovery
+    # document cached on disk, and then shared by every call.
     # You can browse other available api services and versions here:
     #     https://developers.google.com/api-client-library/python/apis/
-    return discovery.build('storage', 'v1', credentials=credentials)
+    return services.get_service('storage', 'v1')
 
 
 def get_bucket_metadata(bucket):
@@ -55,28 +60,200 @@ def get_bucket_metadata(bucket):
     return req.execute()
 
 
-def list_bucket(bucket):
-    """Returns a list of metadata of the objects within the given bucket."""
-    service = create_service()
-
-    # Create a request to objects.list to retrieve a list of objects.
-    fields_to_return = \
-        'nextPageToken,items(name,size,contentType,metadata(my-key))'
-    req = service.objects().list(bucket=bucket, fields=fields_to_return)
-
-    all_objects = []
+def list_pages(service, bucket, prefix=None, delimiter=None,
+               fields=DEFAULT_FIELDS, page_size=None):
+    """Yields each page of an objects.list request, following pageToken."""
+    req = service.objects().list(
+        bucket=bucket, prefix=prefix, delimiter=delimiter, fields=fields,
+        maxResults=page_size)
     # If you have too many items to list in one request, list_next() will
     # automatically handle paging with the pageToken.
     while req:
-        resp = req.execute()
-        all_objects.extend(resp.get('items', []))
+        resp = req.execute(num_retries=5)
+        yield resp
         req = service.objects().list_next(req, resp)
-    return all_objects
 
 
-def main(bucket):
-    print(json.dumps(get_bucket_metadata(bucket), indent=2))
-    print(json.dumps(list_bucket(bucket), indent=2))
+class ShardedLister(object):
+    """Lists a bucket as prefix shards, several at once.
+
+    The keyspace is split on the delimiter: the first `shard_depth` levels
+    of common prefixes are discovered with delimited listings, and each
+    prefix below them is then listed as its own shard, concurrently with
+    the others. A page is fetched only when there is room for it, so at
+    most `num_workers * 2` pages are held in memory however large the
+    bucket is.
+
+    Objects come out in no particular order across shards.
+
+    Args:
+        service: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        bucket: the bucket to list.
+        shard_depth: how many levels of prefixes to split into shards.
+        delimiter: what separates the levels of a name.
+        num_workers: the most pages fetched at once.
+        fields: the partial response to ask for. Must include
+            nextPageToken and prefixes.
+        page_size: the most entries in a page.
+    """
+
+    def __init__(self, service, bucket, shard_depth=1, delimiter='/',
+                 num_workers=DEFAULT_NUM_WORKERS, fields=DEFAULT_FIELDS,
+                 page_size=None):
+        self.service = service
+        self.bucket = bucket
+        self.shard_depth = shard_depth
+        self.delimiter = delimiter
+        self.num_workers = num_workers
+        self.fields = fields
+        self.page_size = page_size
+        self.pages_listed = 0
+
+    def _list_page(self, prefix, delimiter, page_token):
+        return self.service.objects().list(
+            bucket=self.bucket, prefix=prefix or None, delimiter=delimiter,
+            pageToken=page_token, fields=self.fields,
+            maxResults=self.page_size).execute(num_retries=5)
+
+    def _expand(self, prefix, depth, page_token=None):
+        """Lists a page of the objects directly under a prefix.
+
+        Returns:
+            The objects, and the follow-up tasks: the next page, and a task
+            for each common prefix on this page.
+        """
+        resp = self._list_page(prefix, self.delimiter, page_token)
+        follow_ups = []
+        if resp.get('nextPageToken'):
+            follow_ups.append(
+                (self._expand, prefix, depth, resp['nextPageToken']))
+        for common_prefix in resp.get('prefixes', []):
+            if depth + 1 < self.shard_depth:
+                follow_ups.append((self._expand, common_prefix, depth + 1))
+            else:
+                follow_ups.append((self._list_shard, common_prefix))
+        return resp.get('items', []), follow_ups
+
+    def _list_shard(self, prefix, page_token=None):
+        """Lists a page of every object under a prefix."""
+        resp = self._list_page(prefix, None, page_token)
+        follow_ups = []
+        if resp.get('nextPageToken'):
+            follow_ups.append(
+                (self._list_shard, prefix, resp['nextPageToken']))
+        return resp.get('items', []), follow_ups
+
+    def list(self, prefix=''):
+        """Yields the metadata of every object under the prefix."""
+        tasks = collections.deque(
+            [(self._expand, prefix, 0)] if self.shard_depth else
+            [(self._list_shard, prefix)])
+        max_pending = self.num_workers * 2
+        pending = set()
+
+        executor = futures.ThreadPoolExecutor(max_workers=self.num_workers)
+        try:
+            while tasks or pending:
+                while tasks and len(pending) < max_pending:
+                    pending.add(executor.submit(*tasks.popleft()))
+                done, pending = futures.wait(
+                    pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    items, follow_ups = future.result()
+                    self.pages_listed += 1
+                    tasks.extend(follow_ups)
+                    for item in items:
+                        yield item
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown()
+
+
+def list_bucket(bucket, prefix=None, shard_depth=0,
+                num_workers=DEFAULT_NUM_WORKERS, fields=DEFAULT_FIELDS):
+    """Yields the metadata of the objects within the given bucket.
+
+    With a shard_depth, the bucket is listed as prefix shards concurrently
+    by a ShardedLister, and objects come out in no particular order.
+    """
+    service = create_service()
+
+    if shard_depth:
+        lister = ShardedLister(
+            service, bucket, shard_depth, num_workers=num_workers,
+            fields=fields)
+        for item in lister.list(prefix or ''):
+            yield item
+        return
+
+    # Create a request to objects.list to retrieve a list of objects, and
+    # yield them a page at a time rather than holding them all in memory.
+    for resp in list_pages(service, bucket, prefix, fields=fields):
+        for item in resp.get('items', []):
+            yield item
+
+
+def get_objects_metadata(bucket, names, batch_size=batch.DEFAULT_BATCH_SIZE):
+    """Retrieves the metadata of the named objects, sending the requests
+    in batches rather than one round trip per object.
+
+    Returns:
+        A list with, for each name, the object's metadata or None if it
+        doesn't exist.
+    """
+    service = create_service()
+
+    with batch.Batcher(service.new_batch_http_request, batch_size) as batcher:
+        results = [
+            batcher.add(service.objects().get(bucket=bucket, object=name))
+            for name in names]
+
+    metadata = []
+    for result in results:
+        error = result.exception()
+        if error is not None and error.resp.status != 404:
+            raise error
+        metadata.append(result.result() if error is None else None)
+    return metadata
+
+
+def write_ndjson(records, out=None):
+    """Writes records as newline-delimited JSON, one line as each arrives,
+    to stdout unless another file is given.
+
+    Returns:
+        The number of records written.
+    """
+    out = out or sys.stdout
+    count = 0
+    for record in records:
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+        count += 1
+    return count
+
+
+def main(bucket, object_names=(), ndjson=False, shard_depth=0,
+         num_workers=DEFAULT_NUM_WORKERS, index_path=None):
+    if object_names:
+        print(json.dumps(get_bucket_metadata(bucket), indent=2))
+        print(json.dumps(
+            get_objects_metadata(bucket, object_names), indent=2))
+        return
+
+    objects = list_bucket(
+        bucket, shard_depth=shard_depth, num_workers=num_workers)
+    if index_path:
+        # Only what changed since the index was last brought up to date.
+        with object_index.ObjectIndex(index_path, bucket) as index:
+            count = write_ndjson(index.sync(objects))
+        sys.stderr.write('{} changes.\n'.format(count))
+    elif ndjson:
+        write_ndjson(objects)
+    else:
+        print(json.dumps(get_bucket_metadata(bucket), indent=2))
+        print(json.dumps(list(objects), indent=2))
 
 
 if __name__ == '__main__':
@@ -84,7 +261,28 @@ if __name__ == '__main__':
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('bucket', help='Your Cloud Storage bucket.')
+    parser.add_argument(
+        '--object', dest='object_names', action='append', default=[],
+        help='An object to get the metadata of, instead of listing the '
+             'bucket. May be repeated; the requests are sent in batches.')
+    parser.add_argument(
+        '--ndjson', action='store_true',
+        help='Stream the objects out as newline-delimited JSON.')
+    parser.add_argument(
+        '--shard_depth', type=int, default=0,
+        help='List the bucket concurrently as shards, split on this many '
+             'levels of "/"-delimited prefixes.')
+    parser.add_argument(
+        '-w', '--num_workers', type=int, default=DEFAULT_NUM_WORKERS,
+        help='Number of pages to list at once when sharding.')
+    parser.add_argument(
+        '--index',
+        help='A local SQLite index of the bucket. Only the objects added, '
+             'changed or deleted since it was last updated are written, '
+             'as newline-delimited JSON, and the index is brought up to '
+             'date.')
 
     args = parser.parse_args()
 
-    main(args.bucket)
+    main(args.bucket, args.object_names, args.ndjson, args.shard_depth,
+         args.num_workers, args.index)
@@ -11,8 +11,87 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+
+import fake_gcs
+import list_objects
 from list_objects import main
+import pytest
+
+NAMES = sorted(
+    ['top-{}'.format(i) for i in range(3)] +
+    ['a/{}'.format(i) for i in range(25)] +
+    ['b/c/{}'.format(i) for i in range(7)] +
+    ['b/d/e/{}'.format(i) for i in range(4)] +
+    ['b/f'])
 
 
 def test_main(cloud_config):
     main(cloud_config.storage_bucket)
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    for name in NAMES:
+        fake.add_object('bucket', name, name.encode('utf-8'))
+    monkeypatch.setattr(
+        list_objects, 'create_service', lambda: fake_gcs.build_service(fake))
+    return fake
+
+
+def test_list_bucket_pages(fake):
+    service = fake_gcs.build_service(fake)
+    pages = list(list_objects.list_pages(service, 'bucket', page_size=10))
+
+    assert len(pages) == 4
+    assert [item['name'] for page in pages for item in page['items']] == (
+        NAMES)
+
+
+@pytest.mark.parametrize('shard_depth', [0, 1, 2, 3])
+def test_list_bucket_sharded(fake, shard_depth):
+    objects = list_objects.list_bucket(
+        'bucket', shard_depth=shard_depth, num_workers=3)
+
+    assert sorted(item['name'] for item in objects) == NAMES
+
+
+def test_list_bucket_prefix(fake):
+    objects = list_objects.list_bucket('bucket', prefix='b/', shard_depth=1)
+
+    assert sorted(item['name'] for item in objects) == [
+        name for name in NAMES if name.startswith('b/')]
+
+
+def test_sharded_lister_bounds_pending_pages(fake):
+    lister = list_objects.ShardedLister(
+        fake_gcs.build_service(fake), 'bucket', num_workers=1, page_size=5)
+    objects = lister.list()
+
+    next(objects)
+    # The root page, and at most two more for the one worker.
+    assert fake.request_count <= 3
+    assert len(list(objects)) == len(NAMES) - 1
+    assert lister.pages_listed == fake.request_count
+
+
+def test_main_index(fake, tmpdir, capsys):
+    index_path = str(tmpdir.join('index.db'))
+
+    main('bucket', ndjson=True, shard_depth=1, index_path=index_path)
+    out, _ = capsys.readouterr()
+    assert len(out.splitlines()) == len(NAMES)
+
+    fake.add_object('bucket', 'a/0', b'changed')
+    fake.add_object('bucket', 'new', b'new')
+    fake._delete('bucket', 'b/f')
+    main('bucket', ndjson=True, shard_depth=1, index_path=index_path)
+    out, err = capsys.readouterr()
+
+    changes = sorted(
+        (record['change'], record['name'])
+        for record in map(json.loads, out.splitlines()))
+    assert changes == [
+        ('added', 'new'), ('changed', 'a/0'), ('deleted', 'b/f')]
+    assert err == '3 changes.\n'
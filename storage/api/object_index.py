@@ -0,0 +1,178 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local SQLite index of a bucket's objects.
+
+Listing a large bucket again only to find what changed since the last
+listing is slow. The index records the name, generation, size and MD5 hash
+of every object seen, so that a new listing can be synced against it and
+only the objects added, changed or deleted since are passed on.
+"""
+
+import sqlite3
+import time
+
+# Rows written to the index per transaction.
+DEFAULT_BATCH_SIZE = 500
+
+ADDED = 'added'
+CHANGED = 'changed'
+DELETED = 'deleted'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    bucket TEXT NOT NULL,
+    name TEXT NOT NULL,
+    generation TEXT,
+    size INTEGER,
+    md5 TEXT,
+    sync INTEGER NOT NULL,
+    PRIMARY KEY (bucket, name)
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    sync INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+"""
+
+
+def _record(change, name, generation, size, md5):
+    record = {'change': change, 'name': name, 'generation': generation}
+    if size is not None:
+        record['size'] = str(size)
+    if md5 is not None:
+        record['md5Hash'] = md5
+    return record
+
+
+class ObjectIndex(object):
+    """The index of one bucket's objects, in a SQLite database file.
+
+    Several buckets may share a file. Use as a context manager, or call
+    close().
+    """
+
+    def __init__(self, path, bucket):
+        self.bucket = bucket
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute(
+            'SELECT COUNT(*) FROM objects WHERE bucket = ?',
+            (self.bucket,)).fetchone()[0]
+
+    def get(self, name):
+        """Returns the indexed generation, size and MD5 of an object, or
+        None if it isn't in the index."""
+        return self._db.execute(
+            'SELECT generation, size, md5 FROM objects '
+            'WHERE bucket = ? AND name = ?', (self.bucket, name)).fetchone()
+
+    def _diff_batch(self, sync, items):
+        """Returns the changes in a batch of items, and the rows to write
+        for them once the changes have been passed on."""
+        names = [item['name'] for item in items]
+        known = dict(
+            (name, generation) for name, generation in self._db.execute(
+                'SELECT name, generation FROM objects '
+                'WHERE bucket = ? AND name IN ({})'.format(
+                    ','.join('?' * len(names))),
+                [self.bucket] + names))
+
+        changes = []
+        rows = []
+        for item in items:
+            name = item['name']
+            row = (self.bucket, name, item.get('generation'),
+                   int(item['size']) if 'size' in item else None,
+                   item.get('md5Hash'), sync)
+            rows.append(row)
+            if name not in known:
+                changes.append(_record(ADDED, *row[1:5]))
+            elif known[name] != row[2]:
+                changes.append(_record(CHANGED, *row[1:5]))
+
+        return changes, rows
+
+    def _write_batch(self, rows):
+        with self._db:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+
+    def sync(self, items, batch_size=DEFAULT_BATCH_SIZE):
+        """Brings the index up to date with a complete listing of the bucket.
+
+        Args:
+            items: the metadata of every object in the bucket, in any order,
+                such as from list_objects.list_bucket. Each must have a
+                name, and should have a generation, size and md5Hash.
+            batch_size: the most objects looked up and written at once.
+
+        Yields:
+            A record of each object added or changed since the last sync, as
+            the listing is read, then of each object deleted since. A record
+            has the change (ADDED, CHANGED or DELETED), name and generation,
+            and the size and md5Hash if known.
+
+            Deletions are only found once the whole listing has been read,
+            so the generator must be exhausted for the sync to finish; if it
+            isn't, the next sync still finds everything that changed. A
+            batch is only written to the index once all of its changes have
+            been yielded, so none is lost if the caller stops early.
+        """
+        with self._db:
+            sync = self._db.execute(
+                'INSERT INTO syncs (bucket, started) VALUES (?, ?)',
+                (self.bucket, time.time())).lastrowid
+
+        items = iter(items)
+        while True:
+            chunk = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) == batch_size:
+                    break
+            if not chunk:
+                break
+            changes, rows = self._diff_batch(sync, chunk)
+            for change in changes:
+                yield change
+            self._write_batch(rows)
+
+        # Whatever this sync didn't see is gone from the bucket.
+        deleted = self._db.execute(
+            'SELECT name, generation, size, md5 FROM objects '
+            'WHERE bucket = ? AND sync != ?', (self.bucket, sync)).fetchall()
+        for row in deleted:
+            yield _record(DELETED, *row)
+
+        with self._db:
+            self._db.execute(
+                'DELETE FROM objects WHERE bucket = ? AND sync != ?',
+                (self.bucket, sync))
+            self._db.execute(
+                'UPDATE syncs SET finished = ? WHERE sync = ?',
+                (time.time(), sync))
@@ -0,0 +1,90 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import object_index
+
+
+def objects(*generations):
+    return [
+        {'name': 'object-{}'.format(index), 'generation': str(generation),
+         'size': '10', 'md5Hash': 'hash'}
+        for index, generation in enumerate(generations)]
+
+
+def changes(index, items, **kwargs):
+    return sorted(
+        (record['change'], record['name'], record['generation'])
+        for record in index.sync(items, **kwargs))
+
+
+def test_sync(tmpdir):
+    path = str(tmpdir.join('index.db'))
+    with object_index.ObjectIndex(path, 'bucket') as index:
+        assert changes(index, objects(1, 1, 1), batch_size=2) == [
+            ('added', 'object-0', '1'),
+            ('added', 'object-1', '1'),
+            ('added', 'object-2', '1')]
+        assert changes(index, objects(1, 1, 1)) == []
+
+    with object_index.ObjectIndex(path, 'bucket') as index:
+        assert changes(index, objects(1, 2)) == [
+            ('changed', 'object-1', '2'),
+            ('deleted', 'object-2', '1')]
+        assert len(index) == 2
+        assert index.get('object-1') == ('2', 10, 'hash')
+        assert index.get('object-2') is None
+
+
+def test_sync_buckets_are_separate(tmpdir):
+    path = str(tmpdir.join('index.db'))
+    with object_index.ObjectIndex(path, 'first') as first, \
+            object_index.ObjectIndex(path, 'second') as second:
+        list(first.sync(objects(1, 1)))
+        assert changes(second, objects(1)) == [('added', 'object-0', '1')]
+        assert len(first) == 2
+
+
+def test_unfinished_sync_is_caught_up(tmpdir):
+    with object_index.ObjectIndex(str(tmpdir.join('i.db')), 'b') as index:
+        list(index.sync(objects(1, 1, 1)))
+        partial = index.sync(objects(2, 2), batch_size=1)
+        next(partial)
+        partial.close()
+
+        # The change yielded last was never acknowledged by resuming the
+        # sync, so it is found again.
+        assert changes(index, objects(2, 2)) == [
+            ('changed', 'object-0', '2'),
+            ('changed', 'object-1', '2'),
+            ('deleted', 'object-2', '1')]
+
+
+def test_abandoned_sync_loses_no_changes(tmpdir):
+    with object_index.ObjectIndex(str(tmpdir.join('i.db')), 'b') as index:
+        list(index.sync(objects(1, 1, 1)))
+        partial = index.sync(objects(2, 2, 2))
+        next(partial)
+        partial.close()
+
+        assert changes(index, objects(2, 2, 2)) == [
+            ('changed', 'object-0', '2'),
+            ('changed', 'object-1', '2'),
+            ('changed', 'object-2', '2')]
+
+        partial = index.sync(objects(2))
+        next(partial)
+        partial.close()
+
+        assert changes(index, objects(2)) == [
+            ('deleted', 'object-1', '2'),
+            ('deleted', 'object-2', '2')]
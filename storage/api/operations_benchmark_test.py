@@ -0,0 +1,250 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks of the Cloud Storage operations of these samples.
+
+Each benchmark runs an operation against a fake_gcs.FakeGcsServer, which
+adds LATENCY seconds to every request, and records the bytes or objects the
+operation moves in its extra_info, so that throughput can be worked out
+from the saved timings. To save a run and compare it with the last one:
+
+    $ nox -s benchmarks -- --benchmark-compare
+
+Without pytest-benchmark these tests are skipped, and with
+--benchmark-disable, as in the tests session, each operation runs once.
+"""
+
+from concurrent import futures
+import io
+import os
+
+import batch
+import bulk_operations
+import compose_objects
+import composite_upload
+import customer_supplied_keys
+import fake_gcs
+from googleapiclient import http
+import list_objects
+import pytest
+import sliced_download
+
+pytest.importorskip('pytest_benchmark')
+
+LATENCY = 0.002
+SIZE = 1024 * 1024
+DATA = os.urandom(SIZE)
+CHUNK_SIZE = 256 * 1024
+NAMES = ['dir-{}/object-{}'.format(index % 10, index) for index in range(500)]
+
+
+@pytest.fixture
+def server(request):
+    server = fake_gcs.FakeGcsServer(fake_gcs.FakeGcs(latency=LATENCY))
+    server.start()
+    request.addfinalizer(server.stop)
+    return server
+
+
+@pytest.fixture
+def service(server):
+    return server.build_service()
+
+
+@pytest.fixture
+def executor(request):
+    executor = futures.ThreadPoolExecutor(max_workers=8)
+    request.addfinalizer(executor.shutdown)
+    return executor
+
+
+def add_objects(fake, names, data=b'x' * 1000):
+    for name in names:
+        fake.add_object('bucket', name, data)
+
+
+def insert(service, name, body=None, resumable=False):
+    return service.objects().insert(
+        bucket='bucket', name=name, body=body,
+        media_body=http.MediaIoBaseUpload(
+            io.BytesIO(DATA), 'application/octet-stream',
+            chunksize=CHUNK_SIZE, resumable=resumable)).execute()
+
+
+@pytest.mark.benchmark(group='insert')
+def test_insert_simple(benchmark, service):
+    benchmark.extra_info['bytes'] = SIZE
+    resource = benchmark(insert, service, 'simple')
+    assert int(resource['size']) == SIZE
+
+
+@pytest.mark.benchmark(group='insert')
+def test_insert_multipart(benchmark, service):
+    benchmark.extra_info['bytes'] = SIZE
+    resource = benchmark(
+        insert, service, None, {'name': 'multipart', 'metadata': {'a': 'b'}})
+    assert int(resource['size']) == SIZE
+
+
+@pytest.mark.benchmark(group='insert')
+def test_insert_resumable(benchmark, service):
+    benchmark.extra_info['bytes'] = SIZE
+    resource = benchmark(insert, service, 'resumable', resumable=True)
+    assert int(resource['size']) == SIZE
+
+
+@pytest.mark.benchmark(group='insert')
+def test_composite_upload(benchmark, service, tmpdir):
+    filename = tmpdir.join('data.bin')
+    filename.write(DATA, mode='wb')
+    benchmark.extra_info['bytes'] = SIZE
+    resource = benchmark(
+        composite_upload.upload_file, service, 'bucket', str(filename),
+        {'name': 'composite'}, num_parts=4, num_workers=4, min_part_size=1)
+    assert int(resource['size']) == SIZE
+
+
+@pytest.mark.benchmark(group='insert')
+def test_csek_upload(benchmark, service):
+    session = customer_supplied_keys.CsekSession(
+        service, customer_supplied_keys.ENCRYPTION_KEY, chunksize=CHUNK_SIZE)
+    benchmark.extra_info['bytes'] = SIZE
+    resource = benchmark(
+        lambda: session.upload('bucket', 'encrypted', io.BytesIO(DATA)))
+    assert int(resource['size']) == SIZE
+
+
+@pytest.mark.benchmark(group='get_media')
+def test_get_media_ranges(benchmark, server, service):
+    server.fake.add_object('bucket', 'data', DATA)
+
+    def download():
+        out = io.BytesIO()
+        downloader = http.MediaIoBaseDownload(
+            out, service.objects().get_media(bucket='bucket', object='data'),
+            chunksize=CHUNK_SIZE)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk()
+        return out.getvalue()
+
+    benchmark.extra_info['bytes'] = SIZE
+    assert benchmark(download) == DATA
+
+
+@pytest.mark.benchmark(group='get_media')
+def test_sliced_download(benchmark, server, service, tmpdir):
+    server.fake.add_object('bucket', 'data', DATA)
+    filename = str(tmpdir.join('data.bin'))
+    benchmark.extra_info['bytes'] = SIZE
+    benchmark(
+        sliced_download.download_file, service, 'bucket', 'data', filename,
+        num_slices=4, num_workers=4)
+    assert os.path.getsize(filename) == SIZE
+
+
+@pytest.mark.benchmark(group='get_media')
+def test_csek_download(benchmark, server, service):
+    server.fake.add_object(
+        'bucket', 'encrypted', DATA,
+        key_sha256=customer_supplied_keys.KEY_HASH)
+    session = customer_supplied_keys.CsekSession(
+        service, customer_supplied_keys.ENCRYPTION_KEY, chunksize=CHUNK_SIZE)
+
+    def download():
+        out = io.BytesIO()
+        session.download('bucket', 'encrypted', out)
+        return out.getvalue()
+
+    benchmark.extra_info['bytes'] = SIZE
+    assert benchmark(download) == DATA
+
+
+@pytest.mark.benchmark(group='list')
+def test_list_pages(benchmark, server, service):
+    add_objects(server.fake, NAMES)
+    benchmark.extra_info['objects'] = len(NAMES)
+    pages = benchmark(
+        lambda: list(list_objects.list_pages(
+            service, 'bucket', prefix='dir-', page_size=50)))
+    assert sum(len(page['items']) for page in pages) == len(NAMES)
+
+
+@pytest.mark.benchmark(group='list')
+def test_sharded_list(benchmark, server, service):
+    add_objects(server.fake, NAMES)
+    lister = list_objects.ShardedLister(
+        service, 'bucket', shard_depth=1, page_size=50)
+    benchmark.extra_info['objects'] = len(NAMES)
+    items = benchmark(lambda: list(lister.list()))
+    assert len(items) == len(NAMES)
+
+
+@pytest.mark.benchmark(group='metadata')
+def test_batch_get(benchmark, server, service):
+    add_objects(server.fake, NAMES)
+
+    def get_all():
+        with batch.Batcher(service.new_batch_http_request) as batcher:
+            results = [
+                batcher.add(service.objects().get(
+                    bucket='bucket', object=name))
+                for name in NAMES]
+        return [result.result() for result in results]
+
+    benchmark.extra_info['objects'] = len(NAMES)
+    assert len(benchmark(get_all)) == len(NAMES)
+
+
+@pytest.mark.benchmark(group='compose')
+def test_compose_tree(benchmark, server, service, executor):
+    names = NAMES[:100]
+    add_objects(server.fake, names)
+    benchmark.extra_info['objects'] = len(names)
+    resource = benchmark(
+        compose_objects.compose_tree, service, 'bucket', names, 'composed',
+        {}, executor)
+    assert int(resource['size']) == len(names) * 1000
+
+
+@pytest.mark.benchmark(group='bulk')
+def test_bulk_copy(benchmark, server, service):
+    add_objects(server.fake, NAMES)
+    benchmark.extra_info['objects'] = len(NAMES)
+    stats = benchmark(
+        bulk_operations.bulk_copy, service, 'bucket', NAMES, 'bucket',
+        'copies/', num_workers=16)
+    assert not stats.failures
+
+
+@pytest.mark.benchmark(group='bulk')
+def test_bulk_rewrite(benchmark, server, service):
+    add_objects(server.fake, NAMES, DATA[:10 * 1000])
+    benchmark.extra_info['objects'] = len(NAMES)
+    benchmark.extra_info['bytes'] = len(NAMES) * 10 * 1000
+    stats = benchmark(
+        bulk_operations.bulk_rewrite, service, 'bucket', NAMES,
+        destination_prefix='rewritten/', num_workers=16)
+    assert not stats.failures
+
+
+@pytest.mark.benchmark(group='bulk')
+def test_bulk_delete(benchmark, server, service):
+    # Each round deletes the objects that the setup adds back.
+    benchmark.extra_info['objects'] = len(NAMES)
+    stats = benchmark.pedantic(
+        bulk_operations.bulk_delete, args=(service, 'bucket', NAMES),
+        kwargs={'num_workers': 16},
+        setup=lambda: add_objects(server.fake, NAMES), rounds=5)
+    assert stats.succeeded == len(NAMES)
+    assert not server.fake.object_names('bucket')
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures how long it takes to get a Cloud Storage service object.
+
+Compares:
+    uncached: discovery.build without a discovery cache, which is what
+        every create_service() call used to do.
+    cold: services.get_service with an empty discovery cache.
+    warm: services.get_service in a new process, with the discovery
+        document already cached on disk.
+    memoized: services.get_service again in the same process.
+
+Requires application default credentials and network access.
+
+Example invocation:
+    $ python services_benchmark.py --runs 5
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+from googleapiclient import discovery
+import services
+
+
+def timed(function):
+    start = time.time()
+    function()
+    return time.time() - start
+
+
+def main(api, version, runs):
+    credentials = services.get_credentials()
+    cache_dir = tempfile.mkdtemp()
+    timings = {'uncached': [], 'cold': [], 'warm': [], 'memoized': []}
+
+    try:
+        for _ in range(runs):
+            timings['uncached'].append(timed(lambda: discovery.build(
+                api, version, credentials=credentials,
+                cache_discovery=False)))
+
+            shutil.rmtree(cache_dir)
+            services.clear()
+            cache = services.DiskCache(cache_dir)
+            timings['cold'].append(timed(lambda: services.get_service(
+                api, version, credentials, cache)))
+
+            services.clear()
+            timings['warm'].append(timed(lambda: services.get_service(
+                api, version, credentials, cache)))
+
+            timings['memoized'].append(timed(lambda: services.get_service(
+                api, version, credentials, cache)))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    for label in ('uncached', 'cold', 'warm', 'memoized'):
+        values = timings[label]
+        print('{}: mean {:.1f}ms, best {:.1f}ms'.format(
+            label, 1000 * sum(values) / len(values), 1000 * min(values)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api', default='storage', help='The API name.')
+    parser.add_argument('--version', default='v1', help='The API version.')
+    parser.add_argument(
+        '--runs', help='Number of times to measure.', type=int, default=5)
+
+    args = parser.parse_args()
+
+    main(args.api, args.version, args.runs)
@@ -0,0 +1,101 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import threading
+
+import httplib2
+import pytest
+import services
+
+DISCOVERY_DOC = json.dumps({
+    'kind': 'discovery#restDescription',
+    'name': 'storage',
+    'version': 'v1',
+    'rootUrl': 'https://www.googleapis.com/',
+    'servicePath': 'storage/v1/',
+    'resources': {},
+})
+
+
+class DiscoveryHttp(object):
+    """Serves a discovery document and counts the requests for it."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, uri, *args, **kwargs):
+        self.requests += 1
+        return httplib2.Response({'status': 200}), DISCOVERY_DOC.encode()
+
+
+class FakeCredentials(object):
+    def __init__(self, http):
+        self.http = http
+
+    def authorize(self, http):
+        return self.http
+
+
+@pytest.fixture
+def clean_services(request):
+    services.clear()
+    request.addfinalizer(services.clear)
+
+
+def test_disk_cache(tmpdir):
+    cache = services.DiskCache(str(tmpdir.join('cache')))
+
+    assert cache.get('https://example.com/doc') is None
+    cache.set('https://example.com/doc', DISCOVERY_DOC)
+    assert cache.get('https://example.com/doc') == DISCOVERY_DOC
+
+    cache.max_age = -1
+    assert cache.get('https://example.com/doc') is None
+
+
+def test_get_service_memoized(tmpdir, clean_services):
+    http = DiscoveryHttp()
+    credentials = FakeCredentials(http)
+    cache = services.DiskCache(str(tmpdir))
+
+    service = services.get_service('storage', 'v1', credentials, cache)
+
+    assert services.get_service('storage', 'v1', credentials, cache) is (
+        service)
+    assert http.requests == 1
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    # A new process reads the discovery document from disk.
+    services.clear()
+    assert services.get_service('storage', 'v1', credentials, cache) is not (
+        service)
+    assert http.requests == 1
+
+
+def test_thread_local_http():
+    created = []
+
+    def factory():
+        created.append(DiscoveryHttp())
+        return created[-1]
+
+    http = services.ThreadLocalHttp(factory)
+    http.request('https://example.com')
+    http.request('https://example.com')
+    thread = threading.Thread(target=http.request, args=('https://a.com',))
+    thread.start()
+    thread.join()
+
+    assert [h.requests for h in created] == [2, 1]
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Downloads an object as slices in parallel, resuming after failures.
+
+A single download stream is limited by the throughput of one connection,
+and starts over from the beginning if it fails. A sliced download instead:
+
+* preallocates the output file at the object's size, and splits the object
+  into slices that are downloaded concurrently with HTTP Range requests,
+  each written in place into its own region of the file;
+* pins the object's generation, so that a slice can't come from a newer
+  version of the object;
+* records in a small state file next to the output how much of each slice
+  has been written, so that running the download again after a failure
+  only fetches the missing ranges; and
+* checks the whole file against the object's MD5 hash, or its CRC32C for
+  composite objects, which have no MD5 hash.
+
+Example invocation:
+    $ python sliced_download.py my-bucket big-file.bin big-file.bin
+"""
+
+import argparse
+from concurrent import futures
+import json
+import os
+import threading
+
+import checksums
+import composite_upload
+import services
+
+DEFAULT_NUM_SLICES = 8
+DEFAULT_NUM_WORKERS = 8
+# Slices smaller than this aren't worth an extra connection.
+DEFAULT_MIN_SLICE_SIZE = 4 * 1024 * 1024
+# The most bytes fetched by one Range request.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+STATE_SUFFIX = '.download-state'
+
+
+def verify_file(filename, resource, chunksize=DEFAULT_CHUNK_SIZE):
+    """Checks a downloaded file against the object's metadata.
+
+    Raises:
+        checksums.ChecksumMismatch: if the file doesn't match.
+    """
+    checksums.hash_file(
+        filename, checksums.Hasher.for_object(resource), chunksize).verify(
+            resource, filename)
+
+
+class SlicedDownload(object):
+    """Downloads one object into a local file.
+
+    Args:
+        service: an initialized and authorized storage
+            google-api-client object, safe to use from several threads.
+        bucket: the bucket holding the object.
+        name: the name of the object.
+        filename: the local file to write.
+        num_slices: the most slices to split the object into.
+        min_slice_size: the fewest bytes in a slice.
+        chunksize: the most bytes fetched by one request.
+        num_retries: number of times to retry in case of 500 error.
+    """
+
+    def __init__(self, service, bucket, name, filename,
+                 num_slices=DEFAULT_NUM_SLICES,
+                 min_slice_size=DEFAULT_MIN_SLICE_SIZE,
+                 chunksize=DEFAULT_CHUNK_SIZE, num_retries=5):
+        self.service = service
+        self.bucket = bucket
+        self.name = name
+        self.filename = filename
+        self.state_path = filename + STATE_SUFFIX
+        self.num_slices = num_slices
+        self.min_slice_size = min_slice_size
+        self.chunksize = chunksize
+        self.num_retries = num_retries
+        self.bytes_fetched = 0
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _load_state(self, resource):
+        """Returns the saved state if it is for this version of the object,
+        and otherwise starts over with an empty, preallocated file."""
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+            if (state['bucket'], state['name'], state['generation']) == (
+                    self.bucket, self.name, resource['generation']) and (
+                    os.path.getsize(self.filename) == int(resource['size'])):
+                return state
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        size = int(resource['size'])
+        with open(self.filename, 'wb') as f:
+            f.truncate(size)
+        state = {
+            'bucket': self.bucket,
+            'name': self.name,
+            'generation': resource['generation'],
+            # The offset, length and bytes written so far of each slice.
+            'slices': [
+                [offset, length, 0] for offset, length in
+                composite_upload.split(
+                    size, self.num_slices, self.min_slice_size)],
+        }
+        self._state = state
+        self._save_state()
+        return state
+
+    def _save_state(self):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._state, f)
+        if os.name == 'nt' and os.path.exists(self.state_path):
+            # os.rename can't replace an existing file on Windows.
+            os.remove(self.state_path)
+        os.rename(temp_path, self.state_path)
+
+    def _fetch(self, start, end):
+        request = self.service.objects().get_media(
+            bucket=self.bucket, object=self.name,
+            generation=self._state['generation'])
+        request.headers['range'] = 'bytes={}-{}'.format(start, end - 1)
+        return request.execute(num_retries=self.num_retries)
+
+    def _download_slice(self, index):
+        offset, length, written = self._state['slices'][index]
+        with open(self.filename, 'r+b') as f:
+            while written < length:
+                start = offset + written
+                end = min(start + self.chunksize, offset + length)
+                data = self._fetch(start, end)
+                if not data:
+                    raise IOError('Empty response for bytes {}-{}.'.format(
+                        start, end - 1))
+
+                f.seek(start)
+                f.write(data[:end - start])
+                # The data must reach the file before the state says so.
+                f.flush()
+                written += min(len(data), end - start)
+                with self._lock:
+                    self.bytes_fetched += len(data)
+                    self._state['slices'][index][2] = written
+                    self._save_state()
+
+    def run(self, num_workers=DEFAULT_NUM_WORKERS):
+        """Downloads the missing slices and verifies the file.
+
+        Returns:
+            The object's resource.
+
+        Raises:
+            checksums.ChecksumMismatch: if the file doesn't match the object,
+                in which case the next run starts over.
+        """
+        resource = self.service.objects().get(
+            bucket=self.bucket, object=self.name).execute(
+                num_retries=self.num_retries)
+        self._state = self._load_state(resource)
+
+        missing = [
+            index for index, (_, length, written) in
+            enumerate(self._state['slices']) if written < length]
+        executor = futures.ThreadPoolExecutor(max_workers=num_workers)
+        try:
+            list(executor.map(self._download_slice, missing))
+        finally:
+            executor.shutdown()
+
+        try:
+            verify_file(self.filename, resource, self.chunksize)
+        finally:
+            os.remove(self.state_path)
+        return resource
+
+
+def download_file(service, bucket, name, filename,
+                  num_slices=DEFAULT_NUM_SLICES,
+                  num_workers=DEFAULT_NUM_WORKERS, **kwargs):
+    """Downloads an object into a file with a SlicedDownload."""
+    return SlicedDownload(
+        service, bucket, name, filename, num_slices, **kwargs).run(
+            num_workers)
+
+
+def main(bucket, name, filename, num_slices, num_workers):
+    service = services.get_service('storage', 'v1')
+    download = SlicedDownload(service, bucket, name, filename, num_slices)
+    resource = download.run(num_workers)
+    print('Downloaded {} bytes of {} ({} fetched by this run).'.format(
+        resource['size'], name, download.bytes_fetched))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('bucket', help='Your Cloud Storage bucket.')
+    parser.add_argument('name', help='The object to download.')
+    parser.add_argument('filename', help='Where to write the object.')
+    parser.add_argument(
+        '-s', '--slices', help='The most slices to split the object into.',
+        type=int, default=DEFAULT_NUM_SLICES)
+    parser.add_argument(
+        '-w', '--num_workers', help='Number of slices to download at once.',
+        type=int, default=DEFAULT_NUM_WORKERS)
+
+    args = parser.parse_args()
+
+    main(args.bucket, args.name, args.filename, args.slices,
+         args.num_workers)
@@ -0,0 +1,128 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+import checksums
+import crud_object
+import fake_gcs
+import httplib2
+import pytest
+import sliced_download
+
+DATA = os.urandom(100000)
+
+
+def make_download(fake, filename, **kwargs):
+    kwargs.setdefault('num_slices', 4)
+    kwargs.setdefault('min_slice_size', 1)
+    kwargs.setdefault('chunksize', 5000)
+    return sliced_download.SlicedDownload(
+        fake_gcs.build_service(fake), 'bucket', 'object', filename, **kwargs)
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('data', [DATA, b''])
+def test_download(tmpdir, data):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'object', data)
+    filename = str(tmpdir.join('out.bin'))
+
+    make_download(fake, filename).run(num_workers=4)
+
+    assert read(filename) == data
+    assert not os.path.exists(filename + sliced_download.STATE_SUFFIX)
+
+
+def test_download_composite(tmpdir):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'part', DATA)
+    service = fake_gcs.build_service(fake)
+    service.objects().compose(
+        destinationBucket='bucket', destinationObject='object',
+        body={'sourceObjects': [{'name': 'part'}] * 2}).execute()
+    filename = str(tmpdir.join('out.bin'))
+
+    resource = make_download(fake, filename).run()
+
+    assert 'md5Hash' not in resource
+    assert read(filename) == DATA * 2
+
+
+def test_download_resumes(tmpdir):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'object', DATA)
+    filename = str(tmpdir.join('out.bin'))
+    fake.inject(drop=True, after=7)
+
+    first = make_download(fake, filename)
+    with pytest.raises(httplib2.HttpLib2Error):
+        first.run(num_workers=1)
+    assert os.path.exists(filename + sliced_download.STATE_SUFFIX)
+
+    second = make_download(fake, filename)
+    second.run(num_workers=1)
+
+    assert read(filename) == DATA
+    assert first.bytes_fetched + second.bytes_fetched == len(DATA)
+
+
+def test_download_restarts_for_new_generation(tmpdir):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'object', DATA)
+    filename = str(tmpdir.join('out.bin'))
+    # An earlier run that wrote every slice, then crashed.
+    earlier = make_download(fake, filename)
+    earlier._load_state(fake_gcs.build_service(fake).objects().get(
+        bucket='bucket', object='object').execute())
+    for state in earlier._state['slices']:
+        state[2] = state[1]
+    earlier._save_state()
+
+    fake.add_object('bucket', 'object', DATA[::-1])
+    download = make_download(fake, filename)
+    download.run()
+
+    assert read(filename) == DATA[::-1]
+    assert download.bytes_fetched == len(DATA)
+
+
+def test_download_checksum_mismatch(tmpdir, monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'object', DATA)
+    filename = str(tmpdir.join('out.bin'))
+    resource = fake_gcs._resource
+    monkeypatch.setattr(
+        fake_gcs, '_resource',
+        lambda *args: dict(resource(*args), md5Hash='bad'))
+
+    with pytest.raises(checksums.ChecksumMismatch):
+        make_download(fake, filename).run()
+    assert not os.path.exists(filename + sliced_download.STATE_SUFFIX)
+
+
+def test_crud_object_get_in_slices(monkeypatch):
+    fake = fake_gcs.FakeGcs()
+    fake.add_object('bucket', 'object', DATA)
+    monkeypatch.setattr(
+        crud_object, 'create_service', lambda: fake_gcs.build_service(fake))
+
+    with tempfile.NamedTemporaryFile(mode='w+b') as out_file:
+        crud_object.get_object('bucket', 'object', out_file, num_slices=4)
+        out_file.seek(0)
+        assert out_file.read() == DATA
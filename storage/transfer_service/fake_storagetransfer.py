@@ -0,0 +1,172 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process stand-in for the Storage Transfer API service object.
+
+FakeStorageTransfer mimics the parts of the googleapiclient service object
+used by these samples, so that they can be tested without a project or
+network access. Its transfer operations copy data at a steady rate, by a
+clock that the caller controls, so that their progress can be followed the
+way it would be on the real service.
+"""
+
+import json
+import threading
+
+
+class FakeClock(object):
+    """A clock that only moves when slept on."""
+
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeRequest(object):
+    """A request that is only answered when it is executed."""
+
+    def __init__(self, service, handler, **kwargs):
+        self.headers = {}
+        self._service = service
+        self._handler = handler
+        self._kwargs = kwargs
+
+    def execute(self, num_retries=0, http=None):
+        self._service.record_request()
+        return self._handler(**self._kwargs)
+
+
+class FakeStorageTransfer(object):
+    """Serves transfer operations added with add_operation.
+
+    Args:
+        clock: a callable returning the current time in seconds.
+        page_size: the most operations returned in one page.
+    """
+
+    def __init__(self, clock, page_size=2):
+        self.clock = clock
+        self.page_size = page_size
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._operations = []
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def add_operation(self, project_id, job_name, total_bytes, total_objects,
+                      bytes_per_second, stall_at=None, failed_objects=0):
+        """Starts a transfer operation of a job, which copies objects at
+        bytes_per_second from now on.
+
+        Args:
+            stall_at: if given, the operation stops making progress once it
+                has copied this many bytes.
+            failed_objects: how many of the objects fail to copy.
+        """
+        with self._lock:
+            name = 'transferOperations/{}-{}'.format(
+                job_name.split('/')[-1], len(self._operations))
+            self._operations.append({
+                'name': name,
+                'projectId': project_id,
+                'transferJobName': job_name,
+                'start': self.clock(),
+                'totalBytes': total_bytes,
+                'totalObjects': total_objects,
+                'bytesPerSecond': bytes_per_second,
+                'stallAt': stall_at,
+                'failedObjects': failed_objects,
+            })
+            return name
+
+    def operation(self, record):
+        """Returns the resource of an operation as of now."""
+        total_bytes = record['totalBytes']
+        copied = min(
+            total_bytes,
+            int((self.clock() - record['start']) * record['bytesPerSecond']))
+        if record['stallAt'] is not None:
+            copied = min(copied, record['stallAt'])
+        done = copied == total_bytes
+        objects = record['totalObjects'] - record['failedObjects']
+        copied_objects = objects if done else (
+            objects * copied // total_bytes if total_bytes else 0)
+
+        counters = {
+            'objectsFoundFromSource': str(record['totalObjects']),
+            'bytesFoundFromSource': str(total_bytes),
+            'objectsCopiedToSink': str(copied_objects),
+            'bytesCopiedToSink': str(copied),
+        }
+        if done and record['failedObjects']:
+            counters['objectsFromSourceFailed'] = str(record['failedObjects'])
+        status = 'IN_PROGRESS'
+        if done:
+            status = 'FAILED' if record['failedObjects'] else 'SUCCESS'
+        return {
+            'name': record['name'],
+            'metadata': {
+                '@type': 'type.googleapis.com/'
+                         'google.storagetransfer.v1.TransferOperation',
+                'name': record['name'],
+                'projectId': record['projectId'],
+                'transferJobName': record['transferJobName'],
+                'status': status,
+                'counters': counters,
+            },
+            'done': done,
+        }
+
+    def transferOperations(self):
+        return _TransferOperations(self)
+
+
+class _TransferOperations(object):
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, name, filter, pageToken=None, pageSize=None):
+        return FakeRequest(self._service, self._list, filter=filter,
+                           pageToken=pageToken)
+
+    def list_next(self, previous_request, previous_response):
+        token = previous_response.get('nextPageToken')
+        if not token:
+            return None
+        return FakeRequest(
+            self._service, self._list,
+            filter=previous_request._kwargs['filter'], pageToken=token)
+
+    def _list(self, filter, pageToken):
+        query = json.loads(filter)
+        job_names = query.get('job_names')
+        with self._service._lock:
+            records = [
+                record for record in self._service._operations
+                if record['projectId'] == query['project_id'] and (
+                    not job_names or record['transferJobName'] in job_names)]
+
+        start = int(pageToken or 0)
+        end = start + self._service.page_size
+        reply = {'operations': [
+            self._service.operation(record) for record in records[start:end]]}
+        if end < len(records):
+            reply['nextPageToken'] = str(end)
+        return reply
@@ -29,6 +29,7 @@ import json
 
 from googleapiclient import discovery
 from oauth2client.client import GoogleCredentials
+import transfer_monitor
 
 
 # [START main]
@@ -76,6 +77,7 @@ def main(description, project_id, day, month, year, hours, minutes,
     result = storagetransfer.transferJobs().create(body=transfer_job).execute()
     print('Returned transferJob: {}'.format(
         json.dumps(result, indent=4)))
+    return result
 # [END main]
 
 if __name__ == '__main__':
@@ -88,12 +90,15 @@ if __name__ == '__main__':
     parser.add_argument('time', help='Time (24hr) HH:MM.')
     parser.add_argument('source_bucket', help='Source bucket name.')
     parser.add_argument('sink_bucket', help='Sink bucket name.')
+    parser.add_argument(
+        '--monitor', action='store_true',
+        help='Follow the progress of the job until its operations are done.')
 
     args = parser.parse_args()
     date = datetime.datetime.strptime(args.date, '%Y/%m/%d')
     time = datetime.datetime.strptime(args.time, '%H:%M')
 
-    main(
+    result = main(
         args.description,
         args.project_id,
         date.year,
@@ -103,4 +108,7 @@ if __name__ == '__main__':
         time.minute,
         args.source_bucket,
         args.sink_bucket)
+
+    if args.monitor:
+        transfer_monitor.main(args.project_id, [result['name']])
 # [END all]
@@ -0,0 +1,167 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Builds googleapiclient service objects once and shares them, on a
+transport that can be used from several threads.
+
+Building a service object means fetching its discovery document over the
+network and parsing it, which takes a noticeable fraction of a second.
+get_service() avoids paying for this more than necessary:
+
+* Discovery documents are cached on disk by DiskCache, so only the first
+  run on a machine fetches them, much like speech_rest.py keeps its
+  discovery document next to the sample.
+* Service objects are memoized per (api, version, credentials) for the life
+  of the process.
+* All services built with the same credentials share one transport, which
+  keeps a keep-alive connection per thread and so can be used from several
+  threads at once.
+
+Each sample directory is installed and run on its own, so the directories
+whose samples share service objects each have this same module: bigquery/api,
+storage/api and storage/transfer_service. datastore/api has only its
+ThreadLocalHttp and authorized_http(). `nox -s shared_modules` checks that
+the copies match.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from googleapiclient import discovery
+from googleapiclient.discovery_cache import base
+import httplib2
+from oauth2client.client import GoogleCredentials
+
+DISCOVERY_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'google-api-discovery')
+
+# Discovery documents change rarely, but do change, so cached copies are
+# refreshed daily.
+DISCOVERY_MAX_AGE = 24 * 60 * 60
+
+
+class DiskCache(base.Cache):
+    """Keeps discovery documents as files in a directory."""
+
+    def __init__(self, directory=DISCOVERY_CACHE_DIR,
+                 max_age=DISCOVERY_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, url):
+        name = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def get(self, url):
+        path = self._path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                return None
+            with open(path, 'rb') as f:
+                return f.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+    def set(self, url, content):
+        path = self._path(url)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(temp_path, 'wb') as f:
+                f.write(content.encode('utf-8'))
+            if os.name == 'nt' and os.path.exists(path):
+                # os.rename can't replace an existing file on Windows.
+                os.remove(path)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            # The cache is only an optimization; carry on without it.
+            pass
+
+
+class ThreadLocalHttp(object):
+    """Dispatches requests to a per-thread httplib2.Http instance.
+
+    httplib2.Http objects are not safe to share between threads. This gives
+    each thread its own, each keeping its connections alive between
+    requests.
+    """
+
+    def __init__(self, http_factory=httplib2.Http):
+        self._http_factory = http_factory
+        self._local = threading.local()
+
+    def request(self, *args, **kwargs):
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = self._local.http = self._http_factory()
+        return http.request(*args, **kwargs)
+
+
+_lock = threading.RLock()
+_default_credentials = []
+_transports = {}
+_services = {}
+
+
+def get_credentials():
+    """Returns the application default credentials, loading them once."""
+    with _lock:
+        if not _default_credentials:
+            # When running locally, these are available after running
+            # `gcloud init`. When running on compute engine, these are
+            # available from the environment.
+            _default_credentials.append(
+                GoogleCredentials.get_application_default())
+        return _default_credentials[0]
+
+
+def authorized_http(credentials=None):
+    """Returns the shared transport authorized with the credentials."""
+    with _lock:
+        credentials = credentials or get_credentials()
+        if credentials not in _transports:
+            _transports[credentials] = credentials.authorize(
+                ThreadLocalHttp())
+        return _transports[credentials]
+
+
+def get_service(api, version, credentials=None, cache=None):
+    """Returns a service object for an API, building it only once.
+
+    Args:
+        api: the name of the API, e.g. 'storage'.
+        version: the version of the API, e.g. 'v1'.
+        credentials: the credentials to authorize requests with. Defaults
+            to the application default credentials.
+        cache: where discovery documents are cached. Defaults to a
+            DiskCache in DISCOVERY_CACHE_DIR.
+    """
+    with _lock:
+        credentials = credentials or get_credentials()
+        key = (api, version, credentials)
+        if key not in _services:
+            _services[key] = discovery.build(
+                api, version, http=authorized_http(credentials),
+                cache=cache or DiskCache())
+        return _services[key]
+
+
+def clear():
+    """Forgets all credentials, transports and services built so far."""
+    with _lock:
+        del _default_credentials[:]
+        _transports.clear()
+        _services.clear()
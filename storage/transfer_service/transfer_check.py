@@ -29,6 +29,7 @@ import json
 
 from googleapiclient import discovery
 from oauth2client.client import GoogleCredentials
+import transfer_monitor
 
 
 # [START main]
@@ -38,10 +39,10 @@ def main(project_id, job_name):
     storagetransfer = discovery.build(
         'storagetransfer', 'v1', credentials=credentials)
 
-    filterString = (
-        '{{"project_id": "{project_id}", '
-        '"job_names": ["{job_name}"]}}'
-    ).format(project_id=project_id, job_name=job_name)
+    filterString = json.dumps({
+        'project_id': project_id,
+        'job_names': [job_name],
+    })
 
     result = storagetransfer.transferOperations().list(
         name="transferOperations",
@@ -56,8 +57,14 @@ if __name__ == '__main__':
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('project_id', help='Your Google Cloud project ID.')
     parser.add_argument('job_name', help='Your job name.')
+    parser.add_argument(
+        '--monitor', action='store_true',
+        help='Follow the progress of the job until its operations are done.')
 
     args = parser.parse_args()
 
-    main(args.project_id, args.job_name)
+    if args.monitor:
+        transfer_monitor.main(args.project_id, [args.job_name])
+    else:
+        main(args.project_id, args.job_name)
 # [END all]
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Command-line sample that follows the progress of transfer jobs.
+
+Each poll pages through the transfer operations of the jobs, listing groups
+of jobs concurrently, and compares each operation's counters with those of
+earlier polls to work out:
+
+* how many bytes and objects it copies per second,
+* when it should finish, at that rate, and
+* whether it has stalled, making no progress for a while.
+
+The interval between polls adapts: it shrinks towards a quarter of the time
+the soonest operation has left while the transfers make progress, and
+doubles while nothing changes, such as before a scheduled job starts.
+
+For more information, see README.md.
+
+Example invocation:
+    $ python transfer_monitor.py my-project transferJobs/123 transferJobs/456
+"""
+
+import argparse
+import collections
+from concurrent import futures
+import datetime
+import itertools
+import json
+import sys
+import time
+
+import services
+
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 120
+# An operation that has made no progress for this many seconds is stalled.
+DEFAULT_STALL_AFTER = 600
+# The most job names in the filter of one list request.
+JOBS_PER_REQUEST = 20
+# The number of polls over which rates are measured.
+RATE_WINDOW = 10
+
+
+def create_transfer_client():
+    """Returns a storagetransfer service object that can be used from
+    several threads at once, unlike create_client.create_transfer_client's.
+    """
+    return services.get_service('storagetransfer', 'v1')
+
+
+def _count(counters, key):
+    # Counters are int64s, which the API encodes as strings.
+    return int(counters.get(key, 0))
+
+
+def _format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1000:
+            return '{:.1f} {}'.format(count, unit)
+        count /= 1000.0
+    return '{:.1f} TB'.format(count)
+
+
+class OperationProgress(object):
+    """Follows the counters of one transfer operation from poll to poll."""
+
+    def __init__(self, name, job_name):
+        self.name = name
+        self.job_name = job_name
+        self.status = None
+        self.done = False
+        self.counters = {}
+        self.last_change = None
+        # The (time, bytes copied, objects copied) of the latest polls.
+        self._snapshots = collections.deque(maxlen=RATE_WINDOW)
+
+    def update(self, operation, now):
+        """Records the operation as polled at `now`.
+
+        Returns:
+            Whether the operation has changed since the last poll.
+        """
+        metadata = operation.get('metadata', {})
+        status = metadata.get('status')
+        self.counters = metadata.get('counters', {})
+        self.done = operation.get('done', False)
+        snapshot = (now, self.bytes_copied, self.objects_copied)
+
+        changed = status != self.status or not self._snapshots or (
+            snapshot[1:] != self._snapshots[-1][1:])
+        if changed:
+            self.last_change = now
+        self.status = status
+        self._snapshots.append(snapshot)
+        return changed
+
+    @property
+    def bytes_copied(self):
+        return _count(self.counters, 'bytesCopiedToSink')
+
+    @property
+    def objects_copied(self):
+        return _count(self.counters, 'objectsCopiedToSink')
+
+    @property
+    def bytes_remaining(self):
+        return max(0, _count(self.counters, 'bytesFoundFromSource') - sum(
+            _count(self.counters, key) for key in (
+                'bytesCopiedToSink', 'bytesFromSourceSkippedBySync',
+                'bytesFromSourceFailed')))
+
+    def rates(self):
+        """Returns the bytes and objects copied per second over the latest
+        polls, or Nones before there are two polls to compare."""
+        if len(self._snapshots) < 2:
+            return None, None
+        (start, start_bytes, start_objects) = self._snapshots[0]
+        (end, end_bytes, end_objects) = self._snapshots[-1]
+        elapsed = end - start
+        if not elapsed:
+            return None, None
+        return ((end_bytes - start_bytes) / float(elapsed),
+                (end_objects - start_objects) / float(elapsed))
+
+    def eta(self):
+        """Returns the seconds left at the current rate, or None if the
+        rate isn't known or is zero."""
+        if self.done:
+            return 0
+        bytes_per_second, _ = self.rates()
+        if not bytes_per_second:
+            return None
+        return self.bytes_remaining / bytes_per_second
+
+    def stalled(self, now, stall_after=DEFAULT_STALL_AFTER):
+        return not self.done and self.last_change is not None and (
+            now - self.last_change >= stall_after)
+
+    def report(self, now, stall_after=DEFAULT_STALL_AFTER):
+        """Returns a line on the operation's progress."""
+        bytes_per_second, objects_per_second = self.rates()
+        eta = self.eta()
+        line = '{} {} {}: {} of {}, {} of {} objects'.format(
+            self.job_name, self.name.split('/')[-1], self.status,
+            _format_bytes(self.bytes_copied),
+            _format_bytes(_count(self.counters, 'bytesFoundFromSource')),
+            self.objects_copied,
+            _count(self.counters, 'objectsFoundFromSource'))
+        if bytes_per_second is not None and not self.done:
+            line += ', {}/s, {:.1f} objects/s, ETA {}'.format(
+                _format_bytes(bytes_per_second), objects_per_second,
+                datetime.timedelta(seconds=int(eta)) if eta is not None
+                else 'unknown')
+        if self.stalled(now, stall_after):
+            line += ', STALLED for {}'.format(
+                datetime.timedelta(seconds=int(now - self.last_change)))
+        return line
+
+
+class TransferMonitor(object):
+    """Polls the transfer operations of a project's jobs.
+
+    Args:
+        storagetransfer: an initialized and authorized storagetransfer
+            google-api-client object. With more than JOBS_PER_REQUEST jobs,
+            it is used from several threads at once, so it must be built on
+            a thread-safe transport, as create_transfer_client()'s is.
+        project_id: the project the jobs belong to.
+        job_names: the names of the jobs to follow, or None for every job
+            in the project.
+        min_interval: the fewest seconds between polls.
+        max_interval: the most seconds between polls.
+        stall_after: the seconds without progress after which an operation
+            is reported as stalled.
+        clock: returns the current time in seconds.
+        sleep: sleeps for a number of seconds.
+    """
+
+    def __init__(self, storagetransfer, project_id, job_names=None,
+                 min_interval=DEFAULT_MIN_INTERVAL,
+                 max_interval=DEFAULT_MAX_INTERVAL,
+                 stall_after=DEFAULT_STALL_AFTER, clock=time.time,
+                 sleep=time.sleep):
+        self.storagetransfer = storagetransfer
+        self.project_id = project_id
+        self.job_names = list(job_names or [])
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stall_after = stall_after
+        self.clock = clock
+        self.sleep = sleep
+        self.interval = min_interval
+        self.operations = collections.OrderedDict()
+
+    def _list(self, job_names):
+        """Returns every operation of the jobs, following nextPageToken."""
+        query = {'project_id': self.project_id}
+        if job_names:
+            query['job_names'] = job_names
+        operations = self.storagetransfer.transferOperations()
+        request = operations.list(
+            name='transferOperations', filter=json.dumps(query))
+
+        results = []
+        while request is not None:
+            response = request.execute(num_retries=5)
+            results.extend(response.get('operations', []))
+            request = operations.list_next(request, response)
+        return results
+
+    def poll(self):
+        """Lists the operations and updates their progress.
+
+        Returns:
+            Whether any operation has changed since the last poll.
+        """
+        groups = [
+            self.job_names[start:start + JOBS_PER_REQUEST]
+            for start in range(0, len(self.job_names), JOBS_PER_REQUEST)]
+        if len(groups) > 1:
+            executor = futures.ThreadPoolExecutor(max_workers=len(groups))
+            try:
+                results = list(executor.map(self._list, groups))
+            finally:
+                executor.shutdown()
+        else:
+            results = [self._list(groups[0] if groups else None)]
+
+        now = self.clock()
+        changed = False
+        for operation in itertools.chain.from_iterable(results):
+            progress = self.operations.get(operation['name'])
+            if progress is None:
+                progress = OperationProgress(
+                    operation['name'],
+                    operation['metadata'].get('transferJobName'))
+                self.operations[operation['name']] = progress
+            changed = progress.update(operation, now) or changed
+
+        self._adapt_interval(changed)
+        return changed
+
+    def _adapt_interval(self, changed):
+        if not changed:
+            self.interval = min(self.interval * 2, self.max_interval)
+            return
+        etas = [
+            progress.eta() for progress in self.operations.values()
+            if not progress.done and progress.eta() is not None]
+        # Until there is a rate to go by, poll soon to measure one.
+        self.interval = min(etas) / 4.0 if etas else self.min_interval
+        self.interval = max(
+            self.min_interval, min(self.interval, self.max_interval))
+
+    @property
+    def done(self):
+        return bool(self.operations) and all(
+            progress.done for progress in self.operations.values())
+
+    def report(self):
+        now = self.clock()
+        return '\n'.join(
+            progress.report(now, self.stall_after)
+            for progress in self.operations.values())
+
+    def run(self, out=None, max_polls=None):
+        """Polls until every operation is done, writing a report after each
+        poll to out, stdout by default.
+
+        Returns:
+            The number of polls.
+        """
+        out = out or sys.stdout
+        polls = 0
+        while True:
+            self.poll()
+            polls += 1
+            if self.operations:
+                out.write(self.report() + '\n\n')
+            if self.done or (max_polls and polls >= max_polls):
+                return polls
+            self.sleep(self.interval)
+
+
+def main(project_id, job_names, min_interval=DEFAULT_MIN_INTERVAL,
+         max_interval=DEFAULT_MAX_INTERVAL, stall_after=DEFAULT_STALL_AFTER):
+    """Follows the transfer jobs until all their operations are done."""
+    storagetransfer = create_transfer_client()
+    monitor = TransferMonitor(
+        storagetransfer, project_id, job_names, min_interval, max_interval,
+        stall_after)
+    monitor.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('project_id', help='Your Google Cloud project ID.')
+    parser.add_argument(
+        'job_names', nargs='*',
+        help='The jobs to follow. Defaults to every job in the project.')
+    parser.add_argument(
+        '--min_interval', type=float, default=DEFAULT_MIN_INTERVAL,
+        help='The fewest seconds between polls.')
+    parser.add_argument(
+        '--max_interval', type=float, default=DEFAULT_MAX_INTERVAL,
+        help='The most seconds between polls.')
+    parser.add_argument(
+        '--stall_after', type=float, default=DEFAULT_STALL_AFTER,
+        help='Report operations without progress for this many seconds as '
+             'stalled.')
+
+    args = parser.parse_args()
+
+    main(args.project_id, args.job_names, args.min_interval,
+         args.max_interval, args.stall_after)
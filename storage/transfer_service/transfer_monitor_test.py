@@ -0,0 +1,128 @@
+# Copyright 2016, Google, Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import fake_storagetransfer
+import services
+import transfer_monitor
+
+MB = 1000 * 1000
+
+
+class CountingHttp(object):
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, *args, **kwargs):
+        self.requests += 1
+
+
+def make_monitor(fake, clock, job_names, **kwargs):
+    return transfer_monitor.TransferMonitor(
+        fake, 'project', job_names, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_rates_and_eta():
+    clock = fake_storagetransfer.FakeClock()
+    fake = fake_storagetransfer.FakeStorageTransfer(clock)
+    fake.add_operation('project', 'transferJobs/a', 100 * MB, 1000, MB)
+    monitor = make_monitor(fake, clock, ['transferJobs/a'])
+
+    monitor.poll()
+    clock.sleep(10)
+    monitor.poll()
+
+    [progress] = monitor.operations.values()
+    assert progress.rates() == (MB, 10)
+    assert progress.eta() == 90
+    assert monitor.report() == (
+        'transferJobs/a a-0 IN_PROGRESS: 10.0 MB of 100.0 MB, 100 of 1000 '
+        'objects, 1.0 MB/s, 10.0 objects/s, ETA 0:01:30')
+
+
+def test_run_follows_many_jobs(capsys):
+    clock = fake_storagetransfer.FakeClock()
+    start = clock()
+    fake = fake_storagetransfer.FakeStorageTransfer(clock, page_size=3)
+    job_names = ['transferJobs/{}'.format(index) for index in range(45)]
+    for index, job_name in enumerate(job_names):
+        fake.add_operation(
+            'project', job_name, 100 * MB, 100, MB * (index + 1),
+            failed_objects=1 if index == 0 else 0)
+    fake.add_operation('project', 'transferJobs/other', MB, 1, 1)
+
+    polls = make_monitor(fake, clock, job_names, max_interval=30).run()
+
+    # The slowest job takes 100 seconds.
+    assert 100 <= clock() - start < 130
+    assert polls < 20
+    out, _ = capsys.readouterr()
+    last = out.strip().split('\n\n')[-1].splitlines()
+    assert len(last) == 45
+    assert last[0] == (
+        'transferJobs/0 0-0 FAILED: 100.0 MB of 100.0 MB, 99 of 100 objects')
+
+
+def test_stall_detection_and_backoff():
+    clock = fake_storagetransfer.FakeClock()
+    fake = fake_storagetransfer.FakeStorageTransfer(clock)
+    fake.add_operation(
+        'project', 'transferJobs/a', 100 * MB, 100, MB, stall_at=20 * MB)
+    monitor = make_monitor(
+        fake, clock, ['transferJobs/a'], min_interval=5, max_interval=60,
+        stall_after=120)
+
+    intervals = []
+    for _ in range(8):
+        monitor.poll()
+        intervals.append(monitor.interval)
+        clock.sleep(monitor.interval)
+
+    # The interval grows once the operation stops changing.
+    assert intervals[-1] == 60
+    assert intervals == sorted(intervals)
+    assert monitor.report().endswith(', STALLED for 0:05:26')
+
+
+def test_interval_waits_for_jobs_to_start():
+    clock = fake_storagetransfer.FakeClock()
+    fake = fake_storagetransfer.FakeStorageTransfer(clock)
+    monitor = make_monitor(
+        fake, clock, ['transferJobs/a'], min_interval=5, max_interval=60)
+
+    for _ in range(5):
+        monitor.poll()
+    assert monitor.interval == 60
+    assert not monitor.done
+
+    fake.add_operation('project', 'transferJobs/a', 10 * MB, 10, MB)
+    assert monitor.poll()
+    assert monitor.interval == 5
+
+
+def test_thread_local_http():
+    created = []
+
+    def factory():
+        created.append(CountingHttp())
+        return created[-1]
+
+    http = services.ThreadLocalHttp(factory)
+    http.request('https://example.com')
+    http.request('https://example.com')
+    thread = threading.Thread(target=http.request, args=('https://a.com',))
+    thread.start()
+    thread.join()
+
+    assert [h.requests for h in created] == [2, 1]